@@ -13,7 +13,11 @@ from .models import (
     GlobalTemplate, AgentTemplate, AutoReplyTrigger,
     ResponseTimeTracking, AgentDelayEvent,
     AgentKPI, AgentKPIMonthly, CustomerSatisfaction,
-    ActivityLog, LoginAttempt
+    ActivityLog, LoginAttempt,
+    WebhookInbox,
+    BroadcastCampaign, BroadcastRecipient,
+    DeadLetterMessage,
+    MessageStateCounter, MessageDailyStats
 )
 
 
@@ -73,7 +77,7 @@ class CustomerNoteAdmin(admin.ModelAdmin):
 @admin.register(Ticket)
 class TicketAdmin(admin.ModelAdmin):
     list_display = ['ticket_number', 'customer', 'assigned_agent', 'status', 'priority', 'get_category_arabic', 'created_at']
-    list_filter = ['status', 'priority', 'category', 'is_delayed']
+    list_filter = ['status', 'priority', 'category', 'conversation_state', 'is_delayed']
     search_fields = ['ticket_number', 'customer__name']
     readonly_fields = ['created_at', 'updated_at']
 
@@ -197,3 +201,65 @@ class LoginAttemptAdmin(admin.ModelAdmin):
     search_fields = ['username', 'ip_address']
     readonly_fields = ['attempt_time']
 
+
+# ============================================================================
+# WEBHOOK INBOX
+# ============================================================================
+
+@admin.register(WebhookInbox)
+class WebhookInboxAdmin(admin.ModelAdmin):
+    list_display = ['id', 'provider', 'customer_key', 'status', 'attempts', 'next_attempt_at', 'created_at', 'processed_at']
+    list_filter = ['provider', 'status']
+    search_fields = ['customer_key']
+    readonly_fields = ['created_at', 'processed_at', 'claimed_at']
+
+
+# ============================================================================
+# BROADCAST CAMPAIGNS
+# ============================================================================
+
+@admin.register(BroadcastCampaign)
+class BroadcastCampaignAdmin(admin.ModelAdmin):
+    list_display = ['name', 'message_type', 'status', 'total_recipients', 'sent_count', 'failed_count', 'delivered_count', 'read_count', 'created_at']
+    list_filter = ['status', 'message_type']
+    search_fields = ['name']
+    readonly_fields = ['total_recipients', 'sent_count', 'failed_count', 'delivered_count', 'read_count', 'started_at', 'completed_at', 'created_at', 'updated_at']
+
+
+@admin.register(BroadcastRecipient)
+class BroadcastRecipientAdmin(admin.ModelAdmin):
+    list_display = ['campaign', 'wa_id', 'status', 'retry_count', 'sent_at']
+    list_filter = ['status']
+    search_fields = ['wa_id', 'whatsapp_message_id']
+    raw_id_fields = ['campaign', 'customer']
+    readonly_fields = ['created_at', 'sent_at', 'claimed_at']
+
+
+# ============================================================================
+# DEAD LETTER QUEUE
+# ============================================================================
+
+@admin.register(DeadLetterMessage)
+class DeadLetterMessageAdmin(admin.ModelAdmin):
+    list_display = ['message', 'provider', 'retry_count', 'is_retryable', 'created_at']
+    list_filter = ['provider', 'is_retryable']
+    search_fields = ['failure_reason']
+    raw_id_fields = ['message']
+    readonly_fields = ['provider_response', 'attempts', 'created_at']
+
+
+# ============================================================================
+# QUEUE STATISTICS
+# ============================================================================
+
+@admin.register(MessageStateCounter)
+class MessageStateCounterAdmin(admin.ModelAdmin):
+    list_display = ['delivery_status', 'priority', 'count', 'updated_at']
+    list_filter = ['delivery_status', 'priority']
+    readonly_fields = ['updated_at']
+
+
+@admin.register(MessageDailyStats)
+class MessageDailyStatsAdmin(admin.ModelAdmin):
+    list_display = ['date', 'total', 'sent', 'delivered', 'read', 'failed', 'updated_at']
+    readonly_fields = ['updated_at']
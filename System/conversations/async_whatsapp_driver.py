@@ -0,0 +1,465 @@
+"""
+Async WhatsApp Driver
+نسخة asyncio من نمط Driver لإرسال عدد كبير من الرسائل بالتوازي من عملية واحدة
+
+✅ نفس الـ payloads ونفس شكل النتيجة (Dict مع success و message_id) مثل whatsapp_driver.py
+✅ httpx.AsyncClient مع Connection Pool محدود و Keep-Alive و timeout لكل طلب
+✅ إعادة المحاولة على مستوى الاتصال فقط (لا تكرار لرسالة تم استلامها)
+
+Usage:
+    async with get_async_whatsapp_driver() as driver:
+        results = await asyncio.gather(*[
+            driver.send_text_message(phone, text) for phone, text in messages
+        ])
+
+⚠️  الـ AsyncClient مرتبط بالـ event loop الذي أُنشئ فيه: driver واحد لكل event loop
+"""
+
+import logging
+from abc import ABC, abstractmethod
+from typing import Dict, Any, Optional, Tuple
+
+import httpx
+from django.conf import settings
+
+from .whatsapp_driver import MessageDriver
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncMessageDriver(ABC):
+    """
+    Interface موحد (async) لجميع مزودي WhatsApp
+
+    يجب على كل Driver تطبيق هذه الدوال:
+    - send_text_message()
+    - send_media_message()
+    - send_template_message()
+    - send_interactive_message()
+    """
+
+    DEFAULT_POOL_SIZE = 100  # أقصى عدد طلبات متزامنة لكل driver
+
+    def __init__(self, config: Dict[str, Any]):
+        self.config = config
+        self.provider_name = "base"
+        self.timeout = config.get('timeout', 30)
+        self._client: Optional[httpx.AsyncClient] = None
+
+    # ------------------------------------------------------------------
+    # HTTP Client
+    # ------------------------------------------------------------------
+
+    def _get_headers(self) -> Dict[str, str]:
+        return {'Content-Type': 'application/json'}
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """
+        إنشاء AsyncClient عند أول استخدام (داخل الـ event loop الحالي)
+        """
+        if self._client is None:
+            pool_size = self.config.get('pool_size', self.DEFAULT_POOL_SIZE)
+            self._client = httpx.AsyncClient(
+                headers=self._get_headers(),
+                timeout=httpx.Timeout(
+                    self.timeout,
+                    connect=self.config.get('connect_timeout', MessageDriver.DEFAULT_CONNECT_TIMEOUT)
+                ),
+                limits=httpx.Limits(
+                    max_connections=pool_size,
+                    max_keepalive_connections=pool_size
+                ),
+                # ✅ retries في httpx تشمل أخطاء الاتصال فقط (قبل إرسال الطلب)
+                transport=httpx.AsyncHTTPTransport(
+                    retries=self.config.get('transport_retries', MessageDriver.DEFAULT_TRANSPORT_RETRIES)
+                )
+            )
+        return self._client
+
+    async def _post(self, url: str, payload: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        """
+        إرسال طلب POST
+
+        Returns:
+            (status_code, JSON body)
+        """
+        response = await self._get_client().post(url, json=payload)
+        try:
+            data = response.json()
+        except ValueError:
+            data = {}
+        return response.status_code, data
+
+    async def aclose(self) -> None:
+        """إغلاق اتصالات الـ AsyncClient"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    def _error(self, error: str, **extra) -> Dict[str, Any]:
+        return {
+            'success': False,
+            'error': error,
+            'provider': self.provider_name,
+            **extra
+        }
+
+    def normalize_phone(self, phone: str) -> str:
+        """توحيد صيغة رقم الهاتف (نفس منطق MessageDriver)"""
+        return MessageDriver.normalize_phone(self, phone)
+
+    # ------------------------------------------------------------------
+    # Interface
+    # ------------------------------------------------------------------
+
+    @abstractmethod
+    async def send_text_message(self, phone: str, message: str) -> Dict[str, Any]:
+        """إرسال رسالة نصية"""
+        pass
+
+    @abstractmethod
+    async def send_media_message(self, phone: str, media_url: str,
+                                 media_type: str, caption: str = None) -> Dict[str, Any]:
+        """إرسال ميديا (صورة/فيديو/ملف)"""
+        pass
+
+    @abstractmethod
+    async def send_template_message(self, phone: str, template_name: str,
+                                    template_language: str = 'en',
+                                    template_params: Dict[str, Any] = None) -> Dict[str, Any]:
+        """إرسال رسالة Template"""
+        pass
+
+    @abstractmethod
+    async def send_interactive_message(self, phone: str, interactive_data: Dict[str, Any]) -> Dict[str, Any]:
+        """إرسال رسالة Interactive (أزرار/قائمة)"""
+        pass
+
+
+class AsyncWPPConnectDriver(AsyncMessageDriver):
+    """
+    WPPConnect Driver (async)
+
+    ⚠️  WPPConnect لا يدعم Templates؛ الرسائل Interactive تُرسل كنص مع الخيارات مرقمة
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        super().__init__(config)
+        self.provider_name = "wppconnect"
+        self.base_url = config.get('base_url', 'http://localhost:3000')
+        self.api_key = config.get('api_key', '')
+
+    def _get_headers(self) -> Dict[str, str]:
+        return {
+            'Content-Type': 'application/json',
+            'X-API-Key': self.api_key
+        }
+
+    def _chat_id(self, phone: str) -> str:
+        # ✅ chatId كامل (مع @c.us أو @lid) يُستخدم كما هو
+        return phone if '@' in phone else self.normalize_phone(phone)
+
+    async def _send(self, url: str, payload: Dict[str, Any], phone_to_send: str) -> Dict[str, Any]:
+        try:
+            status_code, data = await self._post(url, payload)
+
+            if status_code < 400 and data.get('success'):
+                return {
+                    'success': True,
+                    'message_id': data.get('message_id'),
+                    'provider': self.provider_name,
+                    'phone': data.get('phone', phone_to_send),
+                    'chat_id': data.get('chat_id', phone_to_send)
+                }
+
+            logger.error(f"WPPConnect send failed ({status_code}): {data}")
+            return self._error(data.get('error', f'HTTP {status_code}'))
+
+        except httpx.HTTPError as e:
+            logger.error(f"WPPConnect request error: {str(e)}")
+            return self._error(str(e) or e.__class__.__name__)
+
+    async def send_text_message(self, phone: str, message: str) -> Dict[str, Any]:
+        phone_to_send = self._chat_id(phone)
+        return await self._send(
+            f"{self.base_url}/api/send-message",
+            {'phone': phone_to_send, 'message': message},
+            phone_to_send
+        )
+
+    async def send_media_message(self, phone: str, media_url: str,
+                                 media_type: str, caption: str = None) -> Dict[str, Any]:
+        phone_to_send = self._chat_id(phone)
+        payload = {
+            'phone': phone_to_send,
+            'media_url': media_url,
+            'media_type': media_type
+        }
+        if caption:
+            payload['caption'] = caption
+
+        return await self._send(f"{self.base_url}/api/send-media", payload, phone_to_send)
+
+    async def send_template_message(self, phone: str, template_name: str,
+                                    template_language: str = 'en',
+                                    template_params: Dict[str, Any] = None) -> Dict[str, Any]:
+        return self._error('Template messages are not supported by WPPConnect')
+
+    async def send_interactive_message(self, phone: str, interactive_data: Dict[str, Any]) -> Dict[str, Any]:
+        # نص الرسالة + الخيارات (أزرار أو صفوف القائمة) مرقمة
+        body = interactive_data.get('body', {})
+        lines = [body.get('text', '') if isinstance(body, dict) else str(body)]
+
+        action = interactive_data.get('action', {})
+        options = [
+            button.get('reply', {}).get('title') or button.get('title')
+            for button in action.get('buttons', [])
+        ]
+        for section in action.get('sections', []):
+            options.extend(row.get('title') for row in section.get('rows', []))
+
+        lines.extend(f"{index} {title}" for index, title in enumerate(filter(None, options), start=1))
+
+        return await self.send_text_message(phone, '\n'.join(line for line in lines if line))
+
+
+class AsyncCloudAPIDriver(AsyncMessageDriver):
+    """
+    WhatsApp Business Cloud API Driver (async)
+    """
+
+    MEDIA_TYPE_MAPPING = {
+        'image': 'image',
+        'video': 'video',
+        'audio': 'audio',
+        'document': 'document',
+        'file': 'document'
+    }
+
+    def __init__(self, config: Dict[str, Any]):
+        super().__init__(config)
+        self.provider_name = "cloud_api"
+        self.access_token = config.get('access_token', '')
+        self.phone_number_id = config.get('phone_number_id', '')
+        self.api_version = 'v18.0'
+        self.base_url = config.get('base_url') or f'https://graph.facebook.com/{self.api_version}'
+
+        if not self.access_token or not self.phone_number_id:
+            logger.error("AsyncCloudAPIDriver: Missing access_token or phone_number_id")
+
+    def _get_headers(self) -> Dict[str, str]:
+        return {
+            'Authorization': f'Bearer {self.access_token}',
+            'Content-Type': 'application/json'
+        }
+
+    async def _send(self, phone: str, message_type: str, content: Dict[str, Any]) -> Dict[str, Any]:
+        phone = self.normalize_phone(phone)
+        payload = {
+            "messaging_product": "whatsapp",
+            "recipient_type": "individual",
+            "to": phone,
+            "type": message_type,
+            message_type: content
+        }
+
+        try:
+            status_code, data = await self._post(f"{self.base_url}/{self.phone_number_id}/messages", payload)
+
+            if status_code >= 400:
+                error = data.get('error', {}) if isinstance(data.get('error'), dict) else {}
+                logger.error(f"Cloud API HTTP error ({status_code}): {error.get('message')}")
+                return self._error(error.get('message', f'HTTP {status_code}'), error_code=error.get('code'))
+
+            message_id = (data.get('messages') or [{}])[0].get('id')
+            if not message_id:
+                logger.error(f"Cloud API response missing message_id: {data}")
+                return self._error('No message_id in response')
+
+            return {
+                'success': True,
+                'message_id': message_id,
+                'provider': self.provider_name,
+                'phone': phone,
+                'wa_id': (data.get('contacts') or [{}])[0].get('wa_id')
+            }
+
+        except httpx.HTTPError as e:
+            logger.error(f"Cloud API request error: {str(e)}")
+            return self._error(str(e) or e.__class__.__name__)
+
+    async def send_text_message(self, phone: str, message: str) -> Dict[str, Any]:
+        return await self._send(phone, 'text', {"preview_url": False, "body": message})
+
+    async def send_media_message(self, phone: str, media_url: str,
+                                 media_type: str, caption: str = None) -> Dict[str, Any]:
+        cloud_type = self.MEDIA_TYPE_MAPPING.get(media_type, 'document')
+        media_object = {"link": media_url}
+
+        # caption للصور والفيديو فقط
+        if caption and cloud_type in ['image', 'video']:
+            media_object['caption'] = caption
+
+        return await self._send(phone, cloud_type, media_object)
+
+    async def send_template_message(self, phone: str, template_name: str,
+                                    template_language: str = 'en',
+                                    template_params: Dict[str, Any] = None) -> Dict[str, Any]:
+        template = {
+            "name": template_name,
+            "language": {"code": template_language}
+        }
+        if template_params:
+            template.update(template_params)  # مثال: {'components': [...]}
+
+        return await self._send(phone, 'template', template)
+
+    async def send_interactive_message(self, phone: str, interactive_data: Dict[str, Any]) -> Dict[str, Any]:
+        return await self._send(phone, 'interactive', interactive_data)
+
+
+class AsyncElmujibCloudAPIDriver(AsyncMessageDriver):
+    """
+    Elmujib Cloud Business API Driver (async)
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        super().__init__(config)
+        self.provider_name = "elmujib_cloud"
+        self.base_url = config.get('base_url', 'https://elmujib.com/api')
+        self.vendor_uid = config.get('vendor_uid', '')
+        self.bearer_token = config.get('bearer_token', '')
+        self.from_phone_number_id = config.get('from_phone_number_id', '')
+        self.auth_method = config.get('auth_method', 'header')
+
+        if not self.vendor_uid or not self.bearer_token:
+            logger.error("AsyncElmujibCloudAPIDriver: Missing vendor_uid or bearer_token")
+
+    def _get_headers(self) -> Dict[str, str]:
+        headers = {'Content-Type': 'application/json'}
+        if self.auth_method == 'header':
+            headers['Authorization'] = f'Bearer {self.bearer_token}'
+        return headers
+
+    def _url(self, endpoint: str) -> str:
+        url = f"{self.base_url}/{self.vendor_uid}/contact/{endpoint}"
+        if self.auth_method == 'query':
+            url = f"{url}?token={self.bearer_token}"
+        return url
+
+    async def _send(self, endpoint: str, phone: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        phone = self.normalize_phone(phone)
+        payload = {"phone_number": phone, **payload}
+        if self.from_phone_number_id:
+            payload["from_phone_number_id"] = self.from_phone_number_id
+
+        try:
+            status_code, data = await self._post(self._url(endpoint), payload)
+
+            succeeded = (
+                data.get('success')
+                or data.get('status') in ['success', 'processed']
+                or str(data.get('message', '')).lower() in ['message processed', 'processed', 'ok']
+            )
+            if status_code < 400 and succeeded:
+                return {
+                    'success': True,
+                    'message_id': data.get('message_id') or data.get('id'),
+                    'provider': self.provider_name,
+                    'phone': phone
+                }
+
+            error_msg = data.get('error') or data.get('message') or f'HTTP {status_code}'
+            logger.error(f"Elmujib API error ({endpoint}): {error_msg}")
+            return self._error(error_msg)
+
+        except httpx.HTTPError as e:
+            logger.error(f"Elmujib API request error ({endpoint}): {str(e)}")
+            return self._error(str(e) or e.__class__.__name__)
+
+    async def send_text_message(self, phone: str, message: str) -> Dict[str, Any]:
+        return await self._send('send-message', phone, {"message_body": message})
+
+    async def send_media_message(self, phone: str, media_url: str,
+                                 media_type: str, caption: str = None) -> Dict[str, Any]:
+        payload = {"media_type": media_type, "media_url": media_url}
+
+        if caption and media_type in ['image', 'video']:
+            payload['caption'] = caption
+
+        if media_type == 'document':
+            payload['file_name'] = caption or 'document'
+
+        return await self._send('send-media-message', phone, payload)
+
+    async def send_template_message(self, phone: str, template_name: str,
+                                    template_language: str = 'en',
+                                    template_params: Dict[str, Any] = None) -> Dict[str, Any]:
+        payload = {"template_name": template_name, "template_language": template_language}
+        if template_params:
+            payload.update(template_params)
+
+        return await self._send('send-template-message', phone, payload)
+
+    async def send_interactive_message(self, phone: str, interactive_data: Dict[str, Any]) -> Dict[str, Any]:
+        return await self._send('send-interactive-message', phone, dict(interactive_data))
+
+
+# ============================================
+# Driver Factory
+# ============================================
+
+def get_async_whatsapp_driver(driver_type: Optional[str] = None) -> AsyncMessageDriver:
+    """
+    إنشاء Async Driver للمزود الحالي (نفس إعدادات get_whatsapp_driver)
+
+    ⚠️  driver جديد في كل استدعاء: يُستخدم داخل event loop واحد ثم يُغلق (async with)
+
+    Args:
+        driver_type: اسم المزود (افتراضي settings.WHATSAPP_DRIVER)
+
+    Returns:
+        AsyncMessageDriver instance
+    """
+    driver_type = driver_type or getattr(settings, 'WHATSAPP_DRIVER', 'wppconnect')
+
+    http_config = {
+        'pool_size': getattr(settings, 'WHATSAPP_ASYNC_POOL_SIZE', AsyncMessageDriver.DEFAULT_POOL_SIZE),
+        'connect_timeout': getattr(settings, 'WHATSAPP_HTTP_CONNECT_TIMEOUT', MessageDriver.DEFAULT_CONNECT_TIMEOUT),
+        'transport_retries': getattr(settings, 'WHATSAPP_HTTP_RETRIES', MessageDriver.DEFAULT_TRANSPORT_RETRIES),
+    }
+
+    if driver_type == 'wppconnect':
+        return AsyncWPPConnectDriver({
+            'base_url': getattr(settings, 'WPPCONNECT_BASE_URL', 'http://localhost:3000'),
+            'api_key': getattr(settings, 'WPPCONNECT_API_KEY', 'your-secret-api-key'),
+            'timeout': getattr(settings, 'WPPCONNECT_TIMEOUT', 30),
+            **http_config
+        })
+
+    elif driver_type == 'cloud_api':
+        return AsyncCloudAPIDriver({
+            'access_token': getattr(settings, 'WHATSAPP_CLOUD_ACCESS_TOKEN', ''),
+            'phone_number_id': getattr(settings, 'WHATSAPP_CLOUD_PHONE_NUMBER_ID', ''),
+            **http_config
+        })
+
+    elif driver_type == 'elmujib_cloud':
+        return AsyncElmujibCloudAPIDriver({
+            'base_url': getattr(settings, 'ELMUJIB_API_BASE_URL', 'https://elmujib.com/api'),
+            'vendor_uid': getattr(settings, 'ELMUJIB_VENDOR_UID', ''),
+            'bearer_token': getattr(settings, 'ELMUJIB_BEARER_TOKEN', ''),
+            'from_phone_number_id': getattr(settings, 'ELMUJIB_FROM_PHONE_NUMBER_ID', ''),
+            'auth_method': getattr(settings, 'ELMUJIB_AUTH_METHOD', 'header'),
+            'timeout': getattr(settings, 'ELMUJIB_TIMEOUT', 30),
+            **http_config
+        })
+
+    else:
+        raise ValueError(f"Unknown WhatsApp driver: {driver_type}")
@@ -0,0 +1,311 @@
+"""
+Auto Reply Engine
+مطابقة الرسائل الواردة مع محفزات الرد التلقائي (AutoReplyTrigger) واختيارات القائمة
+
+كل المحفزات النشطة وكلمات القائمة تُجمع في Automaton واحد (Aho-Corasick) على نص
+عربي موحّد (normalize_arabic):
+
+    message_text → normalize_arabic() → automaton (مرور واحد على النص) → AutoReplyMatch
+
+✅ تكلفة المطابقة خطية في طول الرسالة مهما زاد عدد المحفزات
+✅ الـ Automaton في الذاكرة ويُبنى من جديد فقط عند تغير المحفزات:
+   - فوراً في نفس العملية (signals.py)
+   - وبين العمليات: فحص خفيف (استعلام aggregate واحد) كل AUTO_REPLY_REFRESH_SECONDS
+✅ توحيد النص: التشكيل والتطويل، أشكال الألف، ى/ي، ة/ه، الأرقام العربية-الهندية
+   ('شكوى' = 'شكوي'، 'أدوية' = 'ادويه'، '١' = '1')
+
+قواعد المطابقة:
+    اختيار القائمة   الرسالة كلها (بعد التوحيد) = كلمة القائمة
+    المحفز           كلمة/عبارة كاملة داخل الرسالة، والأطول هو المعتمد عند تعدد المحفزات
+
+Usage:
+    match = get_auto_reply_engine().match(message_text)
+    match.menu_category   # 'complaint' / 'medicine_order' / 'follow_up' / None
+    match.trigger         # CompiledTrigger / None
+"""
+
+import logging
+import re
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from django.db.models import Count, Max
+
+from .models import AutoReplyTrigger, Message, Ticket
+
+logger = logging.getLogger(__name__)
+
+# كلمات اختيار القائمة (بعد الترحيب) لكل فئة
+MENU_KEYWORDS = {
+    'complaint': ['1', 'شكوى', 'استفسار'],
+    'medicine_order': ['2', 'أدوية', 'دواء'],
+    'follow_up': ['3', 'متابعة', 'طلب سابق'],
+}
+
+_ARABIC_DIACRITICS = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]')  # تشكيل + تطويل
+_WHITESPACE = re.compile(r'\s+')
+_ARABIC_LETTERS = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ى': 'ي', 'ة': 'ه', 'ؤ': 'و', 'ئ': 'ي',
+    **{chr(0x0660 + digit): str(digit) for digit in range(10)},  # ٠-٩
+    **{chr(0x06f0 + digit): str(digit) for digit in range(10)},  # ۰-۹
+})
+
+
+def normalize_arabic(text: Optional[str]) -> str:
+    """
+    توحيد النص للمطابقة (نفس الدالة للمحفزات والرسائل)
+    """
+    if not text:
+        return ''
+    text = _ARABIC_DIACRITICS.sub('', text).translate(_ARABIC_LETTERS).lower()
+    return _WHITESPACE.sub(' ', text).strip()
+
+
+# ============================================
+# Aho-Corasick Automaton
+# ============================================
+
+class AhoCorasickAutomaton:
+    """
+    Automaton لمطابقة عدة كلمات في مرور واحد على النص
+
+    Usage:
+        automaton = AhoCorasickAutomaton([('شكوي', 'complaint'), ('دواء', 'medicine_order')])
+        for start, end, payload in automaton.iter_matches(text):
+            ...
+    """
+
+    def __init__(self, patterns: List[Tuple[str, Any]]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[Tuple[int, Any]]] = [[]]  # (طول الكلمة, payload)
+        self.patterns_count = 0
+
+        for pattern, payload in patterns:
+            if pattern:
+                self._add(pattern, payload)
+
+        self._build_failure_links()
+
+    def _add(self, pattern: str, payload: Any) -> None:
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = next_state
+
+        self._output[state].append((len(pattern), payload))
+        self.patterns_count += 1
+
+    def _build_failure_links(self) -> None:
+        # BFS: رابط الفشل لكل حالة = أطول لاحقة لها موجودة في الـ trie
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                self._output[next_state].extend(self._output[self._fail[next_state]])
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int, Any]]:
+        """
+        كل التطابقات في النص
+
+        Yields:
+            (start, end, payload) حيث text[start:end] هي الكلمة
+        """
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+
+            for length, payload in self._output[state]:
+                yield index + 1 - length, index + 1, payload
+
+
+# ============================================
+# Auto Reply Engine
+# ============================================
+
+@dataclass(frozen=True)
+class CompiledTrigger:
+    """محفز نشط جاهز للمطابقة (بدون استعلامات عند الرد)"""
+    id: int
+    keyword: str
+    trigger_type: str
+    reply_text: str
+
+
+@dataclass
+class AutoReplyMatch:
+    """نتيجة مطابقة رسالة واحدة"""
+    menu_category: Optional[str] = None
+    trigger: Optional[CompiledTrigger] = None
+
+
+class AutoReplyEngine:
+    """
+    Automaton واحد لكل المحفزات النشطة وكلمات القائمة، آمن مع الـ threads
+    """
+
+    DEFAULT_REFRESH_SECONDS = 30  # أقصى مدة قبل ملاحظة تعديل محفز من عملية أخرى
+
+    def __init__(self, refresh_seconds: Optional[float] = None):
+        self.refresh_seconds = refresh_seconds if refresh_seconds is not None else getattr(
+            settings, 'AUTO_REPLY_REFRESH_SECONDS', self.DEFAULT_REFRESH_SECONDS
+        )
+        self._lock = threading.Lock()
+        self._automaton: Optional[AhoCorasickAutomaton] = None
+        self._signature = None
+        self._checked_at = 0.0
+        self.builds = 0
+
+    def invalidate(self) -> None:
+        """
+        تم تعديل محفز أو قالب: إعادة الفحص (والبناء إذا لزم) عند المطابقة التالية
+        """
+        with self._lock:
+            self._signature = None
+            self._checked_at = 0.0
+
+    def _load_signature(self) -> Tuple:
+        stats = AutoReplyTrigger.objects.aggregate(
+            count=Count('id'),
+            updated_at=Max('updated_at'),
+            template_updated_at=Max('template__updated_at')
+        )
+        return stats['count'], stats['updated_at'], stats['template_updated_at']
+
+    def _compile(self) -> AhoCorasickAutomaton:
+        patterns = [
+            (normalize_arabic(keyword), ('menu', category))
+            for category, keywords in MENU_KEYWORDS.items()
+            for keyword in keywords
+        ]
+
+        for trigger in AutoReplyTrigger.objects.filter(is_active=True).select_related('template'):
+            reply_text = trigger.reply_text or (
+                trigger.template.content if trigger.template and trigger.template.is_active else None
+            )
+            keyword = normalize_arabic(trigger.trigger_keyword)
+            if not keyword or not reply_text:
+                continue
+
+            patterns.append((keyword, ('trigger', CompiledTrigger(
+                id=trigger.id,
+                keyword=keyword,
+                trigger_type=trigger.trigger_type,
+                reply_text=reply_text
+            ))))
+
+        return AhoCorasickAutomaton(patterns)
+
+    def _current_automaton(self) -> AhoCorasickAutomaton:
+        now = time.monotonic()
+        with self._lock:
+            if self._automaton is not None and self._signature is not None \
+                    and now - self._checked_at < self.refresh_seconds:
+                return self._automaton
+
+            signature = self._load_signature()
+            if self._automaton is None or signature != self._signature:
+                self._automaton = self._compile()
+                self.builds += 1
+                logger.info(f"[AUTO REPLY] Automaton built: {self._automaton.patterns_count} keyword(s)")
+
+            self._signature = signature
+            self._checked_at = now
+            return self._automaton
+
+    def match(self, message_text: Optional[str]) -> AutoReplyMatch:
+        """
+        مطابقة رسالة مع القائمة والمحفزات (مرور واحد على النص)
+        """
+        text = normalize_arabic(message_text)
+        result = AutoReplyMatch()
+        if not text:
+            return result
+
+        best_trigger = None  # (الطول, -البداية, المحفز)
+        for start, end, (kind, payload) in self._current_automaton().iter_matches(text):
+            if kind == 'menu':
+                if start == 0 and end == len(text):
+                    result.menu_category = payload
+                continue
+
+            # كلمة كاملة فقط ('دواء' لا تطابق 'الدواءات'، '1' لا تطابق '10')
+            if (start and text[start - 1].isalnum()) or (end < len(text) and text[end].isalnum()):
+                continue
+
+            rank = (end - start, -start)
+            if best_trigger is None or rank > best_trigger[0]:
+                best_trigger = (rank, payload)
+
+        if best_trigger:
+            result.trigger = best_trigger[1]
+        return result
+
+    def match_menu(self, message_text: Optional[str]) -> Optional[str]:
+        return self.match(message_text).menu_category
+
+
+def send_trigger_reply(ticket: Ticket, trigger: CompiledTrigger) -> Dict[str, Any]:
+    """
+    إضافة رد المحفز لقائمة الانتظار (مسار ردود النظام)
+
+    Returns:
+        Dict مع success و message_id (نتيجة enqueue)
+    """
+    from .message_queue import get_message_queue
+
+    ticket = Ticket.objects.select_related('assigned_agent__user').get(id=ticket.id)
+    result = get_message_queue().enqueue(
+        ticket_id=ticket.id,
+        user=ticket.assigned_agent.user if ticket.assigned_agent else None,
+        message_text=trigger.reply_text,
+        priority=Message.PRIORITY_SYSTEM,
+        auto_reply=True
+    )
+
+    if result.get('success'):
+        logger.info(f"[AUTO REPLY] Trigger '{trigger.keyword}' reply queued for ticket {ticket.ticket_number}")
+    elif not result.get('duplicate'):
+        logger.warning(f"[AUTO REPLY] Trigger '{trigger.keyword}' reply not queued: {result.get('error')}")
+
+    return result
+
+
+# ============================================
+# Singleton Instance
+# ============================================
+
+_auto_reply_engine_instance = None
+
+def get_auto_reply_engine() -> AutoReplyEngine:
+    """
+    الحصول على AutoReplyEngine Singleton Instance
+
+    Returns:
+        AutoReplyEngine instance
+    """
+    global _auto_reply_engine_instance
+
+    if _auto_reply_engine_instance is None:
+        _auto_reply_engine_instance = AutoReplyEngine()
+
+    return _auto_reply_engine_instance
@@ -0,0 +1,722 @@
+"""
+Broadcast Campaign Engine
+إرسال جماعي (عروض / تنبيهات توفر الأدوية) لآلاف العملاء
+
+Features:
+✅ اختيار الجمهور بفلتر على Customer / CustomerTag (بدون تحميل العملاء في الذاكرة)
+✅ إنشاء المستلمين على دفعات (bulk_create) بدلاً من enqueue لكل عميل
+✅ الإرسال محكوم بالـ Rate Limiter المشترك (حد المزود + حد خاص بالحملات + حد لكل عميل)
+✅ حجز آمن بين عدة عمليات (نفس أسلوب MessageQueue: lease token + Visibility Timeout + Backoff)
+✅ عدادات تقدم وتوصيل لكل حملة تُحدّث تدريجياً
+✅ رسائل Template (Elmujib send_template_message)
+✅ الحملات تفسح الطريق لردود الموظفين والنظام: عند وجود رسائل مستحقة في MessageQueue
+   تأخذ الحملة حصة مسار الإرسال الجماعي فقط (MessageQueue.LANE_WEIGHTS)
+
+Usage:
+    engine = get_broadcast_engine()
+    result = engine.create_campaign('عرض الشتاء', message_text='...', audience_filter={'tags': ['vip']})
+    engine.launch(result['campaign_id'])
+    engine.process_batch()  # من العامل: python manage.py send_broadcasts --continuous
+"""
+
+import logging
+import random
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Dict, Any, Optional, List
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import BroadcastCampaign, BroadcastRecipient, Customer, CustomerTag, Message, User
+from .message_queue import MessageQueue
+from .rate_limiter import get_rate_limiter
+from .whatsapp_driver import get_whatsapp_driver
+
+logger = logging.getLogger(__name__)
+
+AUDIENCE_FILTER_KEYS = {'customer_types', 'tags', 'exclude_tags', 'customer_ids'}
+MEDIA_TYPES = {'image', 'document', 'video'}
+
+# ترتيب حالات التوصيل (الانتقال للأمام فقط)
+DELIVERY_STATUS_ORDER = {'sent': 0, 'delivered': 1, 'read': 2}
+
+
+class BroadcastEngine:
+    """
+    Broadcast Campaign Engine
+
+    Usage:
+        engine = BroadcastEngine()
+        engine.launch(campaign_id)
+        engine.process_batch(workers=4)
+    """
+
+    BATCH_SIZE = 50  # عدد المستلمين في كل دفعة حجز
+    DEFAULT_WORKERS = 4
+    DEFAULT_CHUNK_SIZE = 1000  # حجم دفعة bulk_create
+    MAX_RETRY_COUNT = MessageQueue.MAX_RETRY_COUNT
+    RETRY_DELAY_SECONDS = MessageQueue.RETRY_DELAY_SECONDS
+    RETRY_JITTER = MessageQueue.RETRY_JITTER
+    CLAIM_TIMEOUT_SECONDS = MessageQueue.CLAIM_TIMEOUT_SECONDS
+
+    def __init__(self):
+        self._driver = None
+
+    @property
+    def driver(self):
+        return self._driver or get_whatsapp_driver()
+
+    @driver.setter
+    def driver(self, driver):
+        self._driver = driver
+
+    def supports_templates(self) -> bool:
+        """
+        هل المزود الحالي يدعم رسائل Template (Elmujib)
+        """
+        return callable(getattr(self.driver, 'send_template_message', None))
+
+    # ============================================
+    # Audience & Campaign Creation
+    # ============================================
+
+    def select_audience(self, audience_filter: Optional[Dict[str, Any]] = None):
+        """
+        العملاء المستهدفون بالحملة
+
+        Args:
+            audience_filter: {
+                'customer_types': ['vip', ...],
+                'tags': ['diabetes', ...],          # أي تاج منها
+                'exclude_tags': ['no_promotions'],
+                'customer_ids': [1, 2, ...]
+            }
+
+        Returns:
+            QuerySet للعملاء (غير المحظورين) مرتب حسب id
+        """
+        audience_filter = audience_filter or {}
+
+        customers = Customer.objects.filter(is_blocked=False).exclude(
+            wa_id__endswith='@lid'  # حسابات LID لا تستقبل رسائل آلية
+        )
+
+        if audience_filter.get('customer_types'):
+            customers = customers.filter(customer_type__in=audience_filter['customer_types'])
+
+        if audience_filter.get('customer_ids'):
+            customers = customers.filter(id__in=audience_filter['customer_ids'])
+
+        # ✅ subquery بدلاً من JOIN + DISTINCT (العميل قد يملك أكثر من تاج مطابق)
+        if audience_filter.get('tags'):
+            customers = customers.filter(
+                id__in=CustomerTag.objects.filter(tag__in=audience_filter['tags']).values('customer_id')
+            )
+
+        if audience_filter.get('exclude_tags'):
+            customers = customers.exclude(
+                id__in=CustomerTag.objects.filter(tag__in=audience_filter['exclude_tags']).values('customer_id')
+            )
+
+        return customers.order_by('id')
+
+    def create_campaign(
+        self,
+        name: str,
+        message_text: Optional[str] = None,
+        audience_filter: Optional[Dict[str, Any]] = None,
+        message_type: str = 'text',
+        media_url: Optional[str] = None,
+        template_name: Optional[str] = None,
+        template_language: str = 'ar',
+        template_params: Optional[Dict[str, Any]] = None,
+        user: Optional[User] = None
+    ) -> Dict[str, Any]:
+        """
+        إنشاء حملة بحالة draft (بدون إنشاء المستلمين)
+
+        Returns:
+            Dict مع success و campaign_id و audience_size
+        """
+        audience_filter = audience_filter or {}
+
+        unknown_keys = set(audience_filter) - AUDIENCE_FILTER_KEYS
+        if unknown_keys:
+            return {'success': False, 'error': f'Unknown audience filter keys: {", ".join(sorted(unknown_keys))}'}
+
+        if message_type == 'template':
+            if not template_name:
+                return {'success': False, 'error': 'template_name is required for template campaigns'}
+            if not self.supports_templates():
+                return {
+                    'success': False,
+                    'error': f'Template messages are not supported by provider {self.driver.provider_name}'
+                }
+        elif message_type in MEDIA_TYPES:
+            if not media_url:
+                return {'success': False, 'error': 'media_url is required for media campaigns'}
+        elif message_type == 'text':
+            if not message_text:
+                return {'success': False, 'error': 'message_text is required for text campaigns'}
+        else:
+            return {'success': False, 'error': f'Unsupported message type: {message_type}'}
+
+        campaign = BroadcastCampaign.objects.create(
+            name=name,
+            message_type=message_type,
+            message_text=message_text,
+            media_url=media_url,
+            template_name=template_name,
+            template_language=template_language,
+            template_params=template_params or {},
+            audience_filter=audience_filter,
+            created_by=user
+        )
+
+        logger.info(f"📣 Broadcast campaign {campaign.id} created: {name}")
+
+        return {
+            'success': True,
+            'campaign_id': campaign.id,
+            'status': campaign.status,
+            'audience_size': self.select_audience(audience_filter).count()
+        }
+
+    def _create_recipients(self, campaign: BroadcastCampaign) -> int:
+        """
+        إنشاء صفوف المستلمين على دفعات (bulk_create) بدون تحميل كل العملاء في الذاكرة
+
+        Returns:
+            عدد المستلمين
+        """
+        chunk_size = getattr(settings, 'BROADCAST_CHUNK_SIZE', self.DEFAULT_CHUNK_SIZE)
+        now = timezone.now()
+        total = 0
+        chunk = []
+
+        audience = self.select_audience(campaign.audience_filter).values_list('id', 'wa_id')
+        for customer_id, wa_id in audience.iterator(chunk_size=chunk_size):
+            chunk.append(BroadcastRecipient(
+                campaign=campaign,
+                customer_id=customer_id,
+                wa_id=wa_id,
+                next_attempt_at=now
+            ))
+            if len(chunk) >= chunk_size:
+                BroadcastRecipient.objects.bulk_create(chunk, ignore_conflicts=True)
+                total += len(chunk)
+                chunk = []
+
+        if chunk:
+            BroadcastRecipient.objects.bulk_create(chunk, ignore_conflicts=True)
+            total += len(chunk)
+
+        return total
+
+    # ============================================
+    # Campaign Lifecycle
+    # ============================================
+
+    def launch(self, campaign_id: int) -> Dict[str, Any]:
+        """
+        بدء حملة (draft) أو استئنافها (paused)
+
+        ✅ الانتقال draft → running يتم مرة واحدة فقط (compare-and-set)
+        ✅ إنشاء المستلمين داخل نفس الـ transaction (كل شيء أو لا شيء)
+        """
+        now = timezone.now()
+
+        resumed = BroadcastCampaign.objects.filter(
+            id=campaign_id,
+            status='paused'
+        ).update(status='running', updated_at=now)
+        if resumed:
+            logger.info(f"▶️  Broadcast campaign {campaign_id} resumed")
+            return {'success': True, 'campaign_id': campaign_id, 'status': 'running'}
+
+        with transaction.atomic():
+            launched = BroadcastCampaign.objects.filter(
+                id=campaign_id,
+                status='draft'
+            ).update(status='running', started_at=now, updated_at=now)
+
+            if not launched:
+                campaign = BroadcastCampaign.objects.filter(id=campaign_id).only('status').first()
+                return {
+                    'success': False,
+                    'error': f'Campaign is {campaign.status}' if campaign else 'Campaign not found'
+                }
+
+            campaign = BroadcastCampaign.objects.get(id=campaign_id)
+            total = self._create_recipients(campaign)
+
+            campaign.total_recipients = total
+            fields = ['total_recipients', 'updated_at']
+            if not total:
+                campaign.status = 'completed'
+                campaign.completed_at = now
+                fields += ['status', 'completed_at']
+            campaign.save(update_fields=fields)
+
+        logger.info(f"🚀 Broadcast campaign {campaign_id} launched for {total} recipients")
+
+        return {
+            'success': True,
+            'campaign_id': campaign_id,
+            'status': campaign.status,
+            'total_recipients': total
+        }
+
+    def pause(self, campaign_id: int) -> Dict[str, Any]:
+        """
+        إيقاف مؤقت (المستلمون المحجوزون حالياً يكملون إرسالهم)
+        """
+        paused = BroadcastCampaign.objects.filter(
+            id=campaign_id,
+            status='running'
+        ).update(status='paused', updated_at=timezone.now())
+
+        if not paused:
+            return {'success': False, 'error': 'Campaign is not running'}
+
+        return {'success': True, 'campaign_id': campaign_id, 'status': 'paused'}
+
+    def cancel(self, campaign_id: int) -> Dict[str, Any]:
+        """
+        إلغاء حملة (المستلمون الذين لم يُرسل لهم يبقون pending ولا يُرسلون)
+        """
+        cancelled = BroadcastCampaign.objects.filter(
+            id=campaign_id,
+            status__in=['draft', 'running', 'paused']
+        ).update(status='cancelled', completed_at=timezone.now(), updated_at=timezone.now())
+
+        if not cancelled:
+            return {'success': False, 'error': 'Campaign cannot be cancelled'}
+
+        return {'success': True, 'campaign_id': campaign_id, 'status': 'cancelled'}
+
+    # ============================================
+    # Dispatch
+    # ============================================
+
+    def release_stale_claims(self) -> int:
+        """
+        إعادة المستلمين المحجوزين من عامل متوقف إلى pending (Visibility Timeout)
+        """
+        cutoff = timezone.now() - timedelta(seconds=self.CLAIM_TIMEOUT_SECONDS)
+
+        released = BroadcastRecipient.objects.filter(
+            status='sending',
+            claimed_at__lt=cutoff
+        ).update(status='pending', claimed_by=None, claimed_at=None)
+
+        if released:
+            logger.warning(f"Released {released} stale broadcast claim(s)")
+
+        return released
+
+    def _yield_batch_size(self, batch_size: int) -> int:
+        """
+        حجم الدفعة بعد إفساح الطريق للرسائل التفاعلية ورسائل النظام
+
+        ✅ الحملات والردود تتشارك حد المزود: عند وجود رسائل مستحقة في مساري
+           INTERACTIVE / SYSTEM تأخذ الحملة حصة مسار BULK فقط من الدفعة
+           (نفس أوزان MessageQueue.LANE_WEIGHTS، وبدون توقف كامل حتى لا تتجمد الحملة)
+        ✅ استعلام exists واحد (index: delivery_status, priority, next_attempt_at)
+        """
+        busy = Message.objects.filter(
+            delivery_status='pending',
+            priority__lt=Message.PRIORITY_BULK,
+            next_attempt_at__lte=timezone.now()
+        ).exists()
+
+        if not busy:
+            return batch_size
+
+        weights = MessageQueue.LANE_WEIGHTS
+        share = batch_size * weights[Message.PRIORITY_BULK] // sum(weights.values())
+        return max(share, 1)
+
+    def claim_batch(self, batch_size: Optional[int] = None) -> List[BroadcastRecipient]:
+        """
+        حجز دفعة من المستلمين المستحقين في الحملات الجارية
+
+        ✅ PostgreSQL: SELECT ... FOR UPDATE SKIP LOCKED
+        ✅ SQLite: compare-and-set (UPDATE ... WHERE status='pending')
+        """
+        batch_size = batch_size or self.BATCH_SIZE
+        lease = uuid.uuid4().hex
+        now = timezone.now()
+
+        candidates = BroadcastRecipient.objects.filter(
+            status='pending',
+            next_attempt_at__lte=now,
+            campaign__status='running'
+        ).order_by('id')
+
+        with transaction.atomic():
+            if connection.features.has_select_for_update_skip_locked:
+                candidates = candidates.select_for_update(skip_locked=True, of=('self',))
+
+            due_ids = list(candidates.values_list('id', flat=True)[:batch_size])
+
+            if not due_ids:
+                return []
+
+            BroadcastRecipient.objects.filter(
+                id__in=due_ids,
+                status='pending'
+            ).update(status='sending', claimed_by=lease, claimed_at=now)
+
+        return list(
+            BroadcastRecipient.objects.filter(
+                id__in=due_ids,
+                status='sending',
+                claimed_by=lease
+            ).select_related('campaign').order_by('id')
+        )
+
+    def _save_claimed(self, recipient: BroadcastRecipient, **fields) -> bool:
+        """
+        حفظ نتيجة مستلم محجوز وإنهاء الحجز (مشروط بأن الحجز ما زال لهذا العامل)
+        """
+        fields.update(claimed_by=None, claimed_at=None)
+
+        saved = BroadcastRecipient.objects.filter(
+            id=recipient.id,
+            claimed_by=recipient.claimed_by
+        ).update(**fields)
+
+        if not saved:
+            logger.warning(f"Broadcast recipient {recipient.id} claim expired before its result was saved")
+
+        for field, value in fields.items():
+            setattr(recipient, field, value)
+
+        return bool(saved)
+
+    def _next_attempt_at(self, retry_count: int):
+        delay_seconds = self.RETRY_DELAY_SECONDS[min(retry_count - 1, len(self.RETRY_DELAY_SECONDS) - 1)]
+        delay_seconds *= random.uniform(1 - self.RETRY_JITTER, 1 + self.RETRY_JITTER)
+
+        return timezone.now() + timedelta(seconds=delay_seconds)
+
+    def send_to_recipient(self, recipient: BroadcastRecipient) -> Dict[str, Any]:
+        """
+        إرسال رسالة الحملة لمستلم واحد عبر المزود الحالي
+        """
+        campaign = recipient.campaign
+
+        if campaign.message_type == 'template':
+            return self.driver.send_template_message(
+                recipient.wa_id,
+                campaign.template_name,
+                template_language=campaign.template_language,
+                template_params=campaign.template_params or None
+            )
+
+        if campaign.message_type in MEDIA_TYPES:
+            return self.driver.send_media_message(
+                phone=recipient.wa_id,
+                media_url=campaign.media_url,
+                media_type=campaign.message_type,
+                caption=campaign.message_text
+            )
+
+        return self.driver.send_text_message(phone=recipient.wa_id, message=campaign.message_text)
+
+    def _process_recipient(self, recipient: BroadcastRecipient, paused: threading.Event) -> Dict[str, Any]:
+        """
+        معالجة مستلم محجوز واحد
+
+        Returns:
+            Dict مع outcome (sent / failed / retry / rate_limited / released) و retry_at
+        """
+        if paused.is_set():
+            self._save_claimed(recipient, status='pending')
+            return {'outcome': 'released', 'retry_at': None}
+
+        circuit_retry_at = self.driver.circuit_retry_at()
+        if circuit_retry_at:
+            # ✅ المزود متوقف (Circuit Breaker) → بدون احتساب محاولة
+            paused.set()
+            self._save_claimed(recipient, status='pending', next_attempt_at=circuit_retry_at)
+            return {'outcome': 'rate_limited', 'retry_at': circuit_retry_at}
+
+        decision = get_rate_limiter().acquire(
+            self.driver.provider_name,
+            recipient=recipient.wa_id,
+            broadcast=True
+        )
+        if not decision['allowed']:
+            # ✅ حد المزود أو حد الحملات → إيقاف باقي الدفعة؛ حد العميل → هذا المستلم فقط
+            if not decision['bucket'].startswith('recipient:'):
+                paused.set()
+            self._save_claimed(recipient, status='pending', next_attempt_at=decision['retry_at'])
+            return {'outcome': 'rate_limited', 'retry_at': decision['retry_at']}
+
+        try:
+            result = self.send_to_recipient(recipient)
+        except Exception as e:
+            logger.error(f"Error sending broadcast to recipient {recipient.id}: {str(e)}", exc_info=True)
+            result = {'success': False, 'error': str(e)}
+
+        if result.get('success'):
+            self._save_claimed(
+                recipient,
+                status='sent',
+                whatsapp_message_id=result.get('message_id'),
+                sent_at=timezone.now(),
+                error_message=None
+            )
+            return {'outcome': 'sent', 'retry_at': None}
+
+        retry_count = recipient.retry_count + 1
+        final = retry_count >= self.MAX_RETRY_COUNT
+        self._save_claimed(
+            recipient,
+            status='failed' if final else 'pending',
+            retry_count=retry_count,
+            next_attempt_at=self._next_attempt_at(retry_count),
+            error_message=result.get('error', 'Unknown error')
+        )
+        return {'outcome': 'failed' if final else 'retry', 'retry_at': None}
+
+    def _process_slice(self, recipients: List[BroadcastRecipient], paused: threading.Event) -> List[Dict[str, Any]]:
+        try:
+            return [
+                dict(self._process_recipient(recipient, paused), campaign_id=recipient.campaign_id)
+                for recipient in recipients
+            ]
+        finally:
+            # كل thread له اتصال قاعدة بيانات خاص به
+            connection.close()
+
+    def _update_counters(self, results: List[Dict[str, Any]]) -> None:
+        """
+        تحديث عدادات الحملات تدريجياً (F expressions) وإنهاء الحملات المكتملة
+        """
+        per_campaign = {}
+        for result in results:
+            counters = per_campaign.setdefault(result['campaign_id'], {'sent': 0, 'failed': 0})
+            if result['outcome'] in counters:
+                counters[result['outcome']] += 1
+
+        now = timezone.now()
+        for campaign_id, counters in per_campaign.items():
+            if counters['sent'] or counters['failed']:
+                BroadcastCampaign.objects.filter(id=campaign_id).update(
+                    sent_count=F('sent_count') + counters['sent'],
+                    failed_count=F('failed_count') + counters['failed'],
+                    updated_at=now
+                )
+
+        unfinished = BroadcastRecipient.objects.filter(
+            campaign_id__in=per_campaign,
+            status__in=['pending', 'sending']
+        ).values('campaign_id')
+
+        completed = BroadcastCampaign.objects.filter(
+            id__in=per_campaign,
+            status='running'
+        ).exclude(id__in=unfinished).update(status='completed', completed_at=now, updated_at=now)
+
+        if completed:
+            logger.info(f"✅ {completed} broadcast campaign(s) completed")
+
+    def process_batch(self, workers: Optional[int] = None, batch_size: Optional[int] = None) -> Dict[str, Any]:
+        """
+        إرسال دفعة من رسائل الحملات الجارية
+
+        ✅ المستلمون مستقلون (رسالة واحدة لكل عميل) → إرسال متوازي بدون انتظار ترتيب
+        ✅ عند الوصول لحد المزود/الحملات تتوقف الدفعة وترجع retry_at
+        ✅ عند وجود ردود موظفين/نظام مستحقة تُصغّر الدفعة (_yield_batch_size) وترجع yielded=True
+
+        Returns:
+            Dict مع إحصائيات المعالجة
+        """
+        workers = workers or getattr(settings, 'MESSAGE_QUEUE_WORKERS', self.DEFAULT_WORKERS)
+
+        batch_size = batch_size or self.BATCH_SIZE
+
+        self.release_stale_claims()
+        allowed_size = self._yield_batch_size(batch_size)
+        claimed = self.claim_batch(allowed_size)
+        yielded = allowed_size < batch_size
+
+        if not claimed:
+            return {
+                'success': True,
+                'processed': 0,
+                'sent': 0,
+                'failed': 0,
+                'rate_limited': 0,
+                'retry_at': None,
+                'fetched': 0,
+                'yielded': yielded,
+                'message': 'No pending broadcast messages'
+            }
+
+        pool_size = min(workers, len(claimed))
+        slices = [claimed[index::pool_size] for index in range(pool_size)]
+        paused = threading.Event()
+
+        with ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='broadcast') as executor:
+            results = [
+                result
+                for slice_results in executor.map(lambda recipients: self._process_slice(recipients, paused), slices)
+                for result in slice_results
+            ]
+
+        self._update_counters(results)
+
+        sent_count = sum(1 for result in results if result['outcome'] == 'sent')
+        failed_count = sum(1 for result in results if result['outcome'] in ('failed', 'retry'))
+        rate_limited_count = sum(1 for result in results if result['outcome'] == 'rate_limited')
+        retry_times = [result['retry_at'] for result in results if result['retry_at']]
+
+        logger.info(f"[BROADCAST] {sent_count} sent, {failed_count} failed, {rate_limited_count} rate limited")
+
+        return {
+            'success': True,
+            'processed': sent_count + failed_count,
+            'sent': sent_count,
+            'failed': failed_count,
+            'rate_limited': rate_limited_count,
+            'retry_at': min(retry_times) if retry_times else None,
+            'fetched': len(claimed),
+            'yielded': yielded,
+            'message': f'Processed {sent_count + failed_count} broadcast messages'
+        }
+
+    # ============================================
+    # Delivery Tracking & Progress
+    # ============================================
+
+    def record_delivery_status(self, whatsapp_message_id: str, delivery_status: str) -> bool:
+        """
+        تسجيل حالة توصيل (delivered / read) لرسالة حملة وتحديث عدادات الحملة
+
+        ✅ الانتقال للأمام فقط (read لا يرجع إلى delivered)
+
+        Returns:
+            True إذا كانت الرسالة تابعة لحملة وتم تحديث حالتها
+        """
+        return self.record_delivery_statuses({whatsapp_message_id: delivery_status}) > 0
+
+    def record_delivery_statuses(self, statuses: Dict[str, str]) -> int:
+        """
+        تسجيل دفعة حالات توصيل لرسائل الحملات (من delivery_receipts)
+
+        ✅ استعلام واحد للمستلمين (whatsapp_message_id__in)
+        ✅ UPDATE واحد لكل انتقال في كل حملة (sent→delivered / sent→read / delivered→read)
+        ✅ UPDATE واحد لعدادات كل حملة
+
+        Args:
+            statuses: {whatsapp_message_id: delivered / read}
+
+        Returns:
+            عدد المستلمين الذين تم تحديث حالتهم
+        """
+        statuses = {
+            whatsapp_message_id: delivery_status
+            for whatsapp_message_id, delivery_status in statuses.items()
+            if whatsapp_message_id and delivery_status in ('delivered', 'read')
+        }
+        if not statuses:
+            return 0
+
+        recipients = BroadcastRecipient.objects.filter(
+            whatsapp_message_id__in=list(statuses)
+        ).only('id', 'campaign_id', 'status', 'whatsapp_message_id')
+
+        # (الحملة، الحالة الحالية، الحالة الجديدة) → المستلمين
+        # ✅ التجميع حسب الحملة يجعل عدد الصفوف المحدثة هو نفسه الزيادة في عداداتها
+        transitions = {}
+        for recipient in recipients:
+            delivery_status = statuses[recipient.whatsapp_message_id]
+            if recipient.status not in DELIVERY_STATUS_ORDER:
+                continue
+            if DELIVERY_STATUS_ORDER[recipient.status] >= DELIVERY_STATUS_ORDER[delivery_status]:
+                continue
+            key = (recipient.campaign_id, recipient.status, delivery_status)
+            transitions.setdefault(key, []).append(recipient.id)
+
+        counters = {}  # campaign_id → {delivered_count, read_count}
+        updated_count = 0
+
+        for (campaign_id, current_status, delivery_status), recipient_ids in transitions.items():
+            # compare-and-set: مستلم غيّره عامل آخر لا يُحتسب مرتين
+            updated = BroadcastRecipient.objects.filter(
+                id__in=recipient_ids,
+                status=current_status
+            ).update(status=delivery_status)
+            if not updated:
+                continue
+
+            campaign_counters = counters.setdefault(campaign_id, {})
+            if current_status == 'sent':
+                # read يعني أنها وصلت أيضاً
+                campaign_counters['delivered_count'] = campaign_counters.get('delivered_count', 0) + updated
+            if delivery_status == 'read':
+                campaign_counters['read_count'] = campaign_counters.get('read_count', 0) + updated
+            updated_count += updated
+
+        for campaign_id, campaign_counters in counters.items():
+            BroadcastCampaign.objects.filter(id=campaign_id).update(**{
+                field: F(field) + count for field, count in campaign_counters.items()
+            })
+
+        return updated_count
+
+    def get_progress(self, campaign: BroadcastCampaign) -> Dict[str, Any]:
+        """
+        تقدم الحملة من العدادات (بدون COUNT على المستلمين)
+        """
+        done = campaign.sent_count + campaign.failed_count
+        if campaign.total_recipients:
+            progress_percent = round(done * 100 / campaign.total_recipients, 1)
+        else:
+            progress_percent = 100.0 if campaign.status == 'completed' else 0.0
+
+        return {
+            'campaign_id': campaign.id,
+            'name': campaign.name,
+            'status': campaign.status,
+            'message_type': campaign.message_type,
+            'total_recipients': campaign.total_recipients,
+            'sent': campaign.sent_count,
+            'failed': campaign.failed_count,
+            'delivered': campaign.delivered_count,
+            'read': campaign.read_count,
+            'remaining': max(campaign.total_recipients - done, 0),
+            'progress_percent': progress_percent,
+            'started_at': campaign.started_at,
+            'completed_at': campaign.completed_at,
+        }
+
+
+# ============================================
+# Singleton Instance
+# ============================================
+
+_broadcast_engine_instance = None
+
+def get_broadcast_engine() -> BroadcastEngine:
+    """
+    الحصول على BroadcastEngine Singleton Instance
+
+    Returns:
+        BroadcastEngine instance
+    """
+    global _broadcast_engine_instance
+
+    if _broadcast_engine_instance is None:
+        _broadcast_engine_instance = BroadcastEngine()
+
+    return _broadcast_engine_instance
@@ -0,0 +1,192 @@
+"""
+Provider Circuit Breaker
+قاطع دائرة لكل مزود WhatsApp (لا ننتظر timeout كامل على مزود متوقف)
+
+Features:
+✅ closed → open بعد عدد من الأخطاء المتتالية (أخطاء اتصال / timeout / 5xx)
+✅ open: الطلبات ترفض فوراً بدون اتصال (CircuitOpenError)
+✅ half_open: بعد مهلة الاستعادة يُسمح بطلب تجريبي واحد؛ نجاحه يغلق الدائرة
+✅ مدمج في requests.Session الخاصة بكل Driver (طلبات الإرسال: circuit=True)
+
+الحالة في ذاكرة كل عملية (كل عامل يكتشف توقف المزود بنفسه خلال عدة طلبات).
+
+Usage:
+    breaker = CircuitBreaker('wppconnect', failure_threshold=5, reset_timeout=30)
+    session = CircuitBreakerSession(breaker)
+    breaker.retry_at()  # None إذا كان الإرسال مسموحاً الآن
+"""
+
+import logging
+import threading
+import time
+from datetime import timedelta
+from typing import Dict, Any, Optional
+
+import requests
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """الدائرة مفتوحة: الطلب رُفض بدون الاتصال بالمزود"""
+
+
+class CircuitBreaker:
+    """
+    Circuit Breaker (closed / open / half_open)
+
+    Usage:
+        if breaker.allow_request():
+            ...
+            breaker.record_success()  # أو record_failure()
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    DEFAULT_FAILURE_THRESHOLD = 5  # أخطاء متتالية قبل فتح الدائرة
+    DEFAULT_RESET_TIMEOUT = 30  # ثواني قبل الطلب التجريبي
+
+    def __init__(self, name: str, failure_threshold: Optional[int] = None, reset_timeout: Optional[float] = None):
+        self.name = name
+        self.failure_threshold = failure_threshold or self.DEFAULT_FAILURE_THRESHOLD
+        self.reset_timeout = reset_timeout or self.DEFAULT_RESET_TIMEOUT
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = None  # time.monotonic()
+        self._probe_in_flight = False
+        self._last_error = None
+
+    def _remaining_open_seconds(self) -> float:
+        return max(self._opened_at + self.reset_timeout - time.monotonic(), 0.0)
+
+    def allow_request(self) -> bool:
+        """
+        هل يُسمح بإرسال طلب الآن؟ (في half_open يحجز الطلب التجريبي)
+        """
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+
+            if self._state == self.OPEN:
+                if self._remaining_open_seconds() > 0:
+                    return False
+                self._state = self.HALF_OPEN
+                self._probe_in_flight = False
+                logger.info(f"🟡 Circuit for {self.name} is half-open, probing provider")
+
+            # half_open: طلب تجريبي واحد فقط في نفس الوقت
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info(f"🟢 Circuit for {self.name} closed (provider recovered)")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._opened_at = None
+            self._probe_in_flight = False
+            self._last_error = None
+
+    def record_failure(self, error: Optional[str] = None) -> None:
+        with self._lock:
+            self._failures += 1
+            self._last_error = error
+            self._probe_in_flight = False
+
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    logger.error(
+                        f"🔴 Circuit for {self.name} opened after {self._failures} failure(s): {error}"
+                    )
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def release_probe(self) -> None:
+        """
+        تحرير الطلب التجريبي بدون احتساب نجاح أو فشل
+        """
+        with self._lock:
+            self._probe_in_flight = False
+
+    def retry_at(self):
+        """
+        أقرب وقت يُسمح فيه بالإرسال (بدون تغيير الحالة)
+
+        Returns:
+            None إذا كان الإرسال مسموحاً الآن، وإلا datetime
+        """
+        with self._lock:
+            if self._state == self.OPEN:
+                remaining = self._remaining_open_seconds()
+                if remaining > 0:
+                    return timezone.now() + timedelta(seconds=remaining)
+            elif self._state == self.HALF_OPEN and self._probe_in_flight:
+                return timezone.now() + timedelta(seconds=1)
+            return None
+
+    def get_state(self) -> Dict[str, Any]:
+        """
+        حالة الدائرة (للعرض في whatsapp_status)
+        """
+        with self._lock:
+            state = self._state
+            if state == self.OPEN and self._remaining_open_seconds() == 0:
+                state = self.HALF_OPEN  # الطلب التالي سيكون تجريبياً
+
+            return {
+                'provider': self.name,
+                'state': state,
+                'consecutive_failures': self._failures,
+                'failure_threshold': self.failure_threshold,
+                'retry_in_seconds': round(self._remaining_open_seconds(), 1) if self._state == self.OPEN else 0,
+                'last_error': self._last_error,
+            }
+
+
+class CircuitBreakerSession(requests.Session):
+    """
+    requests.Session تمر طلبات الإرسال فيها على CircuitBreaker
+
+    ✅ طلبات الإرسال فقط (circuit=True) تُحتسب؛ طلبات الحالة/QR/جهات الاتصال لا تغلق
+       دائرة مفتوحة ولا تستهلك الطلب التجريبي (GET ناجح على /status لا يعني أن الإرسال يعمل)
+    ✅ خطأ اتصال / timeout / 5xx → فشل
+    ✅ أي رد آخر (حتى 4xx مثل رقم غير صحيح) → المزود يعمل
+
+    Usage:
+        session.post(url, json=payload, circuit=True)
+    """
+
+    def __init__(self, breaker: CircuitBreaker):
+        super().__init__()
+        self.breaker = breaker
+
+    def request(self, method, url, *args, circuit: bool = False, **kwargs):
+        if not circuit:
+            return super().request(method, url, *args, **kwargs)
+
+        if not self.breaker.allow_request():
+            raise CircuitOpenError(f"Circuit open for {self.breaker.name}, request not sent")
+
+        try:
+            response = super().request(method, url, *args, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            self.breaker.record_failure(str(e))
+            raise
+        except Exception:
+            # خطأ غير متعلق بالمزود (مثلاً: payload غير صالح) → لا يُحتسب، فقط تحرير الطلب التجريبي
+            self.breaker.release_probe()
+            raise
+
+        if response.status_code >= 500:
+            self.breaker.record_failure(f"HTTP {response.status_code}")
+        else:
+            self.breaker.record_success()
+
+        return response
@@ -0,0 +1,292 @@
+"""
+Delay Scheduler
+جدولة التأخير المعتمدة على الأحداث
+
+بدلاً من فحص كل التذاكر المفتوحة مع كل تحميل صفحة، يحتفظ المجدول بـ min-heap
+لمواعيد استحقاق التأخير:
+
+    due_at = last_customer_message_at + SystemSettings.delay_threshold_minutes
+
+ولا يكتب في قاعدة البيانات (is_delayed + TicketStateLog + AgentDelayEvent)
+إلا عندما يحين موعد فعلي. صفحات العرض تقرأ is_delayed المخزن فقط.
+
+رد الموظف (last_agent_message_at) من أي مسار يُلغي الموعد ويُنهي التأخير في المزامنة
+التدريجية التالية (خلال SYNC_INTERVAL_SECONDS) بدون انتظار إعادة البناء الكاملة.
+
+Usage:
+    scheduler = get_delay_scheduler()
+    scheduler.run()  # حلقة مستمرة (python run_delay_tracker.py)
+"""
+
+import heapq
+import logging
+import threading
+import time
+from datetime import timedelta
+from typing import Dict, Optional
+
+from django.db.models import F, Max, Q
+from django.utils import timezone
+
+from .models import Ticket, SystemSettings
+
+logger = logging.getLogger(__name__)
+
+
+class DelayScheduler:
+    """
+    Min-heap لمواعيد التأخير
+
+    - كل عنصر: (due_at, ticket_id, customer_message_at)
+    - الإلغاء كسول (lazy): العنصر يُتجاهل عند خروجه إذا تغيرت آخر رسالة للعميل
+    - المزامنة مع قاعدة البيانات تدريجية لأن الـ webhooks والـ views تعمل في عمليات أخرى:
+      watermark على last_customer_message_at (مواعيد جديدة)
+      و watermark على last_agent_message_at (إلغاء المواعيد وإنهاء التأخير فوراً)
+    """
+
+    SYNC_INTERVAL_SECONDS = 5  # أقصى مدة بين مزامنتين تدريجيتين
+    FULL_RESYNC_SECONDS = 300  # إعادة بناء كاملة للـ heap كل 5 دقائق
+    WATERMARK_OVERLAP_SECONDS = 5  # هامش للمعاملات التي تُحفظ متأخرة
+
+    def __init__(self):
+        self._heap = []
+        self._scheduled: Dict[int, object] = {}  # ticket_id → customer_message_at
+        self._watermark = None
+        self._agent_watermark = None
+        self._threshold_minutes: Optional[int] = None
+        self._last_full_sync = 0.0
+        self._lock = threading.Lock()
+
+    # ------------------------------------------------------------------
+    # Heap operations
+    # ------------------------------------------------------------------
+
+    def schedule(self, ticket_id: int, customer_message_at) -> None:
+        """
+        جدولة موعد تأخير لتذكرة (يستبدل أي موعد سابق لنفس التذكرة)
+        """
+        if customer_message_at is None or self._threshold_minutes is None:
+            return
+
+        with self._lock:
+            if self._scheduled.get(ticket_id) == customer_message_at:
+                return
+            self._scheduled[ticket_id] = customer_message_at
+            due_at = customer_message_at + timedelta(minutes=self._threshold_minutes)
+            heapq.heappush(self._heap, (due_at, ticket_id, customer_message_at))
+
+    def cancel(self, ticket_id: int) -> None:
+        """
+        إلغاء موعد التأخير لتذكرة (الموظف رد أو التذكرة أُغلقت)
+        """
+        with self._lock:
+            self._scheduled.pop(ticket_id, None)
+
+    def next_due_at(self):
+        """
+        أقرب موعد تأخير صالح (أو None إذا كان الـ heap فارغاً)
+        """
+        with self._lock:
+            while self._heap:
+                due_at, ticket_id, customer_message_at = self._heap[0]
+                if self._scheduled.get(ticket_id) == customer_message_at:
+                    return due_at
+                heapq.heappop(self._heap)
+        return None
+
+    def _pop_due(self, now) -> Dict[int, object]:
+        due = {}
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                _, ticket_id, customer_message_at = heapq.heappop(self._heap)
+                if self._scheduled.get(ticket_id) == customer_message_at:
+                    del self._scheduled[ticket_id]
+                    due[ticket_id] = customer_message_at
+        return due
+
+    # ------------------------------------------------------------------
+    # Database synchronisation
+    # ------------------------------------------------------------------
+
+    def _awaiting_reply_tickets(self):
+        """
+        التذاكر المفتوحة غير المتأخرة التي تنتظر رد الموظف
+        """
+        return Ticket.objects.filter(
+            status='open',
+            is_delayed=False,
+            last_customer_message_at__isnull=False
+        ).filter(
+            Q(last_agent_message_at__isnull=True) |
+            Q(last_agent_message_at__lte=F('last_customer_message_at'))
+        )
+
+    def sync(self, force_full: bool = False) -> int:
+        """
+        مزامنة المواعيد من قاعدة البيانات
+
+        Returns:
+            عدد المواعيد المُضافة
+        """
+        threshold = SystemSettings.get_settings().delay_threshold_minutes
+        full = (
+            force_full
+            or threshold != self._threshold_minutes
+            or time.monotonic() - self._last_full_sync >= self.FULL_RESYNC_SECONDS
+        )
+
+        tickets = self._awaiting_reply_tickets()
+
+        if full:
+            with self._lock:
+                self._heap = []
+                self._scheduled = {}
+            self._threshold_minutes = threshold
+            self._last_full_sync = time.monotonic()
+        elif self._watermark is not None:
+            tickets = tickets.filter(
+                last_customer_message_at__gt=self._watermark - timedelta(seconds=self.WATERMARK_OVERLAP_SECONDS)
+            )
+
+        added = 0
+        for ticket_id, customer_message_at in tickets.values_list('id', 'last_customer_message_at'):
+            self.schedule(ticket_id, customer_message_at)
+            added += 1
+            if self._watermark is None or customer_message_at > self._watermark:
+                self._watermark = customer_message_at
+
+        if full:
+            # إعادة البناء تشمل كل الردود حتى الآن → الـ watermark يبدأ من آخر رد
+            self._agent_watermark = Ticket.objects.aggregate(
+                latest=Max('last_agent_message_at')
+            )['latest']
+            logger.info(f"Delay scheduler rebuilt: {added} deadline(s), threshold={threshold} min")
+        else:
+            self._sync_agent_replies(threshold)
+
+        return added
+
+    def _sync_agent_replies(self, threshold: int) -> int:
+        """
+        ردود الموظفين منذ آخر مزامنة (من أي مسار يحدّث last_agent_message_at)
+
+        ✅ الموعد المجدول يُلغى (lazy cancel)
+        ✅ التذكرة المتأخرة تُنهى حالة تأخيرها فوراً (reconcile_ticket_delays للتذاكر المعنية فقط)
+
+        Returns:
+            عدد التذاكر التي لم تعد متأخرة
+        """
+        from .utils import reconcile_ticket_delays
+
+        replies = Ticket.objects.filter(status='open', last_agent_message_at__isnull=False)
+        if self._agent_watermark is not None:
+            replies = replies.filter(
+                last_agent_message_at__gt=self._agent_watermark - timedelta(seconds=self.WATERMARK_OVERLAP_SECONDS)
+            )
+
+        delayed_ids = []
+        for ticket_id, agent_message_at, customer_message_at, is_delayed in replies.values_list(
+            'id', 'last_agent_message_at', 'last_customer_message_at', 'is_delayed'
+        ):
+            if self._agent_watermark is None or agent_message_at > self._agent_watermark:
+                self._agent_watermark = agent_message_at
+            if customer_message_at is None or agent_message_at > customer_message_at:
+                self.cancel(ticket_id)
+                if is_delayed:
+                    delayed_ids.append(ticket_id)
+
+        if not delayed_ids:
+            return 0
+
+        result = reconcile_ticket_delays(ticket_ids=delayed_ids, delay_threshold=threshold)
+        return result['no_longer_delayed']
+
+    # ------------------------------------------------------------------
+    # Firing
+    # ------------------------------------------------------------------
+
+    def fire_due(self, now=None) -> int:
+        """
+        تنفيذ المواعيد المستحقة فقط
+
+        Returns:
+            عدد التذاكر التي أصبحت متأخرة
+        """
+        from .utils import reconcile_ticket_delays
+
+        now = now or timezone.now()
+        due = self._pop_due(now)
+
+        if not due:
+            return 0
+
+        # مزامنة set-based للتذاكر المستحقة فقط (تعيد التحقق من شرط التأخير)
+        result = reconcile_ticket_delays(
+            ticket_ids=due.keys(),
+            delay_threshold=self._threshold_minutes
+        )
+        fired = result['newly_delayed']
+
+        if fired:
+            logger.info(f"Delay scheduler fired {fired} deadline(s)")
+
+        return fired
+
+    def sweep(self) -> Dict[str, int]:
+        """
+        مزامنة شاملة دورية (شبكة أمان) لكل التذاكر المفتوحة ثم إعادة بناء الـ heap
+
+        تلتقط التغييرات التي لا تحدّث last_customer_message_at / last_agent_message_at
+        (مثلاً تعديل حد التأخير أو تعديل يدوي في قاعدة البيانات)
+        """
+        from .utils import reconcile_ticket_delays
+
+        result = reconcile_ticket_delays()
+        self.sync(force_full=True)
+        return result
+
+    def run(self, stop_event: Optional[threading.Event] = None) -> None:
+        """
+        حلقة المجدول: مزامنة → تنفيذ المستحق → النوم حتى أقرب موعد
+        """
+        stop_event = stop_event or threading.Event()
+        self.sweep()
+
+        while not stop_event.is_set():
+            try:
+                if time.monotonic() - self._last_full_sync >= self.FULL_RESYNC_SECONDS:
+                    self.sweep()
+                else:
+                    self.sync()
+                self.fire_due()
+            except Exception as e:
+                logger.error(f"Delay scheduler error: {str(e)}", exc_info=True)
+
+            sleep_seconds = self.SYNC_INTERVAL_SECONDS
+            next_due = self.next_due_at()
+            if next_due is not None:
+                until_due = (next_due - timezone.now()).total_seconds()
+                sleep_seconds = max(0.0, min(sleep_seconds, until_due))
+
+            stop_event.wait(sleep_seconds)
+
+
+# ============================================
+# Singleton Instance
+# ============================================
+
+_delay_scheduler_instance = None
+
+def get_delay_scheduler() -> DelayScheduler:
+    """
+    الحصول على DelayScheduler Singleton Instance
+
+    Returns:
+        DelayScheduler instance
+    """
+    global _delay_scheduler_instance
+
+    if _delay_scheduler_instance is None:
+        _delay_scheduler_instance = DelayScheduler()
+
+    return _delay_scheduler_instance
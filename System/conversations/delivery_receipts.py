@@ -0,0 +1,268 @@
+"""
+Delivery Receipts
+معالجة إشعارات حالة التوصيل (sent / delivered / read / failed) للرسائل الصادرة
+
+Cloud API و Elmujib يرسلان الحالات في نفس الـ webhook (statuses) على دفعات:
+
+    payload → parse_<provider>_statuses() → List[DeliveryReceipt] → apply_delivery_receipts()
+
+✅ كل الحالات في الدفعة تُحل باستعلام واحد (whatsapp_message_id__in)
+✅ الانتقال للأمام فقط (read لا يرجع إلى delivered، و failed لا يلغي delivered)
+✅ UPDATE واحد لكل حالة جديدة (على الرسائل المحجوزة FOR UPDATE) بدلاً من save() لكل رسالة
+✅ سجلات MessageDeliveryLog بـ bulk_create واحد
+✅ الحالات التي لا تخص Message تُمرر دفعة واحدة لرسائل الحملات (BroadcastRecipient)
+
+Query budget:
+    QUERIES_PER_RECEIPT_BATCH  دفعة كاملة مهما كان عدد الحالات لمسار أولوية واحد
+                               (+ تحديث لكل حملة، + عدادات كل مسار إضافي)
+
+صندوق الوارد (process_webhook_inbox) يجمع webhooks الحالات في الدفعة الواحدة
+ويطبقها معاً (نافذة قصيرة) بدلاً من معالجة كل webhook على حدة.
+"""
+
+import logging
+from dataclasses import dataclass
+from typing import Dict, Any, List, Optional
+
+from django.db import transaction
+from django.db.models import Case, TextField, Value, When
+
+from .models import Message, MessageDeliveryLog
+from .queue_stats import record_transitions, transition_deltas
+
+logger = logging.getLogger(__name__)
+
+# select للرسائل + UPDATE لكل حالة (sent/delivered/read/failed) + bulk_create + select لمستلمي الحملات
+# (عدادات queue_stats تُطبق بعد الـ commit خارج هذه الميزانية)
+QUERIES_PER_RECEIPT_BATCH = 7
+
+# ترتيب الحالات داخل الدفعة: عند تكرار نفس الرسالة تُعتمد الحالة الأبعد
+RECEIPT_STATUS_ORDER = {'sent': 0, 'failed': 1, 'delivered': 2, 'read': 3}
+
+# الحالات الحالية التي يُسمح بالانتقال منها إلى كل حالة (للأمام فقط)
+ALLOWED_PREVIOUS_STATUSES = {
+    'sent': ('pending', 'queued', 'sending'),
+    'delivered': ('pending', 'queued', 'sending', 'sent'),
+    'read': ('pending', 'queued', 'sending', 'sent', 'delivered'),
+    'failed': ('pending', 'queued', 'sending', 'sent'),
+}
+
+ERROR_MESSAGE_MAX_LENGTH = 255  # MessageDeliveryLog.error_message
+
+
+@dataclass
+class DeliveryReceipt:
+    """حالة توصيل رسالة صادرة"""
+    whatsapp_message_id: str  # ID الرسالة من المزود (wamid)
+    status: str               # sent, delivered, read, failed
+    timestamp: Optional[int] = None
+    error_message: Optional[str] = None
+
+
+def _receipt_from_status(status: Dict[str, Any]) -> Optional[DeliveryReceipt]:
+    whatsapp_message_id = (
+        status.get('id')
+        or status.get('message_id')
+        or status.get('wamid')
+        or status.get('whatsapp_message_id')
+    )
+    delivery_status = str(status.get('status') or '').lower()
+
+    if not whatsapp_message_id or delivery_status not in RECEIPT_STATUS_ORDER:
+        return None
+
+    error_message = None
+    if delivery_status == 'failed':
+        errors = status.get('errors') or []
+        if errors and isinstance(errors[0], dict):
+            error = errors[0]
+            details = (error.get('error_data') or {}).get('details')
+            error_message = ' - '.join(
+                str(part) for part in (error.get('code'), error.get('title'), details) if part
+            )
+        error_message = (error_message or status.get('error') or 'Delivery failed')[:ERROR_MESSAGE_MAX_LENGTH]
+
+    timestamp = status.get('timestamp')
+    try:
+        timestamp = int(timestamp) if timestamp else None
+    except (TypeError, ValueError):
+        timestamp = None
+
+    return DeliveryReceipt(
+        whatsapp_message_id=str(whatsapp_message_id),
+        status=delivery_status,
+        timestamp=timestamp,
+        error_message=error_message
+    )
+
+
+# ============================================
+# Provider Parsers → DeliveryReceipt
+# ============================================
+
+def parse_cloud_api_statuses(data: Dict[str, Any]) -> List[DeliveryReceipt]:
+    """
+    استخراج الحالات من بيانات WhatsApp Business Cloud API (entry/changes/statuses)
+    """
+    receipts = []
+
+    for entry in data.get('entry', []):
+        for change in entry.get('changes', []):
+            for status in change.get('value', {}).get('statuses', []):
+                receipt = _receipt_from_status(status)
+                if receipt:
+                    receipts.append(receipt)
+
+    return receipts
+
+
+def parse_elmujib_statuses(data: Dict[str, Any]) -> List[DeliveryReceipt]:
+    """
+    استخراج الحالات من بيانات Elmujib
+
+    يدعم:
+    - نفس شكل Cloud API (entry/changes/statuses)
+    - قائمة statuses في أعلى البيانات
+    - إشعار حالة واحد: {"status": "delivered", "message_id": "wamid..."} بدون نص رسالة
+    """
+    if data.get('entry'):
+        return parse_cloud_api_statuses(data)
+
+    if isinstance(data.get('statuses'), list):
+        statuses = data['statuses']
+    elif data.get('status') and not (
+        data.get('text') or data.get('message_text') or data.get('message')
+    ):
+        statuses = [data]
+    else:
+        statuses = []
+
+    receipts = []
+    for status in statuses:
+        receipt = _receipt_from_status(status)
+        if receipt:
+            receipts.append(receipt)
+
+    return receipts
+
+
+def has_incoming_messages(provider: str, data: Dict[str, Any]) -> bool:
+    """
+    هل تحتوي البيانات على رسائل واردة؟ (webhook حالات فقط يُجمع مع غيره في صندوق الوارد)
+    """
+    if provider == 'cloud_api' or data.get('entry'):
+        return any(
+            change.get('value', {}).get('messages')
+            for entry in data.get('entry', [])
+            for change in entry.get('changes', [])
+        )
+
+    if provider == 'elmujib_cloud':
+        return not parse_elmujib_statuses(data)
+
+    return True
+
+
+def get_receipt_parser(provider: str):
+    return {
+        'cloud_api': parse_cloud_api_statuses,
+        'elmujib_cloud': parse_elmujib_statuses,
+    }.get(provider)
+
+
+# ============================================
+# Apply
+# ============================================
+
+def apply_delivery_receipts(receipts: List[DeliveryReceipt]) -> Dict[str, Any]:
+    """
+    تطبيق دفعة حالات توصيل
+
+    Args:
+        receipts: الحالات (من webhook واحد أو عدة webhooks)
+
+    Returns:
+        Dict مع success و received و updated و broadcast_updated
+    """
+    # ✅ حالة واحدة لكل رسالة: الأبعد في الدفعة
+    latest = {}
+    for receipt in receipts:
+        current = latest.get(receipt.whatsapp_message_id)
+        if current is None or RECEIPT_STATUS_ORDER[receipt.status] >= RECEIPT_STATUS_ORDER[current.status]:
+            latest[receipt.whatsapp_message_id] = receipt
+
+    if not latest:
+        return {'success': True, 'received': len(receipts), 'updated': 0, 'broadcast_updated': 0}
+
+    with transaction.atomic():
+        # ✅ FOR UPDATE: الحالات المقروءة ثابتة حتى نهاية الـ transaction → تغييرات العدادات
+        #    محسوبة من الصفوف التي تحدثت فعلاً (بدون استعلام إضافي)
+        messages = Message.objects.filter(
+            whatsapp_message_id__in=list(latest)
+        ).select_for_update().only('id', 'whatsapp_message_id', 'delivery_status', 'priority', 'direction')
+
+        by_status = {}  # الحالة الجديدة → [(message, receipt)]
+        matched_ids = set()
+        for message in messages:
+            matched_ids.add(message.whatsapp_message_id)
+            receipt = latest[message.whatsapp_message_id]
+            if message.delivery_status in ALLOWED_PREVIOUS_STATUSES[receipt.status]:
+                by_status.setdefault(receipt.status, []).append((message, receipt))
+
+        logs = []
+        counter_deltas = {}
+        for delivery_status, group in by_status.items():
+            message_ids = [message.id for message, _ in group]
+            fields = {'delivery_status': delivery_status}
+            if delivery_status == 'failed':
+                fields['error_message'] = Case(
+                    *[When(id=message.id, then=Value(receipt.error_message)) for message, receipt in group],
+                    output_field=TextField()
+                )
+
+            # الصفوف محجوزة والحالة السابقة مفحوصة أعلاه → كل رسائل المجموعة تتحدث
+            Message.objects.filter(id__in=message_ids).update(**fields)
+
+            logs.extend(
+                MessageDeliveryLog(
+                    message_id=message.id,
+                    delivery_status=delivery_status,
+                    error_message=receipt.error_message
+                )
+                for message, receipt in group
+            )
+            for key, delta in transition_deltas(
+                [(message.delivery_status, message.priority) for message, _ in group
+                 if message.direction == 'outgoing'],
+                delivery_status
+            ).items():
+                counter_deltas[key] = counter_deltas.get(key, 0) + delta
+
+        if logs:
+            MessageDeliveryLog.objects.bulk_create(logs)
+        record_transitions(counter_deltas)
+
+        # ✅ الباقي قد يكون رسائل حملات
+        unmatched = {
+            whatsapp_message_id: receipt.status
+            for whatsapp_message_id, receipt in latest.items()
+            if whatsapp_message_id not in matched_ids
+        }
+        broadcast_updated = 0
+        if unmatched:
+            from .broadcast import get_broadcast_engine
+            broadcast_updated = get_broadcast_engine().record_delivery_statuses(unmatched)
+
+    updated_count = len(logs)
+    if updated_count or broadcast_updated:
+        logger.info(
+            f"[RECEIPTS] {len(receipts)} received: {updated_count} messages, "
+            f"{broadcast_updated} broadcast recipients updated"
+        )
+
+    return {
+        'success': True,
+        'received': len(receipts),
+        'updated': updated_count,
+        'broadcast_updated': broadcast_updated
+    }
@@ -0,0 +1,160 @@
+"""
+Customer Identity Cache
+ذاكرة مؤقتة (LRU) لهوية العميل والتذكرة المفتوحة
+
+المفتاح هو معرف WhatsApp الخام كما يصل من المزود (بدون normalize_phone_number):
+    '201234567890@c.us'  /  '25516987932689@lid'  /  '201234567890' (Cloud API)
+
+والقيمة: customer_id + open ticket_id + بيانات ثابتة للعرض.
+
+✅ محادثة مستمرة = صفر استعلامات بحث عن العميل أو التذكرة
+✅ محدودة الحجم (LRU) وآمنة مع الـ threads
+✅ تُلغى عند إغلاق التذكرة أو تعديل/حذف العميل (signals.py)
+✅ صحيحة بين العمليات: ingestion تحدّث التذكرة بشرط status مفتوحة،
+   وإذا لم يتم تحديث أي صف تُلغى القيمة ويُعاد البحث من قاعدة البيانات
+
+Usage:
+    cache = get_identity_cache()
+    identity = cache.get(whatsapp_id)
+    cache.put(whatsapp_id, customer, ticket)
+    cache.invalidate_ticket(ticket_id)
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Any, Optional
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CachedIdentity:
+    """هوية عميل محفوظة في الذاكرة"""
+    customer_id: int
+    phone_number: str
+    wa_id: str
+    ticket_id: int
+    ticket_number: str
+    agent_username: Optional[str]  # للعرض في نتيجة الـ webhook فقط
+    classified: bool                # conversation_state == classified (لا يرجع بعد التصنيف)
+
+
+class IdentityCache:
+    """
+    LRU: whatsapp_id → CachedIdentity
+    """
+
+    DEFAULT_MAX_ENTRIES = 10000
+
+    def __init__(self, max_entries: Optional[int] = None):
+        self.max_entries = max_entries or getattr(settings, 'IDENTITY_CACHE_MAX_ENTRIES', self.DEFAULT_MAX_ENTRIES)
+        self._entries: 'OrderedDict[str, CachedIdentity]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Optional[str]) -> Optional[CachedIdentity]:
+        if not key:
+            return None
+
+        with self._lock:
+            identity = self._entries.get(key)
+            if identity is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return identity
+
+    def put(self, key: Optional[str], customer, ticket) -> None:
+        """
+        حفظ هوية العميل وتذكرته المفتوحة
+        """
+        if not key or customer.id is None or ticket.id is None:
+            return
+
+        identity = CachedIdentity(
+            customer_id=customer.id,
+            phone_number=customer.phone_number,
+            wa_id=customer.wa_id,
+            ticket_id=ticket.id,
+            ticket_number=ticket.ticket_number,
+            agent_username=ticket.assigned_agent.user.username if ticket.assigned_agent_id else None,
+            classified=ticket.conversation_state == 'classified'
+        )
+
+        with self._lock:
+            self._entries[key] = identity
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    # ------------------------------------------------------------------
+    # Invalidation
+    # ------------------------------------------------------------------
+
+    def invalidate(self, key: Optional[str]) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def _invalidate_where(self, predicate) -> int:
+        with self._lock:
+            keys = [key for key, identity in self._entries.items() if predicate(identity)]
+            for key in keys:
+                del self._entries[key]
+        return len(keys)
+
+    def invalidate_ticket(self, ticket_id: int) -> int:
+        """
+        إلغاء القيم المرتبطة بتذكرة (عند الإغلاق)
+        """
+        return self._invalidate_where(lambda identity: identity.ticket_id == ticket_id)
+
+    def invalidate_customer(self, customer_id: int) -> int:
+        """
+        إلغاء القيم المرتبطة بعميل (عند الدمج أو التعديل أو الحذف)
+        """
+        return self._invalidate_where(lambda identity: identity.customer_id == customer_id)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total * 100, 1) if total else 0.0
+            }
+
+
+# ============================================
+# Singleton Instance
+# ============================================
+
+_identity_cache_instance = None
+
+def get_identity_cache() -> IdentityCache:
+    """
+    الحصول على IdentityCache Singleton Instance
+
+    Returns:
+        IdentityCache instance
+    """
+    global _identity_cache_instance
+
+    if _identity_cache_instance is None:
+        _identity_cache_instance = IdentityCache()
+
+    return _identity_cache_instance
@@ -0,0 +1,983 @@
+"""
+Inbound Message Ingestion
+معالجة الرسائل الواردة من مزودي WhatsApp
+
+خدمة موحدة لكل المزودين (WPPConnect / Cloud API / Elmujib):
+
+    payload → parse_<provider>_payload() → List[IncomingMessage] → ingest_messages()
+
+✅ كل الدفعة داخل transaction واحدة
+✅ عدد استعلامات ثابت ومحدود لكل رسالة (KPI الموظف بعد الـ commit عند فتح التذكرة)
+✅ دفعات Cloud API متعددة الرسائل (entry/changes/messages) عبر ingest_messages_bulk:
+   استعلام واحد للمرسلين، استعلام واحد للتكرار، و bulk_create للرسائل
+✅ رسائل الترحيب والقائمة تُضاف لقائمة الانتظار (مسار ردود النظام) بعد الـ commit:
+   لا اتصال بالمزود في مسار الـ webhook، والعامل يرسلها مع retry
+✅ اختيار القائمة ومحفزات الرد التلقائي بمطابقة واحدة لكل رسالة (auto_reply.py)
+✅ identity cache (LRU) للعميل والتذكرة المفتوحة: محادثة مستمرة بدون استعلامات بحث
+✅ الترحيب/القائمة من Ticket.conversation_state و customer_messages_count
+   (بدون بحث عن نص الترحيب أو عد رسائل العميل مع كل رسالة)
+
+Query budget (بدون رسالة الترحيب/القائمة التي تُضاف لقائمة الانتظار بعد الـ commit):
+    QUERIES_PER_MESSAGE        عميل وتذكرة موجودان
+    QUERIES_PER_NEW_CUSTOMER   عميل جديد + تذكرة جديدة + موظف متاح
+    QUERIES_PER_BULK_BATCH     دفعة Cloud API كاملة (+ QUERIES_PER_NEW_TICKET لكل تذكرة جديدة)
+
+تُستدعى من عامل صندوق الوارد (process_webhook_inbox) بعد أن يقوم الـ webhook
+بحفظ البيانات الخام في WebhookInbox وإرجاع 200 فوراً.
+"""
+
+import logging
+from datetime import timedelta
+from typing import Dict, Any, List, Optional, Tuple
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, IntegerField, Q, Value, When
+from django.utils import timezone
+
+from .models import ActivityLog, Agent, Customer, Ticket, Message
+from .whatsapp_driver import IncomingMessage
+from .identity_cache import CachedIdentity, get_identity_cache
+from .auto_reply import get_auto_reply_engine, send_trigger_reply
+from .delivery_receipts import apply_delivery_receipts, parse_cloud_api_statuses, parse_elmujib_statuses
+from .utils import (
+    normalize_phone_number,
+    generate_ticket_number,
+    reserve_ticket_numbers,
+    get_available_agent,
+    log_activity,
+    send_welcome_message,
+    handle_menu_selection
+)
+
+logger = logging.getLogger(__name__)
+
+# ✅ الحد الأقصى للاستعلامات لكل رسالة بدون SAVEPOINT (يتحقق منه test_ingestion_queries.py)
+QUERIES_PER_MESSAGE = 7
+QUERIES_PER_NEW_CUSTOMER = 11
+# ingest_messages_bulk: ثابت للدفعة كلها (مهما كان عدد الرسائل) + لكل تذكرة جديدة
+QUERIES_PER_BULK_BATCH = 8
+QUERIES_PER_NEW_TICKET = 4
+
+CONTENT_DEDUP_SECONDS = 10
+
+
+# ============================================
+# Provider Parsers → IncomingMessage
+# ============================================
+
+def _to_int(value) -> int:
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def parse_wppconnect_payload(data: Dict[str, Any]) -> List[IncomingMessage]:
+    """
+    تحويل بيانات WPPConnect إلى IncomingMessage
+    """
+    return [IncomingMessage(
+        id_ext=data.get('id_ext'),
+        phone=data.get('phone'),
+        message_text=data.get('message_text', ''),
+        message_type=data.get('message_type', 'text'),
+        sender_name=data.get('sender_name', '-'),
+        timestamp=_to_int(data.get('timestamp')),
+        is_from_me=data.get('is_from_me', False),
+        media_url=data.get('media_url'),
+        mime_type=data.get('mime_type'),
+        chat_id=data.get('chat_id'),  # ✅ الـ chatId الكامل (مع @c.us أو @lid)
+        real_phone=data.get('real_phone'),  # ✅ الرقم الحقيقي (إذا كان @lid)
+        raw_data=data
+    )]
+
+
+def parse_cloud_api_payload(data: Dict[str, Any]) -> List[IncomingMessage]:
+    """
+    تحويل بيانات WhatsApp Business Cloud API (entry/changes/messages) إلى IncomingMessage
+
+    ✅ كل الرسائل في كل الـ entries/changes في قائمة واحدة
+    """
+    incoming = []
+
+    for entry in data.get('entry', []):
+        for change in entry.get('changes', []):
+            value = change.get('value', {})
+
+            # أسماء المرسلين من contacts
+            names = {
+                contact.get('wa_id'): contact.get('profile', {}).get('name', '-')
+                for contact in value.get('contacts', [])
+            }
+
+            for message in value.get('messages', []):
+                from_number = message.get('from')  # رقم المرسل (مع كود الدولة)
+                message_type = message.get('type', 'text')
+
+                # استخراج نص الرسالة حسب النوع
+                message_text = ''
+                media_url = None
+                mime_type = None
+                media_obj = message.get(message_type) or {}
+
+                if message_type == 'text':
+                    message_text = media_obj.get('body', '')
+                elif message_type == 'image':
+                    media_url = media_obj.get('id')  # Media ID (سيتم تحويله لـ URL)
+                    message_text = media_obj.get('caption', '[صورة]')
+                    mime_type = media_obj.get('mime_type')
+                elif message_type == 'video':
+                    media_url = media_obj.get('id')
+                    message_text = media_obj.get('caption', '[فيديو]')
+                    mime_type = media_obj.get('mime_type')
+                elif message_type == 'audio':
+                    media_url = media_obj.get('id')
+                    message_text = '[رسالة صوتية]'
+                    mime_type = media_obj.get('mime_type')
+                elif message_type == 'document':
+                    media_url = media_obj.get('id')
+                    message_text = media_obj.get('filename', '[ملف]')
+                    mime_type = media_obj.get('mime_type')
+                else:
+                    message_text = f'[{message_type}]'
+
+                incoming.append(IncomingMessage(
+                    id_ext=message.get('id'),
+                    phone=from_number,
+                    message_text=message_text,
+                    message_type=message_type,
+                    sender_name=names.get(from_number, '-'),
+                    timestamp=_to_int(message.get('timestamp')),
+                    is_from_me=False,
+                    media_url=media_url,
+                    mime_type=mime_type,
+                    chat_id=from_number,  # ✅ Cloud API يستخدم الرقم كـ wa_id بدون لاحقة
+                    raw_data=message
+                ))
+
+    return incoming
+
+
+def parse_elmujib_payload(data: Dict[str, Any]) -> List[IncomingMessage]:
+    """
+    تحويل بيانات Elmujib Cloud API إلى IncomingMessage
+    """
+    sender_info = data.get('sender') or {}
+    from_number = (
+        data.get('from')
+        or data.get('phone')
+        or sender_info.get('wa_id')
+        or sender_info.get('phone')
+        or sender_info.get('phone_number')
+    )
+
+    raw_text = data.get('text')
+    if isinstance(raw_text, dict):
+        raw_text = raw_text.get('body')
+    message_text = data.get('message_text') or raw_text or data.get('message') or ''
+
+    message_type = data.get('type') or data.get('message_type') or 'text'
+
+    media_url = None
+    mime_type = None
+    if message_type in ['image', 'video', 'audio', 'document']:
+        media_obj = data.get(message_type) or {}
+        media_url = media_obj.get('url') or media_obj.get('id')
+        mime_type = media_obj.get('mime_type') or media_obj.get('mimeType')
+
+    return [IncomingMessage(
+        id_ext=(
+            data.get('id')
+            or data.get('message_id')
+            or data.get('wamid')
+            or data.get('id_ext')
+        ),
+        phone=from_number,
+        message_text=message_text,
+        message_type=message_type,
+        sender_name=data.get('sender_name') or sender_info.get('name') or '-',
+        timestamp=_to_int(data.get('timestamp') or data.get('time')),
+        is_from_me=data.get('is_from_me', False),
+        media_url=media_url,
+        mime_type=mime_type,
+        raw_data=data
+    )]
+
+
+# ============================================
+# Customer & Ticket Resolution
+# ============================================
+
+def _resolve_identity(incoming: IncomingMessage) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Returns:
+        (normalized_phone, whatsapp_id)
+    """
+    normalized_phone = None
+    source_phone = incoming.real_phone or incoming.phone
+    if source_phone:
+        try:
+            normalized_phone = normalize_phone_number(source_phone)
+        except Exception:
+            normalized_phone = None
+
+    if incoming.chat_id:
+        whatsapp_id = incoming.chat_id
+    elif incoming.phone:
+        whatsapp_id = incoming.phone if '@' in incoming.phone else incoming.phone + '@c.us'
+    else:
+        whatsapp_id = None
+
+    return normalized_phone, whatsapp_id
+
+
+def _new_customer_fields(normalized_phone: Optional[str], whatsapp_id: str, sender_name: str) -> Dict[str, Any]:
+    """
+    بيانات العميل الجديد (الاسم الافتراضي + رقم placeholder لعملاء LID)
+    """
+    if normalized_phone:
+        return {
+            'wa_id': whatsapp_id,
+            'phone_number': normalized_phone,
+            'name': sender_name if sender_name != '-' else f'عميل {normalized_phone[-4:]}',
+        }
+
+    # Generate a unique placeholder: 201000 + last 6 digits from wa_id
+    lid_digits = ''.join(ch for ch in whatsapp_id.split('@')[0] if ch.isdigit())
+    placeholder_suffix = lid_digits[-6:] if len(lid_digits) >= 6 else f"{lid_digits:0>6}"
+    return {
+        'wa_id': whatsapp_id,
+        'phone_number': f"201000{placeholder_suffix}",
+        'name': sender_name if sender_name != '-' else 'عميل واتساب',
+    }
+
+
+def _resolve_customer(incoming: IncomingMessage) -> Tuple[Customer, bool]:
+    """
+    البحث عن العميل بالرقم أو wa_id باستعلام واحد، أو إنشاؤه
+
+    Returns:
+        (customer, created)
+    """
+    normalized_phone, whatsapp_id = _resolve_identity(incoming)
+
+    lookup = Q(wa_id=whatsapp_id)
+    if normalized_phone:
+        lookup |= Q(phone_number=normalized_phone)
+
+    candidates = list(Customer.objects.filter(lookup)[:2])
+    by_phone = next((c for c in candidates if normalized_phone and c.phone_number == normalized_phone), None)
+    by_wa_id = next((c for c in candidates if c.wa_id == whatsapp_id), None)
+
+    # Always store 201xxxxxxxxxx for phone_number if we can normalize
+    # For LID, keep a placeholder phone_number and rely on wa_id for messaging
+    customer = by_phone or by_wa_id
+    if customer:
+        if customer.wa_id != whatsapp_id and by_wa_id is None:
+            customer.wa_id = whatsapp_id
+            Customer.objects.filter(id=customer.id).update(wa_id=whatsapp_id)
+        return customer, False
+
+    try:
+        with transaction.atomic():
+            customer = Customer.objects.create(
+                **_new_customer_fields(normalized_phone, whatsapp_id, incoming.sender_name)
+            )
+    except IntegrityError:
+        # ✅ عامل آخر أنشأ العميل بالتزامن
+        return Customer.objects.filter(lookup).first(), False
+
+    logger.info(f"New customer created: {customer.phone_number}")
+    log_activity(
+        user=None,
+        action='customer_created',
+        entity_type='customer',
+        entity_id=customer.id
+    )
+
+    return customer, True
+
+
+def _open_ticket(customer: Customer, now, messages_count: int = 1,
+                 ticket_number: Optional[str] = None) -> Ticket:
+    """
+    فتح تذكرة جديدة للعميل مع أول رسالة (أو messages_count رسالة في الدفعة)
+
+    ✅ العدادات تُحدَّث بـ F() مباشرة، و _counters_updated يخبر post_save signal
+       بعدم إعادة عد التذاكر (COUNT) وحساب KPI الموظف بعد الـ commit (signals.py)
+    """
+    # الحصول على موظف متاح
+    available_agent = get_available_agent()
+
+    ticket = Ticket(
+        ticket_number=ticket_number or generate_ticket_number(),
+        customer=customer,
+        assigned_agent=available_agent,
+        current_agent=available_agent,
+        # بدون موظف: حالة معلقة والأدمن يقدر يرد عليها
+        status='open' if available_agent else 'pending',
+        priority='low',  # أولوية منخفضة حتى يختار العميل
+        category='general',
+        last_message_at=now,
+        last_customer_message_at=now,
+        messages_count=messages_count,
+        customer_messages_count=messages_count
+    )
+    ticket._counters_updated = True
+    ticket.save(force_insert=True)
+
+    if available_agent:
+        # تحديث عدد التذاكر النشطة للموظف وحالته (busy عند الوصول للسعة)
+        Agent.objects.filter(id=available_agent.id).update(
+            current_active_tickets=F('current_active_tickets') + 1,
+            status=Case(
+                When(current_active_tickets__gte=F('max_capacity') - 1, then=Value('busy')),
+                default=F('status')
+            )
+        )
+        logger.info(f"Ticket created: {ticket.ticket_number} - Agent: {available_agent.user.username}")
+    else:
+        logger.warning("No available agent found! Creating ticket without agent (Admin can handle it)")
+
+    # تحديث عداد التذاكر للعميل
+    Customer.objects.filter(id=customer.id).update(
+        total_tickets_count=F('total_tickets_count') + 1,
+        last_contact_date=now
+    )
+    customer.total_tickets_count += 1
+
+    return ticket
+
+
+# ============================================
+# Auto Replies (بعد الـ commit)
+# ============================================
+
+def _send_auto_reply(action: str, customer: Customer, ticket: Ticket, message_text: str) -> None:
+    """
+    رسالة الترحيب أو معالجة اختيار القائمة أو رد محفز (الرد يُضاف لقائمة الانتظار ولا يُرسل هنا)
+
+    ✅ مطابقة واحدة للرسالة (AutoReplyEngine) لاختيار القائمة والمحفزات معاً
+    """
+    try:
+        if action == 'welcome':
+            logger.info(f"Queueing welcome message for new customer: {customer.phone_number}")
+            if send_welcome_message(customer, ticket):
+                logger.info(f"Welcome message queued for {customer.phone_number}")
+            else:
+                logger.warning(f"Failed to queue welcome message for {customer.phone_number}")
+            return
+
+        match = get_auto_reply_engine().match(message_text)
+
+        # رسالة سابقة في نفس الدفعة اختارت من القائمة بالفعل → المحفزات فقط
+        if action == 'menu' and ticket.conversation_state != Ticket.CONVERSATION_CLASSIFIED:
+            logger.info(f"Processing menu selection for customer {customer.phone_number}: '{message_text}'")
+            menu_selection_result = handle_menu_selection(
+                customer, message_text, ticket, menu_category=match.menu_category
+            )
+
+            if menu_selection_result.get('success'):
+                logger.info(f"✅ Ticket {ticket.ticket_number} category updated: category={ticket.category}, priority={ticket.priority}")
+                return
+            elif menu_selection_result.get('message') == 'invalid_selection':
+                # عدم إرسال رسالة توضيحية تلقائية؛ اترك الأمر للموظف للرد
+                logger.info(f"Invalid menu selection from {customer.phone_number}: {message_text}")
+
+        if match.trigger:
+            send_trigger_reply(ticket, match.trigger)
+
+    except Exception as reply_error:
+        logger.error(f"Error in welcome/menu processing: {str(reply_error)}", exc_info=True)
+
+
+def _reply_state_ticket(ticket_id: int) -> Ticket:
+    """
+    ✅ التذكرة بحالة المحادثة الحالية (بحث بالـ primary key فقط)
+    """
+    return Ticket.objects.select_related('assigned_agent__user').get(id=ticket_id)
+
+
+def _auto_reply_for(conversation_state: str, customer_messages: int) -> str:
+    """
+    تحديد الرد التلقائي: 'welcome' للرسالة الأولى، 'menu' حتى يختار العميل،
+    ثم 'trigger' (محفزات الرد التلقائي فقط)
+    """
+    if conversation_state == Ticket.CONVERSATION_CLASSIFIED:
+        return 'trigger'
+    if customer_messages == 1 and conversation_state == Ticket.CONVERSATION_NEW:
+        return 'welcome'
+    if customer_messages >= 2 or conversation_state == Ticket.CONVERSATION_WELCOMED:
+        return 'menu'
+    return 'trigger'
+
+
+# ============================================
+# Ingestion Service
+# ============================================
+
+def _existing_messages(message_ids) -> Dict[str, Message]:
+    """
+    ✅ فحص التكرار لكل الدفعة باستعلام واحد (whatsapp_message_id__in)
+    """
+    if not message_ids:
+        return {}
+
+    return {
+        message.whatsapp_message_id: message
+        for message in Message.objects.select_related('ticket').filter(
+            whatsapp_message_id__in=message_ids
+        ).only('id', 'whatsapp_message_id', 'ticket_id', 'ticket__ticket_number')
+    }
+
+
+def _duplicate_result(existing_message: Message) -> Dict[str, Any]:
+    logger.warning(f"⚠️ Duplicate message detected: {existing_message.whatsapp_message_id} - Skipping")
+    return {
+        'success': True,
+        'duplicate': True,
+        'ticket_id': existing_message.ticket_id,
+        'ticket_number': existing_message.ticket.ticket_number,
+        'message_id': existing_message.id,
+        'message': 'Message already exists - skipped'
+    }
+
+
+def _message_result(message: Message, ticket: Ticket, **overrides) -> Dict[str, Any]:
+    result = {
+        'success': True,
+        'ticket_id': ticket.id,
+        'ticket_number': ticket.ticket_number,
+        'message_id': message.id,
+    }
+    if 'agent_username' in overrides:
+        result['assigned_agent'] = overrides['agent_username']
+    else:
+        result['assigned_agent'] = ticket.assigned_agent.user.username if ticket.assigned_agent else None
+    return result
+
+
+def _lookup_customer_ticket(incoming: IncomingMessage) -> Tuple[Customer, Optional[Ticket]]:
+    """
+    العميل وتذكرته المفتوحة من قاعدة البيانات (cache miss)
+    """
+    customer, customer_created = _resolve_customer(incoming)
+    if customer_created:
+        return customer, None
+
+    open_ticket = Ticket.objects.select_related('assigned_agent__user').filter(
+        customer=customer,
+        status__in=['open', 'pending']
+    ).first()
+    return customer, open_ticket
+
+
+def _touch_ticket(ticket: Ticket, now) -> bool:
+    """
+    تحديث آخر رسالة في التذكرة
+
+    ✅ بشرط أن تكون مفتوحة: يتحقق من صحة الـ cache بدون استعلام إضافي
+
+    Returns:
+        False إذا لم تعد التذكرة مفتوحة
+    """
+    updated = Ticket.objects.filter(
+        id=ticket.id,
+        status__in=['open', 'pending']
+    ).update(
+        last_message_at=now,
+        last_customer_message_at=now,
+        messages_count=F('messages_count') + 1,
+        customer_messages_count=F('customer_messages_count') + 1
+    )
+
+    if updated:
+        ticket.last_message_at = now
+        ticket.last_customer_message_at = now
+        ticket.messages_count += 1
+        ticket.customer_messages_count += 1
+
+    return bool(updated)
+
+
+def _identity_objects(identity: CachedIdentity) -> Tuple[Customer, Ticket]:
+    """
+    كائنات خفيفة من الـ cache (بدون استعلام) تكفي لحفظ الرسالة والرد
+    """
+    customer = Customer(
+        id=identity.customer_id,
+        phone_number=identity.phone_number,
+        wa_id=identity.wa_id
+    )
+    ticket = Ticket(
+        id=identity.ticket_id,
+        ticket_number=identity.ticket_number,
+        customer_id=identity.customer_id
+    )
+    ticket.customer = customer
+    return customer, ticket
+
+
+def _ingest_one(incoming: IncomingMessage, seen_ids: Dict[str, Message],
+                resolved: Dict[str, Tuple[Customer, Optional[Ticket]]]) -> Dict[str, Any]:
+    now = timezone.now()
+
+    # ✅ التحقق من عدم وجود رسالة مكررة (تم جلب IDs الدفعة مسبقاً)
+    if incoming.id_ext and incoming.id_ext in seen_ids:
+        return _duplicate_result(seen_ids[incoming.id_ext])
+
+    _, whatsapp_id = _resolve_identity(incoming)
+    if not whatsapp_id:
+        return {'success': False, 'error': 'Missing sender phone'}
+
+    identity_cache = get_identity_cache()
+    identity = None
+
+    # العميل والتذكرة: cache الدفعة → identity cache → قاعدة البيانات
+    if whatsapp_id in resolved:
+        customer, open_ticket = resolved[whatsapp_id]
+    else:
+        identity = identity_cache.get(whatsapp_id)
+        if identity:
+            customer, open_ticket = _identity_objects(identity)
+        else:
+            customer, open_ticket = _lookup_customer_ticket(incoming)
+
+    if open_ticket is not None and not incoming.id_ext:
+        # ✅ إذا لم يكن هناك id_ext، نتحقق من التكرار بناءً على الوقت والمحتوى
+        recent_duplicate = Message.objects.filter(
+            ticket_id=open_ticket.id,
+            sender_type='customer',
+            message_text=incoming.message_text,
+            created_at__gte=now - timedelta(seconds=CONTENT_DEDUP_SECONDS)
+        ).first()
+
+        if recent_duplicate:
+            logger.warning("⚠️ Duplicate message detected by content and time - Skipping")
+            return {
+                'success': True,
+                'duplicate': True,
+                'ticket_id': open_ticket.id,
+                'ticket_number': open_ticket.ticket_number,
+                'message_id': recent_duplicate.id,
+                'message': 'Duplicate message by content - skipped'
+            }
+
+    while open_ticket is not None and not _touch_ticket(open_ticket, now):
+        # التذكرة أُغلقت أو حُذفت (في عملية أخرى) → إعادة البحث من قاعدة البيانات
+        identity_cache.invalidate(whatsapp_id)
+        if identity is None:
+            open_ticket = None
+        else:
+            identity = None
+            customer, open_ticket = _lookup_customer_ticket(incoming)
+
+    ticket_created = open_ticket is None
+    if ticket_created:
+        logger.info(f"Creating new ticket for {customer.phone_number}")
+        open_ticket = _open_ticket(customer, now)
+
+    open_ticket.customer = customer
+
+    # حفظ الرسالة
+    message = Message.objects.create(
+        ticket=open_ticket,
+        sender=None,  # من العميل
+        sender_type='customer',
+        direction='incoming',
+        message_text=incoming.message_text,
+        message_type=incoming.message_type or 'text',
+        whatsapp_message_id=incoming.id_ext,
+        delivery_status='delivered',
+        media_url=incoming.media_url,
+        mime_type=incoming.mime_type
+    )
+
+    if incoming.id_ext:
+        seen_ids[incoming.id_ext] = message
+
+    logger.info(f"✅ Message saved: {message.id} - Ticket {open_ticket.ticket_number}")
+
+    # ✅ رسالة الترحيب والقائمة المنسدلة والمحفزات بعد الـ commit
+    action = 'trigger'
+    if identity is not None and not identity.classified:
+        # كائن الـ cache لا يحمل حالة المحادثة → التذكرة نفسها (العداد يشمل هذه الرسالة)
+        open_ticket = _reply_state_ticket(open_ticket.id)
+        open_ticket.customer = customer
+        identity = None
+    if identity is None:
+        action = _auto_reply_for(open_ticket.conversation_state, open_ticket.customer_messages_count)
+
+    # ✅ رسالة بدون نص (ميديا فقط) لا تطابق أي محفز → بدون callback
+    if action != 'trigger' or incoming.message_text:
+        message_text = incoming.message_text
+        reply_ticket = open_ticket
+        transaction.on_commit(
+            lambda: _send_auto_reply(action, customer, reply_ticket, message_text)
+        )
+
+    resolved[whatsapp_id] = (customer, open_ticket)
+
+    if identity:
+        # من الـ cache: بدون تحميل الموظف
+        return _message_result(message, open_ticket, agent_username=identity.agent_username)
+
+    identity_cache.put(whatsapp_id, customer, open_ticket)
+    return _message_result(message, open_ticket)
+
+
+def ingest_messages(messages: List[IncomingMessage]) -> List[Dict[str, Any]]:
+    """
+    حفظ دفعة من الرسائل الواردة داخل transaction واحدة
+
+    Args:
+        messages: قائمة IncomingMessage من أي مزود
+
+    Returns:
+        قائمة نتائج (Dict لكل رسالة بنفس الترتيب)
+    """
+    # تجاهل الرسائل المرسلة مني
+    results: List[Optional[Dict[str, Any]]] = [None] * len(messages)
+    pending = []
+    for index, incoming in enumerate(messages):
+        if incoming.is_from_me:
+            logger.info("⏭️  Skipping message from me")
+            results[index] = {'success': True, 'message': 'Message from me - skipped'}
+        else:
+            pending.append((index, incoming))
+
+    if not pending:
+        return results
+
+    resolved = {}
+    try:
+        with transaction.atomic():
+            seen_ids = _existing_messages({incoming.id_ext for _, incoming in pending if incoming.id_ext})
+
+            for index, incoming in pending:
+                results[index] = _ingest_one(incoming, seen_ids, resolved)
+    except Exception:
+        # ✅ rollback → لا نترك في الـ cache تذاكر/عملاء لم يتم حفظهم
+        _forget_identities(resolved)
+        raise
+
+    return results
+
+
+def _forget_identities(resolved) -> None:
+    identity_cache = get_identity_cache()
+    for whatsapp_id in list(resolved):
+        identity_cache.invalidate(whatsapp_id)
+
+
+def ingest_message(incoming: IncomingMessage) -> Dict[str, Any]:
+    """
+    حفظ رسالة واردة واحدة
+
+    Returns:
+        Dict مع success و ticket_id و message_id
+    """
+    return ingest_messages([incoming])[0]
+
+
+# ============================================
+# Bulk Ingestion (Cloud API multi-message deliveries)
+# ============================================
+
+def ingest_messages_bulk(messages: List[IncomingMessage]) -> List[Dict[str, Any]]:
+    """
+    حفظ دفعة رسائل متعددة المرسلين بعدد استعلامات ثابت للدفعة كلها
+
+    ✅ كل المرسلين باستعلام واحد (wa_id__in / phone_number__in)
+    ✅ كل الـ whatsapp_message_id باستعلام واحد (__in) لفحص التكرار
+    ✅ العملاء الجدد والرسائل بـ bulk_create
+    ✅ عدادات التذاكر بـ F() في UPDATE واحد لكل التذاكر
+
+    الرسائل بدون id_ext (فحص التكرار بالمحتوى) تمر بالمسار العادي _ingest_one.
+
+    Args:
+        messages: قائمة IncomingMessage
+
+    Returns:
+        قائمة نتائج (Dict لكل رسالة بنفس الترتيب)
+    """
+    results: List[Optional[Dict[str, Any]]] = [None] * len(messages)
+    pending = []
+    without_id = []
+
+    for index, incoming in enumerate(messages):
+        if incoming.is_from_me:
+            results[index] = {'success': True, 'message': 'Message from me - skipped'}
+            continue
+
+        normalized_phone, whatsapp_id = _resolve_identity(incoming)
+        if not whatsapp_id:
+            results[index] = {'success': False, 'error': 'Missing sender phone'}
+        elif not incoming.id_ext:
+            without_id.append((index, incoming))
+        else:
+            pending.append((index, incoming, normalized_phone, whatsapp_id))
+
+    if not pending and not without_id:
+        return results
+
+    now = timezone.now()
+
+    with transaction.atomic():
+        seen_ids = _existing_messages({incoming.id_ext for _, incoming, _, _ in pending})
+
+        # تكرار داخل نفس الدفعة أو في قاعدة البيانات
+        accepted = []
+        batch_duplicates = []
+        batch_ids = set()
+        for item in pending:
+            index, incoming = item[0], item[1]
+            if incoming.id_ext in seen_ids:
+                results[index] = _duplicate_result(seen_ids[incoming.id_ext])
+            elif incoming.id_ext in batch_ids:
+                batch_duplicates.append(item)
+            else:
+                batch_ids.add(incoming.id_ext)
+                accepted.append(item)
+
+        resolved = {}
+
+        if accepted:
+            # ============================================
+            # 1. العملاء: استعلام واحد + bulk_create للجدد
+            # ============================================
+            identities = {}
+            for _, incoming, normalized_phone, whatsapp_id in accepted:
+                identities.setdefault(whatsapp_id, (normalized_phone, incoming))
+
+            phones = {phone for phone, _ in identities.values() if phone}
+            existing = list(Customer.objects.filter(
+                Q(wa_id__in=identities.keys()) | Q(phone_number__in=phones)
+            ))
+            by_wa_id = {customer.wa_id: customer for customer in existing}
+            by_phone = {customer.phone_number: customer for customer in existing}
+
+            customers = {}
+            new_customers = {}
+            for whatsapp_id, (normalized_phone, incoming) in identities.items():
+                customer = (by_phone.get(normalized_phone) if normalized_phone else None) or by_wa_id.get(whatsapp_id)
+                if customer:
+                    if customer.wa_id != whatsapp_id and whatsapp_id not in by_wa_id:
+                        customer.wa_id = whatsapp_id
+                        by_wa_id[whatsapp_id] = customer
+                        Customer.objects.filter(id=customer.id).update(wa_id=whatsapp_id)
+                    customers[whatsapp_id] = customer
+                    continue
+
+                fields = _new_customer_fields(normalized_phone, whatsapp_id, incoming.sender_name)
+                customer = by_phone.get(fields['phone_number'])
+                if customer is None:
+                    customer = Customer(**fields)
+                    by_phone[customer.phone_number] = customer
+                    new_customers[whatsapp_id] = customer
+                customers[whatsapp_id] = customer
+
+            created_customer_ids = set()
+            if new_customers:
+                try:
+                    with transaction.atomic():
+                        Customer.objects.bulk_create(new_customers.values())
+                except IntegrityError:
+                    # ✅ عامل آخر أنشأ بعض العملاء بالتزامن → المسار الفردي
+                    for whatsapp_id in new_customers:
+                        customer, created = _resolve_customer(identities[whatsapp_id][1])
+                        customers[whatsapp_id] = customer
+                        if created:
+                            created_customer_ids.add(customer.id)
+                else:
+                    created_customer_ids = {customer.id for customer in new_customers.values()}
+                    ActivityLog.objects.bulk_create([
+                        ActivityLog(
+                            user=None,
+                            action='customer_created',
+                            entity_type='customer',
+                            entity_id=customer.id
+                        )
+                        for customer in new_customers.values()
+                    ])
+                    logger.info(f"New customers created: {len(created_customer_ids)}")
+
+            # ============================================
+            # 2. التذاكر المفتوحة: استعلام واحد
+            # ============================================
+            per_customer = {}
+            for _, _, _, whatsapp_id in accepted:
+                customer = customers[whatsapp_id]
+                per_customer[customer.id] = per_customer.get(customer.id, 0) + 1
+
+            open_tickets = {}
+            existing_customer_ids = set(per_customer) - created_customer_ids
+            if existing_customer_ids:
+                for ticket in Ticket.objects.select_related('assigned_agent__user').filter(
+                    customer_id__in=existing_customer_ids,
+                    status__in=['open', 'pending']
+                ).order_by('id'):
+                    open_tickets.setdefault(ticket.customer_id, ticket)
+
+            created_ticket_ids = set()
+            without_ticket = [
+                customer for customer in dict.fromkeys(customers.values())
+                if customer.id not in open_tickets
+            ]
+            # ✅ حجز أرقام كل التذاكر الجديدة في استعلام واحد
+            ticket_numbers = reserve_ticket_numbers(len(without_ticket))
+            for customer, ticket_number in zip(without_ticket, ticket_numbers):
+                logger.info(f"Creating new ticket for {customer.phone_number}")
+                ticket = _open_ticket(
+                    customer, now,
+                    messages_count=per_customer[customer.id],
+                    ticket_number=ticket_number
+                )
+                open_tickets[customer.id] = ticket
+                created_ticket_ids.add(ticket.id)
+
+            # ============================================
+            # 3. الرسائل: bulk_create
+            # ============================================
+            new_messages = []
+            for _, incoming, _, whatsapp_id in accepted:
+                customer = customers[whatsapp_id]
+                ticket = open_tickets[customer.id]
+                ticket.customer = customer
+                new_messages.append(Message(
+                    ticket=ticket,
+                    sender=None,  # من العميل
+                    sender_type='customer',
+                    direction='incoming',
+                    message_text=incoming.message_text,
+                    message_type=incoming.message_type or 'text',
+                    whatsapp_message_id=incoming.id_ext,
+                    delivery_status='delivered',
+                    media_url=incoming.media_url,
+                    mime_type=incoming.mime_type
+                ))
+            Message.objects.bulk_create(new_messages)
+
+            # ============================================
+            # 4. العدادات بـ F()
+            # ============================================
+            increments = {}
+            for customer_id, count in per_customer.items():
+                ticket = open_tickets[customer_id]
+                if ticket.id in created_ticket_ids:
+                    continue
+                increments[ticket.id] = count
+                ticket.last_message_at = now
+                ticket.last_customer_message_at = now
+                ticket.messages_count += count
+                ticket.customer_messages_count += count
+
+            if increments:
+                increment = Case(
+                    *[When(id=ticket_id, then=Value(count)) for ticket_id, count in increments.items()],
+                    default=Value(0),
+                    output_field=IntegerField()
+                )
+                Ticket.objects.filter(id__in=increments.keys()).update(
+                    last_message_at=now,
+                    last_customer_message_at=now,
+                    messages_count=F('messages_count') + increment,
+                    customer_messages_count=F('customer_messages_count') + increment
+                )
+
+            # بديل post_save signal للرسائل (bulk_create لا يرسل signals)
+            Customer.objects.filter(id__in=per_customer.keys()).update(last_contact_date=now)
+
+            # ============================================
+            # 5. النتائج + الردود التلقائية بعد الـ commit
+            # ============================================
+            # ترتيب كل رسالة بين رسائل العميل في التذكرة (العداد بعد الدفعة - رسائل الدفعة)
+            positions = {}
+            for (index, incoming, _, whatsapp_id), message in zip(accepted, new_messages):
+                customer = customers[whatsapp_id]
+                ticket = open_tickets[customer.id]
+                seen_ids[incoming.id_ext] = message
+                resolved[whatsapp_id] = (customer, ticket)
+                results[index] = _message_result(message, ticket)
+
+                position = positions.get(
+                    ticket.id, ticket.customer_messages_count - per_customer[customer.id]
+                ) + 1
+                positions[ticket.id] = position
+
+                action = _auto_reply_for(ticket.conversation_state, position)
+                if action != 'trigger' or incoming.message_text:
+                    message_text = incoming.message_text
+                    transaction.on_commit(
+                        lambda action=action, customer=customer, ticket=ticket, message_text=message_text:
+                        _send_auto_reply(action, customer, ticket, message_text)
+                    )
+
+            logger.info(f"✅ Bulk ingested {len(new_messages)} message(s) for {len(per_customer)} customer(s)")
+
+        for index, incoming, _, _ in batch_duplicates:
+            results[index] = _duplicate_result(seen_ids[incoming.id_ext])
+
+        for index, incoming in without_id:
+            results[index] = _ingest_one(incoming, seen_ids, resolved)
+
+    return results
+
+
+# ============================================
+# Provider Entry Points (Webhook Inbox / Views)
+# ============================================
+
+def process_wppconnect_payload(data):
+    """
+    معالجة رسالة واردة من WPPConnect
+
+    Returns:
+        Dict مع success و ticket_id و message_id
+    """
+    return ingest_message(parse_wppconnect_payload(data)[0])
+
+
+def process_cloud_api_payload(data):
+    """
+    معالجة الرسائل الواردة من WhatsApp Business Cloud API (دفعة واحدة)
+
+    Returns:
+        Dict مع success و results
+    """
+    messages = parse_cloud_api_payload(data)
+
+    # ✅ Meta تجمع عدة رسائل في POST واحد → مسار الدفعات
+    if len(messages) > 1:
+        results = ingest_messages_bulk(messages)
+    else:
+        results = ingest_messages(messages)
+
+    response = {
+        'success': True,
+        'message': 'Webhook processed',
+        'processed': len(results),
+        'results': results
+    }
+
+    # ✅ حالات التوصيل (statuses) في نفس الـ webhook → دفعة واحدة
+    receipts = parse_cloud_api_statuses(data)
+    if receipts:
+        response['receipts'] = apply_delivery_receipts(receipts)
+
+    return response
+
+
+def process_elmujib_payload(data):
+    """
+    معالجة رسالة واردة من Elmujib Cloud API
+
+    Returns:
+        Dict مع success و ticket_id و message_id (أو نتيجة حالات التوصيل)
+    """
+    # ✅ إشعار حالة توصيل وليس رسالة واردة
+    receipts = parse_elmujib_statuses(data)
+    if receipts:
+        return apply_delivery_receipts(receipts)
+
+    return ingest_message(parse_elmujib_payload(data)[0])
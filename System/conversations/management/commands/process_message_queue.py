@@ -6,14 +6,21 @@ Django Management Command: process_message_queue
 Usage:
     python manage.py process_message_queue                # معالجة عادية
     python manage.py process_message_queue --continuous   # معالجة مستمرة
+    python manage.py process_message_queue --continuous --workers 4  # معالجة متوازية
     python manage.py process_message_queue --stats        # عرض الإحصائيات فقط
     python manage.py process_message_queue --retry-failed # إعادة محاولة الفاشلة
+
+الوضع المستمر يسوّي عدادات queue_stats دورياً (QUEUE_STATS_RECONCILE_SECONDS، افتراضي 600)
 """
 
 import time
 import logging
+from django.conf import settings
 from django.core.management.base import BaseCommand
+from django.utils import timezone
 from conversations.message_queue import get_message_queue
+from conversations.queue_stats import reconcile, rollup_daily
+from conversations.queue_wakeup import QueueWakeup
 
 logger = logging.getLogger(__name__)
 
@@ -21,11 +28,15 @@ logger = logging.getLogger(__name__)
 class Command(BaseCommand):
     help = 'معالجة قائمة انتظار رسائل WhatsApp'
 
+    MIN_IDLE_SECONDS = 0.5  # أقل انتظار بين الدفعات أثناء الخمول
+    MAX_IDLE_SECONDS = 10  # أقصى انتظار (polling احتياطي)
+    DEFAULT_RECONCILE_SECONDS = 600  # تسوية العدادات كل 10 دقائق (مثل cron الخاص بـ reconcile_queue_stats)
+
     def add_arguments(self, parser):
         parser.add_argument(
             '--continuous',
             action='store_true',
-            help='معالجة مستمرة (كل 10 ثواني)',
+            help='معالجة مستمرة (إيقاظ فوري عند إضافة رسالة)',
         )
         
         parser.add_argument(
@@ -46,6 +57,37 @@ class Command(BaseCommand):
             default=10,
             help='عدد الرسائل في كل دفعة (افتراضي: 10)',
         )
+        
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='عدد الـ workers المتوازية (افتراضي: 1 = إرسال متسلسل)',
+        )
+
+    def process(self, queue, options):
+        """
+        معالجة دفعة واحدة (متسلسلة أو متوازية حسب --workers)
+        """
+        workers = options['workers']
+        
+        if workers > 1:
+            # ✅ كل worker يأخذ حتى batch-size رسالة
+            return queue.dispatch(workers=workers, batch_size=options['batch_size'] * workers)
+        
+        return queue.process_pending(batch_size=options['batch_size'])
+
+    def reconcile_stats(self):
+        """
+        تسوية عدادات queue_stats + الإحصائيات اليومية (لا توقف الإرسال أبداً)
+        """
+        try:
+            result = reconcile()
+            rollup_daily()
+            if result['corrections']:
+                self.stdout.write(f"🔢 تسوية العدادات: {result['corrections']}")
+        except Exception as e:
+            logger.error(f"Queue stats reconcile failed: {str(e)}", exc_info=True)
 
     def handle(self, *args, **options):
         queue = get_message_queue()
@@ -61,10 +103,17 @@ class Command(BaseCommand):
             
             self.stdout.write(f"  📨 إجمالي الرسائل: {stats['total']}")
             self.stdout.write(f"  ⏳ في الانتظار: {stats['pending']}")
+            self.stdout.write(
+                f"     💬 ردود الموظفين: {stats['pending_interactive']} | "
+                f"🤖 ردود النظام: {stats['pending_system']} | "
+                f"📣 جماعي: {stats['pending_bulk']}"
+            )
             self.stdout.write(f"  📤 جاري الإرسال: {stats['sending']}")
             self.stdout.write(f"  ✅ تم الإرسال: {stats['sent']}")
             self.stdout.write(f"  📥 تم التوصيل: {stats['delivered']}")
+            self.stdout.write(f"  👁️ تمت القراءة: {stats['read']}")
             self.stdout.write(f"  ❌ فشلت: {stats['failed']}")
+            self.stdout.write(f"  🪦 Dead Letter Queue: {stats['dead_letters']}")
             self.stdout.write('')
             
             return
@@ -95,31 +144,65 @@ class Command(BaseCommand):
         
         if options['continuous']:
             self.stdout.write(self.style.SUCCESS('🔄 معالجة مستمرة (اضغط Ctrl+C للإيقاف)'))
+            if options['workers'] > 1:
+                self.stdout.write(f"⚡ عدد الـ workers: {options['workers']}")
+            
+            # ✅ إيقاظ فوري عند إضافة رسالة (LISTEN/NOTIFY أو UDP) بدلاً من الانتظار الثابت
+            wakeup = QueueWakeup()
+            mode = wakeup.listen()
+            self.stdout.write(f"🔔 وضع الإيقاظ: {mode}")
             self.stdout.write('')
             
+            idle_seconds = self.MIN_IDLE_SECONDS
+            reconcile_seconds = getattr(settings, 'QUEUE_STATS_RECONCILE_SECONDS', self.DEFAULT_RECONCILE_SECONDS)
+            last_reconcile = None  # أول تسوية عند البدء
+            
             try:
                 while True:
-                    result = queue.process_pending(batch_size=batch_size)
+                    # ✅ تسوية دورية للعدادات (تصحح أي انحراف من تطبيقها بعد الـ commit)
+                    if reconcile_seconds and (
+                        last_reconcile is None or time.monotonic() - last_reconcile >= reconcile_seconds
+                    ):
+                        self.reconcile_stats()
+                        last_reconcile = time.monotonic()
+                    
+                    result = self.process(queue, options)
                     
                     if result['processed'] > 0:
                         self.stdout.write(
                             f"✅ معالجة: {result['sent']} نجحت، "
                             f"{result['failed']} فشلت"
                         )
-                    else:
-                        self.stdout.write('💤 لا توجد رسائل معلقة، انتظار...')
+                        idle_seconds = self.MIN_IDLE_SECONDS
+                    
+                    # ✅ Rate Limit → انتظار حتى retry_at فقط (بحد أقصى 10 ثواني)
+                    if result.get('retry_at'):
+                        wait_seconds = (result['retry_at'] - timezone.now()).total_seconds()
+                        self.stdout.write(f"🚦 تم الوصول لحد الإرسال، استئناف بعد {max(wait_seconds, 0):.1f} ثانية")
+                        time.sleep(min(max(wait_seconds, 0.1), 10))
+                        continue
                     
-                    time.sleep(10)  # انتظار 10 ثواني
+                    # ✅ الدفعة كانت ممتلئة → توجد رسائل أخرى، لا داعي للانتظار
+                    if result.get('fetched', 0) >= batch_size * options['workers'] and result['processed'] > 0:
+                        continue
+                    
+                    # ✅ انتظار إشعار، مع polling متزايد أثناء الخمول (للرسائل المجدولة لإعادة المحاولة)
+                    if wakeup.wait(idle_seconds):
+                        idle_seconds = self.MIN_IDLE_SECONDS
+                    else:
+                        idle_seconds = min(idle_seconds * 2, self.MAX_IDLE_SECONDS)
                     
             except KeyboardInterrupt:
                 self.stdout.write('')
                 self.stdout.write(self.style.WARNING('⏹️  تم الإيقاف من قبل المستخدم'))
+            finally:
+                wakeup.close()
         
         else:
             # معالجة مرة واحدة
             self.stdout.write(self.style.SUCCESS('📤 معالجة قائمة الانتظار...'))
             
-            result = queue.process_pending(batch_size=batch_size)
+            result = self.process(queue, options)
             
             if result['success']:
                 self.stdout.write('')
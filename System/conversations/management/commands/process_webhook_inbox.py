@@ -0,0 +1,129 @@
+"""
+Django Management Command: process_webhook_inbox
+
+معالجة صندوق وارد الـ Webhooks في الخلفية
+
+Usage:
+    python manage.py process_webhook_inbox                   # معالجة دفعة واحدة
+    python manage.py process_webhook_inbox --continuous      # معالجة مستمرة
+    python manage.py process_webhook_inbox --stats           # عرض الإحصائيات فقط
+    python manage.py process_webhook_inbox --purge-days 7    # حذف السجلات المعالجة الأقدم من 7 أيام
+"""
+
+import time
+import logging
+from django.core.management.base import BaseCommand
+from conversations.webhook_inbox import get_webhook_inbox
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'معالجة صندوق وارد WhatsApp Webhooks'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--continuous',
+            action='store_true',
+            help='معالجة مستمرة',
+        )
+
+        parser.add_argument(
+            '--stats',
+            action='store_true',
+            help='عرض الإحصائيات فقط',
+        )
+
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=50,
+            help='عدد السجلات في كل دفعة (افتراضي: 50)',
+        )
+
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=1.0,
+            help='مدة الانتظار بالثواني عندما يكون الصندوق فارغاً (افتراضي: 1)',
+        )
+
+        parser.add_argument(
+            '--purge-days',
+            type=int,
+            default=None,
+            help='حذف السجلات المعالجة الأقدم من X أيام',
+        )
+
+    def handle(self, *args, **options):
+        inbox = get_webhook_inbox()
+
+        # ============================================
+        # عرض الإحصائيات فقط
+        # ============================================
+        if options['stats']:
+            self.stdout.write(self.style.SUCCESS('📊 إحصائيات صندوق الوارد:'))
+            self.stdout.write('')
+
+            stats = inbox.get_inbox_stats()
+
+            self.stdout.write(f"  📨 إجمالي السجلات: {stats['total']}")
+            self.stdout.write(f"  ⏳ في الانتظار: {stats['pending']}")
+            self.stdout.write(f"  ⚙️  قيد المعالجة: {stats['processing']}")
+            self.stdout.write(f"  ✅ تمت المعالجة: {stats['processed']}")
+            self.stdout.write(f"  ❌ فشلت: {stats['failed']}")
+            self.stdout.write('')
+
+            return
+
+        # ============================================
+        # حذف السجلات القديمة
+        # ============================================
+        if options['purge_days'] is not None:
+            deleted = inbox.purge_processed(days=options['purge_days'])
+            self.stdout.write(self.style.SUCCESS(f"🗑️  تم حذف {deleted} سجل"))
+            return
+
+        # ============================================
+        # معالجة عادية
+        # ============================================
+        batch_size = options['batch_size']
+
+        if options['continuous']:
+            self.stdout.write(self.style.SUCCESS('🔄 معالجة مستمرة لصندوق الوارد (اضغط Ctrl+C للإيقاف)'))
+            self.stdout.write('')
+
+            try:
+                while True:
+                    result = inbox.process_batch(batch_size=batch_size)
+
+                    if result['claimed'] > 0:
+                        self.stdout.write(
+                            f"✅ معالجة: {result['processed']} نجحت، "
+                            f"{result['failed']} فشلت"
+                        )
+
+                    # ✅ الدفعة ممتلئة → توجد سجلات أخرى، لا ننتظر
+                    if result['claimed'] < batch_size:
+                        time.sleep(options['interval'])
+
+            except KeyboardInterrupt:
+                self.stdout.write('')
+                self.stdout.write(self.style.WARNING('⏹️  تم الإيقاف من قبل المستخدم'))
+
+        else:
+            # معالجة مرة واحدة
+            self.stdout.write(self.style.SUCCESS('📥 معالجة صندوق الوارد...'))
+
+            result = inbox.process_batch(batch_size=batch_size)
+
+            self.stdout.write('')
+            self.stdout.write(f"  ✅ نجحت: {result['processed']}")
+            self.stdout.write(f"  ❌ فشلت: {result['failed']}")
+            self.stdout.write(f"  📊 إجمالي: {result['claimed']}")
+            self.stdout.write('')
+
+            if result['claimed'] == 0:
+                self.stdout.write(self.style.WARNING('💤 صندوق الوارد فارغ'))
+            else:
+                self.stdout.write(self.style.SUCCESS('✅ تمت المعالجة بنجاح'))
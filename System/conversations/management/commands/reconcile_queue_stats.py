@@ -0,0 +1,55 @@
+"""
+Django Management Command: reconcile_queue_stats
+
+تسوية عدادات قائمة انتظار الرسائل وحساب الإحصائيات اليومية
+
+Usage:
+    python manage.py reconcile_queue_stats             # تسوية + rollup لآخر يومين
+    python manage.py reconcile_queue_stats --days 30   # إعادة حساب آخر 30 يوم
+    python manage.py reconcile_queue_stats --rollup-only
+
+Cron (كل 10 دقائق):
+    */10 * * * * cd /path/to/System && python manage.py reconcile_queue_stats
+"""
+
+import logging
+from django.core.management.base import BaseCommand
+from conversations.queue_stats import reconcile, rollup_daily
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'تسوية عدادات قائمة انتظار الرسائل وحساب الإحصائيات اليومية'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=2,
+            help='عدد الأيام المنتهية لإعادة حساب إحصائياتها (افتراضي: 2)',
+        )
+
+        parser.add_argument(
+            '--rollup-only',
+            action='store_true',
+            help='حساب الإحصائيات اليومية فقط بدون تسوية العدادات',
+        )
+
+    def handle(self, *args, **options):
+        if not options['rollup_only']:
+            self.stdout.write(self.style.SUCCESS('🔢 تسوية عدادات قائمة الانتظار...'))
+
+            result = reconcile()
+
+            if result['corrections']:
+                for counter, difference in result['corrections'].items():
+                    self.stdout.write(f"  ✏️  {counter}: {difference:+d}")
+            else:
+                self.stdout.write('  ✅ العدادات مطابقة')
+
+        self.stdout.write(self.style.SUCCESS(f"📅 حساب إحصائيات آخر {options['days']} يوم..."))
+        rollup_daily(days=options['days'])
+
+        self.stdout.write('')
+        self.stdout.write(self.style.SUCCESS('✅ تم تحديث إحصائيات قائمة الانتظار'))
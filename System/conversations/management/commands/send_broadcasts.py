@@ -0,0 +1,143 @@
+"""
+Django Management Command: send_broadcasts
+
+إرسال رسائل حملات الإرسال الجماعي
+
+Usage:
+    python manage.py send_broadcasts                       # دفعة واحدة
+    python manage.py send_broadcasts --continuous          # إرسال مستمر
+    python manage.py send_broadcasts --launch 5            # بدء الحملة رقم 5
+    python manage.py send_broadcasts --stats               # تقدم الحملات
+"""
+
+import time
+import logging
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from conversations.models import BroadcastCampaign
+from conversations.broadcast import get_broadcast_engine
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'إرسال رسائل حملات WhatsApp الجماعية'
+
+    IDLE_SECONDS = 5  # انتظار عند عدم وجود رسائل (الحملات ليست حساسة للتأخير)
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--continuous',
+            action='store_true',
+            help='إرسال مستمر',
+        )
+
+        parser.add_argument(
+            '--launch',
+            type=int,
+            help='بدء (أو استئناف) حملة برقمها',
+        )
+
+        parser.add_argument(
+            '--stats',
+            action='store_true',
+            help='عرض تقدم الحملات فقط',
+        )
+
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=50,
+            help='عدد المستلمين في كل دفعة (افتراضي: 50)',
+        )
+
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=None,
+            help='عدد الـ workers المتوازية (افتراضي: MESSAGE_QUEUE_WORKERS)',
+        )
+
+    def handle(self, *args, **options):
+        engine = get_broadcast_engine()
+
+        # ============================================
+        # عرض تقدم الحملات
+        # ============================================
+        if options['stats']:
+            self.stdout.write(self.style.SUCCESS('📊 تقدم الحملات:'))
+            self.stdout.write('')
+
+            for campaign in BroadcastCampaign.objects.exclude(status='draft').order_by('-created_at')[:20]:
+                progress = engine.get_progress(campaign)
+                self.stdout.write(
+                    f"  📣 #{progress['campaign_id']} {progress['name']} [{progress['status']}] "
+                    f"{progress['progress_percent']}% - "
+                    f"✅ {progress['sent']} / 📥 {progress['delivered']} / 👁️ {progress['read']} / "
+                    f"❌ {progress['failed']} من {progress['total_recipients']}"
+                )
+            self.stdout.write('')
+
+            return
+
+        # ============================================
+        # بدء حملة
+        # ============================================
+        if options['launch']:
+            result = engine.launch(options['launch'])
+
+            if result['success']:
+                self.stdout.write(self.style.SUCCESS(
+                    f"🚀 الحملة #{options['launch']}: {result['status']}"
+                    + (f" ({result['total_recipients']} مستلم)" if 'total_recipients' in result else '')
+                ))
+            else:
+                self.stdout.write(self.style.ERROR(f"❌ فشل: {result.get('error')}"))
+
+            return
+
+        # ============================================
+        # الإرسال
+        # ============================================
+        if options['continuous']:
+            self.stdout.write(self.style.SUCCESS('🔄 إرسال مستمر للحملات (اضغط Ctrl+C للإيقاف)'))
+            self.stdout.write('')
+
+            try:
+                while True:
+                    result = engine.process_batch(workers=options['workers'], batch_size=options['batch_size'])
+
+                    if result['processed'] > 0:
+                        self.stdout.write(
+                            f"✅ معالجة: {result['sent']} نجحت، "
+                            f"{result['failed']} فشلت"
+                        )
+
+                    # ✅ Rate Limit → انتظار حتى retry_at فقط (بحد أقصى 10 ثواني)
+                    if result.get('retry_at'):
+                        wait_seconds = (result['retry_at'] - timezone.now()).total_seconds()
+                        time.sleep(min(max(wait_seconds, 0.1), 10))
+                        continue
+
+                    if result['fetched'] >= options['batch_size']:
+                        continue
+
+                    time.sleep(self.IDLE_SECONDS)
+
+            except KeyboardInterrupt:
+                self.stdout.write('')
+                self.stdout.write(self.style.WARNING('⏹️  تم الإيقاف من قبل المستخدم'))
+
+        else:
+            self.stdout.write(self.style.SUCCESS('📤 إرسال دفعة من الحملات...'))
+
+            result = engine.process_batch(workers=options['workers'], batch_size=options['batch_size'])
+
+            self.stdout.write('')
+            self.stdout.write(f"  ✅ نجحت: {result['sent']}")
+            self.stdout.write(f"  ❌ فشلت: {result['failed']}")
+            self.stdout.write(f"  🚦 مؤجلة (Rate Limit): {result['rate_limited']}")
+            self.stdout.write('')
+
+            if result['fetched'] == 0:
+                self.stdout.write(self.style.WARNING('💤 لا توجد رسائل حملات معلقة'))
@@ -4,23 +4,37 @@ Message Queue Manager
 
 Features:
 ✅ Cache الرسائل قبل الإرسال
-✅ Deduplication لمنع التكرار
-✅ Rate Limiting لتجنب الحظر
+✅ Deduplication لمنع التكرار (قيد فريد على message_hash + dedup_bucket مع Cache للـ hashes الحديثة)
+✅ Rate Limiting مشترك بين كل العمليات لتجنب الحظر (rate_limiter.py)
 ✅ Retry Mechanism مع Exponential Backoff
 ✅ Batch Processing للإرسال الجماعي
+✅ Concurrent Dispatcher (عدة workers) مع الحفاظ على ترتيب رسائل كل عميل
+✅ حجز آمن للرسائل بين عدة عمليات (SKIP LOCKED / compare-and-set) مع Visibility Timeout
+✅ Priority Lanes (ردود الموظفين ← ردود النظام ← الإرسال الجماعي) مع Weighted Fair Scheduling
+✅ Dead Letter Queue: الرسائل الفاشلة نهائياً مع سبب الفشل ورد المزود وسجل المحاولات
 """
 
 import hashlib
+import json
 import logging
+import random
+import threading
 import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Any, Optional, List
+from django.conf import settings
 from django.utils import timezone
-from django.db import transaction, OperationalError
+from django.db import connection, transaction, IntegrityError, OperationalError
 from datetime import timedelta
 import sqlite3
 
-from .models import Message, Ticket, User
+from .models import DeadLetterMessage, Message, MessageDeliveryLog, Ticket, User
 from .whatsapp_driver import get_whatsapp_driver
+from .rate_limiter import get_rate_limiter
+from .queue_wakeup import notify_message_queue
+from .queue_stats import get_daily_stats, get_state_counts, record_transition, record_transitions, transition_deltas
 
 logger = logging.getLogger(__name__)
 
@@ -42,6 +56,44 @@ def retry_db_operation(func, max_retries=3, delay=0.1):
     return None
 
 
+class RecentHashCache:
+    """
+    Cache داخل العملية للـ hashes المرسلة حديثاً (قبل قاعدة البيانات)
+
+    ✅ التكرار المتتالي من نفس العملية (ضغط مزدوج على زر الإرسال) يُرفض بدون أي استعلام
+    ✅ المفتاح يشمل النافذة الزمنية → الإدخالات القديمة لا تطابق أبداً وتُحذف بالترتيب
+    """
+
+    MAX_ENTRIES = 10000
+
+    def __init__(self, max_entries: Optional[int] = None):
+        self.max_entries = max_entries or self.MAX_ENTRIES
+        self._entries: 'OrderedDict[tuple, bool]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def contains(self, message_hash: str, dedup_bucket: int) -> bool:
+        with self._lock:
+            return (message_hash, dedup_bucket) in self._entries
+
+    def add(self, message_hash: str, dedup_bucket: int) -> None:
+        with self._lock:
+            self._entries[(message_hash, dedup_bucket)] = True
+
+            # الإدخالات بترتيب الإضافة: الأقدم في البداية
+            while self._entries:
+                (_, oldest_bucket), _ = next(iter(self._entries.items()))
+                if oldest_bucket >= dedup_bucket and len(self._entries) <= self.max_entries:
+                    break
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+_recent_hashes = RecentHashCache()
+
+
 class MessageQueue:
     """
     Message Queue Manager
@@ -50,50 +102,90 @@ class MessageQueue:
         queue = MessageQueue()
         message = queue.enqueue(ticket_id=1, user=user, text="مرحباً")
         queue.process_pending()  # معالجة كل الرسائل المعلقة
+        queue.dispatch(workers=4)  # معالجة متوازية (عميل واحد = worker واحد بالترتيب)
+        queue.enqueue(..., priority=Message.PRIORITY_BULK)  # رسائل API منخفضة الأولوية
     """
     
     # إعدادات الـ Queue
     MAX_RETRY_COUNT = 3  # أقصى عدد للمحاولات
+    DEDUP_WINDOW_SECONDS = 300  # نفس الرسالة لنفس التذكرة خلال نفس النافذة (5 دقائق) = تكرار
     RETRY_DELAY_SECONDS = [5, 30, 120]  # تأخير بين المحاولات (5s, 30s, 2min)
+    RETRY_JITTER = 0.2  # ±20% عشوائية على التأخير حتى لا تُعاد المحاولات الفاشلة معاً
     BATCH_SIZE = 10  # عدد الرسائل لكل دفعة
-    RATE_LIMIT_PER_MINUTE = 20  # أقصى عدد رسائل في الدقيقة
+    DEFAULT_WORKERS = 4  # عدد الـ workers في وضع dispatch
+    CLAIM_TIMEOUT_SECONDS = 120  # Visibility Timeout: بعدها تُعاد رسالة العامل المتوقف إلى pending
+    
+    # ✅ أوزان المسارات: من كل 10 أماكن في الدفعة (عند وجود رسائل في كل المسارات)
+    #    6 لردود الموظفين، 3 لردود النظام، 1 للإرسال الجماعي. المكان غير المستخدم يذهب لمسار آخر
+    #    مسار BULK موجود لمن يستدعي enqueue(priority=PRIORITY_BULK) عبر الـ API فقط؛ حملات
+    #    الإرسال الجماعي لا تمر بهذه الـ Queue (broadcast.py) لكنها تأخذ نفس حصة BULK
+    #    من دفعتها عند وجود رسائل مستحقة هنا (BroadcastEngine._yield_batch_size)
+    LANE_WEIGHTS = {
+        Message.PRIORITY_INTERACTIVE: 6,
+        Message.PRIORITY_SYSTEM: 3,
+        Message.PRIORITY_BULK: 1,
+    }
     
     def __init__(self):
-        self.driver = get_whatsapp_driver()
-        self._sent_messages_count = 0
-        self._last_reset_time = time.time()
+        self._driver = None
+        self._lane_credits = {lane: 0 for lane in self.LANE_WEIGHTS}  # Smooth Weighted Round Robin
+    
+    @property
+    def driver(self):
+        """
+        الـ Driver الحالي (Singleton لكل مزود، يتبع reset_whatsapp_drivers)
+        """
+        return self._driver or get_whatsapp_driver()
     
-    def generate_message_hash(self, ticket_id: int, message_text: str, sender_id: int) -> str:
+    @driver.setter
+    def driver(self, driver):
+        self._driver = driver
+    
+    def generate_message_hash(self, ticket_id: int, message_text: str, sender_id: int,
+                              media_url: Optional[str] = None) -> str:
         """
         توليد Hash فريد للرسالة لمنع التكرار
         
+        ✅ بدون وقت: النافذة الزمنية في dedup_bucket (القيد الفريد على الاثنين معاً)
+        
         Args:
             ticket_id: رقم التذكرة
             message_text: نص الرسالة
             sender_id: رقم المرسل
+            media_url: رابط الميديا (اختياري)
         
         Returns:
             SHA256 hash
         """
-        unique_string = f"{ticket_id}:{message_text}:{sender_id}:{timezone.now().strftime('%Y%m%d%H%M')}"
+        unique_string = f"{ticket_id}:{message_text}:{sender_id}:{media_url or ''}"
         return hashlib.sha256(unique_string.encode()).hexdigest()
     
-    def check_duplicate(self, message_hash: str, minutes: int = 5) -> bool:
+    def get_dedup_bucket(self, now=None) -> int:
+        """
+        رقم النافذة الزمنية الحالية (DEDUP_WINDOW_SECONDS)
+        """
+        now = now or timezone.now()
+        return int(now.timestamp()) // self.DEDUP_WINDOW_SECONDS
+    
+    def check_duplicate(self, message_hash: str, dedup_bucket: Optional[int] = None) -> bool:
         """
-        التحقق من وجود رسالة مكررة في آخر X دقائق
+        التحقق من وجود رسالة مكررة في نفس النافذة الزمنية
+        
+        ⚠️ للاستعلام فقط: enqueue لا يستدعيها (القيد الفريد يرفض التكرار عند الإدخال)
         
         Args:
             message_hash: الـ hash المطلوب
-            minutes: عدد الدقائق للبحث (افتراضي 5)
+            dedup_bucket: النافذة الزمنية (افتراضي: الحالية)
         
         Returns:
             True إذا وجدت رسالة مكررة
         """
-        cutoff_time = timezone.now() - timedelta(minutes=minutes)
+        if dedup_bucket is None:
+            dedup_bucket = self.get_dedup_bucket()
         
-        duplicate = Message.objects.filter(
+        duplicate = _recent_hashes.contains(message_hash, dedup_bucket) or Message.objects.filter(
             message_hash=message_hash,
-            created_at__gte=cutoff_time
+            dedup_bucket=dedup_bucket
         ).exists()
         
         if duplicate:
@@ -105,27 +197,40 @@ class MessageQueue:
     def enqueue(
         self,
         ticket_id: int,
-        user: User,
+        user: Optional[User],
         message_text: str,
         message_type: str = 'text',
         media_url: Optional[str] = None,
-        mime_type: Optional[str] = None
+        mime_type: Optional[str] = None,
+        priority: int = Message.PRIORITY_INTERACTIVE,
+        auto_reply: bool = False
     ) -> Dict[str, Any]:
         """
         إضافة رسالة إلى قائمة الانتظار
         
         Args:
             ticket_id: رقم التذكرة
-            user: المستخدم المرسل
+            user: المستخدم المرسل (None لرد تلقائي في تذكرة بدون موظف)
             message_text: نص الرسالة
             message_type: نوع الرسالة (text, image, etc)
             media_url: رابط الميديا (اختياري)
             mime_type: نوع الملف (اختياري)
+            priority: مسار الأولوية (Message.PRIORITY_INTERACTIVE / SYSTEM / BULK)
+            auto_reply: رد تلقائي (ترحيب / قائمة): لا يُعتبر رد الموظف
+                        (last_agent_message_at وحالة التأخير بدون تغيير)
         
         Returns:
             Dict مع success و message_id
         """
         try:
+            # توليد Hash للرسالة
+            message_hash = self.generate_message_hash(ticket_id, message_text, user.id if user else 0, media_url)
+            dedup_bucket = self.get_dedup_bucket()
+            
+            # ✅ التكرار من نفس العملية → بدون أي استعلام
+            if _recent_hashes.contains(message_hash, dedup_bucket):
+                return self._duplicate_result(ticket_id, message_hash)
+            
             # الحصول على التذكرة
             try:
                 ticket = Ticket.objects.select_related('customer').get(id=ticket_id)
@@ -164,43 +269,51 @@ class MessageQueue:
                         'reason': 'Invalid phone number format'
                     }
             
-            # توليد Hash للرسالة
-            message_hash = self.generate_message_hash(ticket_id, message_text, user.id)
-            
-            # التحقق من التكرار
-            if self.check_duplicate(message_hash, minutes=5):
-                logger.warning(f"Duplicate message rejected for ticket {ticket_id}")
-                return {
-                    'success': False,
-                    'error': 'Duplicate message detected',
-                    'duplicate': True
-                }
-            
             # حفظ الرسالة بحالة 'pending' مع retry للـ database lock
+            # ✅ insert-or-ignore: القيد الفريد (message_hash, dedup_bucket) يرفض التكرار
+            #    حتى مع طلبين متزامنين (SAVEPOINT حتى لا تفسد الـ transaction الخارجية)
             def create_message():
-                return Message.objects.create(
-                    ticket=ticket,
-                    sender=user,
-                    sender_type='agent' if user.role == 'agent' else 'admin',
-                    direction='outgoing',
-                    message_text=message_text,
-                    message_type=message_type,
-                    media_url=media_url,
-                    mime_type=mime_type,
-                    delivery_status='pending',
-                    message_hash=message_hash,
-                    retry_count=0
-                )
+                try:
+                    with transaction.atomic():
+                        return Message.objects.create(
+                            ticket=ticket,
+                            sender=user,
+                            sender_type='agent' if auto_reply or user.role == 'agent' else 'admin',
+                            direction='outgoing',
+                            message_text=message_text,
+                            message_type=message_type,
+                            media_url=media_url,
+                            mime_type=mime_type,
+                            delivery_status='pending',
+                            message_hash=message_hash,
+                            dedup_bucket=dedup_bucket,
+                            retry_count=0,
+                            priority=priority
+                        )
+                except IntegrityError:
+                    if Message.objects.filter(message_hash=message_hash, dedup_bucket=dedup_bucket).exists():
+                        return None
+                    raise
 
             message = retry_db_operation(create_message)
+            
+            if message is None:
+                _recent_hashes.add(message_hash, dedup_bucket)
+                return self._duplicate_result(ticket_id, message_hash)
+            
+            # ✅ بعد الـ commit فقط (رسالة تم التراجع عنها ليست تكراراً)
+            transaction.on_commit(lambda: _recent_hashes.add(message_hash, dedup_bucket))
 
             logger.info(f"[QUEUED] Message queued: {message.id} for ticket {ticket_id}")
 
+            # ✅ إيقاظ العامل فور الـ commit
+            transaction.on_commit(notify_message_queue)
+
             # تحديث آخر رسالة في التذكرة مع retry
             def update_ticket():
                 ticket.last_message_at = timezone.now()
                 # تحديث last_agent_message_at لإلغاء حالة التأخير
-                if user.role in ['agent', 'admin']:
+                if not auto_reply and user.role in ['agent', 'admin']:
                     ticket.last_agent_message_at = timezone.now()
                     ticket.save(update_fields=['last_message_at', 'last_agent_message_at'])
                     
@@ -227,31 +340,353 @@ class MessageQueue:
                 'error': str(e)
             }
     
-    def _check_rate_limit(self) -> bool:
+    def _duplicate_result(self, ticket_id: int, message_hash: str) -> Dict[str, Any]:
+        logger.warning(f"Duplicate message rejected for ticket {ticket_id}: {message_hash[:16]}...")
+        return {
+            'success': False,
+            'error': 'Duplicate message detected',
+            'duplicate': True
+        }
+    
+    def _check_rate_limit(self, message: Message) -> Dict[str, Any]:
         """
-        التحقق من Rate Limit
+        التحقق من Rate Limit المشترك بين كل العمليات وحجز مكان للإرسال
+        
+        ✅ Bucket للمزود + Bucket للعميل (rate_limiter.py)
+        ✅ لا ينتظر: يرجع retry_at إذا تم الوصول للحد
+        ✅ دائرة المزود مفتوحة (Circuit Breaker) → نفس معاملة حد المزود بدون احتساب محاولة
         
         Returns:
-            True إذا يمكن الإرسال
+            Dict مع allowed و retry_at و bucket
         """
-        current_time = time.time()
+        circuit_retry_at = self.driver.circuit_retry_at()
+        if circuit_retry_at:
+            return {
+                'allowed': False,
+                'retry_at': circuit_retry_at,
+                'bucket': f'provider:{self.driver.provider_name}'
+            }
         
-        # إعادة تعيين العداد كل دقيقة
-        if current_time - self._last_reset_time >= 60:
-            self._sent_messages_count = 0
-            self._last_reset_time = current_time
+        return get_rate_limiter().acquire(
+            self.driver.provider_name,
+            recipient=message.ticket.customer.wa_id
+        )
+    
+    def release_stale_claims(self) -> int:
+        """
+        إعادة الرسائل المحجوزة من عامل متوقف إلى pending (Visibility Timeout)
         
-        # التحقق من الحد
-        if self._sent_messages_count >= self.RATE_LIMIT_PER_MINUTE:
-            logger.warning(f"⚠️  Rate limit reached: {self._sent_messages_count}/min")
-            return False
+        Returns:
+            عدد الرسائل المُعادة
+        """
+        cutoff = timezone.now() - timedelta(seconds=self.CLAIM_TIMEOUT_SECONDS)
+        
+        # ✅ الصفوف محجوزة (FOR UPDATE) حتى نهاية الـ transaction → العدادات من الصفوف التي تحدثت فعلاً
+        #    (عامل آخر يحرر نفس الرسائل بالتزامن يتخطاها: SKIP LOCKED)
+        with transaction.atomic():
+            stale = Message.objects.filter(
+                delivery_status='sending',
+                claimed_at__lt=cutoff
+            )
+            if connection.features.has_select_for_update_skip_locked:
+                stale = stale.select_for_update(skip_locked=True)
+            else:
+                stale = stale.select_for_update()
+            stale = list(stale.values_list('id', 'priority'))
+            
+            if not stale:
+                return 0
+            
+            released = Message.objects.filter(
+                id__in=[message_id for message_id, _ in stale]
+            ).update(delivery_status='pending', claimed_by=None, claimed_at=None)
+            
+            record_transitions(transition_deltas(
+                [('sending', priority) for _, priority in stale], 'pending'
+            ))
+        
+        logger.warning(f"Released {released} stale message queue claim(s)")
         
-        return True
+        return released
     
-    @transaction.atomic
+    def _schedule_lanes(self, due_by_lane: Dict[int, List[int]], batch_size: int) -> List[int]:
+        """
+        ترتيب الدفعة بين المسارات: Smooth Weighted Round Robin
+
+        ✅ كل مسار يأخذ حصة من الدفعة حسب وزنه (LANE_WEIGHTS)
+        ✅ المسار الفارغ لا يحجز مكاناً (الحصة تذهب للمسارات الأخرى)
+        ✅ الرصيد يُحفظ بين الدفعات → حتى الدفعات الصغيرة تعطي الإرسال الجماعي نصيبه
+        ✅ داخل كل مسار: الترتيب حسب created_at
+
+        Args:
+            due_by_lane: {priority: [message ids مرتبة]}
+            batch_size: حجم الدفعة
+
+        Returns:
+            قائمة message ids بترتيب الإرسال
+        """
+        queues = {lane: list(ids) for lane, ids in due_by_lane.items() if ids}
+        scheduled = []
+
+        while queues and len(scheduled) < batch_size:
+            total_weight = 0
+            for lane in queues:
+                self._lane_credits[lane] += self.LANE_WEIGHTS[lane]
+                total_weight += self.LANE_WEIGHTS[lane]
+
+            lane = max(queues, key=lambda candidate: (self._lane_credits[candidate], -candidate))
+            self._lane_credits[lane] -= total_weight
+            scheduled.append(queues[lane].pop(0))
+
+            if not queues[lane]:
+                del queues[lane]
+
+        # ✅ مسار بدون رسائل لا يجمع رصيداً أثناء الخمول
+        for lane in self._lane_credits:
+            if lane not in due_by_lane or not due_by_lane[lane]:
+                self._lane_credits[lane] = 0
+
+        return scheduled
+    
+    def claim_batch(self, batch_size: Optional[int] = None) -> List[Message]:
+        """
+        حجز دفعة من الرسائل المعلقة لهذا العامل
+        
+        ✅ PostgreSQL: SELECT ... FOR UPDATE SKIP LOCKED (العمال لا ينتظرون بعضهم)
+        ✅ SQLite: compare-and-set (UPDATE ... WHERE delivery_status='pending')
+        ✅ كل حجز له lease token خاص به (claimed_by) ووقت حجز (claimed_at)
+        ✅ يتم تخطي العملاء الذين لديهم رسالة قيد الإرسال لدى عامل آخر
+        ✅ الدفعة موزعة بين مسارات الأولوية (_schedule_lanes)
+        
+        Args:
+            batch_size: عدد الرسائل في الدفعة (اختياري)
+        
+        Returns:
+            قائمة الرسائل المحجوزة (بحالة 'sending') بترتيب الإرسال
+        """
+        batch_size = batch_size or self.BATCH_SIZE
+        lease = uuid.uuid4().hex
+        now = timezone.now()
+        
+        # ✅ عميل لديه رسالة قيد الإرسال → رسائله التالية تنتظر (الحفاظ على الترتيب)
+        sending_customers = Message.objects.filter(
+            delivery_status='sending',
+            claimed_by__isnull=False
+        ).values('ticket__customer_id')
+        
+        due_by_lane = {}
+        with transaction.atomic():
+            for lane in self.LANE_WEIGHTS:
+                # ✅ رسالة أقدم تنتظر إعادة المحاولة في نفس المسار أو مسار أعلى → تنتظر رسائله أيضاً
+                #    (رد الموظف لا ينتظر رسالة جماعية فاشلة لنفس العميل)
+                backoff_customers = Message.objects.filter(
+                    delivery_status='pending',
+                    next_attempt_at__gt=now,
+                    priority__lte=lane
+                ).values('ticket__customer_id')
+                
+                # ✅ فقط الرسائل المستحقة (index: delivery_status, priority, next_attempt_at)
+                candidates = Message.objects.filter(
+                    delivery_status='pending',
+                    priority=lane,
+                    next_attempt_at__lte=now,
+                    retry_count__lt=self.MAX_RETRY_COUNT
+                ).exclude(
+                    ticket__customer_id__in=sending_customers
+                ).exclude(
+                    ticket__customer_id__in=backoff_customers
+                ).order_by('created_at', 'id')
+                
+                if connection.features.has_select_for_update_skip_locked:
+                    candidates = candidates.select_for_update(skip_locked=True, of=('self',))
+                
+                due_by_lane[lane] = list(candidates.values_list('id', flat=True)[:batch_size])
+            
+            due_ids = self._schedule_lanes(due_by_lane, batch_size)
+            
+            if not due_ids:
+                return []
+            
+            Message.objects.filter(
+                id__in=due_ids,
+                delivery_status='pending'
+            ).update(
+                delivery_status='sending',
+                claimed_by=lease,
+                claimed_at=now,
+                last_retry_at=now
+            )
+        
+        send_order = {message_id: position for position, message_id in enumerate(due_ids)}
+        claimed = sorted(
+            Message.objects.filter(
+                id__in=due_ids,
+                delivery_status='sending',
+                claimed_by=lease
+            ).select_related('ticket__customer'),
+            key=lambda message: send_order[message.id]
+        )
+        
+        record_transitions(transition_deltas(
+            [('pending', message.priority) for message in claimed], 'sending'
+        ))
+        
+        # ✅ عامل آخر حجز رسائل أقدم لنفس العميل بالتزامن → نتركها له
+        claimed_customers = {message.ticket.customer_id for message in claimed}
+        other_min_ids = {}
+        if claimed_customers:
+            for customer_id, message_id in Message.objects.filter(
+                delivery_status='sending',
+                ticket__customer_id__in=claimed_customers
+            ).exclude(claimed_by=lease).values_list('ticket__customer_id', 'id'):
+                other_min_ids[customer_id] = min(message_id, other_min_ids.get(customer_id, message_id))
+        
+        contested = [
+            message for message in claimed
+            if message.ticket.customer_id in other_min_ids
+            and other_min_ids[message.ticket.customer_id] < message.id
+        ]
+        for message in contested:
+            self.release_claim(message)
+        
+        return [message for message in claimed if message not in contested]
+    
+    def _save_claimed(self, message: Message, **fields) -> bool:
+        """
+        حفظ نتيجة رسالة محجوزة وإنهاء الحجز
+        
+        ✅ الحفظ مشروط بأن الحجز ما زال لهذا العامل (انتهاء الـ Visibility Timeout
+           يعني أن عاملاً آخر أعاد حجزها)
+        """
+        fields.update(claimed_by=None, claimed_at=None, updated_at=timezone.now())
+        
+        saved = Message.objects.filter(
+            id=message.id,
+            claimed_by=message.claimed_by
+        ).update(**fields)
+        
+        if not saved:
+            logger.warning(f"Message {message.id} claim expired before its result was saved")
+        elif 'delivery_status' in fields:
+            record_transition(message.delivery_status, fields['delivery_status'], message.priority)
+        
+        for field, value in fields.items():
+            setattr(message, field, value)
+        
+        return bool(saved)
+    
+    def release_claim(self, message: Message, retry_at=None) -> bool:
+        """
+        إعادة رسالة محجوزة إلى pending بدون احتسابها كمحاولة
+        
+        Args:
+            message: الرسالة المحجوزة
+            retry_at: أقرب وقت للمحاولة التالية (مثلاً من Rate Limiter)
+        """
+        if retry_at:
+            return self._save_claimed(message, delivery_status='pending', next_attempt_at=retry_at)
+        
+        return self._save_claimed(message, delivery_status='pending')
+    
+    def _next_attempt_at(self, retry_count: int):
+        """
+        وقت المحاولة التالية: Exponential Backoff حسب RETRY_DELAY_SECONDS مع Jitter
+        """
+        delay_seconds = self.RETRY_DELAY_SECONDS[min(retry_count - 1, len(self.RETRY_DELAY_SECONDS) - 1)]
+        delay_seconds *= random.uniform(1 - self.RETRY_JITTER, 1 + self.RETRY_JITTER)
+        
+        return timezone.now() + timedelta(seconds=delay_seconds)
+    
+    def _public_media_url(self, media_url: str) -> str:
+        """
+        تحويل مسار الميديا المحلي (/media/...) إلى رابط يصل إليه المزود (WHATSAPP_MEDIA_DOMAIN)
+        """
+        if media_url.startswith('http'):
+            return media_url
+        
+        domain = getattr(settings, 'WHATSAPP_MEDIA_DOMAIN', 'http://localhost:8000').rstrip('/')
+        return f"{domain}/{media_url.lstrip('/')}"
+    
+    def _record_failure(self, message: Message, retry_count: int, error_msg: str,
+                        provider_response: Optional[Dict[str, Any]] = None,
+                        is_retryable: bool = True) -> None:
+        """
+        تسجيل محاولة فاشلة (سجل المحاولات في MessageDeliveryLog)
+
+        ✅ عند الوصول إلى MAX_RETRY_COUNT تنتقل الرسالة إلى Dead Letter Queue
+        """
+        delivery_status = 'failed' if retry_count >= self.MAX_RETRY_COUNT else 'pending'
+
+        saved = self._save_claimed(
+            message,
+            retry_count=retry_count,
+            delivery_status=delivery_status,
+            next_attempt_at=self._next_attempt_at(retry_count),
+            error_message=error_msg
+        )
+        if not saved:
+            return
+
+        try:
+            MessageDeliveryLog.objects.create(
+                message=message,
+                delivery_status='failed',
+                error_message=error_msg[:255]
+            )
+            if delivery_status == 'failed':
+                self._dead_letter(
+                    message,
+                    error_msg,
+                    provider_response=provider_response,
+                    is_retryable=is_retryable
+                )
+        except Exception as e:
+            logger.error(f"Error recording failure history for message {message.id}: {str(e)}")
+
+    def _dead_letter(self, message: Message, failure_reason: str,
+                     provider_response: Optional[Dict[str, Any]] = None,
+                     is_retryable: bool = True) -> DeadLetterMessage:
+        """
+        نقل رسالة فشلت نهائياً إلى Dead Letter Queue مع سجل محاولاتها
+        """
+        attempts = [
+            {
+                'attempt': number,
+                'error': log.error_message,
+                'at': log.created_at.isoformat(),
+            }
+            for number, log in enumerate(
+                message.delivery_logs.filter(delivery_status='failed').order_by('created_at', 'id'),
+                start=1
+            )
+        ]
+
+        # ✅ رد المزود كما هو (بعد التأكد أنه قابل للتخزين كـ JSON)
+        if provider_response is not None:
+            provider_response = json.loads(json.dumps(provider_response, default=str))
+
+        dead_letter, _ = DeadLetterMessage.objects.update_or_create(
+            message=message,
+            defaults={
+                'provider': self.driver.provider_name,
+                'failure_reason': failure_reason,
+                'provider_response': provider_response,
+                'attempts': attempts,
+                'retry_count': message.retry_count,
+                'is_retryable': is_retryable,
+            }
+        )
+
+        logger.warning(f"[DEAD LETTER] Message {message.id} after {message.retry_count} attempt(s): {failure_reason}")
+        return dead_letter
+
     def process_message(self, message: Message) -> bool:
         """
-        معالجة رسالة واحدة (إرسالها عبر WhatsApp)
+        معالجة رسالة محجوزة واحدة (إرسالها عبر WhatsApp)
+        
+        ✅ الرسالة يجب أن تكون محجوزة عبر claim_batch (بحالة 'sending')
+        ✅ Rate Limit يتم التحقق منه قبل الاستدعاء (_check_rate_limit)
+        ✅ لا transaction مفتوحة أثناء الاتصال بمزود WhatsApp
         
         Args:
             message: الرسالة المطلوب إرسالها
@@ -260,17 +695,6 @@ class MessageQueue:
             True إذا نجح الإرسال
         """
         try:
-            # التحقق من Rate Limit
-            if not self._check_rate_limit():
-                logger.info("Rate limit reached, pausing...")
-                time.sleep(3)  # انتظار 3 ثواني
-                return False
-            
-            # تحديث الحالة إلى 'sending'
-            message.delivery_status = 'sending'
-            message.last_retry_at = timezone.now()
-            message.save(update_fields=['delivery_status', 'last_retry_at'])
-            
             # تحديد نوع الإرسال
             # ✅ استخدام wa_id بدلاً من phone_number (يحتوي على @lid أو @c.us الصحيح)
             customer_wa_id = message.ticket.customer.wa_id
@@ -285,25 +709,21 @@ class MessageQueue:
                 # إرسال ميديا
                 result = self.driver.send_media_message(
                     phone=customer_wa_id,
-                    media_url=message.media_url,
+                    media_url=self._public_media_url(message.media_url),
                     media_type=message.message_type,
                     caption=message.message_text
                 )
             
             if result.get('success'):
                 # نجح الإرسال ✅
-                message.delivery_status = 'sent'
-                message.whatsapp_message_id = result.get('message_id')
-                message.sent_at = timezone.now()
-                message.error_message = None
-                message.save(update_fields=[
-                    'delivery_status',
-                    'whatsapp_message_id',
-                    'sent_at',
-                    'error_message'
-                ])
+                self._save_claimed(
+                    message,
+                    delivery_status='sent',
+                    whatsapp_message_id=result.get('message_id'),
+                    sent_at=timezone.now(),
+                    error_message=None
+                )
                 
-                self._sent_messages_count += 1
                 logger.info(f"[SUCCESS] Message {message.id} sent successfully")
                 return True
             else:
@@ -313,18 +733,17 @@ class MessageQueue:
                 # ✅ إذا كان الخطأ بسبب @lid، نضع رسالة واضحة
                 if '@lid' in customer_wa_id or 'lid' in error_msg.lower():
                     error_msg = f"⚠️ حساب واتساب للأعمال: لا يمكن إرسال رسائل آلية لهذا العميل. يُرجى الرد يدوياً من تطبيق WhatsApp."
-                    message.delivery_status = 'failed'  # فشل نهائي
-                    message.retry_count = self.MAX_RETRY_COUNT  # لا نعيد المحاولة
+                    retry_count = self.MAX_RETRY_COUNT  # فشل نهائي: لا نعيد المحاولة
+                    is_retryable = False
                 else:
-                    message.retry_count += 1
-                    message.delivery_status = 'failed' if message.retry_count >= self.MAX_RETRY_COUNT else 'pending'
-
-                message.error_message = error_msg
-                message.save(update_fields=[
-                    'retry_count',
-                    'delivery_status',
-                    'error_message'
-                ])
+                    retry_count = message.retry_count + 1
+                    is_retryable = True
+
+                self._record_failure(
+                    message, retry_count, error_msg,
+                    provider_response=result,
+                    is_retryable=is_retryable
+                )
                 
                 logger.error(f"[FAILED] Message {message.id} failed: {message.error_message}")
                 return False
@@ -333,14 +752,12 @@ class MessageQueue:
             logger.error(f"Error processing message {message.id}: {str(e)}", exc_info=True)
             
             # تسجيل الفشل
-            message.retry_count += 1
-            message.delivery_status = 'failed' if message.retry_count >= self.MAX_RETRY_COUNT else 'pending'
-            message.error_message = str(e)
-            message.save(update_fields=[
-                'retry_count',
-                'delivery_status',
-                'error_message'
-            ])
+            self._record_failure(
+                message,
+                message.retry_count + 1,
+                str(e),
+                provider_response={'exception': type(e).__name__, 'error': str(e)}
+            )
             
             return False
     
@@ -348,44 +765,53 @@ class MessageQueue:
         """
         معالجة جميع الرسائل المعلقة
         
+        ✅ آمنة مع عدة عمال (claim_batch)
+        ✅ بدون time.sleep بين الرسائل (الـ Rate Limiter المشترك هو الذي يحدد السرعة)
+        
         Args:
             batch_size: عدد الرسائل في الدفعة (اختياري)
         
         Returns:
             Dict مع إحصائيات المعالجة
         """
-        batch_size = batch_size or self.BATCH_SIZE
-        
-        # جلب الرسائل المعلقة
-        pending_messages = Message.objects.filter(
-            delivery_status='pending',
-            retry_count__lt=self.MAX_RETRY_COUNT
-        ).order_by('created_at')[:batch_size]
+        self.release_stale_claims()
+        claimed_messages = self.claim_batch(batch_size)
         
-        if not pending_messages.exists():
+        if not claimed_messages:
             logger.info("No pending messages to process")
             return {
                 'success': True,
                 'processed': 0,
                 'sent': 0,
                 'failed': 0,
+                'fetched': 0,
                 'message': 'No pending messages'
             }
         
-        logger.info(f"Processing {pending_messages.count()} pending messages...")
+        logger.info(f"Processing {len(claimed_messages)} pending messages...")
         
         sent_count = 0
         failed_count = 0
+        rate_limited_count = 0
+        retry_at = None
+        provider_paused = False
+        failed_customers = set()
         
-        for message in pending_messages:
-            # التحقق من وقت الانتظار بين المحاولات
-            if message.retry_count > 0 and message.last_retry_at:
-                delay_seconds = self.RETRY_DELAY_SECONDS[min(message.retry_count - 1, len(self.RETRY_DELAY_SECONDS) - 1)]
-                time_since_last_retry = (timezone.now() - message.last_retry_at).total_seconds()
-                
-                if time_since_last_retry < delay_seconds:
-                    logger.info(f"Message {message.id} waiting for retry delay...")
-                    continue
+        for message in claimed_messages:
+            # ✅ الحفاظ على الترتيب: إذا فشلت رسالة لعميل، تنتظر رسائله التالية
+            if provider_paused or message.ticket.customer_id in failed_customers:
+                self.release_claim(message)
+                continue
+            
+            # ✅ Rate Limit: بدون انتظار، الرسالة تعود إلى pending حتى retry_at
+            decision = self._check_rate_limit(message)
+            if not decision['allowed']:
+                self.release_claim(message, retry_at=decision['retry_at'])
+                rate_limited_count += 1
+                retry_at = min(retry_at, decision['retry_at']) if retry_at else decision['retry_at']
+                failed_customers.add(message.ticket.customer_id)
+                provider_paused = decision['bucket'].startswith('provider:')
+                continue
             
             # معالجة الرسالة
             success = self.process_message(message)
@@ -394,45 +820,176 @@ class MessageQueue:
                 sent_count += 1
             else:
                 failed_count += 1
-            
-            # تأخير بسيط بين الرسائل (Rate Limiting)
-            time.sleep(0.5)
+                failed_customers.add(message.ticket.customer_id)
         
-        logger.info(f"[PROCESSED] Processed: {sent_count} sent, {failed_count} failed")
+        logger.info(f"[PROCESSED] Processed: {sent_count} sent, {failed_count} failed, {rate_limited_count} rate limited")
         
         return {
             'success': True,
             'processed': sent_count + failed_count,
             'sent': sent_count,
             'failed': failed_count,
+            'rate_limited': rate_limited_count,
+            'retry_at': retry_at,
+            'fetched': len(claimed_messages),
             'message': f'Processed {sent_count + failed_count} messages'
         }
     
+    def _process_customer_messages(self, messages: List[Message], provider_paused: threading.Event) -> Dict[str, Any]:
+        """
+        إرسال رسائل عميل واحد بالترتيب (داخل worker thread)
+        
+        ✅ إذا فشلت رسالة تتوقف رسائل العميل التالية حتى لا تصل قبلها
+        ✅ إذا وصل المزود للحد، يتوقف كل الـ workers (provider_paused)
+        """
+        sent_count = 0
+        failed_count = 0
+        rate_limited_count = 0
+        retry_at = None
+        
+        try:
+            for index, message in enumerate(messages):
+                if provider_paused.is_set():
+                    for waiting_message in messages[index:]:
+                        self.release_claim(waiting_message)
+                    break
+                
+                decision = self._check_rate_limit(message)
+                if not decision['allowed']:
+                    rate_limited_count += 1
+                    retry_at = decision['retry_at']
+                    if decision['bucket'].startswith('provider:'):
+                        provider_paused.set()
+                    self.release_claim(message, retry_at=retry_at)
+                    for waiting_message in messages[index + 1:]:
+                        self.release_claim(waiting_message)
+                    break
+                
+                if self.process_message(message):
+                    sent_count += 1
+                else:
+                    failed_count += 1
+                    for waiting_message in messages[index + 1:]:
+                        self.release_claim(waiting_message)
+                    break
+        finally:
+            # كل thread له اتصال قاعدة بيانات خاص به
+            connection.close()
+        
+        return {
+            'sent': sent_count,
+            'failed': failed_count,
+            'rate_limited': rate_limited_count,
+            'retry_at': retry_at
+        }
+    
+    def dispatch(self, workers: Optional[int] = None, batch_size: Optional[int] = None) -> Dict[str, Any]:
+        """
+        معالجة الرسائل المعلقة بشكل متوازي
+        
+        ✅ رسائل كل عميل تذهب لنفس الـ worker بترتيب created_at
+        ✅ عملاء مختلفون يُرسلون بالتوازي حتى الوصول إلى Rate Limit
+        ✅ بدون time.sleep بين الرسائل (الـ Rate Limit هو الذي يحدد السرعة)
+        ✅ آمنة مع عدة عمليات dispatch في نفس الوقت (claim_batch)
+        
+        Args:
+            workers: عدد الـ workers (افتراضي MESSAGE_QUEUE_WORKERS)
+            batch_size: عدد الرسائل في الدفعة (افتراضي BATCH_SIZE × workers)
+        
+        Returns:
+            Dict مع إحصائيات المعالجة
+        """
+        workers = workers or getattr(settings, 'MESSAGE_QUEUE_WORKERS', self.DEFAULT_WORKERS)
+        batch_size = batch_size or self.BATCH_SIZE * workers
+        
+        self.release_stale_claims()
+        claimed_messages = self.claim_batch(batch_size)
+        
+        # تجميع الرسائل حسب العميل
+        customer_messages = OrderedDict()
+        for message in claimed_messages:
+            customer_messages.setdefault(message.ticket.customer_id, []).append(message)
+        
+        if not customer_messages:
+            return {
+                'success': True,
+                'processed': 0,
+                'sent': 0,
+                'failed': 0,
+                'fetched': 0,
+                'message': 'No pending messages'
+            }
+        
+        pool_size = min(workers, len(customer_messages))
+        logger.info(
+            f"Dispatching {len(claimed_messages)} messages "
+            f"for {len(customer_messages)} customers on {pool_size} workers..."
+        )
+        
+        provider_paused = threading.Event()
+        with ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='message-queue') as executor:
+            results = list(executor.map(
+                lambda messages: self._process_customer_messages(messages, provider_paused),
+                customer_messages.values()
+            ))
+        
+        sent_count = sum(result['sent'] for result in results)
+        failed_count = sum(result['failed'] for result in results)
+        rate_limited_count = sum(result['rate_limited'] for result in results)
+        retry_times = [result['retry_at'] for result in results if result['retry_at']]
+        
+        logger.info(f"[DISPATCHED] Processed: {sent_count} sent, {failed_count} failed, {rate_limited_count} rate limited")
+        
+        return {
+            'success': True,
+            'processed': sent_count + failed_count,
+            'sent': sent_count,
+            'failed': failed_count,
+            'rate_limited': rate_limited_count,
+            'retry_at': min(retry_times) if retry_times else None,
+            'fetched': len(claimed_messages),
+            'message': f'Processed {sent_count + failed_count} messages'
+        }
+    
+
     def get_queue_stats(self) -> Dict[str, Any]:
         """
         الحصول على إحصائيات قائمة الانتظار
         
+        ✅ من العدادات التدريجية (queue_stats) بدلاً من COUNT على كل الرسائل الصادرة
+        ✅ إحصائيات آخر 7 أيام من جدول الـ rollup
+        
         Returns:
             Dict مع الإحصائيات
         """
-        from django.db.models import Count, Q
-        
-        stats = Message.objects.filter(
-            direction='outgoing'
-        ).aggregate(
-            total=Count('id'),
-            pending=Count('id', filter=Q(delivery_status='pending')),
-            sending=Count('id', filter=Q(delivery_status='sending')),
-            sent=Count('id', filter=Q(delivery_status='sent')),
-            delivered=Count('id', filter=Q(delivery_status='delivered')),
-            failed=Count('id', filter=Q(delivery_status='failed'))
-        )
+        counts = get_state_counts()
+        
+        def count(delivery_status, priority=None):
+            return sum(
+                value for (status, lane), value in counts.items()
+                if status == delivery_status and (priority is None or lane == priority)
+            )
+        
+        stats = {
+            'total': sum(counts.values()),
+            'pending': count('pending'),
+            'pending_interactive': count('pending', Message.PRIORITY_INTERACTIVE),
+            'pending_system': count('pending', Message.PRIORITY_SYSTEM),
+            'pending_bulk': count('pending', Message.PRIORITY_BULK),
+            'sending': count('sending'),
+            'sent': count('sent'),
+            'delivered': count('delivered'),
+            'read': count('read'),
+            'failed': count('failed'),
+        }
+        stats['dead_letters'] = DeadLetterMessage.objects.count()
+        stats['daily'] = get_daily_stats(days=7)
         
         return stats
     
     def retry_failed(self, hours: int = 1) -> Dict[str, Any]:
         """
-        إعادة محاولة الرسائل الفاشلة في آخر X ساعات
+        إعادة محاولة الرسائل الفاشلة في آخر X ساعات (من Dead Letter Queue)
         
         Args:
             hours: عدد الساعات للبحث
@@ -440,28 +997,100 @@ class MessageQueue:
         Returns:
             Dict مع نتائج المحاولة
         """
-        cutoff_time = timezone.now() - timedelta(hours=hours)
-        
-        # جلب الرسائل الفاشلة
-        failed_messages = Message.objects.filter(
-            delivery_status='failed',
-            retry_count__lt=self.MAX_RETRY_COUNT,
-            created_at__gte=cutoff_time
-        )
-        
-        # إعادة تعيين الحالة إلى pending
-        updated_count = failed_messages.update(
-            delivery_status='pending',
-            error_message=None
-        )
-        
-        logger.info(f"Reset {updated_count} failed messages to pending")
+        result = self.requeue_dead_letters(hours=hours)
         
         return {
             'success': True,
-            'reset_count': updated_count,
-            'message': f'{updated_count} messages reset for retry'
+            'reset_count': result['requeued'],
+            'message': f"{result['requeued']} messages reset for retry"
         }
+    
+    # ============================================
+    # Dead Letter Queue
+    # ============================================
+    
+    def _dead_letters(self, ids: Optional[List[int]] = None, hours: Optional[int] = None,
+                      older_than_days: Optional[int] = None, retryable_only: bool = False):
+        dead_letters = DeadLetterMessage.objects.all()
+        
+        if ids is not None:
+            dead_letters = dead_letters.filter(id__in=ids)
+        if hours is not None:
+            dead_letters = dead_letters.filter(created_at__gte=timezone.now() - timedelta(hours=hours))
+        if older_than_days is not None:
+            dead_letters = dead_letters.filter(created_at__lt=timezone.now() - timedelta(days=older_than_days))
+        if retryable_only:
+            dead_letters = dead_letters.filter(is_retryable=True)
+        
+        return dead_letters
+    
+    def requeue_dead_letters(self, ids: Optional[List[int]] = None, hours: Optional[int] = None,
+                             force: bool = False) -> Dict[str, Any]:
+        """
+        إعادة رسائل من Dead Letter Queue إلى قائمة الانتظار
+        
+        ✅ انتقائية: حسب ids أو آخر X ساعات
+        ✅ الرسائل غير القابلة لإعادة المحاولة (@lid) تُتخطى إلا مع force
+        ✅ سجل Dead Letter يُحذف، وسجل المحاولات يبقى في MessageDeliveryLog
+        
+        Args:
+            ids: أرقام سجلات Dead Letter (اختياري)
+            hours: فقط ما وصل خلال آخر X ساعات (اختياري)
+            force: إعادة حتى غير القابلة لإعادة المحاولة
+        
+        Returns:
+            Dict مع success و requeued
+        """
+        with transaction.atomic():
+            dead_letters = self._dead_letters(ids=ids, hours=hours, retryable_only=not force)
+            message_ids = list(dead_letters.values_list('message_id', flat=True))
+            
+            if not message_ids:
+                return {'success': True, 'requeued': 0}
+            
+            # ✅ الرسائل محجوزة (FOR UPDATE) → العدادات من الصفوف التي تحدثت فعلاً
+            failed = list(Message.objects.filter(
+                id__in=message_ids,
+                delivery_status='failed'
+            ).select_for_update().values_list('id', 'priority'))
+            requeued = Message.objects.filter(
+                id__in=[message_id for message_id, _ in failed]
+            ).update(
+                delivery_status='pending',
+                retry_count=0,
+                next_attempt_at=timezone.now(),
+                error_message=None,
+                updated_at=timezone.now()
+            )
+            DeadLetterMessage.objects.filter(message_id__in=message_ids).delete()
+            record_transitions(transition_deltas(
+                [('failed', priority) for _, priority in failed], 'pending'
+            ))
+        
+        logger.info(f"Requeued {requeued} dead-letter messages")
+        
+        if requeued:
+            transaction.on_commit(notify_message_queue)
+        
+        return {'success': True, 'requeued': requeued}
+    
+    def purge_dead_letters(self, ids: Optional[List[int]] = None,
+                           older_than_days: Optional[int] = None) -> Dict[str, Any]:
+        """
+        حذف سجلات من Dead Letter Queue (الرسالة تبقى failed في المحادثة)
+        
+        Args:
+            ids: أرقام سجلات Dead Letter (اختياري)
+            older_than_days: فقط الأقدم من X أيام (اختياري)
+        
+        Returns:
+            Dict مع success و purged
+        """
+        purged, _ = self._dead_letters(ids=ids, older_than_days=older_than_days).delete()
+        
+        logger.info(f"Purged {purged} dead-letter entries")
+        
+        return {'success': True, 'purged': purged}
 
 
 # ============================================
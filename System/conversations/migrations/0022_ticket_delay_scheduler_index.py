@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-18 20:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversations', '0021_agent_perm_complaint_agent_perm_consultation_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['status', 'last_customer_message_at'], name='tickets_status_7b7ffa_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-18 20:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversations', '0022_ticket_delay_scheduler_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookInbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('provider', models.CharField(choices=[('wppconnect', 'WPPConnect'), ('cloud_api', 'WhatsApp Cloud API'), ('elmujib_cloud', 'Elmujib Cloud API')], max_length=20)),
+                ('payload', models.JSONField()),
+                ('customer_key', models.CharField(blank=True, max_length=100, null=True)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('processed', 'Processed'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('attempts', models.IntegerField(default=0)),
+                ('error_message', models.TextField(blank=True, null=True)),
+                ('claimed_by', models.CharField(blank=True, max_length=64, null=True)),
+                ('claimed_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'webhook_inbox',
+                'indexes': [models.Index(fields=['status', 'id'], name='webhook_inb_status_d0d652_idx'), models.Index(fields=['customer_key', 'status'], name='webhook_inb_custome_7a0e06_idx'), models.Index(fields=['created_at'], name='webhook_inb_created_80f10a_idx')],
+            },
+        ),
+    ]
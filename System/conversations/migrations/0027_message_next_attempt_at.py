@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 20:27
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversations', '0026_rate_limit_bucket'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='next_attempt_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['delivery_status', 'next_attempt_at'], name='messages_deliver_535e85_idx'),
+        ),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 4.2.7 on 2026-10-18 20:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversations', '0027_message_next_attempt_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BroadcastCampaign',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200)),
+                ('message_type', models.CharField(choices=[('text', 'Text'), ('image', 'Image'), ('document', 'Document'), ('video', 'Video'), ('template', 'Template')], default='text', max_length=20)),
+                ('message_text', models.TextField(blank=True, null=True)),
+                ('media_url', models.CharField(blank=True, max_length=500, null=True)),
+                ('template_name', models.CharField(blank=True, max_length=100, null=True)),
+                ('template_language', models.CharField(default='ar', max_length=10)),
+                ('template_params', models.JSONField(blank=True, default=dict)),
+                ('audience_filter', models.JSONField(blank=True, default=dict)),
+                ('status', models.CharField(choices=[('draft', 'Draft'), ('running', 'Running'), ('paused', 'Paused'), ('completed', 'Completed'), ('cancelled', 'Cancelled')], default='draft', max_length=20)),
+                ('total_recipients', models.IntegerField(default=0)),
+                ('sent_count', models.IntegerField(default=0)),
+                ('failed_count', models.IntegerField(default=0)),
+                ('delivered_count', models.IntegerField(default=0)),
+                ('read_count', models.IntegerField(default=0)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='broadcast_campaigns', to='conversations.user')),
+            ],
+            options={
+                'db_table': 'broadcast_campaigns',
+            },
+        ),
+        migrations.CreateModel(
+            name='BroadcastRecipient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('wa_id', models.CharField(max_length=50)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('sending', 'Sending'), ('sent', 'Sent'), ('delivered', 'Delivered'), ('read', 'Read'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('whatsapp_message_id', models.CharField(blank=True, max_length=100, null=True, unique=True)),
+                ('retry_count', models.IntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('claimed_by', models.CharField(blank=True, max_length=64, null=True)),
+                ('claimed_at', models.DateTimeField(blank=True, null=True)),
+                ('error_message', models.TextField(blank=True, null=True)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('campaign', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recipients', to='conversations.broadcastcampaign')),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='broadcast_receipts', to='conversations.customer')),
+            ],
+            options={
+                'db_table': 'broadcast_recipients',
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='broadcast_r_status_6c4917_idx'), models.Index(fields=['status', 'claimed_at'], name='broadcast_r_status_e90b1e_idx'), models.Index(fields=['campaign', 'status'], name='broadcast_r_campaig_6b3392_idx')],
+                'unique_together': {('campaign', 'customer')},
+            },
+        ),
+        migrations.AddIndex(
+            model_name='broadcastcampaign',
+            index=models.Index(fields=['status'], name='broadcast_c_status_7e723a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='broadcastcampaign',
+            index=models.Index(fields=['created_at'], name='broadcast_c_created_8ed506_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.7 on 2026-10-18 20:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversations', '0028_broadcast_campaigns'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='priority',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'Interactive'), (1, 'System'), (2, 'Bulk')], default=0),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['delivery_status', 'priority', 'next_attempt_at'], name='messages_deliver_3eeb7b_idx'),
+        ),
+    ]
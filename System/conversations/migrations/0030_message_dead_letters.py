@@ -0,0 +1,32 @@
+# Generated by Django 4.2.7 on 2026-10-18 20:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversations', '0029_message_priority'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeadLetterMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('provider', models.CharField(blank=True, max_length=50, null=True)),
+                ('failure_reason', models.TextField()),
+                ('provider_response', models.JSONField(blank=True, null=True)),
+                ('attempts', models.JSONField(default=list)),
+                ('retry_count', models.IntegerField(default=0)),
+                ('is_retryable', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('message', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='dead_letter', to='conversations.message')),
+            ],
+            options={
+                'db_table': 'message_dead_letters',
+                'indexes': [models.Index(fields=['created_at'], name='message_dea_created_2d29c6_idx'), models.Index(fields=['is_retryable', 'created_at'], name='message_dea_is_retr_0624d6_idx')],
+            },
+        ),
+    ]
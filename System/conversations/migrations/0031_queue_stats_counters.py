@@ -0,0 +1,61 @@
+# Generated by Django 4.2.7 on 2026-10-18 20:48
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def seed_state_counters(apps, schema_editor):
+    """
+    العدادات الأولية من الرسائل الموجودة (بعدها تُحدّث تدريجياً)
+    """
+    Message = apps.get_model('conversations', 'Message')
+    MessageStateCounter = apps.get_model('conversations', 'MessageStateCounter')
+
+    MessageStateCounter.objects.bulk_create([
+        MessageStateCounter(delivery_status=row['delivery_status'], priority=row['priority'], count=row['count'])
+        for row in Message.objects.filter(direction='outgoing')
+        .values('delivery_status', 'priority')
+        .annotate(count=Count('id'))
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversations', '0030_message_dead_letters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+                ('total', models.IntegerField(default=0)),
+                ('sent', models.IntegerField(default=0)),
+                ('delivered', models.IntegerField(default=0)),
+                ('read', models.IntegerField(default=0)),
+                ('failed', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'message_daily_stats',
+                'ordering': ['-date'],
+            },
+        ),
+        migrations.CreateModel(
+            name='MessageStateCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('delivery_status', models.CharField(choices=[('pending', 'Pending'), ('queued', 'Queued'), ('sending', 'Sending'), ('sent', 'Sent'), ('delivered', 'Delivered'), ('read', 'Read'), ('failed', 'Failed')], max_length=50)),
+                ('priority', models.PositiveSmallIntegerField(choices=[(0, 'Interactive'), (1, 'System'), (2, 'Bulk')])),
+                ('count', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'message_state_counters',
+                'unique_together': {('delivery_status', 'priority')},
+            },
+        ),
+        migrations.RunPython(seed_state_counters, migrations.RunPython.noop),
+    ]
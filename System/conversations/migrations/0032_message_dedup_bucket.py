@@ -0,0 +1,27 @@
+# Generated by Django 4.2.7 on 2026-10-18 20:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversations', '0031_queue_stats_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='dedup_bucket',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='message_hash',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='message',
+            constraint=models.UniqueConstraint(fields=('message_hash', 'dedup_bucket'), name='unique_message_hash_bucket'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.7 on 2026-10-18 20:52
+
+from django.db import migrations, models
+from django.db.models import Count, Exists, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_conversation_state(apps, schema_editor):
+    """
+    حالة المحادثة وعداد رسائل العميل للتذاكر الموجودة (آخر مرة يُبحث فيها عن نص الترحيب)
+    """
+    Ticket = apps.get_model('conversations', 'Ticket')
+    Message = apps.get_model('conversations', 'Message')
+
+    customer_messages = Message.objects.filter(
+        ticket_id=OuterRef('pk'),
+        sender_type='customer'
+    ).order_by().values('ticket_id').annotate(count=Count('id')).values('count')
+    Ticket.objects.update(
+        customer_messages_count=Coalesce(
+            Subquery(customer_messages, output_field=IntegerField()), Value(0)
+        )
+    )
+
+    Ticket.objects.filter(category_selected_at__isnull=False).update(conversation_state='classified')
+    Ticket.objects.filter(category_selected_at__isnull=True).filter(
+        Exists(Message.objects.filter(
+            ticket_id=OuterRef('pk'),
+            sender_type='agent',
+            message_text__contains='مرحباً بك في صيدليات خليفة'
+        ))
+    ).update(conversation_state='welcomed')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversations', '0032_message_dedup_bucket'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticket',
+            name='conversation_state',
+            field=models.CharField(choices=[('new', 'New'), ('welcomed', 'Welcomed'), ('classified', 'Classified')], default='new', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='ticket',
+            name='customer_messages_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_conversation_state, migrations.RunPython.noop),
+    ]
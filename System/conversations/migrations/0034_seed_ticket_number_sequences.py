@@ -0,0 +1,41 @@
+from datetime import timedelta
+
+from django.db import migrations
+from django.utils import timezone
+
+
+def seed_ticket_number_sequences(apps, schema_editor):
+    """
+    عدادات الأيام التي أُنشئت فيها تذاكر بالطريقة القديمة (يوم النشر)
+
+    بعدها لا يبحث reserve_ticket_numbers عن آخر تذكرة أبداً: عداد اليوم الجديد يبدأ من 0
+    """
+    Ticket = apps.get_model('conversations', 'Ticket')
+    TicketNumberSequence = apps.get_model('conversations', 'TicketNumberSequence')
+
+    since = timezone.now() - timedelta(days=2)
+    last_numbers = {}
+    for ticket_number in Ticket.objects.filter(created_at__gte=since).values_list('ticket_number', flat=True):
+        parts = ticket_number.split('-')
+        if len(parts) != 3 or not parts[1].isdigit() or not parts[2].isdigit():
+            continue
+        last_numbers[parts[1]] = max(last_numbers.get(parts[1], 0), int(parts[2]))
+
+    for day, last_number in last_numbers.items():
+        date = f'{day[:4]}-{day[4:6]}-{day[6:]}'
+        sequence, created = TicketNumberSequence.objects.get_or_create(
+            date=date, defaults={'last_number': last_number}
+        )
+        if not created and sequence.last_number < last_number:
+            TicketNumberSequence.objects.filter(id=sequence.id).update(last_number=last_number)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversations', '0033_ticket_conversation_state'),
+    ]
+
+    operations = [
+        migrations.RunPython(seed_ticket_number_sequences, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-18 21:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversations', '0035_webhook_inbox_next_attempt_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['status', 'last_agent_message_at'], name='tickets_status_8d94de_idx'),
+        ),
+    ]
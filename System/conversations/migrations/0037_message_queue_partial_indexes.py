@@ -0,0 +1,37 @@
+# Generated by Django 4.2.7 on 2026-10-18 21:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversations', '0036_ticket_agent_message_index'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='message',
+            name='messages_deliver_a84231_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='message',
+            name='messages_deliver_535e85_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='message',
+            name='messages_deliver_3eeb7b_idx',
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(condition=models.Q(('delivery_status__in', ['pending', 'sending'])), fields=['delivery_status', 'claimed_at'], name='messages_queue_claimed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(condition=models.Q(('delivery_status__in', ['pending', 'sending'])), fields=['delivery_status', 'next_attempt_at'], name='messages_queue_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(condition=models.Q(('delivery_status__in', ['pending', 'sending'])), fields=['delivery_status', 'priority', 'next_attempt_at'], name='messages_queue_lane_idx'),
+        ),
+    ]
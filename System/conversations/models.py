@@ -16,7 +16,7 @@ Django Models - 22 جدول
 """
 
 from django.db import models
-from django.db.models import F
+from django.db.models import F, Q
 from django.contrib.auth.hashers import make_password, check_password
 from django.utils import timezone
 from decimal import Decimal
@@ -265,7 +265,7 @@ class CustomerNote(models.Model):
 
 
 # ============================================================================
-# GROUP 3: TICKET MANAGEMENT (3 Models)
+# GROUP 3: TICKET MANAGEMENT (4 Models)
 # ============================================================================
 
 class Ticket(models.Model):
@@ -293,6 +293,17 @@ class Ticket(models.Model):
         ('urgent', 'Urgent'),
     ]
     
+    # حالة المحادثة للرد التلقائي: new → welcomed → classified
+    CONVERSATION_NEW = 'new'                # لم تُرسل رسالة الترحيب بعد
+    CONVERSATION_WELCOMED = 'welcomed'      # أُرسلت رسالة الترحيب (القائمة) بانتظار اختيار العميل
+    CONVERSATION_CLASSIFIED = 'classified'  # اختار العميل نوع الخدمة
+    
+    CONVERSATION_STATE_CHOICES = [
+        (CONVERSATION_NEW, 'New'),
+        (CONVERSATION_WELCOMED, 'Welcomed'),
+        (CONVERSATION_CLASSIFIED, 'Classified'),
+    ]
+    
     ticket_number = models.CharField(max_length=20, unique=True)
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='tickets')
     assigned_agent = models.ForeignKey(Agent, on_delete=models.SET_NULL, null=True, blank=True, related_name='assigned_tickets')
@@ -303,6 +314,10 @@ class Ticket(models.Model):
     category = models.CharField(max_length=20, choices=CATEGORY_CHOICES, default='general')
     priority = models.CharField(max_length=10, choices=PRIORITY_CHOICES, default='medium')
     
+    # Conversation State (بدلاً من البحث عن نص الترحيب وعد رسائل العميل مع كل رسالة)
+    conversation_state = models.CharField(max_length=10, choices=CONVERSATION_STATE_CHOICES, default=CONVERSATION_NEW)
+    customer_messages_count = models.PositiveIntegerField(default=0)  # عدد رسائل العميل الواردة
+    
     # Delay Tracking
     is_delayed = models.BooleanField(default=False)
     delay_started_at = models.DateTimeField(null=True, blank=True)
@@ -338,6 +353,8 @@ class Ticket(models.Model):
             models.Index(fields=['created_at']),
             models.Index(fields=['is_delayed']),
             models.Index(fields=['assigned_agent', 'status']),
+            models.Index(fields=['status', 'last_customer_message_at']),  # DelayScheduler
+            models.Index(fields=['status', 'last_agent_message_at']),  # DelayScheduler (ردود الموظفين)
         ]
     
     def __str__(self):
@@ -416,6 +433,23 @@ class TicketStateLog(models.Model):
         return f"{self.old_state} → {self.new_state}"
 
 
+class TicketNumberSequence(models.Model):
+    """
+    عداد أرقام التذاكر اليومي (TKT-YYYYMMDD-XXXX)
+
+    ✅ يُحجز الرقم (أو مجموعة أرقام) بـ INSERT ... ON CONFLICT ... RETURNING واحد بدلاً من
+       البحث عن آخر تذكرة في نفس اليوم، ولا يتكرر الرقم مع الطلبات المتزامنة
+    """
+    date = models.DateField(unique=True)
+    last_number = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'ticket_number_sequences'
+
+    def __str__(self):
+        return f"{self.date}: {self.last_number}"
+
+
 # ============================================================================
 # GROUP 4: MESSAGES (3 Models)
 # ============================================================================
@@ -458,6 +492,17 @@ class Message(models.Model):
         ('outgoing', 'Outgoing'),  # من الموظف
     ]
 
+    # ✅ أولوية الإرسال في قائمة الانتظار (رقم أصغر = أولوية أعلى)
+    PRIORITY_INTERACTIVE = 0  # رد الموظف في محادثة حية
+    PRIORITY_SYSTEM = 1       # ردود النظام التلقائية (ترحيب / قائمة)
+    PRIORITY_BULK = 2         # رسائل API منخفضة الأولوية (الحملات تستخدم BroadcastRecipient)
+
+    PRIORITY_CHOICES = [
+        (PRIORITY_INTERACTIVE, 'Interactive'),
+        (PRIORITY_SYSTEM, 'System'),
+        (PRIORITY_BULK, 'Bulk'),
+    ]
+
     ticket = models.ForeignKey(Ticket, on_delete=models.CASCADE, related_name='messages')
     sender = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
     sender_type = models.CharField(max_length=50, choices=SENDER_TYPE_CHOICES)
@@ -472,11 +517,16 @@ class Message(models.Model):
     delivery_status = models.CharField(max_length=50, choices=WHATSAPP_STATUS_CHOICES, default='pending')  # ✅ الافتراضي pending
     
     # ✅ Deduplication & Queue Management
-    message_hash = models.CharField(max_length=64, null=True, blank=True, db_index=True)  # SHA256 hash لمنع التكرار
+    message_hash = models.CharField(max_length=64, null=True, blank=True)  # SHA256 hash لمنع التكرار
+    dedup_bucket = models.BigIntegerField(null=True, blank=True)  # نافذة زمنية للتكرار (unique مع message_hash)
     retry_count = models.IntegerField(default=0)  # عدد محاولات الإرسال
     last_retry_at = models.DateTimeField(null=True, blank=True)  # آخر محاولة
+    next_attempt_at = models.DateTimeField(default=timezone.now)  # أقرب وقت للمحاولة التالية (Backoff)
     error_message = models.TextField(null=True, blank=True)  # رسالة الخطأ
     sent_at = models.DateTimeField(null=True, blank=True)  # وقت الإرسال الفعلي
+    claimed_by = models.CharField(max_length=64, null=True, blank=True)  # lease token للعامل الذي يرسل الرسالة
+    claimed_at = models.DateTimeField(null=True, blank=True)  # وقت الحجز (Visibility Timeout)
+    priority = models.PositiveSmallIntegerField(choices=PRIORITY_CHOICES, default=PRIORITY_INTERACTIVE)
 
     # Flags
     is_deleted = models.BooleanField(default=False)
@@ -496,6 +546,17 @@ class Message(models.Model):
             models.Index(fields=['created_at']),
             models.Index(fields=['whatsapp_message_id']),
             models.Index(fields=['is_read']),
+            # ✅ فهارس جزئية لقائمة الانتظار: الرسائل المعلقة/قيد الإرسال فقط (لا تكبر مع سجل الرسائل المرسلة)
+            models.Index(fields=['delivery_status', 'claimed_at'], name='messages_queue_claimed_idx',
+                         condition=Q(delivery_status__in=['pending', 'sending'])),
+            models.Index(fields=['delivery_status', 'next_attempt_at'], name='messages_queue_due_idx',
+                         condition=Q(delivery_status__in=['pending', 'sending'])),
+            models.Index(fields=['delivery_status', 'priority', 'next_attempt_at'], name='messages_queue_lane_idx',
+                         condition=Q(delivery_status__in=['pending', 'sending'])),
+        ]
+        constraints = [
+            # ✅ منع التكرار على مستوى قاعدة البيانات (طلبان متزامنان لا يمران معاً)
+            models.UniqueConstraint(fields=['message_hash', 'dedup_bucket'], name='unique_message_hash_bucket'),
         ]
 
     def __str__(self):
@@ -958,3 +1019,255 @@ class SystemSettings(models.Model):
         منع حذف الإعدادات
         """
         pass
+
+
+# ============================================================================
+# GROUP 11: WEBHOOK INBOX (1 Model)
+# ============================================================================
+
+class WebhookInbox(models.Model):
+    """
+    صندوق وارد الـ Webhooks (Durable Inbox)
+
+    ✅ الـ webhook يحفظ البيانات الخام ويرجع 200 فوراً
+    ✅ العامل (process_webhook_inbox) يعالج السجلات على دفعات مع الحفاظ على ترتيب رسائل كل عميل
+    """
+    PROVIDER_CHOICES = [
+        ('wppconnect', 'WPPConnect'),
+        ('cloud_api', 'WhatsApp Cloud API'),
+        ('elmujib_cloud', 'Elmujib Cloud API'),
+    ]
+
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('processed', 'Processed'),
+        ('failed', 'Failed'),
+    ]
+
+    provider = models.CharField(max_length=20, choices=PROVIDER_CHOICES)
+    payload = models.JSONField()
+    customer_key = models.CharField(max_length=100, null=True, blank=True)  # مفتاح ترتيب رسائل العميل (wa_id/phone)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.IntegerField(default=0)
+    error_message = models.TextField(null=True, blank=True)
+    claimed_by = models.CharField(max_length=64, null=True, blank=True)  # رمز العامل الذي يعالج السجل
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    next_attempt_at = models.DateTimeField(null=True, blank=True)  # بعد الفشل: لا يُحجز قبل هذا الوقت (Backoff)
+
+    # Timestamps
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'webhook_inbox'
+        indexes = [
+            models.Index(fields=['status', 'id']),
+            models.Index(fields=['customer_key', 'status']),
+            models.Index(fields=['created_at']),
+        ]
+
+    def __str__(self):
+        return f"Webhook #{self.id} ({self.provider}) - {self.status}"
+
+
+# ============================================================================
+# GROUP 12: RATE LIMITING (1 Model)
+# ============================================================================
+
+class RateLimitBucket(models.Model):
+    """
+    Token Bucket مشترك بين كل العمليات (Rate Limiting للإرسال عبر WhatsApp)
+
+    ✅ مفتاح لكل مزود (provider:elmujib_cloud) ولكل مستلم (recipient:2010...)
+    ✅ الرصيد يُعاد حسابه عند كل طلب حسب الوقت المنقضي منذ updated_at
+    """
+    key = models.CharField(max_length=150, unique=True)
+    tokens = models.FloatField()
+    updated_at = models.DateTimeField()  # آخر إعادة حساب للرصيد (يستخدم أيضاً للـ compare-and-set)
+
+    class Meta:
+        db_table = 'rate_limit_buckets'
+
+    def __str__(self):
+        return f"{self.key}: {self.tokens:.2f}"
+
+
+# ============================================================================
+# GROUP 13: BROADCAST CAMPAIGNS (2 Models)
+# ============================================================================
+
+class BroadcastCampaign(models.Model):
+    """
+    حملة إرسال جماعي (عروض / تنبيهات توفر الأدوية)
+
+    ✅ الجمهور يُحدد بفلتر على Customer / CustomerTag (audience_filter)
+    ✅ العدادات تُحدّث تدريجياً أثناء الإرسال (بدون COUNT على كل المستلمين)
+    """
+    MESSAGE_TYPE_CHOICES = [
+        ('text', 'Text'),
+        ('image', 'Image'),
+        ('document', 'Document'),
+        ('video', 'Video'),
+        ('template', 'Template'),
+    ]
+
+    STATUS_CHOICES = [
+        ('draft', 'Draft'),
+        ('running', 'Running'),
+        ('paused', 'Paused'),
+        ('completed', 'Completed'),
+        ('cancelled', 'Cancelled'),
+    ]
+
+    name = models.CharField(max_length=200)
+    message_type = models.CharField(max_length=20, choices=MESSAGE_TYPE_CHOICES, default='text')
+    message_text = models.TextField(null=True, blank=True)  # النص أو الـ caption
+    media_url = models.CharField(max_length=500, null=True, blank=True)
+    template_name = models.CharField(max_length=100, null=True, blank=True)
+    template_language = models.CharField(max_length=10, default='ar')
+    template_params = models.JSONField(default=dict, blank=True)
+    audience_filter = models.JSONField(default=dict, blank=True)  # customer_types / tags / exclude_tags / customer_ids
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='draft')
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='broadcast_campaigns')
+
+    # Counters
+    total_recipients = models.IntegerField(default=0)
+    sent_count = models.IntegerField(default=0)
+    failed_count = models.IntegerField(default=0)
+    delivered_count = models.IntegerField(default=0)
+    read_count = models.IntegerField(default=0)
+
+    # Timestamps
+    started_at = models.DateTimeField(null=True, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'broadcast_campaigns'
+        indexes = [
+            models.Index(fields=['status']),
+            models.Index(fields=['created_at']),
+        ]
+
+    def __str__(self):
+        return f"Campaign: {self.name} ({self.status})"
+
+
+class BroadcastRecipient(models.Model):
+    """
+    مستلم واحد في حملة (صف لكل عميل، يُنشأ بـ bulk_create على دفعات)
+
+    ✅ نفس أسلوب قائمة انتظار الرسائل: lease token + Visibility Timeout + Backoff
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('delivered', 'Delivered'),
+        ('read', 'Read'),
+        ('failed', 'Failed'),
+    ]
+
+    campaign = models.ForeignKey(BroadcastCampaign, on_delete=models.CASCADE, related_name='recipients')
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='broadcast_receipts')
+    wa_id = models.CharField(max_length=50)  # نسخة من wa_id وقت إنشاء الحملة
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    whatsapp_message_id = models.CharField(max_length=100, null=True, blank=True, unique=True)
+    retry_count = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claimed_by = models.CharField(max_length=64, null=True, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    error_message = models.TextField(null=True, blank=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'broadcast_recipients'
+        unique_together = [['campaign', 'customer']]
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+            models.Index(fields=['status', 'claimed_at']),
+            models.Index(fields=['campaign', 'status']),
+        ]
+
+    def __str__(self):
+        return f"{self.campaign_id} → {self.wa_id} ({self.status})"
+
+
+# ============================================================================
+# GROUP 14: DEAD LETTER QUEUE (1 Model)
+# ============================================================================
+
+class DeadLetterMessage(models.Model):
+    """
+    رسالة فشلت نهائياً (وصلت MAX_RETRY_COUNT أو خطأ غير قابل لإعادة المحاولة)
+
+    ✅ سبب الفشل ورد المزود وسجل المحاولات خارج جدول messages
+    ✅ إعادة المحاولة انتقائية (تحذف السجل وتعيد الرسالة إلى pending)
+    """
+    message = models.OneToOneField(Message, on_delete=models.CASCADE, related_name='dead_letter')
+    provider = models.CharField(max_length=50, null=True, blank=True)
+    failure_reason = models.TextField()
+    provider_response = models.JSONField(null=True, blank=True)  # آخر رد من المزود
+    attempts = models.JSONField(default=list)  # [{"attempt": 1, "error": "...", "at": "..."}]
+    retry_count = models.IntegerField(default=0)
+    is_retryable = models.BooleanField(default=True)  # False: مثلاً حساب @lid لا يقبل رسائل آلية
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'message_dead_letters'
+        indexes = [
+            models.Index(fields=['created_at']),
+            models.Index(fields=['is_retryable', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"Dead letter for message {self.message_id}"
+
+
+# ============================================================================
+# GROUP 15: QUEUE STATISTICS (2 Models)
+# ============================================================================
+
+class MessageStateCounter(models.Model):
+    """
+    عدد الرسائل الصادرة في كل حالة (delivery_status, priority)
+
+    ✅ يُحدّث تدريجياً مع كل انتقال حالة (queue_stats.record_transitions)
+    ✅ يُصحح دورياً من جدول messages (reconcile_queue_stats)
+    """
+    delivery_status = models.CharField(max_length=50, choices=Message.WHATSAPP_STATUS_CHOICES)
+    priority = models.PositiveSmallIntegerField(choices=Message.PRIORITY_CHOICES)
+    count = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'message_state_counters'
+        unique_together = [['delivery_status', 'priority']]
+
+    def __str__(self):
+        return f"{self.delivery_status}/{self.priority}: {self.count}"
+
+
+class MessageDailyStats(models.Model):
+    """
+    إحصائيات يومية للرسائل الصادرة (rollup للأيام المنتهية)
+
+    الحالة هي حالة الرسالة عند آخر rollup (التوصيل/القراءة قد يصل بعد نهاية اليوم)
+    """
+    date = models.DateField(unique=True)
+    total = models.IntegerField(default=0)
+    sent = models.IntegerField(default=0)
+    delivered = models.IntegerField(default=0)
+    read = models.IntegerField(default=0)
+    failed = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'message_daily_stats'
+        ordering = ['-date']
+
+    def __str__(self):
+        return f"{self.date}: {self.total}"
@@ -0,0 +1,248 @@
+"""
+Queue Statistics
+إحصائيات قائمة انتظار الرسائل الصادرة بدون COUNT على كل الرسائل
+
+Features:
+✅ عداد لكل (delivery_status, priority) في MessageStateCounter يُحدّث مع كل انتقال حالة
+   (إنشاء رسالة / حجز / إرسال / فشل / حالة توصيل / إعادة من Dead Letter Queue)
+✅ get_state_counts(): استعلام واحد على جدول صغير (21 صف كحد أقصى) مهما كان عدد الرسائل
+✅ التغييرات تُطبق بعد الـ commit (لا قفل على صفوف العدادات داخل معاملات الإرسال)
+✅ reconcile(): تسوية دورية من جدول messages تصحح أي انحراف (مسارات لا تمر بالعدادات)
+   تعمل تلقائياً داخل process_message_queue --continuous (QUEUE_STATS_RECONCILE_SECONDS)
+✅ rollup_daily(): إحصائيات الأيام المنتهية في MessageDailyStats
+
+Usage:
+    record_transition('pending', 'sending', Message.PRIORITY_INTERACTIVE)
+    get_state_counts()
+    python manage.py reconcile_queue_stats   # دورياً (cron)
+"""
+
+import logging
+from datetime import datetime, time, timedelta
+from typing import Dict, Any, List, Optional, Tuple
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from .models import Message, MessageStateCounter, MessageDailyStats
+
+logger = logging.getLogger(__name__)
+
+STATUSES = [status for status, _ in Message.WHATSAPP_STATUS_CHOICES]
+PRIORITIES = [priority for priority, _ in Message.PRIORITY_CHOICES]
+
+
+# ============================================
+# Incremental Counters
+# ============================================
+
+def record_transitions(deltas: Dict[Tuple[str, int], int]) -> None:
+    """
+    تسجيل تغييرات العدادات (تُطبق بعد الـ commit)
+
+    ✅ صف العداد الواحد يُحدّث مع كل رسالة من كل عامل/webhook: التطبيق داخل معاملة
+       الإضافة/الحجز/حالات التوصيل يقفل الصف حتى نهايتها (PostgreSQL) ويجعله نقطة تزاحم.
+       بعد الـ commit كل UPDATE معاملة قصيرة مستقلة، وإذا تم التراجع لا يُطبق شيء.
+    ✅ خارج أي معاملة تُطبق فوراً
+
+    Args:
+        deltas: {(delivery_status, priority): +n / -n}
+    """
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if deltas:
+        transaction.on_commit(lambda: _apply_deltas(deltas))
+
+
+def _apply_deltas(deltas: Dict[Tuple[str, int], int]) -> None:
+    """
+    تطبيق تغييرات العدادات (UPDATE ذري لكل عداد)
+    """
+    for (delivery_status, priority), delta in deltas.items():
+        try:
+            updated = MessageStateCounter.objects.filter(
+                delivery_status=delivery_status,
+                priority=priority
+            ).update(count=F('count') + delta, updated_at=timezone.now())
+
+            if not updated:
+                # أول رسالة في هذه الحالة (أو قبل أول reconcile)
+                try:
+                    with transaction.atomic():
+                        MessageStateCounter.objects.create(
+                            delivery_status=delivery_status,
+                            priority=priority,
+                            count=delta
+                        )
+                except IntegrityError:
+                    MessageStateCounter.objects.filter(
+                        delivery_status=delivery_status,
+                        priority=priority
+                    ).update(count=F('count') + delta, updated_at=timezone.now())
+
+        except Exception as e:
+            # ✅ العدادات لا توقف الإرسال أبداً (reconcile يصحح الانحراف)
+            logger.error(f"Error updating queue counter {delivery_status}/{priority}: {str(e)}")
+
+
+def record_transition(old_status: Optional[str], new_status: Optional[str],
+                      priority: int, count: int = 1) -> None:
+    """
+    انتقال رسالة (أو أكثر) من حالة إلى أخرى
+
+    Args:
+        old_status: الحالة السابقة (None عند الإنشاء)
+        new_status: الحالة الجديدة (None عند الحذف)
+        priority: مسار الأولوية
+        count: عدد الرسائل
+    """
+    if old_status == new_status or not count:
+        return
+
+    deltas = {}
+    if old_status:
+        deltas[(old_status, priority)] = -count
+    if new_status:
+        deltas[(new_status, priority)] = deltas.get((new_status, priority), 0) + count
+
+    record_transitions(deltas)
+
+
+def transition_deltas(rows, new_status: str) -> Dict[Tuple[str, int], int]:
+    """
+    تغييرات العدادات لمجموعة رسائل انتقلت إلى new_status
+
+    Args:
+        rows: [(delivery_status السابقة, priority), ...]
+    """
+    deltas = {}
+    for old_status, priority in rows:
+        if old_status == new_status:
+            continue
+        deltas[(old_status, priority)] = deltas.get((old_status, priority), 0) - 1
+        deltas[(new_status, priority)] = deltas.get((new_status, priority), 0) + 1
+    return deltas
+
+
+def get_state_counts() -> Dict[Tuple[str, int], int]:
+    """
+    العدادات الحالية (استعلام واحد)
+
+    Returns:
+        {(delivery_status, priority): count}
+    """
+    return {
+        (delivery_status, priority): max(count, 0)
+        for delivery_status, priority, count in MessageStateCounter.objects.values_list(
+            'delivery_status', 'priority', 'count'
+        )
+    }
+
+
+# ============================================
+# Reconciliation & Rollup
+# ============================================
+
+def reconcile() -> Dict[str, Any]:
+    """
+    إعادة حساب العدادات من جدول messages (COUNT واحد مجمّع، يعمل دورياً وليس مع كل طلب)
+
+    تغييرات معاملة انتهت ولم تُطبق بعد (on_commit) قد تُحسب مرتين؛ التسوية التالية تصححها
+
+    Returns:
+        Dict مع success و corrections (الفرق لكل عداد تم تصحيحه)
+    """
+    with transaction.atomic():
+        # ✅ قفل العدادات أثناء التسوية (PostgreSQL) حتى لا تضيع تحديثات متزامنة
+        list(MessageStateCounter.objects.select_for_update().values_list('id', flat=True))
+
+        actual = {
+            (row['delivery_status'], row['priority']): row['count']
+            for row in Message.objects.filter(direction='outgoing')
+            .values('delivery_status', 'priority')
+            .annotate(count=Count('id'))
+        }
+        current = {
+            (delivery_status, priority): count
+            for delivery_status, priority, count in MessageStateCounter.objects.values_list(
+                'delivery_status', 'priority', 'count'
+            )
+        }
+
+        corrections = {}
+        for key in set(actual) | set(current):
+            expected = actual.get(key, 0)
+            if current.get(key) == expected:
+                continue
+
+            delivery_status, priority = key
+            MessageStateCounter.objects.update_or_create(
+                delivery_status=delivery_status,
+                priority=priority,
+                defaults={'count': expected}
+            )
+            corrections[f'{delivery_status}/{priority}'] = expected - current.get(key, 0)
+
+    if corrections:
+        logger.warning(f"[QUEUE STATS] Reconciled counters: {corrections}")
+
+    return {
+        'success': True,
+        'corrections': corrections
+    }
+
+
+def rollup_daily(days: int = 2) -> Dict[str, Any]:
+    """
+    حساب إحصائيات آخر X أيام منتهية (اليوم الحالي لا يُحسب حتى ينتهي)
+
+    ✅ آخر يومين يُعاد حسابهما لأن حالات التوصيل/القراءة تصل بعد نهاية اليوم
+
+    Returns:
+        Dict مع success و days (عدد الأيام المحدثة)
+    """
+    today = timezone.localdate()
+    tz = timezone.get_current_timezone()
+
+    for offset in range(days, 0, -1):
+        day = today - timedelta(days=offset)
+        start = timezone.make_aware(datetime.combine(day, time.min), tz)
+        end = start + timedelta(days=1)
+
+        stats = Message.objects.filter(
+            direction='outgoing',
+            created_at__gte=start,
+            created_at__lt=end
+        ).aggregate(
+            total=Count('id'),
+            sent=Count('id', filter=Q(delivery_status__in=['sent', 'delivered', 'read'])),
+            delivered=Count('id', filter=Q(delivery_status__in=['delivered', 'read'])),
+            read=Count('id', filter=Q(delivery_status='read')),
+            failed=Count('id', filter=Q(delivery_status='failed'))
+        )
+
+        MessageDailyStats.objects.update_or_create(date=day, defaults=stats)
+
+    return {
+        'success': True,
+        'days': days
+    }
+
+
+def get_daily_stats(days: int = 7) -> List[Dict[str, Any]]:
+    """
+    آخر X أيام من MessageDailyStats (الأحدث أولاً)
+    """
+    return [
+        {
+            'date': row['date'].isoformat(),
+            'total': row['total'],
+            'sent': row['sent'],
+            'delivered': row['delivered'],
+            'read': row['read'],
+            'failed': row['failed'],
+        }
+        for row in MessageDailyStats.objects.order_by('-date').values(
+            'date', 'total', 'sent', 'delivered', 'read', 'failed'
+        )[:days]
+    ]
@@ -0,0 +1,143 @@
+"""
+Message Queue Wakeup
+إيقاظ عامل قائمة الانتظار فور إضافة رسالة (بدلاً من الانتظار 10 ثواني)
+
+Features:
+✅ PostgreSQL: LISTEN/NOTIFY (الإشعار يصل بعد الـ commit فقط)
+✅ SQLite/غيرها: UDP datagram على localhost (نفس الجهاز)
+✅ بدون قناة إيقاظ: Adaptive Polling (0.5s → 10s أثناء الخمول)
+
+Usage:
+    transaction.on_commit(notify_message_queue)   # بعد enqueue
+
+    wakeup = QueueWakeup()
+    wakeup.listen()
+    wakeup.wait(timeout=10)                        # True إذا وصل إشعار
+"""
+
+import logging
+import select
+import socket
+import time
+from typing import Optional
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'message_queue'
+DEFAULT_WAKEUP_PORT = 47601
+
+
+def _wakeup_port() -> int:
+    return getattr(settings, 'MESSAGE_QUEUE_WAKEUP_PORT', DEFAULT_WAKEUP_PORT)
+
+
+def notify_message_queue() -> None:
+    """
+    إرسال إشعار للعامل بوجود رسائل جديدة (لا يفشل أبداً)
+    """
+    try:
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_notify(%s, '')", [CHANNEL])
+        else:
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+                sock.sendto(b'1', ('127.0.0.1', _wakeup_port()))
+
+    except Exception as e:
+        # الإشعار تحسين للسرعة فقط؛ العامل يكتشف الرسالة بالـ polling على أي حال
+        logger.debug(f"Message queue wakeup failed: {str(e)}")
+
+
+class QueueWakeup:
+    """
+    انتظار إشعار إضافة رسالة داخل العامل
+
+    mode:
+        'postgres' → LISTEN على اتصال مستقل (autocommit)
+        'socket'   → UDP socket على 127.0.0.1
+        'poll'     → لا قناة إيقاظ (انتظار timeout فقط)
+    """
+
+    def __init__(self):
+        self.mode = 'poll'
+        self._pg_connection = None
+        self._socket: Optional[socket.socket] = None
+
+    def listen(self) -> str:
+        """
+        فتح قناة الإيقاظ المناسبة لقاعدة البيانات
+
+        Returns:
+            mode المستخدم
+        """
+        try:
+            if connection.vendor == 'postgresql':
+                self._pg_connection = connection.get_new_connection(connection.get_connection_params())
+                self._pg_connection.autocommit = True
+                with self._pg_connection.cursor() as cursor:
+                    cursor.execute(f'LISTEN {CHANNEL}')
+                self.mode = 'postgres'
+            else:
+                self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                self._socket.bind(('127.0.0.1', _wakeup_port()))
+                self.mode = 'socket'
+
+        except Exception as e:
+            # مثلاً: المنفذ مستخدم من عامل آخر على نفس الجهاز
+            logger.warning(f"Message queue wakeup unavailable, falling back to polling: {str(e)}")
+            self.close()
+            self.mode = 'poll'
+
+        return self.mode
+
+    def _drain_socket(self) -> None:
+        self._socket.setblocking(False)
+        try:
+            while True:
+                self._socket.recv(64)
+        except (BlockingIOError, OSError):
+            pass
+
+    def wait(self, timeout: float) -> bool:
+        """
+        انتظار إشعار حتى timeout ثانية
+
+        Returns:
+            True إذا وصل إشعار، False عند انتهاء المهلة
+        """
+        if self.mode == 'postgres':
+            if hasattr(self._pg_connection, 'notifies') and callable(self._pg_connection.notifies):
+                # psycopg 3
+                return any(True for _ in self._pg_connection.notifies(timeout=timeout, stop_after=1))
+
+            # psycopg2
+            if select.select([self._pg_connection], [], [], timeout)[0]:
+                self._pg_connection.poll()
+                woken = bool(self._pg_connection.notifies)
+                del self._pg_connection.notifies[:]
+                return woken
+            return False
+
+        if self.mode == 'socket':
+            if select.select([self._socket], [], [], timeout)[0]:
+                self._drain_socket()
+                return True
+            return False
+
+        time.sleep(timeout)
+        return False
+
+    def close(self) -> None:
+        if self._pg_connection is not None:
+            try:
+                self._pg_connection.close()
+            except Exception:
+                pass
+            self._pg_connection = None
+
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
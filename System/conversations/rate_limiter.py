@@ -0,0 +1,175 @@
+"""
+Shared Rate Limiter
+Token Bucket مشترك بين كل العمليات لإرسال رسائل WhatsApp
+
+Features:
+✅ الرصيد محفوظ في قاعدة البيانات (RateLimitBucket) → حد واحد لكل العمال والـ views
+✅ Bucket لكل مزود (provider) و Bucket لكل مستلم (recipient)
+✅ Bucket إضافي للحملات (broadcast) → الحملات لا تستهلك كل حد المزود
+✅ لا ينتظر أبداً (بدون time.sleep): يرجع وقت المحاولة التالية retry_at
+✅ compare-and-set على updated_at → آمن بين العمليات بدون أقفال
+
+Usage:
+    limiter = get_rate_limiter()
+    decision = limiter.acquire('elmujib_cloud', recipient='201234567890@c.us')
+    if not decision['allowed']:
+        retry_at = decision['retry_at']
+"""
+
+import logging
+from datetime import timedelta
+from typing import Dict, Any, Optional, List, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import RateLimitBucket
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimitConflict(Exception):
+    """عملية أخرى عدّلت الـ bucket بين القراءة والكتابة"""
+
+
+class TokenBucketLimiter:
+    """
+    Token Bucket: السعة = الحد في الدقيقة، ويُعاد ملؤه بمعدل (الحد / 60) في الثانية
+
+    Usage:
+        limiter = TokenBucketLimiter()
+        limiter.acquire('cloud_api', recipient='201234567890')
+    """
+
+    MAX_CAS_ATTEMPTS = 5  # عدد محاولات compare-and-set قبل اعتبار الطلب مرفوضاً
+
+    def get_limits(self, provider: str, recipient: Optional[str] = None,
+                   broadcast: bool = False) -> List[Tuple[str, int]]:
+        """
+        الـ buckets المطلوبة للإرسال: [(key, per_minute), ...]
+        """
+        provider_limit = getattr(settings, 'WHATSAPP_PROVIDER_RATE_LIMITS', {}).get(
+            provider,
+            getattr(settings, 'WHATSAPP_RATE_LIMIT_PER_MINUTE', 20)
+        )
+        limits = [(f'provider:{provider}', provider_limit)]
+
+        if broadcast:
+            broadcast_limit = getattr(settings, 'WHATSAPP_BROADCAST_RATE_LIMIT_PER_MINUTE', 12)
+            limits.append((f'broadcast:{provider}', broadcast_limit))
+
+        if recipient:
+            recipient_limit = getattr(settings, 'WHATSAPP_RECIPIENT_RATE_LIMIT_PER_MINUTE', 10)
+            limits.append((f'recipient:{str(recipient).split("@")[0]}'[:150], recipient_limit))
+
+        return limits
+
+    def _load_buckets(self, limits: List[Tuple[str, int]], now) -> Dict[str, RateLimitBucket]:
+        """
+        قراءة الـ buckets (وإنشاء الناقص منها بسعة كاملة)
+        """
+        keys = [key for key, _ in limits]
+        buckets = {bucket.key: bucket for bucket in RateLimitBucket.objects.filter(key__in=keys)}
+
+        missing = [
+            RateLimitBucket(key=key, tokens=per_minute, updated_at=now)
+            for key, per_minute in limits
+            if key not in buckets
+        ]
+        if missing:
+            RateLimitBucket.objects.bulk_create(missing, ignore_conflicts=True)
+            buckets = {bucket.key: bucket for bucket in RateLimitBucket.objects.filter(key__in=keys)}
+
+        return buckets
+
+    def _try_acquire(self, limits: List[Tuple[str, int]]) -> Dict[str, Any]:
+        now = timezone.now()
+        buckets = self._load_buckets(limits, now)
+
+        refilled = {}
+        wait_seconds = 0.0
+        for key, per_minute in limits:
+            bucket = buckets[key]
+            rate = per_minute / 60.0
+            elapsed = max((now - bucket.updated_at).total_seconds(), 0.0)
+            tokens = min(float(per_minute), bucket.tokens + elapsed * rate)
+            refilled[key] = tokens
+
+            if tokens < 1:
+                wait_seconds = max(wait_seconds, (1 - tokens) / rate if rate else 60.0)
+
+        # ✅ مرفوض: لا نكتب شيئاً، فقط نرجع وقت المحاولة التالية
+        if wait_seconds > 0:
+            return {
+                'allowed': False,
+                'retry_at': now + timedelta(seconds=wait_seconds),
+                'bucket': next(key for key, _ in limits if refilled[key] < 1)
+            }
+
+        # ✅ مسموح: خصم token من كل الـ buckets معاً أو لا شيء
+        with transaction.atomic():
+            for key, _ in limits:
+                bucket = buckets[key]
+                updated = RateLimitBucket.objects.filter(
+                    id=bucket.id,
+                    updated_at=bucket.updated_at
+                ).update(tokens=refilled[key] - 1, updated_at=now)
+
+                if not updated:
+                    raise RateLimitConflict(key)
+
+        return {'allowed': True, 'retry_at': None, 'bucket': None}
+
+    def acquire(self, provider: str, recipient: Optional[str] = None,
+                broadcast: bool = False) -> Dict[str, Any]:
+        """
+        حجز إذن إرسال رسالة واحدة
+
+        Args:
+            provider: اسم المزود (driver.provider_name)
+            recipient: wa_id / رقم المستلم (اختياري)
+            broadcast: رسالة حملة جماعية (تخضع أيضاً لحد الحملات)
+
+        Returns:
+            Dict مع allowed و retry_at (datetime أو None)
+        """
+        limits = self.get_limits(provider, recipient, broadcast=broadcast)
+
+        for _ in range(self.MAX_CAS_ATTEMPTS):
+            try:
+                decision = self._try_acquire(limits)
+            except RateLimitConflict:
+                continue
+
+            if not decision['allowed']:
+                logger.warning(f"⚠️  Rate limit reached for {decision['bucket']}, retry at {decision['retry_at']}")
+            return decision
+
+        # ✅ تنافس شديد على نفس الـ bucket → نعتبره ممتلئاً لحظياً
+        return {
+            'allowed': False,
+            'retry_at': timezone.now() + timedelta(seconds=1),
+            'bucket': limits[0][0]
+        }
+
+
+# ============================================
+# Singleton Instance
+# ============================================
+
+_rate_limiter_instance = None
+
+def get_rate_limiter() -> TokenBucketLimiter:
+    """
+    الحصول على TokenBucketLimiter Singleton Instance
+
+    Returns:
+        TokenBucketLimiter instance
+    """
+    global _rate_limiter_instance
+
+    if _rate_limiter_instance is None:
+        _rate_limiter_instance = TokenBucketLimiter()
+
+    return _rate_limiter_instance
@@ -315,6 +315,7 @@ class TicketSerializer(serializers.ModelSerializer):
             'created_at', 'first_response_at', 'last_message_at',
             'last_customer_message_at', 'last_agent_message_at', 'closed_at',
             'category_selected_at',  # ✅ إضافة الحقل الجديد
+            'conversation_state', 'customer_messages_count',
             'response_time_seconds', 'handling_time_seconds', 'messages_count',
             'closure_reason', 'updated_at', 'state_logs', 'transfer_logs',
             'is_overdue', 'time_since_last_message'
@@ -323,6 +324,7 @@ class TicketSerializer(serializers.ModelSerializer):
             'id', 'ticket_number', 'is_delayed', 'delay_started_at',
             'total_delay_minutes', 'delay_count', 'first_response_at',
             'category_selected_at',  # ✅ إضافة للحقول للقراءة فقط
+            'conversation_state', 'customer_messages_count',
             'last_message_at', 'last_customer_message_at', 'last_agent_message_at',
             'response_time_seconds', 'handling_time_seconds', 'messages_count',
             'created_at', 'updated_at'
@@ -2,14 +2,21 @@
 Django Signals لتحديث KPIs تلقائياً
 """
 
+import logging
+
+from django.db import transaction
 from django.db.models.signals import post_save, pre_save, post_delete
 from django.dispatch import receiver
 from django.db.models import Count, Q
 from django.contrib.auth import get_user_model
-from .models import Ticket, Message, Agent, Customer
+from .models import Ticket, Message, Agent, Customer, AutoReplyTrigger, GlobalTemplate
 from .utils import calculate_agent_kpi
+from .identity_cache import get_identity_cache
+from .auto_reply import get_auto_reply_engine
+from .queue_stats import record_transition
 
 User = get_user_model()
+logger = logging.getLogger(__name__)
 
 
 @receiver(post_save, sender=Ticket)
@@ -17,6 +24,14 @@ def update_kpi_on_ticket_save(sender, instance, created, **kwargs):
     """
     تحديث KPI عند إنشاء أو تحديث تذكرة
     """
+    # ✅ تذكرة فتحتها ingestion: العدادات محدّثة بـ F() بالفعل (بدون COUNT)
+    #    و KPI الموظف بعد الـ commit (خارج transaction استقبال الرسائل)
+    if getattr(instance, '_counters_updated', False):
+        if instance.assigned_agent_id:
+            agent = instance.assigned_agent
+            transaction.on_commit(lambda: _recalculate_agent_kpi(agent))
+        return
+
     # تحديث current_active_tickets للموظف
     if instance.current_agent:
         try:
@@ -55,6 +70,13 @@ def update_kpi_on_ticket_save(sender, instance, created, **kwargs):
             pass
 
 
+def _recalculate_agent_kpi(agent):
+    try:
+        calculate_agent_kpi(agent)
+    except Exception as e:
+        logger.error(f"Error recalculating KPI for agent {agent.id}: {str(e)}")
+
+
 @receiver(post_delete, sender=Ticket)
 def update_customer_on_ticket_delete(sender, instance, **kwargs):
     """
@@ -73,6 +95,38 @@ def update_customer_on_ticket_delete(sender, instance, **kwargs):
             pass
 
 
+@receiver(post_save, sender=Ticket)
+def invalidate_identity_on_ticket_close(sender, instance, created, **kwargs):
+    """
+    إلغاء هوية العميل من الـ identity cache عند إغلاق التذكرة
+    """
+    if instance.status == 'closed':
+        get_identity_cache().invalidate_ticket(instance.id)
+
+
+@receiver(post_save, sender=Customer)
+def invalidate_identity_on_customer_change(sender, instance, created, **kwargs):
+    """
+    إلغاء هوية العميل من الـ identity cache عند تعديل بياناته أو دمجه
+    """
+    if not created:
+        get_identity_cache().invalidate_customer(instance.id)
+
+
+@receiver(post_delete, sender=Customer)
+def invalidate_identity_on_customer_delete(sender, instance, **kwargs):
+    get_identity_cache().invalidate_customer(instance.id)
+
+
+@receiver([post_save, post_delete], sender=AutoReplyTrigger)
+@receiver([post_save, post_delete], sender=GlobalTemplate)
+def rebuild_auto_reply_on_trigger_change(sender, instance, **kwargs):
+    """
+    إعادة بناء Automaton الرد التلقائي عند تعديل محفز أو قالب (في هذه العملية فوراً)
+    """
+    get_auto_reply_engine().invalidate()
+
+
 @receiver(post_save, sender=Message)
 def update_kpi_on_message_save(sender, instance, created, **kwargs):
     """
@@ -97,6 +151,17 @@ def update_kpi_on_message_save(sender, instance, created, **kwargs):
             pass
 
 
+@receiver(post_save, sender=Message)
+def count_outgoing_message_on_create(sender, instance, created, **kwargs):
+    """
+    تحديث عدادات قائمة الانتظار عند إنشاء رسالة صادرة (queue_stats)
+
+    الحذف لا يُحتسب هنا (بدون post_delete حتى يبقى الحذف الجماعي سريعاً) → reconcile يصححه
+    """
+    if created and instance.direction == 'outgoing':
+        record_transition(None, instance.delivery_status, instance.priority)
+
+
 @receiver(post_save, sender=User)
 def create_agent_profile(sender, instance, created, **kwargs):
     """
@@ -28,6 +28,16 @@ from .views_backup import (
     list_backups,
     delete_backup
 )
+from .views_broadcast import (
+    broadcast_campaigns,
+    broadcast_campaign_progress,
+    broadcast_campaign_action
+)
+from .views_dead_letters import (
+    dead_letters_list,
+    dead_letters_requeue,
+    dead_letters_purge
+)
 
 
 # إنشاء Router
@@ -85,6 +95,14 @@ urlpatterns = [
     path('whatsapp/queue-stats/', message_queue_stats, name='message-queue-stats'),
     path('whatsapp/process-queue/', process_message_queue_api, name='process-message-queue'),
     path('whatsapp/retry-failed/', retry_failed_messages, name='retry-failed-messages'),
+    path('whatsapp/dead-letters/', dead_letters_list, name='dead-letters-list'),
+    path('whatsapp/dead-letters/requeue/', dead_letters_requeue, name='dead-letters-requeue'),
+    path('whatsapp/dead-letters/purge/', dead_letters_purge, name='dead-letters-purge'),
+    
+    # ✅ Broadcast Campaigns
+    path('broadcasts/', broadcast_campaigns, name='broadcast-campaigns'),
+    path('broadcasts/<int:campaign_id>/', broadcast_campaign_progress, name='broadcast-campaign-progress'),
+    path('broadcasts/<int:campaign_id>/<str:action>/', broadcast_campaign_action, name='broadcast-campaign-action'),
     
     # ✅ Conversations Real-time Updates
     path('conversations/', conversations_list_api, name='conversations-list'),
@@ -8,7 +8,7 @@ Utility Functions
 2. Ticket Number Generation
 3. Activity Logging
 4. KPI Calculation
-5. Delay Detection
+5. Delay Detection & Bulk Reconciliation
 """
 
 from django.utils import timezone
@@ -67,6 +67,66 @@ def normalize_phone_number(phone):
 # 2. TICKET NUMBER GENERATION
 # ============================================================================
 
+def _supports_update_returning(connection):
+    """
+    INSERT/UPDATE ... RETURNING: PostgreSQL و SQLite 3.35+ فقط (MySQL/MariaDB لا تدعم UPDATE ... RETURNING)
+    """
+    if connection.vendor == 'postgresql':
+        return True
+    if connection.vendor == 'sqlite':
+        import sqlite3
+        return sqlite3.sqlite_version_info >= (3, 35)
+    return False
+
+
+def reserve_ticket_numbers(count=1):
+    """
+    حجز مجموعة أرقام تذاكر متتالية بشكل ذري (لإنشاء عدة تذاكر دفعة واحدة)
+    Format: TKT-YYYYMMDD-XXXX
+
+    ✅ PostgreSQL / SQLite 3.35+: استعلام واحد دائماً
+       (INSERT ... ON CONFLICT DO UPDATE ... RETURNING، حتى لأول تذكرة في اليوم)
+    ✅ غيرها (MySQL): get_or_create لعداد اليوم ثم select_for_update
+    ✅ لا يتكرر الرقم مع الـ webhooks المتزامنة
+    ✅ عداد اليوم يبدأ من 0 (التذاكر السابقة للعداد هيأتها migration 0034)
+
+    Args:
+        count: عدد الأرقام المطلوبة
+
+    Returns:
+        list: أرقام التذاكر بالترتيب
+    """
+    from .models import TicketNumberSequence
+    from django.db import connection, transaction
+    from django.db.models import F
+
+    if count < 1:
+        return []
+
+    today = timezone.now().date()
+    prefix = f'TKT-{today.strftime("%Y%m%d")}-'
+
+    if _supports_update_returning(connection):
+        table = connection.ops.quote_name(TicketNumberSequence._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (date, last_number) VALUES (%s, %s) '
+                f'ON CONFLICT (date) DO UPDATE SET last_number = {table}.last_number + excluded.last_number '
+                f'RETURNING last_number',
+                [connection.ops.adapt_datefield_value(today), count]
+            )
+            last_number = cursor.fetchone()[0]
+    else:
+        with transaction.atomic():
+            TicketNumberSequence.objects.get_or_create(date=today)
+            sequence = TicketNumberSequence.objects.select_for_update().get(date=today)
+            TicketNumberSequence.objects.filter(id=sequence.id).update(last_number=F('last_number') + count)
+            last_number = sequence.last_number + count
+
+    first_number = last_number - count + 1
+    return [f'{prefix}{number:04d}' for number in range(first_number, last_number + 1)]
+
+
 def generate_ticket_number():
     """
     توليد رقم تذكرة فريد
@@ -74,29 +134,7 @@ def generate_ticket_number():
     
     Example: TKT-20251030-0001
     """
-    from .models import Ticket
-    
-    # الحصول على التاريخ الحالي
-    today = timezone.now().date()
-    date_str = today.strftime('%Y%m%d')
-    
-    # البحث عن آخر تذكرة في نفس اليوم
-    prefix = f'TKT-{date_str}-'
-    last_ticket = Ticket.objects.filter(
-        ticket_number__startswith=prefix
-    ).order_by('-ticket_number').first()
-    
-    if last_ticket:
-        # استخراج الرقم التسلسلي
-        last_number = int(last_ticket.ticket_number.split('-')[-1])
-        new_number = last_number + 1
-    else:
-        new_number = 1
-    
-    # تنسيق الرقم (4 أرقام)
-    ticket_number = f'{prefix}{new_number:04d}'
-    
-    return ticket_number
+    return reserve_ticket_numbers(1)[0]
 
 
 # ============================================================================
@@ -268,7 +306,7 @@ def calculate_agent_kpi(agent, date=None):
 # 5. DELAY DETECTION
 # ============================================================================
 
-def check_ticket_delay(ticket):
+def check_ticket_delay(ticket, delay_threshold=None):
     """
     فحص ما إذا كانت التذكرة متأخرة (حسب الإجابة س11: 3 دقائق)
 
@@ -276,6 +314,7 @@ def check_ticket_delay(ticket):
 
     Args:
         ticket: Ticket object
+        delay_threshold: حد التأخير بالدقائق (افتراضياً من SystemSettings)
 
     Returns:
         bool: True إذا كانت متأخرة
@@ -290,9 +329,10 @@ def check_ticket_delay(ticket):
         return False
 
     # ✅ استخدام delay_threshold من SystemSettings
-    from .models import SystemSettings
-    system_settings = SystemSettings.get_settings()
-    delay_threshold = system_settings.delay_threshold_minutes
+    if delay_threshold is None:
+        from .models import SystemSettings
+        system_settings = SystemSettings.get_settings()
+        delay_threshold = system_settings.delay_threshold_minutes
     
     time_since_customer_message = timezone.now() - ticket.last_customer_message_at
 
@@ -302,16 +342,17 @@ def check_ticket_delay(ticket):
     return False
 
 
-def update_ticket_delay_status(ticket):
+def update_ticket_delay_status(ticket, delay_threshold=None):
     """
     تحديث حالة التأخير للتذكرة
     
     Args:
         ticket: Ticket object
+        delay_threshold: حد التأخير بالدقائق (افتراضياً من SystemSettings)
     """
-    from .models import TicketStateLog
+    from .models import TicketStateLog, AgentDelayEvent
     
-    is_delayed = check_ticket_delay(ticket)
+    is_delayed = check_ticket_delay(ticket, delay_threshold=delay_threshold)
     
     if is_delayed and not ticket.is_delayed:
         # التذكرة أصبحت متأخرة
@@ -328,18 +369,34 @@ def update_ticket_delay_status(ticket):
             new_state='delayed',
             reason='تأخر الرد لأكثر من 3 دقائق'
         )
+        
+        # تسجيل حدث التأخير للموظف
+        if ticket.assigned_agent_id:
+            AgentDelayEvent.objects.create(
+                ticket=ticket,
+                agent_id=ticket.assigned_agent_id,
+                delay_start_time=ticket.delay_started_at,
+                reason='تأخر الرد على رسالة العميل'
+            )
     
     elif not is_delayed and ticket.is_delayed:
         # التذكرة لم تعد متأخرة (الموظف رد)
+        now = timezone.now()
         if ticket.delay_started_at:
             # حساب مدة التأخير
-            delay_duration = timezone.now() - ticket.delay_started_at
+            delay_duration = now - ticket.delay_started_at
             ticket.total_delay_minutes += int(delay_duration.total_seconds() / 60)
         
         ticket.is_delayed = False
         ticket.delay_started_at = None
         ticket.save()
         
+        # إغلاق حدث التأخير المفتوح
+        for delay_event in AgentDelayEvent.objects.filter(ticket=ticket, delay_end_time__isnull=True):
+            delay_event.delay_end_time = now
+            delay_event.delay_duration_seconds = int((now - delay_event.delay_start_time).total_seconds())
+            delay_event.save(update_fields=['delay_end_time', 'delay_duration_seconds'])
+        
         # تسجيل تغيير الحالة
         TicketStateLog.objects.create(
             ticket=ticket,
@@ -350,6 +407,147 @@ def update_ticket_delay_status(ticket):
         )
 
 
+# ✅ الحد الأقصى للاستعلامات لكل مزامنة بدون SAVEPOINT مهما كان عدد التذاكر (يتحقق منه test_delay_reconcile.py)
+# متأخرة: select + update + TicketStateLog + AgentDelayEvent
+# لم تعد متأخرة: select + bulk_update + select للأحداث المفتوحة + bulk_update + TicketStateLog
+QUERIES_PER_DELAY_RECONCILE = 9
+
+
+def reconcile_ticket_delays(ticket_ids=None, delay_threshold=None):
+    """
+    مزامنة حالة التأخير لكل التذاكر المفتوحة دفعة واحدة (Set-based)
+
+    بدلاً من المرور على التذاكر واحدة تلو الأخرى (save + refresh_from_db +
+    TicketStateLog لكل تذكرة)، يتم تحديد التذاكر التي أصبحت متأخرة أو لم تعد
+    متأخرة باستعلامات مُرشَّحة، ثم تحديثها بـ update()/bulk_update() وإنشاء
+    سجلات TicketStateLog و AgentDelayEvent بـ bulk_create.
+
+    - تصبح التذكرة متأخرة: آخر رسالة من العميل أقدم من حد التأخير ولم يرد الموظف بعدها
+    - لا تعود متأخرة: رد الموظف بعد آخر رسالة للعميل
+
+    Args:
+        ticket_ids: تقييد المزامنة على تذاكر معينة (افتراضياً كل التذاكر المفتوحة)
+        delay_threshold: حد التأخير بالدقائق (افتراضياً من SystemSettings)
+
+    Returns:
+        dict: newly_delayed, no_longer_delayed
+    """
+    from .models import Ticket, TicketStateLog, AgentDelayEvent, SystemSettings
+    from django.db import transaction
+    from django.db.models import F, Q
+
+    if delay_threshold is None:
+        delay_threshold = SystemSettings.get_settings().delay_threshold_minutes
+
+    now = timezone.now()
+    cutoff = now - timedelta(minutes=delay_threshold)
+
+    open_tickets = Ticket.objects.filter(status='open')
+    if ticket_ids is not None:
+        open_tickets = open_tickets.filter(id__in=list(ticket_ids))
+
+    awaiting_reply = Q(last_customer_message_at__isnull=False) & (
+        Q(last_agent_message_at__isnull=True) |
+        Q(last_agent_message_at__lte=F('last_customer_message_at'))
+    )
+    agent_replied = (
+        Q(last_customer_message_at__isnull=True) |
+        Q(last_agent_message_at__gt=F('last_customer_message_at'))
+    )
+
+    with transaction.atomic():
+        # 1) التذاكر التي أصبحت متأخرة
+        delayed_rows = list(
+            open_tickets.filter(
+                awaiting_reply,
+                is_delayed=False,
+                last_customer_message_at__lt=cutoff
+            ).select_for_update().values_list('id', 'status', 'assigned_agent_id')
+        )
+
+        if delayed_rows:
+            Ticket.objects.filter(
+                id__in=[row[0] for row in delayed_rows],
+                is_delayed=False
+            ).update(
+                is_delayed=True,
+                delay_started_at=now,
+                delay_count=F('delay_count') + 1
+            )
+
+            TicketStateLog.objects.bulk_create([
+                TicketStateLog(
+                    ticket_id=ticket_id,
+                    changed_by=None,  # تلقائي
+                    old_state=ticket_status,
+                    new_state='delayed',
+                    reason='تأخر الرد لأكثر من 3 دقائق'
+                )
+                for ticket_id, ticket_status, _ in delayed_rows
+            ], batch_size=500)
+
+            AgentDelayEvent.objects.bulk_create([
+                AgentDelayEvent(
+                    ticket_id=ticket_id,
+                    agent_id=agent_id,
+                    delay_start_time=now,
+                    reason='تأخر الرد على رسالة العميل'
+                )
+                for ticket_id, _, agent_id in delayed_rows
+                if agent_id
+            ], batch_size=500)
+
+        # 2) التذاكر التي لم تعد متأخرة (الموظف رد)
+        undelayed_tickets = list(
+            open_tickets.filter(agent_replied, is_delayed=True)
+            .select_for_update()
+            .only('id', 'status', 'delay_started_at', 'total_delay_minutes')
+        )
+
+        if undelayed_tickets:
+            for ticket in undelayed_tickets:
+                if ticket.delay_started_at:
+                    delay_duration = now - ticket.delay_started_at
+                    ticket.total_delay_minutes += int(delay_duration.total_seconds() / 60)
+                ticket.is_delayed = False
+                ticket.delay_started_at = None
+
+            Ticket.objects.bulk_update(
+                undelayed_tickets,
+                ['is_delayed', 'delay_started_at', 'total_delay_minutes'],
+                batch_size=500
+            )
+
+            open_events = list(AgentDelayEvent.objects.filter(
+                ticket_id__in=[ticket.id for ticket in undelayed_tickets],
+                delay_end_time__isnull=True
+            ))
+            for delay_event in open_events:
+                delay_event.delay_end_time = now
+                delay_event.delay_duration_seconds = int((now - delay_event.delay_start_time).total_seconds())
+            AgentDelayEvent.objects.bulk_update(
+                open_events,
+                ['delay_end_time', 'delay_duration_seconds'],
+                batch_size=500
+            )
+
+            TicketStateLog.objects.bulk_create([
+                TicketStateLog(
+                    ticket_id=ticket.id,
+                    changed_by=None,  # تلقائي
+                    old_state='delayed',
+                    new_state=ticket.status,
+                    reason='الموظف رد على الرسالة'
+                )
+                for ticket in undelayed_tickets
+            ], batch_size=500)
+
+    return {
+        'newly_delayed': len(delayed_rows),
+        'no_longer_delayed': len(undelayed_tickets),
+    }
+
+
 # ============================================================================
 # 6. AUTO-ASSIGNMENT ALGORITHM
 # ============================================================================
@@ -372,12 +570,10 @@ def get_available_agent():
         status='available',
         is_on_break=False,  # ✅ استبعاد الموظفين في استراحة
         current_active_tickets__lt=F('max_capacity')
-    ).order_by('current_active_tickets')
+    ).select_related('user').order_by('current_active_tickets')
 
-    if available_agents.exists():
-        return available_agents.first()
-
-    return None
+    # ✅ استعلام واحد بدلاً من exists() + first()
+    return available_agents.first()
 
 
 def assign_ticket_to_agent(ticket, agent):
@@ -410,18 +606,19 @@ def send_welcome_message(customer, ticket=None):
     """
     إرسال رسالة ترحيب مع قائمة منسدلة للعميل الجديد
     
+    ✅ عبر قائمة الانتظار (مسار ردود النظام): الرسالة تُحفظ الآن والعامل يرسلها
+       مع Rate Limit و retry، بدون انتظار المزود في مسار الـ webhook
+    
     Args:
         customer: كائن العميل
         ticket: التذكرة المرتبطة (اختياري)
     
     Returns:
-        bool: True إذا تم الإرسال بنجاح، False خلاف ذلك
+        bool: True إذا تمت إضافة الرسالة لقائمة الانتظار، False خلاف ذلك
     """
     try:
-        from .whatsapp_driver import get_whatsapp_driver
         from .message_queue import get_message_queue
         from .models import Message, Ticket
-        from django.utils import timezone
         import logging
         
         logger = logging.getLogger(__name__)
@@ -442,47 +639,33 @@ def send_welcome_message(customer, ticket=None):
             logger.warning(f"No active ticket found for customer {customer.phone_number} to save welcome message")
             return False
         
-        # ✅ التحقق من عدم إرسال رسالة ترحيب مكررة
-        existing_welcome = Message.objects.filter(
-            ticket=ticket,
-            sender_type='agent',
-            message_text__contains='مرحباً بك في صيدليات خليفة'
-        ).first()
+        # ✅ التحقق من عدم إرسال رسالة ترحيب مكررة: new → welcomed (compare-and-set)
+        claimed = Ticket.objects.filter(
+            id=ticket.id,
+            conversation_state=Ticket.CONVERSATION_NEW
+        ).update(conversation_state=Ticket.CONVERSATION_WELCOMED)
         
-        if existing_welcome:
+        if not claimed:
             logger.info(f"Welcome message already sent for ticket {ticket.ticket_number} - skipping")
             return True  # نرجع True لأن الرسالة موجودة بالفعل
         
-        # الحصول على driver
-        driver = get_whatsapp_driver()
+        ticket.conversation_state = Ticket.CONVERSATION_WELCOMED
         
-        # إرسال الرسالة عبر النظام
-        result = driver.send_text_message(
-            phone=customer.wa_id,
-            message=welcome_text
+        # إضافة الرسالة لقائمة الانتظار (بدون تحديث last_agent_message_at لأنها رسالة ترحيب تلقائية)
+        result = get_message_queue().enqueue(
+            ticket_id=ticket.id,
+            user=ticket.assigned_agent.user if ticket.assigned_agent else None,
+            message_text=welcome_text,
+            priority=Message.PRIORITY_SYSTEM,
+            auto_reply=True
         )
         
-        # حفظ الرسالة في قاعدة البيانات إذا تم الإرسال بنجاح
         if result.get('success', False):
-            welcome_message = Message.objects.create(
-                ticket=ticket,
-                sender=ticket.assigned_agent.user if ticket.assigned_agent else None,
-                sender_type='agent',
-                direction='outgoing',
-                message_text=welcome_text,
-                message_type='text',
-                delivery_status='sent',
-                created_at=timezone.now()
-            )
-            
-            # تحديث آخر رسالة في التذكرة (بدون تحديث last_agent_message_at لأنها رسالة ترحيب تلقائية)
-            ticket.last_message_at = timezone.now()
-            ticket.save(update_fields=['last_message_at'])
-            
-            logger.info(f"Welcome message sent and saved to database - Customer: {customer.phone_number}, Message ID: {welcome_message.id}")
+            logger.info(f"Welcome message queued - Customer: {customer.phone_number}, Message ID: {result['message_id']}")
             return True
         else:
-            logger.warning(f"Welcome message sending failed for {customer.phone_number}: {result}")
+            logger.warning(f"Welcome message queueing failed for {customer.phone_number}: {result}")
+            _release_welcome(ticket)
             return False
         
     except Exception as e:
@@ -490,35 +673,64 @@ def send_welcome_message(customer, ticket=None):
         return False
 
 
-def handle_menu_selection(customer, message_text, ticket):
+def _release_welcome(ticket):
+    """
+    إرجاع التذكرة إلى new عند فشل إرسال الترحيب (ما لم يصنفها العميل في الأثناء)
+    """
+    from .models import Ticket
+    
+    Ticket.objects.filter(
+        id=ticket.id,
+        conversation_state=Ticket.CONVERSATION_WELCOMED
+    ).update(conversation_state=Ticket.CONVERSATION_NEW)
+    ticket.conversation_state = Ticket.CONVERSATION_NEW
+
+
+def handle_menu_selection(customer, message_text, ticket, menu_category=None):
     """
     معالجة اختيار العميل من القائمة المنسدلة
     
+    ✅ رسالة الرد تُضاف لقائمة الانتظار (مسار ردود النظام) ولا تُرسل هنا
+    ✅ الاختيار من AutoReplyEngine (نص عربي موحّد: 'شكوي' = 'شكوى'، '١' = '1')
+    
     Args:
         customer: كائن العميل
         message_text: نص الرسالة
         ticket: التذكرة الحالية
+        menu_category: نتيجة مطابقة سابقة لنفس الرسالة (اختياري، لتجنب مطابقة ثانية)
     
     Returns:
         dict: نتيجة المعالجة مع رسالة الرد
     """
     try:
-        from .whatsapp_driver import get_whatsapp_driver
+        from .auto_reply import get_auto_reply_engine
+        from .message_queue import get_message_queue
+        from .models import Message, Ticket
         import logging
         
         logger = logging.getLogger(__name__)
-        driver = get_whatsapp_driver()
+        
+        # ✅ التذكرة مصنفة بالفعل: لا شيء (من حالة المحادثة بدون استعلام)
+        if ticket.conversation_state == Ticket.CONVERSATION_CLASSIFIED:
+            return {
+                'success': False,
+                'message': 'already_classified',
+                'response_text': None
+            }
         
         # تنظيف النص واستخراج الرقم
         selection = message_text.strip()
+        if menu_category is None:
+            menu_category = get_auto_reply_engine().match_menu(message_text)
         
         # معالجة الاختيارات
-        if selection in ['1', '١', 'شكوى', 'شكوي', 'استفسار']:
+        if menu_category == 'complaint':
             # شكوى أو استفسار
             ticket.category = 'complaint'
             ticket.priority = 'high'
             ticket.category_selected_at = timezone.now()  # ✅ تسجيل وقت اختيار الفئة
-            ticket.save(update_fields=['category', 'priority', 'category_selected_at'])
+            ticket.conversation_state = Ticket.CONVERSATION_CLASSIFIED
+            ticket.save(update_fields=['category', 'priority', 'category_selected_at', 'conversation_state'])
             logger.info(f"✅ Ticket {ticket.ticket_number} category updated to 'complaint' for customer {customer.phone_number}")
 
             response_text = """✅ تم تسجيل طلبك كشكوى/استفسار
@@ -528,12 +740,13 @@ def handle_menu_selection(customer, message_text, ticket):
 
 يرجى وصف مشكلتك بالتفصيل ليتمكن فريقنا من مساعدتك بأفضل شكل ممكن 📝"""
 
-        elif selection in ['2', '٢', 'ادوية', 'أدوية', 'دواء']:
+        elif menu_category == 'medicine_order':
             # طلب أدوية
             ticket.category = 'medicine_order'
             ticket.priority = 'medium'
             ticket.category_selected_at = timezone.now()  # ✅ تسجيل وقت اختيار الفئة
-            ticket.save(update_fields=['category', 'priority', 'category_selected_at'])
+            ticket.conversation_state = Ticket.CONVERSATION_CLASSIFIED
+            ticket.save(update_fields=['category', 'priority', 'category_selected_at', 'conversation_state'])
             logger.info(f"✅ Ticket {ticket.ticket_number} category updated to 'medicine_order' for customer {customer.phone_number}")
 
             response_text = """💊 تم تسجيل طلبك لطلب أدوية
@@ -545,12 +758,13 @@ def handle_menu_selection(customer, message_text, ticket):
 
 🚚 خدمة التوصيل متوفرة خلال ساعة واحدة داخل النطاق المحدد"""
 
-        elif selection in ['3', '٣', 'متابعة', 'متابعه', 'طلب سابق']:
+        elif menu_category == 'follow_up':
             # متابعة طلب سابق
             ticket.category = 'follow_up'
             ticket.priority = 'low'
             ticket.category_selected_at = timezone.now()  # ✅ تسجيل وقت اختيار الفئة
-            ticket.save(update_fields=['category', 'priority', 'category_selected_at'])
+            ticket.conversation_state = Ticket.CONVERSATION_CLASSIFIED
+            ticket.save(update_fields=['category', 'priority', 'category_selected_at', 'conversation_state'])
             logger.info(f"✅ Ticket {ticket.ticket_number} category updated to 'follow_up' for customer {customer.phone_number}")
             
             response_text = """📋 تم تسجيل طلبك لمتابعة طلب سابق
@@ -577,32 +791,19 @@ def handle_menu_selection(customer, message_text, ticket):
                 'response_text': response_text
             }
         
-        # إرسال رسالة الرد
-        result = driver.send_text_message(
-            phone=customer.wa_id,
-            message=response_text
+        # إضافة رسالة الرد لقائمة الانتظار (بدون تحديث last_agent_message_at لأنها رسالة قائمة تلقائية)
+        queued = get_message_queue().enqueue(
+            ticket_id=ticket.id,
+            user=ticket.assigned_agent.user if ticket.assigned_agent else None,
+            message_text=response_text,
+            priority=Message.PRIORITY_SYSTEM,
+            auto_reply=True
         )
         
-        # حفظ رسالة الرد في قاعدة البيانات إذا تم الإرسال بنجاح
-        if result.get('success', False):
-            from .models import Message
-            
-            response_message = Message.objects.create(
-                ticket=ticket,
-                sender=ticket.assigned_agent.user if ticket.assigned_agent else None,
-                sender_type='agent',
-                direction='outgoing',
-                message_text=response_text,
-                message_type='text',
-                delivery_status='sent',
-                created_at=timezone.now()
-            )
-            
-            # تحديث آخر رسالة في التذكرة (بدون تحديث last_agent_message_at لأنها رسالة قائمة تلقائية)
-            ticket.last_message_at = timezone.now()
-            ticket.save(update_fields=['last_message_at'])
-            
-            logger.info(f"Menu selection response saved to database - Message ID: {response_message.id}")
+        if queued.get('success', False):
+            logger.info(f"Menu selection response queued - Message ID: {queued['message_id']}")
+        else:
+            logger.warning(f"Menu selection response for {customer.phone_number} not queued: {queued.get('error')}")
         
         logger.info(f"Menu selection processed for {customer.phone_number}: {selection}")
         
@@ -611,7 +812,8 @@ def handle_menu_selection(customer, message_text, ticket):
             'message': f'selection_processed_{selection}',
             'response_text': response_text,
             'category': ticket.category,
-            'priority': ticket.priority
+            'priority': ticket.priority,
+            'message_id': queued.get('message_id')
         }
         
     except Exception as e:
@@ -636,29 +838,20 @@ def should_send_welcome_message(customer, message_text, current_ticket=None):
         bool: True إذا كان يجب إرسال رسالة الترحيب
     """
     import logging
-    from .models import Message
+    from .models import Ticket
     logger = logging.getLogger(__name__)
     
     try:
-        # ✅ إذا كان لدينا التذكرة الحالية، نتحقق من حالتها
+        # ✅ إذا كان لدينا التذكرة الحالية، نقرر من حالة المحادثة وعداد رسائل العميل (بدون استعلام)
         if current_ticket:
-            logger.info(f"Checking ticket {current_ticket.ticket_number}: category={current_ticket.category}, category_selected_at={current_ticket.category_selected_at}")
+            logger.info(f"Checking ticket {current_ticket.ticket_number}: conversation_state={current_ticket.conversation_state}, customer_messages_count={current_ticket.customer_messages_count}")
             
-            # إذا كانت التذكرة مصنفة بالفعل، لا نرسل رسالة ترحيب
-            if current_ticket.category_selected_at is not None:
-                logger.info(f"Ticket {current_ticket.ticket_number} already classified - skipping welcome message")
+            if current_ticket.conversation_state != Ticket.CONVERSATION_NEW:
+                logger.info(f"Ticket {current_ticket.ticket_number} already {current_ticket.conversation_state} - skipping welcome message")
                 return False
             
-            # ✅ التحقق من عدد رسائل العميل في التذكرة الحالية
-            customer_messages_count = Message.objects.filter(
-                ticket=current_ticket, 
-                sender_type='customer'
-            ).count()
-            
-            logger.info(f"Customer {customer.phone_number} has {customer_messages_count} message(s) in ticket {current_ticket.ticket_number}")
-            
             # ✅ إذا كانت أول رسالة، نرسل رسالة ترحيب (بغض النظر عن محتوى الرسالة)
-            if customer_messages_count == 1:
+            if current_ticket.customer_messages_count == 1:
                 logger.info(f"First message from customer - sending welcome message")
                 return True
             else:
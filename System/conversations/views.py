@@ -1746,12 +1746,6 @@ def conversations_list_api(request):
             'error': 'الموظف غير موجود'
         }, status=status.HTTP_404_NOT_FOUND)
     
-    from .utils import update_ticket_delay_status
-    
-    all_open_tickets = Ticket.objects.filter(status='open')
-    for ticket in all_open_tickets:
-        update_ticket_delay_status(ticket)
-    
     # الحصول على التذاكر المفتوحة المعينة لهذا الموظف فقط
     all_tickets = Ticket.objects.filter(
         current_agent=agent,
@@ -2046,12 +2040,6 @@ def all_conversations_api(request):
     - offset: نقطة البداية (افتراضي: 0)
     """
     try:
-        from .utils import update_ticket_delay_status
-        
-        all_open_tickets = Ticket.objects.filter(status='open')
-        for ticket in all_open_tickets:
-            update_ticket_delay_status(ticket)
-        
         # المعاملات
         search_query = request.GET.get('search', '').strip()
         status_filter = request.GET.get('status', '')
@@ -0,0 +1,134 @@
+# conversations/views_broadcast.py
+"""
+Broadcast Campaign Views
+إدارة حملات الإرسال الجماعي (الإرسال الفعلي يتم في: python manage.py send_broadcasts)
+"""
+
+import logging
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.response import Response
+from rest_framework import status
+
+from .models import BroadcastCampaign
+from .permissions import IsAdmin
+from .broadcast import get_broadcast_engine
+
+logger = logging.getLogger(__name__)
+
+
+@api_view(['GET', 'POST'])
+@permission_classes([IsAdmin])
+def broadcast_campaigns(request):
+    """
+    عرض الحملات أو إنشاء حملة جديدة (draft)
+
+    GET /api/broadcasts/
+    POST /api/broadcasts/
+
+    Body:
+    {
+        "name": "عرض الشتاء",
+        "message_type": "text",          # text / image / document / video / template
+        "message_text": "...",
+        "media_url": "...",              # للميديا
+        "template_name": "winter_offer", # للـ template (Elmujib)
+        "template_language": "ar",
+        "template_params": {},
+        "audience_filter": {"customer_types": ["vip"], "tags": ["diabetes"], "exclude_tags": ["no_promotions"]}
+    }
+    """
+    engine = get_broadcast_engine()
+
+    if request.method == 'GET':
+        campaigns = BroadcastCampaign.objects.order_by('-created_at')[:50]
+        return Response({
+            'success': True,
+            'campaigns': [engine.get_progress(campaign) for campaign in campaigns]
+        })
+
+    name = request.data.get('name')
+    if not name:
+        return Response({
+            'success': False,
+            'error': 'name is required'
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        result = engine.create_campaign(
+            name=name,
+            message_text=request.data.get('message_text'),
+            audience_filter=request.data.get('audience_filter') or {},
+            message_type=request.data.get('message_type', 'text'),
+            media_url=request.data.get('media_url'),
+            template_name=request.data.get('template_name'),
+            template_language=request.data.get('template_language', 'ar'),
+            template_params=request.data.get('template_params'),
+            user=request.user
+        )
+    except Exception as e:
+        logger.error(f"Error creating broadcast campaign: {str(e)}", exc_info=True)
+        return Response({
+            'success': False,
+            'error': str(e)
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    return Response(
+        result,
+        status=status.HTTP_201_CREATED if result['success'] else status.HTTP_400_BAD_REQUEST
+    )
+
+
+@api_view(['GET'])
+@permission_classes([IsAdmin])
+def broadcast_campaign_progress(request, campaign_id):
+    """
+    تقدم الحملة وعدادات التوصيل
+
+    GET /api/broadcasts/<campaign_id>/
+    """
+    campaign = BroadcastCampaign.objects.filter(id=campaign_id).first()
+    if not campaign:
+        return Response({
+            'success': False,
+            'error': 'Campaign not found'
+        }, status=status.HTTP_404_NOT_FOUND)
+
+    return Response({
+        'success': True,
+        'campaign': get_broadcast_engine().get_progress(campaign)
+    })
+
+
+@api_view(['POST'])
+@permission_classes([IsAdmin])
+def broadcast_campaign_action(request, campaign_id, action):
+    """
+    بدء / استئناف / إيقاف مؤقت / إلغاء حملة
+
+    POST /api/broadcasts/<campaign_id>/launch/
+    POST /api/broadcasts/<campaign_id>/pause/
+    POST /api/broadcasts/<campaign_id>/cancel/
+    """
+    engine = get_broadcast_engine()
+    handlers = {
+        'launch': engine.launch,
+        'pause': engine.pause,
+        'cancel': engine.cancel,
+    }
+
+    if action not in handlers:
+        return Response({
+            'success': False,
+            'error': f'Unknown action: {action}'
+        }, status=status.HTTP_404_NOT_FOUND)
+
+    try:
+        result = handlers[action](campaign_id)
+    except Exception as e:
+        logger.error(f"Error running broadcast action {action} on campaign {campaign_id}: {str(e)}", exc_info=True)
+        return Response({
+            'success': False,
+            'error': str(e)
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    return Response(result, status=status.HTTP_200_OK if result['success'] else status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,179 @@
+# conversations/views_dead_letters.py
+"""
+Dead Letter Queue Views
+فحص الرسائل الفاشلة نهائياً وإعادة إرسالها انتقائياً أو حذفها
+"""
+
+import logging
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.response import Response
+from rest_framework import status
+
+from .models import DeadLetterMessage
+from .permissions import IsAdmin
+from .message_queue import get_message_queue
+
+logger = logging.getLogger(__name__)
+
+MAX_PAGE_SIZE = 200
+
+
+def _serialize_dead_letter(dead_letter: DeadLetterMessage):
+    message = dead_letter.message
+    customer = message.ticket.customer
+
+    return {
+        'id': dead_letter.id,
+        'message_id': message.id,
+        'ticket_id': message.ticket_id,
+        'ticket_number': message.ticket.ticket_number,
+        'customer': {
+            'id': customer.id,
+            'name': customer.name,
+            'phone_number': customer.phone_number,
+        },
+        'message_type': message.message_type,
+        'message_text': message.message_text,
+        'priority': message.priority,
+        'provider': dead_letter.provider,
+        'failure_reason': dead_letter.failure_reason,
+        'provider_response': dead_letter.provider_response,
+        'attempts': dead_letter.attempts,
+        'retry_count': dead_letter.retry_count,
+        'is_retryable': dead_letter.is_retryable,
+        'created_at': dead_letter.created_at.isoformat(),
+    }
+
+
+def _int_list(value):
+    if value is None:
+        return None
+    if not isinstance(value, list):
+        raise ValueError('ids must be a list')
+    return [int(item) for item in value]
+
+
+@api_view(['GET'])
+@permission_classes([IsAdmin])
+def dead_letters_list(request):
+    """
+    عرض الرسائل الفاشلة نهائياً (الأحدث أولاً)
+
+    GET /api/whatsapp/dead-letters/?limit=50&offset=0&provider=elmujib_cloud&retryable=true
+    """
+    try:
+        limit = min(max(int(request.GET.get('limit', 50)), 1), MAX_PAGE_SIZE)
+        offset = max(int(request.GET.get('offset', 0)), 0)
+    except ValueError:
+        return Response({
+            'success': False,
+            'error': 'limit and offset must be integers'
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    dead_letters = DeadLetterMessage.objects.all()
+
+    provider = request.GET.get('provider')
+    if provider:
+        dead_letters = dead_letters.filter(provider=provider)
+
+    retryable = request.GET.get('retryable')
+    if retryable in ('true', 'false'):
+        dead_letters = dead_letters.filter(is_retryable=retryable == 'true')
+
+    total_count = dead_letters.count()
+    page = dead_letters.select_related(
+        'message__ticket__customer'
+    ).order_by('-created_at', '-id')[offset:offset + limit]
+
+    return Response({
+        'success': True,
+        'dead_letters': [_serialize_dead_letter(dead_letter) for dead_letter in page],
+        'pagination': {
+            'total': total_count,
+            'limit': limit,
+            'offset': offset,
+            'has_more': offset + limit < total_count,
+            'next_offset': offset + limit if offset + limit < total_count else None
+        }
+    })
+
+
+@api_view(['POST'])
+@permission_classes([IsAdmin])
+def dead_letters_requeue(request):
+    """
+    إعادة رسائل إلى قائمة الانتظار
+
+    POST /api/whatsapp/dead-letters/requeue/
+
+    Body:
+    {
+        "ids": [1, 2, 3],   # أو "hours": 24
+        "force": false      # إعادة حتى غير القابلة لإعادة المحاولة (@lid)
+    }
+    """
+    try:
+        ids = _int_list(request.data.get('ids'))
+        hours = request.data.get('hours')
+        hours = int(hours) if hours is not None else None
+    except (TypeError, ValueError) as e:
+        return Response({'success': False, 'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    if ids is None and hours is None:
+        return Response({
+            'success': False,
+            'error': 'ids or hours is required'
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        result = get_message_queue().requeue_dead_letters(
+            ids=ids,
+            hours=hours,
+            force=bool(request.data.get('force', False))
+        )
+    except Exception as e:
+        logger.error(f"Error requeuing dead letters: {str(e)}", exc_info=True)
+        return Response({
+            'success': False,
+            'error': str(e)
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    return Response(result)
+
+
+@api_view(['POST'])
+@permission_classes([IsAdmin])
+def dead_letters_purge(request):
+    """
+    حذف سجلات من Dead Letter Queue (الرسائل تبقى failed في المحادثات)
+
+    POST /api/whatsapp/dead-letters/purge/
+
+    Body:
+    {
+        "ids": [1, 2, 3]    # أو "older_than_days": 30
+    }
+    """
+    try:
+        ids = _int_list(request.data.get('ids'))
+        older_than_days = request.data.get('older_than_days')
+        older_than_days = int(older_than_days) if older_than_days is not None else None
+    except (TypeError, ValueError) as e:
+        return Response({'success': False, 'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    if ids is None and older_than_days is None:
+        return Response({
+            'success': False,
+            'error': 'ids or older_than_days is required'
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        result = get_message_queue().purge_dead_letters(ids=ids, older_than_days=older_than_days)
+    except Exception as e:
+        logger.error(f"Error purging dead letters: {str(e)}", exc_info=True)
+        return Response({
+            'success': False,
+            'error': str(e)
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    return Response(result)
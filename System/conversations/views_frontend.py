@@ -191,10 +191,7 @@ def admin_dashboard(request):
         messages.error(request, 'ليس لديك صلاحية للوصول لهذه الصفحة')
         return redirect('agent-conversations')
     
-    from .utils import update_ticket_delay_status
-    
-    for ticket in Ticket.objects.filter(status='open'):
-        update_ticket_delay_status(ticket)
+    # ✅ is_delayed يُحدَّث بواسطة DelayScheduler (run_delay_tracker.py) - قراءة فقط هنا
     
     # إحصائيات
     open_tickets = Ticket.objects.filter(status='open').count()
@@ -294,13 +291,9 @@ def admin_tickets(request):
         messages.error(request, 'ليس لديك صلاحية للوصول لهذه الصفحة')
         return redirect('agent-conversations')
     
-    from .utils import update_ticket_delay_status
     from django.utils import timezone
     from datetime import datetime, time
     
-    for ticket in Ticket.objects.filter(status='open'):
-        update_ticket_delay_status(ticket)
-    
     tickets = Ticket.objects.select_related('customer', 'assigned_agent__user').prefetch_related('transfers').order_by('-created_at')
 
     # تحديد بداية ونهاية اليوم الحالي
@@ -651,10 +644,6 @@ def agent_conversations(request):
     
     agent = Agent.objects.get(user=request.user)
     
-    from .utils import check_ticket_delay, update_ticket_delay_status
-    import logging
-    logger = logging.getLogger(__name__)
-    
     # الحصول على التذاكر المفتوحة المعينة لهذا الموظف فقط (current_agent للتحويلات)
     all_tickets = Ticket.objects.filter(
         current_agent=agent,
@@ -664,14 +653,6 @@ def agent_conversations(request):
     # تجميع التذاكر حسب العميل
     customers_map = {}
     for ticket in all_tickets:
-        # تحديث وحفظ حالة التأخير
-        is_delayed_now = check_ticket_delay(ticket)
-        logger.info(f"Ticket #{ticket.id}: last_customer_msg={ticket.last_customer_message_at}, last_agent_msg={ticket.last_agent_message_at}, is_delayed={is_delayed_now}")
-        
-        update_ticket_delay_status(ticket)
-        # إعادة تحميل من الـ database للحصول على القيمة المحدثة
-        ticket.refresh_from_db()
-        
         customer_id = ticket.customer.id
         if customer_id not in customers_map:
             # حساب عدد الرسائل غير المقروءة من العميل
@@ -692,8 +673,8 @@ def agent_conversations(request):
                 'unread_count': unread_count
             }
         customers_map[customer_id]['tickets'].append(ticket)
-        # استخدام check_ticket_delay للتأكد من الحالة الحالية
-        if check_ticket_delay(ticket):
+        # ✅ حالة التأخير المخزنة (يحدثها DelayScheduler)
+        if ticket.is_delayed:
             customers_map[customer_id]['has_delayed'] = True
         # التحقق من التحويل
         if ticket.assigned_agent and ticket.current_agent and ticket.assigned_agent != ticket.current_agent:
@@ -10,14 +10,16 @@ from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from django.utils import timezone
-from django.db.models import Q
+from django.db.models import Q, F
 from django.conf import settings
 from django.core.files.storage import default_storage
+from django.db import transaction
 
 from .models import *
 from .serializers import *
 from .permissions import *
 from .utils import *
+from .queue_wakeup import notify_message_queue
 
 
 # ============================================================================
@@ -125,40 +127,81 @@ class MessageViewSet(viewsets.ModelViewSet):
             
             kwargs['message_type'] = message_type
             
-            message = serializer.save(**kwargs)
-            logger.info(f"Message created: {message.id} - Type: {message.message_type}")
+            # ✅ رسالة الموظف تُحفظ pending وتُرسل عبر MessageQueue (لا اتصال بالمزود داخل الـ request)
+            if kwargs['sender_type'] == 'agent':
+                kwargs['delivery_status'] = 'pending'
+                kwargs['priority'] = Message.PRIORITY_INTERACTIVE
+            
+            with transaction.atomic():
+                message = serializer.save(**kwargs)
+                logger.info(f"Message created: {message.id} - Type: {message.message_type}")
+                
+                self._update_ticket_and_index(message)
+                
+                # ✅ إيقاظ عامل قائمة الانتظار فور الـ commit
+                if message.direction == 'outgoing' and message.delivery_status == 'pending':
+                    transaction.on_commit(notify_message_queue)
             
         except Exception as e:
             logger.error(f"Error in perform_create: {str(e)}", exc_info=True)
             raise
 
-        # تحديث آخر رسالة في التذكرة
+        # تسجيل النشاط
+        try:
+            user = self.request.user
+            if user and user.is_authenticated:
+                log_activity(
+                    user=user,
+                    action='send_message',
+                    entity_type='message',
+                    entity_id=message.id,
+                    request=self.request
+                )
+        except:
+            pass
+
+        # ✅ KPI الموظف يُحدّث من signal الرسالة (update_kpi_on_message_save)
+    
+    def _update_ticket_and_index(self, message):
+        """
+        تحديث آخر رسالة في التذكرة وإنشاء فهرس البحث
+        """
         ticket = message.ticket
-        ticket.last_message_at = timezone.now()
-        ticket.messages_count += 1
+        now = timezone.now()
+        ticket.last_message_at = now
+        ticket.updated_at = now
+        update_fields = ['last_message_at', 'updated_at']
 
         if message.sender_type == 'customer':
-            ticket.last_customer_message_at = timezone.now()
+            ticket.last_customer_message_at = now
+            update_fields.append('last_customer_message_at')
 
             # فحص التأخير
             update_ticket_delay_status(ticket)
 
         elif message.sender_type == 'agent':
-            ticket.last_agent_message_at = timezone.now()
+            ticket.last_agent_message_at = now
+            update_fields.append('last_agent_message_at')
 
             # حساب وقت الاستجابة (إذا كانت أول رسالة من الموظف)
             if not ticket.first_response_at:
-                ticket.first_response_at = timezone.now()
+                ticket.first_response_at = now
+                update_fields.append('first_response_at')
 
                 if ticket.created_at:
-                    response_time = timezone.now() - ticket.created_at
+                    response_time = now - ticket.created_at
                     ticket.response_time_seconds = int(response_time.total_seconds())
+                    update_fields.append('response_time_seconds')
 
             # إلغاء حالة التأخير
             if ticket.is_delayed:
                 update_ticket_delay_status(ticket)
 
-        ticket.save()
+        # ✅ UPDATE مباشر: عدادات التذكرة التي تحسبها signals (التذاكر النشطة / KPI) لا تتغير برسالة جديدة
+        Ticket.objects.filter(id=ticket.id).update(
+            messages_count=F('messages_count') + 1,
+            **{field: getattr(ticket, field) for field in update_fields}
+        )
 
         # إنشاء فهرس البحث
         if message.message_text:
@@ -167,85 +210,27 @@ class MessageViewSet(viewsets.ModelViewSet):
                 customer=ticket.customer,
                 search_text=message.message_text
             )
-        
-        # تسجيل النشاط
+    
+    @action(detail=False, methods=['get'])
+    def delivery_status(self, request):
+        """
+        حالة توصيل عدة رسائل (polling بعد الإرسال)
+        GET /api/messages/delivery_status/?ids=1,2,3
+        """
         try:
-            user = self.request.user
-            if user and user.is_authenticated:
-                log_activity(
-                    user=user,
-                    action='send_message',
-                    entity_type='message',
-                    entity_id=message.id,
-                    request=self.request
-                )
-        except:
-            pass
-
-        # إرسال الرسالة إلى WhatsApp (للرسائل الصادرة من الموظف)
-        if message.sender_type == 'agent' and message.direction == 'outgoing':
-            try:
-                from .whatsapp_driver import get_whatsapp_driver
-                driver = get_whatsapp_driver()
-                
-                # تحضير رقم الهاتف
-                customer = ticket.customer
-                phone_to_use = customer.wa_id if customer.wa_id else customer.phone_number
-                
-                logger.info(f"Sending to WhatsApp - Phone: {phone_to_use}, Type: {message.message_type}")
-                
-                if message.message_type == 'text' and message.message_text:
-                    # إرسال رسالة نصية
-                    result = driver.send_text_message(
-                        phone=phone_to_use,
-                        message=message.message_text
-                    )
-                
-                elif message.message_type == 'image' and message.media_url:
-                    # إرسال صورة
-                    # تحويل media_url إلى URL كامل إذا لزم الأمر
-                    media_url = message.media_url
-                    if not media_url.startswith('http'):
-                        # إذا كانت مسارات نسبية، تحويلها إلى URL مطلقة
-                        domain = getattr(settings, 'WHATSAPP_MEDIA_DOMAIN', 'http://localhost:8000')
-                        # تنظيف الـ domain والـ path وبناء URL صحيح
-                        domain = domain.rstrip('/')
-                        path = media_url.lstrip('/')
-                        media_url = f"{domain}/{path}"
-                    
-                    logger.info(f"Sending image to WhatsApp - URL: {media_url}")
-                    logger.info(f"Message text (caption): {message.message_text}")
-                    
-                    result = driver.send_media_message(
-                        phone=phone_to_use,
-                        media_url=media_url,
-                        media_type='image',
-                        caption=message.message_text if message.message_text else None
-                    )
-                
-                else:
-                    result = None
-                
-                # حفظ معرّف رسالة WhatsApp إذا نجح الإرسال
-                if result and result.get('success'):
-                    message.whatsapp_message_id = result.get('message_id')
-                    message.delivery_status = 'sent'
-                    message.save(update_fields=['whatsapp_message_id', 'delivery_status'])
-                    logger.info(f"Message sent to WhatsApp successfully: {result.get('message_id')}")
-                else:
-                    logger.warning(f"Failed to send to WhatsApp: {result}")
-                    
-            except Exception as e:
-                logger.error(f"Error sending message to WhatsApp: {str(e)}", exc_info=True)
-                # لا نرفع الخطأ هنا حتى لا نفشل في حفظ الرسالة
+            ids = [int(value) for value in request.query_params.get('ids', '').split(',') if value.strip()]
+        except ValueError:
+            return Response({
+                'error': 'ids يجب أن تكون أرقاماً'
+            }, status=status.HTTP_400_BAD_REQUEST)
         
-        # تحديث KPI للموظف تلقائياً (عند إرسال رسالة من الموظف)
-        if message.sender_type == 'agent' and ticket.assigned_agent:
-            try:
-                from .utils import calculate_agent_kpi
-                calculate_agent_kpi(ticket.assigned_agent)
-            except:
-                pass
+        statuses = Message.objects.filter(id__in=ids[:200]).values(
+            'id', 'delivery_status', 'whatsapp_message_id', 'error_message', 'sent_at'
+        )
+        
+        return Response({
+            'messages': list(statuses)
+        })
     
     @action(detail=True, methods=['post'])
     def mark_read(self, request, pk=None):
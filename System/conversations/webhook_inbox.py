@@ -0,0 +1,459 @@
+"""
+Webhook Inbox
+صندوق وارد الـ Webhooks مع عامل معالجة في الخلفية
+
+Features:
+✅ الـ webhook يتحقق ويحفظ البيانات الخام ويرجع 200 فوراً (لا انتظار لمزود WhatsApp)
+✅ معالجة على دفعات مع الحفاظ على ترتيب رسائل كل عميل
+✅ حجز السجلات (claim) بشكل آمن لعدة عمال مع استرجاع سجلات العامل المتوقف
+✅ إعادة المحاولة عند الفشل حتى MAX_ATTEMPTS بتأخير متزايد (Backoff + Jitter)
+✅ webhooks حالات التوصيل فقط (statuses) في الدفعة تُطبق معاً (delivery_receipts)
+✅ webhook الـ Cloud API الذي يحمل رسائل عدة عملاء يُقسم إلى سجل لكل عميل
+
+Usage:
+    entries = store_webhook('wppconnect', data)  # داخل الـ view
+    inbox = get_webhook_inbox()
+    inbox.process_batch()                      # داخل العامل
+"""
+
+import logging
+import random
+import uuid
+from datetime import timedelta
+from typing import Dict, Any, List, Optional, Tuple
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import WebhookInbox
+from .delivery_receipts import apply_delivery_receipts, get_receipt_parser, has_incoming_messages
+
+logger = logging.getLogger(__name__)
+
+
+def get_customer_key(provider: str, data: Dict[str, Any]) -> Optional[str]:
+    """
+    استخراج مفتاح العميل من البيانات الخام (لترتيب رسائل نفس العميل)
+
+    Args:
+        provider: wppconnect / cloud_api / elmujib_cloud
+        data: البيانات الخام
+
+    Returns:
+        wa_id أو رقم الهاتف (أو None)
+    """
+    if provider == 'wppconnect':
+        key = data.get('chat_id') or data.get('phone')
+
+    elif provider == 'cloud_api':
+        # أول مرسل (store_webhook يقسم الـ webhook متعدد المرسلين قبل ذلك)
+        key = None
+        for entry in data.get('entry', []):
+            for change in entry.get('changes', []):
+                for message in change.get('value', {}).get('messages', []):
+                    key = message.get('from')
+                    break
+                if key:
+                    break
+            if key:
+                break
+
+    else:
+        sender_info = data.get('sender') or {}
+        key = (
+            data.get('from')
+            or data.get('phone')
+            or sender_info.get('wa_id')
+            or sender_info.get('phone')
+            or sender_info.get('phone_number')
+        )
+
+    return _normalize_customer_key(key)
+
+
+def _normalize_customer_key(key) -> Optional[str]:
+    if not key:
+        return None
+
+    return str(key).split('@')[0][:100]
+
+
+def _cloud_api_subset(data: Dict[str, Any], parts: Dict[Tuple[int, int], Dict[str, list]]) -> Dict[str, Any]:
+    """
+    نسخة من webhook الـ Cloud API تحتوي على أجزاء محددة فقط
+
+    Args:
+        parts: {(entry_index, change_index): {'messages': [...], 'contacts': [...]} أو {'statuses': [...]}}
+    """
+    entries = []
+    for entry_index, entry in enumerate(data.get('entry', [])):
+        changes = []
+        for change_index, change in enumerate(entry.get('changes', [])):
+            if (entry_index, change_index) not in parts:
+                continue
+            value = {
+                key: item for key, item in change.get('value', {}).items()
+                if key not in ('messages', 'contacts', 'statuses')
+            }
+            value.update(parts[(entry_index, change_index)])
+            changes.append(dict(change, value=value))
+        if changes:
+            entries.append(dict(entry, changes=changes))
+
+    return dict(data, entry=entries)
+
+
+def split_cloud_api_payload(data: Dict[str, Any]) -> List[Tuple[Optional[str], Dict[str, Any]]]:
+    """
+    تقسيم webhook الـ Cloud API حسب المرسل
+
+    webhook واحد قد يحمل رسائل عدة عملاء؛ تخزينه بمفتاح أول مرسل فقط يجعل رسائل
+    الباقين خارج ترتيب العميل (claim_batch) ويربط فشلهم بإعادة محاولة عميل آخر.
+
+    ✅ سجل لكل مرسل (رسائله + بيانات جهة الاتصال الخاصة به فقط)
+    ✅ حالات التوصيل (statuses) في سجل مستقل بدون مفتاح عميل (تُجمع مع دفعة حالات التوصيل)
+
+    Returns:
+        [(customer_key, payload), ...] بترتيب أول رسالة لكل مرسل
+    """
+    senders = {}  # customer_key → {(entry_index, change_index): {'messages', 'contacts'}}
+    statuses = {}
+
+    for entry_index, entry in enumerate(data.get('entry', [])):
+        for change_index, change in enumerate(entry.get('changes', [])):
+            value = change.get('value', {})
+            for message in value.get('messages', []):
+                part = senders.setdefault(_normalize_customer_key(message.get('from')), {}).setdefault(
+                    (entry_index, change_index), {'messages': [], 'contacts': []}
+                )
+                part['messages'].append(message)
+                part['contacts'].extend(
+                    contact for contact in value.get('contacts', [])
+                    if contact.get('wa_id') == message.get('from') and contact not in part['contacts']
+                )
+            if value.get('statuses'):
+                statuses[(entry_index, change_index)] = {'statuses': value['statuses']}
+
+    if len(senders) + (1 if statuses else 0) <= 1:
+        return [(get_customer_key('cloud_api', data), data)]
+
+    split = [(customer_key, _cloud_api_subset(data, parts)) for customer_key, parts in senders.items()]
+    if statuses:
+        split.append((None, _cloud_api_subset(data, statuses)))
+
+    return split
+
+
+def store_webhook(provider: str, data: Dict[str, Any]) -> List[WebhookInbox]:
+    """
+    حفظ البيانات الخام في صندوق الوارد (استعلام INSERT واحد)
+
+    ✅ Cloud API: سجل لكل مرسل (split_cloud_api_payload)
+
+    Args:
+        provider: wppconnect / cloud_api / elmujib_cloud
+        data: البيانات الخام
+
+    Returns:
+        قائمة WebhookInbox entries
+    """
+    if provider == 'cloud_api':
+        parts = split_cloud_api_payload(data)
+    else:
+        parts = [(get_customer_key(provider, data), data)]
+
+    return WebhookInbox.objects.bulk_create([
+        WebhookInbox(provider=provider, payload=payload, customer_key=customer_key)
+        for customer_key, payload in parts
+    ])
+
+
+class WebhookInboxProcessor:
+    """
+    عامل معالجة صندوق الوارد
+
+    Usage:
+        inbox = WebhookInboxProcessor()
+        inbox.process_batch(batch_size=50)
+    """
+
+    BATCH_SIZE = 50  # عدد السجلات لكل دفعة
+    MAX_ATTEMPTS = 5  # أقصى عدد للمحاولات قبل اعتبار السجل فاشلاً
+    CLAIM_TIMEOUT_SECONDS = 300  # بعدها يُعاد السجل المحجوز لعامل متوقف إلى pending
+    RETRY_DELAY_SECONDS = [5, 30, 120, 600]  # تأخير بين المحاولات (5s, 30s, 2min, 10min)
+    RETRY_JITTER = 0.2  # ±20% عشوائية على التأخير حتى لا تُعاد السجلات الفاشلة معاً
+
+    def __init__(self):
+        self.worker_id = uuid.uuid4().hex
+
+    def _get_handler(self, provider: str):
+        from .ingestion import (
+            process_wppconnect_payload,
+            process_cloud_api_payload,
+            process_elmujib_payload,
+        )
+
+        return {
+            'wppconnect': process_wppconnect_payload,
+            'cloud_api': process_cloud_api_payload,
+            'elmujib_cloud': process_elmujib_payload,
+        }[provider]
+
+    def release_stale_claims(self) -> int:
+        """
+        إعادة السجلات المحجوزة من عامل متوقف إلى pending
+        """
+        cutoff = timezone.now() - timedelta(seconds=self.CLAIM_TIMEOUT_SECONDS)
+
+        released = WebhookInbox.objects.filter(
+            status='processing',
+            claimed_at__lt=cutoff
+        ).update(status='pending', claimed_by=None, claimed_at=None)
+
+        if released:
+            logger.warning(f"Released {released} stale webhook inbox claim(s)")
+
+        return released
+
+    def claim_batch(self, batch_size: Optional[int] = None):
+        """
+        حجز دفعة من السجلات المعلقة
+
+        ✅ يتم تخطي العملاء الذين لديهم سجل قيد المعالجة لدى عامل آخر
+        ✅ فقط السجلات المستحقة (next_attempt_at)؛ عميل لديه سجل ينتظر إعادة المحاولة
+           تنتظر سجلاته التالية أيضاً (حتى ينجح أو يصل MAX_ATTEMPTS فيصبح failed)
+        ✅ الحجز compare-and-set (status='pending') لمنع المعالجة المزدوجة
+
+        Returns:
+            قائمة السجلات المحجوزة مرتبة حسب id
+        """
+        batch_size = batch_size or self.BATCH_SIZE
+        now = timezone.now()
+
+        busy_customers = WebhookInbox.objects.filter(
+            status='processing',
+            customer_key__isnull=False
+        ).values('customer_key')
+
+        backoff_customers = WebhookInbox.objects.filter(
+            status='pending',
+            next_attempt_at__gt=now,
+            customer_key__isnull=False
+        ).values('customer_key')
+
+        candidate_ids = list(
+            WebhookInbox.objects.filter(status='pending')
+            .filter(Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now))
+            .exclude(customer_key__in=busy_customers)
+            .exclude(customer_key__in=backoff_customers)
+            .order_by('id')
+            .values_list('id', flat=True)[:batch_size]
+        )
+
+        if not candidate_ids:
+            return []
+
+        WebhookInbox.objects.filter(
+            id__in=candidate_ids,
+            status='pending'
+        ).update(
+            status='processing',
+            claimed_by=self.worker_id,
+            claimed_at=now
+        )
+
+        claimed = list(
+            WebhookInbox.objects.filter(
+                id__in=candidate_ids,
+                status='processing',
+                claimed_by=self.worker_id
+            ).order_by('id')
+        )
+
+        # ✅ عامل آخر حجز رسائل أقدم لنفس العميل بالتزامن → نتركها له
+        claimed_keys = {entry.customer_key for entry in claimed if entry.customer_key}
+        other_min_ids = {}
+        if claimed_keys:
+            for customer_key, entry_id in WebhookInbox.objects.filter(
+                status='processing',
+                customer_key__in=claimed_keys
+            ).exclude(claimed_by=self.worker_id).values_list('customer_key', 'id'):
+                other_min_ids[customer_key] = min(entry_id, other_min_ids.get(customer_key, entry_id))
+
+        contested_ids = [
+            entry.id for entry in claimed
+            if entry.customer_key in other_min_ids and other_min_ids[entry.customer_key] < entry.id
+        ]
+        if contested_ids:
+            WebhookInbox.objects.filter(id__in=contested_ids).update(
+                status='pending', claimed_by=None, claimed_at=None
+            )
+
+        return [entry for entry in claimed if entry.id not in contested_ids]
+
+    def process_entry(self, entry: WebhookInbox) -> Dict[str, Any]:
+        """
+        معالجة سجل واحد داخل transaction
+        """
+        handler = self._get_handler(entry.provider)
+
+        with transaction.atomic():
+            result = handler(entry.payload)
+            WebhookInbox.objects.filter(id=entry.id).update(
+                status='processed',
+                attempts=entry.attempts + 1,
+                error_message=None,
+                processed_at=timezone.now()
+            )
+
+        return result
+
+    def process_receipt_entries(self, entries) -> Dict[str, Any]:
+        """
+        معالجة سجلات حالات التوصيل معاً داخل transaction واحدة
+
+        ✅ استعلام واحد للرسائل لكل الحالات في الدفعة بدلاً من دفعة لكل webhook
+        """
+        receipts = []
+        for entry in entries:
+            receipts.extend(get_receipt_parser(entry.provider)(entry.payload))
+
+        with transaction.atomic():
+            result = apply_delivery_receipts(receipts)
+            WebhookInbox.objects.filter(id__in=[entry.id for entry in entries]).update(
+                status='processed',
+                attempts=F('attempts') + 1,
+                error_message=None,
+                processed_at=timezone.now()
+            )
+
+        return result
+
+    def _next_attempt_at(self, attempts: int):
+        delay_seconds = self.RETRY_DELAY_SECONDS[min(attempts - 1, len(self.RETRY_DELAY_SECONDS) - 1)]
+        delay_seconds *= random.uniform(1 - self.RETRY_JITTER, 1 + self.RETRY_JITTER)
+
+        return timezone.now() + timedelta(seconds=delay_seconds)
+
+    def _mark_failed(self, entry: WebhookInbox, error: Exception) -> None:
+        attempts = entry.attempts + 1
+        final = attempts >= self.MAX_ATTEMPTS
+        WebhookInbox.objects.filter(id=entry.id).update(
+            status='failed' if final else 'pending',
+            attempts=attempts,
+            error_message=str(error),
+            next_attempt_at=None if final else self._next_attempt_at(attempts),
+            claimed_by=None,
+            claimed_at=None
+        )
+
+    def process_batch(self, batch_size: Optional[int] = None) -> Dict[str, Any]:
+        """
+        معالجة دفعة من صندوق الوارد
+
+        Returns:
+            Dict مع إحصائيات المعالجة
+        """
+        self.release_stale_claims()
+        entries = self.claim_batch(batch_size)
+        claimed_count = len(entries)
+
+        processed_count = 0
+        failed_count = 0
+        failed_customers = set()
+
+        # ✅ حالات التوصيل فقط (بدون رسائل واردة) → دفعة واحدة؛ لا تحتاج ترتيب العميل
+        receipt_entries = [
+            entry for entry in entries
+            if get_receipt_parser(entry.provider) and not has_incoming_messages(entry.provider, entry.payload)
+        ]
+        if receipt_entries:
+            receipt_ids = {entry.id for entry in receipt_entries}
+            entries = [entry for entry in entries if entry.id not in receipt_ids]
+
+            try:
+                self.process_receipt_entries(receipt_entries)
+                processed_count += len(receipt_entries)
+
+            except Exception as e:
+                logger.error(f"Error processing delivery receipts batch: {str(e)}", exc_info=True)
+                for entry in receipt_entries:
+                    self._mark_failed(entry, e)
+                failed_count += len(receipt_entries)
+
+        for entry in entries:
+            # ✅ الحفاظ على الترتيب: إذا فشلت رسالة لعميل، تنتظر رسائله التالية
+            if entry.customer_key and entry.customer_key in failed_customers:
+                WebhookInbox.objects.filter(id=entry.id).update(
+                    status='pending', claimed_by=None, claimed_at=None
+                )
+                continue
+
+            try:
+                self.process_entry(entry)
+                processed_count += 1
+
+            except Exception as e:
+                logger.error(f"Error processing webhook inbox entry {entry.id}: {str(e)}", exc_info=True)
+
+                self._mark_failed(entry, e)
+                failed_count += 1
+                if entry.customer_key:
+                    failed_customers.add(entry.customer_key)
+
+        if claimed_count:
+            logger.info(f"[INBOX] Processed: {processed_count} ok, {failed_count} failed")
+
+        return {
+            'success': True,
+            'processed': processed_count,
+            'failed': failed_count,
+            'claimed': claimed_count
+        }
+
+    def get_inbox_stats(self) -> Dict[str, Any]:
+        """
+        إحصائيات صندوق الوارد
+        """
+        from django.db.models import Count, Q
+
+        return WebhookInbox.objects.aggregate(
+            total=Count('id'),
+            pending=Count('id', filter=Q(status='pending')),
+            processing=Count('id', filter=Q(status='processing')),
+            processed=Count('id', filter=Q(status='processed')),
+            failed=Count('id', filter=Q(status='failed'))
+        )
+
+    def purge_processed(self, days: int = 7) -> int:
+        """
+        حذف السجلات المعالجة الأقدم من X أيام
+        """
+        cutoff = timezone.now() - timedelta(days=days)
+        deleted, _ = WebhookInbox.objects.filter(
+            status='processed',
+            processed_at__lt=cutoff
+        ).delete()
+        return deleted
+
+
+# ============================================
+# Singleton Instance
+# ============================================
+
+_webhook_inbox_instance = None
+
+def get_webhook_inbox() -> WebhookInboxProcessor:
+    """
+    الحصول على WebhookInboxProcessor Singleton Instance
+
+    Returns:
+        WebhookInboxProcessor instance
+    """
+    global _webhook_inbox_instance
+
+    if _webhook_inbox_instance is None:
+        _webhook_inbox_instance = WebhookInboxProcessor()
+
+    return _webhook_inbox_instance
@@ -3,14 +3,28 @@ WhatsApp Driver Pattern
 نمط Driver للتعامل مع مزودي WhatsApp المختلفين
 
 يسمح بالتبديل بين WPPConnect و Cloud API بدون تغيير الكود التجاري
+
+✅ Driver واحد لكل مزود في العملية (get_whatsapp_driver)
+✅ كل Driver يملك requests.Session مع Connection Pooling و Keep-Alive
+✅ إعادة المحاولة على مستوى الاتصال + timeout لكل طلب
+✅ reset_whatsapp_drivers() عند تغيير الإعدادات
+✅ Circuit Breaker لكل Driver + Failover اختياري لمزود احتياطي (WHATSAPP_FAILOVER_DRIVER)
 """
 
 import requests
 import logging
+import threading
+from functools import partial
 from abc import ABC, abstractmethod
 from typing import Dict, Any, Optional
 from dataclasses import dataclass
 from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .circuit_breaker import CircuitBreaker, CircuitBreakerSession
 
 logger = logging.getLogger(__name__)
 
@@ -28,6 +42,8 @@ class IncomingMessage:
     media_url: Optional[str] = None  # رابط الميديا (إن وجد)
     mime_type: Optional[str] = None  # نوع الملف
     raw_data: Optional[Dict[str, Any]] = None  # البيانات الخام
+    chat_id: Optional[str] = None    # الـ chatId الكامل (مع @c.us أو @lid) - يُستخدم كـ wa_id
+    real_phone: Optional[str] = None  # الرقم الحقيقي (إذا كان @lid)
 
 
 @dataclass
@@ -50,9 +66,65 @@ class MessageDriver(ABC):
     - get_qr_code()
     """
     
+    DEFAULT_POOL_SIZE = 10  # أقصى عدد اتصالات مفتوحة لكل host
+    DEFAULT_CONNECT_TIMEOUT = 5  # ثواني لفتح الاتصال
+    DEFAULT_TRANSPORT_RETRIES = 2  # إعادة محاولة أخطاء الاتصال
+    
     def __init__(self, config: Dict[str, Any]):
         self.config = config
         self.provider_name = "base"
+        self.timeout = config.get('timeout', 30)
+        self.request_timeout = (config.get('connect_timeout', self.DEFAULT_CONNECT_TIMEOUT), self.timeout)
+        self.breaker = CircuitBreaker(
+            type(self).__name__,
+            failure_threshold=config.get('circuit_failure_threshold'),
+            reset_timeout=config.get('circuit_reset_timeout')
+        )
+        self.session = self._build_session()
+    
+    def _build_session(self) -> requests.Session:
+        """
+        إنشاء Session مع Connection Pool
+        
+        ✅ Keep-Alive: لا TCP/TLS handshake جديد لكل رسالة
+        ✅ أخطاء الاتصال (قبل إرسال الطلب) يعاد محاولتها لكل الطلبات
+        ✅ أخطاء القراءة و 502/503/504 يعاد محاولتها لطلبات GET فقط (POST قد يكرر الرسالة)
+        ✅ طلبات الإرسال تمر على Circuit Breaker (رفض فوري عندما يكون المزود متوقفاً)
+        """
+        retries = self.config.get('transport_retries', self.DEFAULT_TRANSPORT_RETRIES)
+        pool_size = self.config.get('pool_size', self.DEFAULT_POOL_SIZE)
+        
+        adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=Retry(
+                total=retries,
+                connect=retries,
+                read=retries,
+                status=retries,
+                backoff_factor=0.3,
+                status_forcelist=(502, 503, 504),
+                allowed_methods=frozenset(['GET']),
+                raise_on_status=False
+            )
+        )
+        
+        session = CircuitBreakerSession(self.breaker)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+    
+    def close(self) -> None:
+        """إغلاق اتصالات الـ Session"""
+        self.session.close()
+    
+    def circuit_retry_at(self):
+        """أقرب وقت يُسمح فيه بالإرسال (None = متاح الآن)"""
+        return self.breaker.retry_at()
+    
+    def get_circuit_state(self) -> Dict[str, Any]:
+        """حالة Circuit Breaker للمزود"""
+        return dict(self.breaker.get_state(), provider=self.provider_name)
     
     @abstractmethod
     def send_text_message(self, phone: str, message: str) -> Dict[str, Any]:
@@ -100,7 +172,6 @@ class WPPConnectDriver(MessageDriver):
         self.provider_name = "wppconnect"
         self.base_url = config.get('base_url', 'http://localhost:3000')
         self.api_key = config.get('api_key', '')
-        self.timeout = config.get('timeout', 30)
     
     def _get_headers(self) -> Dict[str, str]:
         """الحصول على Headers للـ API"""
@@ -140,11 +211,12 @@ class WPPConnectDriver(MessageDriver):
 
             logger.info(f"Sending message to {phone_to_send} via WPPConnect")
             
-            response = requests.post(
+            response = self.session.post(
                 url,
                 json=payload,
                 headers=self._get_headers(),
-                timeout=self.timeout
+                timeout=self.request_timeout,
+                circuit=True
             )
             
             response.raise_for_status()
@@ -220,11 +292,12 @@ class WPPConnectDriver(MessageDriver):
 
             logger.info(f"Sending {media_type} to {phone_to_send} - URL: {media_url}")
             
-            response = requests.post(
+            response = self.session.post(
                 url,
                 json=payload,
                 headers=self._get_headers(),
-                timeout=self.timeout
+                timeout=self.request_timeout,
+                circuit=True
             )
             
             response.raise_for_status()
@@ -272,10 +345,10 @@ class WPPConnectDriver(MessageDriver):
         try:
             url = f"{self.base_url}/api/status"
             
-            response = requests.get(
+            response = self.session.get(
                 url,
                 headers=self._get_headers(),
-                timeout=self.timeout
+                timeout=self.request_timeout
             )
             
             response.raise_for_status()
@@ -309,10 +382,10 @@ class WPPConnectDriver(MessageDriver):
         try:
             url = f"{self.base_url}/api/qr-code"
             
-            response = requests.get(
+            response = self.session.get(
                 url,
                 headers=self._get_headers(),
-                timeout=self.timeout
+                timeout=self.request_timeout
             )
             
             response.raise_for_status()
@@ -396,11 +469,12 @@ class CloudAPIDriver(MessageDriver):
             
             logger.info(f"Sending text message to {phone} via Cloud API")
             
-            response = requests.post(
+            response = self.session.post(
                 url,
                 json=payload,
                 headers=self._get_headers(),
-                timeout=30
+                timeout=self.request_timeout,
+                circuit=True
             )
             
             response.raise_for_status()
@@ -499,11 +573,12 @@ class CloudAPIDriver(MessageDriver):
             
             logger.info(f"Sending {cloud_type} to {phone} via Cloud API - URL: {media_url}")
             
-            response = requests.post(
+            response = self.session.post(
                 url,
                 json=payload,
                 headers=self._get_headers(),
-                timeout=30
+                timeout=self.request_timeout,
+                circuit=True
             )
             
             response.raise_for_status()
@@ -563,10 +638,10 @@ class CloudAPIDriver(MessageDriver):
         try:
             url = f"{self.base_url}/{self.phone_number_id}"
             
-            response = requests.get(
+            response = self.session.get(
                 url,
                 headers=self._get_headers(),
-                timeout=30
+                timeout=self.request_timeout
             )
             
             response.raise_for_status()
@@ -634,7 +709,6 @@ class ElmujibCloudAPIDriver(MessageDriver):
         self.vendor_uid = config.get('vendor_uid', '')
         self.bearer_token = config.get('bearer_token', '')
         self.from_phone_number_id = config.get('from_phone_number_id', '')
-        self.timeout = config.get('timeout', 30)
         self.auth_method = config.get('auth_method', 'header')
         
         if not self.vendor_uid or not self.bearer_token:
@@ -685,11 +759,12 @@ class ElmujibCloudAPIDriver(MessageDriver):
             
             logger.info(f"Sending text message to {phone} via Elmujib Cloud API (auth: {self.auth_method})")
             
-            response = requests.post(
+            response = self.session.post(
                 url,
                 json=payload,
                 headers=self._get_headers(),
-                timeout=self.timeout
+                timeout=self.request_timeout,
+                circuit=True
             )
             
             response.raise_for_status()
@@ -774,11 +849,12 @@ class ElmujibCloudAPIDriver(MessageDriver):
             
             logger.info(f"Sending {media_type} to {phone} via Elmujib Cloud API - URL: {media_url}")
             
-            response = requests.post(
+            response = self.session.post(
                 url,
                 json=payload,
                 headers=self._get_headers(),
-                timeout=self.timeout
+                timeout=self.request_timeout,
+                circuit=True
             )
             
             response.raise_for_status()
@@ -861,11 +937,12 @@ class ElmujibCloudAPIDriver(MessageDriver):
             
             logger.info(f"Sending template '{template_name}' to {phone} via Elmujib Cloud API")
             
-            response = requests.post(
+            response = self.session.post(
                 url,
                 json=payload,
                 headers=self._get_headers(),
-                timeout=self.timeout
+                timeout=self.request_timeout,
+                circuit=True
             )
             
             response.raise_for_status()
@@ -924,11 +1001,12 @@ class ElmujibCloudAPIDriver(MessageDriver):
             
             logger.info(f"Sending interactive message to {phone} via Elmujib Cloud API")
             
-            response = requests.post(
+            response = self.session.post(
                 url,
                 json=payload,
                 headers=self._get_headers(),
-                timeout=self.timeout
+                timeout=self.request_timeout,
+                circuit=True
             )
             
             response.raise_for_status()
@@ -976,11 +1054,11 @@ class ElmujibCloudAPIDriver(MessageDriver):
             
             logger.info(f"Creating contact via Elmujib Cloud API")
             
-            response = requests.post(
+            response = self.session.post(
                 url,
                 json=contact_data,
                 headers=self._get_headers(),
-                timeout=self.timeout
+                timeout=self.request_timeout
             )
             
             response.raise_for_status()
@@ -1028,11 +1106,11 @@ class ElmujibCloudAPIDriver(MessageDriver):
             
             logger.info(f"Updating contact {phone} via Elmujib Cloud API")
             
-            response = requests.post(
+            response = self.session.post(
                 url,
                 json=contact_data,
                 headers=self._get_headers(),
-                timeout=self.timeout
+                timeout=self.request_timeout
             )
             
             response.raise_for_status()
@@ -1080,11 +1158,11 @@ class ElmujibCloudAPIDriver(MessageDriver):
             
             logger.info(f"Getting contact {phone_or_email} via Elmujib Cloud API")
             
-            response = requests.get(
+            response = self.session.get(
                 url,
                 params=params,
                 headers=self._get_headers(),
-                timeout=self.timeout
+                timeout=self.request_timeout
             )
             
             response.raise_for_status()
@@ -1163,27 +1241,117 @@ class ElmujibCloudAPIDriver(MessageDriver):
         }
 
 
+# ============================================
+# Failover
+# ============================================
+
+class FailoverDriver:
+    """
+    Driver أساسي + Driver احتياطي
+
+    ✅ الإرسال عبر الأساسي طالما دائرته مغلقة
+    ✅ عند فتح دائرة الأساسي → الإرسال عبر الاحتياطي (قائمة الانتظار تستمر في التفريغ)
+    ✅ عودة تلقائية للأساسي بعد نجاح الطلب التجريبي (half_open)
+    ✅ لا إعادة إرسال لنفس الرسالة عبر الاحتياطي بعد timeout (قد تكون وصلت)؛
+       قائمة الانتظار تعيد المحاولة لاحقاً
+    ✅ حسابات LID (@lid) لا تنتقل للاحتياطي: المعرف ليس رقم هاتف ويعمل مع WPPConnect فقط
+    """
+
+    def __init__(self, primary: MessageDriver, secondary: MessageDriver):
+        self.primary = primary
+        self.secondary = secondary
+
+    @property
+    def drivers(self):
+        return [self.primary, self.secondary]
+
+    def _active_driver(self, method_name: Optional[str] = None) -> MessageDriver:
+        candidates = [
+            driver for driver in self.drivers
+            if method_name is None or callable(getattr(driver, method_name, None))
+        ]
+        for driver in candidates:
+            if driver.circuit_retry_at() is None:
+                return driver
+
+        # كل الدوائر مفتوحة → الأساسي (يرفض فوراً بدون اتصال)
+        return candidates[0]
+
+    @property
+    def provider_name(self) -> str:
+        return self._active_driver().provider_name
+
+    def _route(self, method_name: str, phone: str, *args, **kwargs) -> Dict[str, Any]:
+        driver = self._active_driver(method_name)
+
+        if driver is not self.primary and phone.endswith('@lid') and driver.provider_name != 'wppconnect':
+            # ✅ لا تحويل LID إلى رقم وهمي؛ الأساسي يرفض فوراً وقائمة الانتظار تعيد المحاولة
+            logger.warning(f"↪️  Failover skipped for LID recipient ({self.primary.provider_name} circuit open)")
+            driver = self.primary
+
+        if driver is not self.primary:
+            logger.warning(f"↪️  Failover: sending via {driver.provider_name} ({self.primary.provider_name} circuit open)")
+            # chatId الخاص بـ WPPConnect (201...@c.us) → رقم فقط للمزودات الأخرى
+            if driver.provider_name != 'wppconnect' and '@' in phone:
+                phone = phone.split('@')[0]
+
+        return getattr(driver, method_name)(phone, *args, **kwargs)
+
+    def __getattr__(self, name: str):
+        if name.startswith('send_'):
+            if not any(callable(getattr(driver, name, None)) for driver in self.drivers):
+                raise AttributeError(name)
+            return partial(self._route, name)
+
+        return getattr(self.primary, name)
+
+    def circuit_retry_at(self):
+        retry_times = [driver.circuit_retry_at() for driver in self.drivers]
+        if None in retry_times:
+            return None
+        return min(retry_times)
+
+    def get_circuit_state(self) -> Dict[str, Any]:
+        return dict(
+            self.primary.get_circuit_state(),
+            active_provider=self.provider_name,
+            failover=self.secondary.get_circuit_state()
+        )
+
+    def close(self) -> None:
+        """الـ drivers الفعلية تُغلق من reset_whatsapp_drivers"""
+        pass
+
+
 # ============================================
 # Driver Factory
 # ============================================
 
-def get_whatsapp_driver() -> MessageDriver:
+_driver_instances: Dict[str, MessageDriver] = {}
+_driver_lock = threading.Lock()
+
+# الإعدادات التي تستوجب إعادة إنشاء الـ drivers عند تغييرها
+DRIVER_SETTING_PREFIXES = ('WHATSAPP_', 'WPPCONNECT_', 'ELMUJIB_')
+
+
+def _build_whatsapp_driver(driver_type: str) -> MessageDriver:
     """
-    الحصول على WhatsApp Driver المناسب
-    
-    يقرأ من settings.py:
-    WHATSAPP_DRIVER = 'wppconnect'  # أو 'cloud_api' أو 'elmujib_cloud'
-    
-    Returns:
-        MessageDriver instance
+    إنشاء Driver جديد حسب نوع المزود من settings.py
     """
-    driver_type = getattr(settings, 'WHATSAPP_DRIVER', 'wppconnect')
+    http_config = {
+        'pool_size': getattr(settings, 'WHATSAPP_HTTP_POOL_SIZE', MessageDriver.DEFAULT_POOL_SIZE),
+        'connect_timeout': getattr(settings, 'WHATSAPP_HTTP_CONNECT_TIMEOUT', MessageDriver.DEFAULT_CONNECT_TIMEOUT),
+        'transport_retries': getattr(settings, 'WHATSAPP_HTTP_RETRIES', MessageDriver.DEFAULT_TRANSPORT_RETRIES),
+        'circuit_failure_threshold': getattr(settings, 'WHATSAPP_CIRCUIT_FAILURE_THRESHOLD', CircuitBreaker.DEFAULT_FAILURE_THRESHOLD),
+        'circuit_reset_timeout': getattr(settings, 'WHATSAPP_CIRCUIT_RESET_SECONDS', CircuitBreaker.DEFAULT_RESET_TIMEOUT),
+    }
     
     if driver_type == 'wppconnect':
         config = {
             'base_url': getattr(settings, 'WPPCONNECT_BASE_URL', 'http://localhost:3000'),
             'api_key': getattr(settings, 'WPPCONNECT_API_KEY', 'your-secret-api-key'),
-            'timeout': getattr(settings, 'WPPCONNECT_TIMEOUT', 30)
+            'timeout': getattr(settings, 'WPPCONNECT_TIMEOUT', 30),
+            **http_config
         }
         return WPPConnectDriver(config)
     
@@ -1191,7 +1359,8 @@ def get_whatsapp_driver() -> MessageDriver:
         config = {
             'access_token': getattr(settings, 'WHATSAPP_CLOUD_ACCESS_TOKEN', ''),
             'phone_number_id': getattr(settings, 'WHATSAPP_CLOUD_PHONE_NUMBER_ID', ''),
-            'business_account_id': getattr(settings, 'WHATSAPP_CLOUD_BUSINESS_ACCOUNT_ID', '')
+            'business_account_id': getattr(settings, 'WHATSAPP_CLOUD_BUSINESS_ACCOUNT_ID', ''),
+            **http_config
         }
         return CloudAPIDriver(config)
     
@@ -1202,9 +1371,74 @@ def get_whatsapp_driver() -> MessageDriver:
             'bearer_token': getattr(settings, 'ELMUJIB_BEARER_TOKEN', ''),
             'from_phone_number_id': getattr(settings, 'ELMUJIB_FROM_PHONE_NUMBER_ID', ''),
             'auth_method': getattr(settings, 'ELMUJIB_AUTH_METHOD', 'header'),
-            'timeout': getattr(settings, 'ELMUJIB_TIMEOUT', 30)
+            'timeout': getattr(settings, 'ELMUJIB_TIMEOUT', 30),
+            **http_config
         }
         return ElmujibCloudAPIDriver(config)
     
     else:
         raise ValueError(f"Unknown WhatsApp driver: {driver_type}")
+
+
+def _get_cached_driver(driver_type: str) -> MessageDriver:
+    driver = _driver_instances.get(driver_type)
+    if driver is None:
+        with _driver_lock:
+            driver = _driver_instances.get(driver_type)
+            if driver is None:
+                driver = _build_whatsapp_driver(driver_type)
+                _driver_instances[driver_type] = driver
+    
+    return driver
+
+
+def get_whatsapp_driver() -> MessageDriver:
+    """
+    الحصول على WhatsApp Driver المناسب
+    
+    يقرأ من settings.py:
+    WHATSAPP_DRIVER = 'wppconnect'  # أو 'cloud_api' أو 'elmujib_cloud'
+    WHATSAPP_FAILOVER_DRIVER = 'elmujib_cloud'  # اختياري: مزود احتياطي عند فتح الدائرة
+    
+    ✅ نفس الـ instance (ونفس الـ Session) لكل مزود داخل العملية
+    
+    Returns:
+        MessageDriver instance (أو FailoverDriver عند ضبط مزود احتياطي)
+    """
+    driver_type = getattr(settings, 'WHATSAPP_DRIVER', 'wppconnect')
+    failover_type = getattr(settings, 'WHATSAPP_FAILOVER_DRIVER', None)
+    
+    if not failover_type or failover_type == driver_type:
+        return _get_cached_driver(driver_type)
+    
+    key = f'{driver_type}->{failover_type}'
+    driver = _driver_instances.get(key)
+    if driver is None:
+        driver = FailoverDriver(_get_cached_driver(driver_type), _get_cached_driver(failover_type))
+        with _driver_lock:
+            driver = _driver_instances.setdefault(key, driver)
+    
+    return driver
+
+
+def reset_whatsapp_drivers() -> None:
+    """
+    إغلاق وحذف كل الـ drivers (يُعاد إنشاؤها بالإعدادات الحالية عند أول طلب)
+    """
+    with _driver_lock:
+        drivers = list(_driver_instances.values())
+        _driver_instances.clear()
+    
+    for driver in drivers:
+        driver.close()
+    
+    logger.info(f"Reset {len(drivers)} WhatsApp driver(s)")
+
+
+@receiver(setting_changed)
+def reset_drivers_on_setting_change(sender, setting, **kwargs):
+    """
+    إعادة إنشاء الـ drivers عند تغيير إعدادات WhatsApp (override_settings وغيرها)
+    """
+    if setting.startswith(DRIVER_SETTING_PREFIXES):
+        reset_whatsapp_drivers()
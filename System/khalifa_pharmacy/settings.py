@@ -327,6 +327,11 @@ else:
 # WhatsApp Driver: 'wppconnect' أو 'cloud_api' أو 'elmujib_cloud'
 WHATSAPP_DRIVER = 'elmujib_cloud'
 
+# Failover - مزود احتياطي يُستخدم عند فتح Circuit Breaker للمزود الأساسي (None = بدون)
+WHATSAPP_FAILOVER_DRIVER = os.getenv('WHATSAPP_FAILOVER_DRIVER') or None
+WHATSAPP_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('WHATSAPP_CIRCUIT_FAILURE_THRESHOLD', '5'))  # أخطاء متتالية قبل فتح الدائرة
+WHATSAPP_CIRCUIT_RESET_SECONDS = int(os.getenv('WHATSAPP_CIRCUIT_RESET_SECONDS', '30'))  # مهلة قبل الطلب التجريبي
+
 # WPPConnect Settings
 WPPCONNECT_PORT = os.getenv('WPPCONNECT_PORT', '3000')
 WPPCONNECT_HOST = os.getenv('WPPCONNECT_HOST', 'localhost')
@@ -352,6 +357,33 @@ ELMUJIB_TIMEOUT = 30
 # استخدم رابط IP أو domain عام عند النشر على الإنترنت
 WHATSAPP_MEDIA_DOMAIN = os.getenv('WHATSAPP_MEDIA_DOMAIN', 'http://localhost:8888')
 
+# HTTP Connection Pool لكل مزود (Session واحدة لكل عملية)
+WHATSAPP_HTTP_POOL_SIZE = int(os.getenv('WHATSAPP_HTTP_POOL_SIZE', '10'))  # يجب ألا يقل عن MESSAGE_QUEUE_WORKERS
+WHATSAPP_HTTP_CONNECT_TIMEOUT = int(os.getenv('WHATSAPP_HTTP_CONNECT_TIMEOUT', '5'))
+WHATSAPP_HTTP_RETRIES = int(os.getenv('WHATSAPP_HTTP_RETRIES', '2'))
+WHATSAPP_ASYNC_POOL_SIZE = int(os.getenv('WHATSAPP_ASYNC_POOL_SIZE', '100'))  # أقصى طلبات متزامنة لكل AsyncMessageDriver
+
+# Webhook Inbox - الـ webhook يحفظ البيانات ويرد فوراً، والمعالجة في process_webhook_inbox
+# False = المعالجة المتزامنة داخل الـ request (السلوك القديم)
+WHATSAPP_WEBHOOK_ASYNC = os.getenv('WHATSAPP_WEBHOOK_ASYNC', 'True') == 'True'
+
+# Identity Cache - أقصى عدد للعملاء في ذاكرة LRU لكل عملية (wa_id → عميل + تذكرة مفتوحة)
+IDENTITY_CACHE_MAX_ENTRIES = int(os.getenv('IDENTITY_CACHE_MAX_ENTRIES', '10000'))
+
+# Message Queue - عدد الـ workers المتوازية في process_message_queue --workers
+MESSAGE_QUEUE_WORKERS = int(os.getenv('MESSAGE_QUEUE_WORKERS', '4'))
+MESSAGE_QUEUE_WAKEUP_PORT = int(os.getenv('MESSAGE_QUEUE_WAKEUP_PORT', '47601'))  # إيقاظ العامل عبر UDP على localhost (غير PostgreSQL)
+QUEUE_STATS_RECONCILE_SECONDS = int(os.getenv('QUEUE_STATS_RECONCILE_SECONDS', '600'))  # تسوية عدادات queue_stats داخل العامل المستمر (0 = cron فقط)
+
+# Rate Limiting - Token Bucket مشترك بين كل العمليات (رسائل/دقيقة)
+WHATSAPP_RATE_LIMIT_PER_MINUTE = int(os.getenv('WHATSAPP_RATE_LIMIT_PER_MINUTE', '20'))  # لكل مزود
+WHATSAPP_PROVIDER_RATE_LIMITS = {}  # تخصيص حد مزود معين، مثال: {'cloud_api': 80}
+WHATSAPP_RECIPIENT_RATE_LIMIT_PER_MINUTE = int(os.getenv('WHATSAPP_RECIPIENT_RATE_LIMIT_PER_MINUTE', '10'))  # لكل عميل
+
+# Broadcast Campaigns - الحملات تستهلك جزءاً فقط من حد المزود (الباقي لردود المحادثات)
+WHATSAPP_BROADCAST_RATE_LIMIT_PER_MINUTE = int(os.getenv('WHATSAPP_BROADCAST_RATE_LIMIT_PER_MINUTE', '12'))
+BROADCAST_CHUNK_SIZE = int(os.getenv('BROADCAST_CHUNK_SIZE', '1000'))  # حجم دفعة bulk_create للمستلمين
+
 # WPPConnect Configuration
 WHATSAPP_CONFIG = {
     'base_url': f"http://{os.getenv('WPPCONNECT_HOST', 'localhost')}:{os.getenv('WPPCONNECT_PORT', '3000')}",
@@ -0,0 +1,228 @@
+"""
+Test: AsyncMessageDriver (conversations/async_whatsapp_driver.py) ضد سيرفر HTTP محلي وهمي
+
+يتحقق من:
+- payloads لكل مزود (WPPConnect / Cloud API / Elmujib) لكل أنواع الرسائل
+- شكل النتيجة (success, message_id, provider)
+- الأخطاء (HTTP 4xx/5xx) ترجع success=False بدون استثناء
+- مئات الطلبات المتزامنة من event loop واحد (التوازي الفعلي على السيرفر)
+
+لا اتصال بأي مزود حقيقي.
+
+Usage:
+    python test_async_driver.py
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import django
+
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8')
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'khalifa_pharmacy.settings')
+django.setup()
+
+from conversations.async_whatsapp_driver import (
+    AsyncWPPConnectDriver,
+    AsyncCloudAPIDriver,
+    AsyncElmujibCloudAPIDriver,
+)
+
+FAILING_PHONE = '201000000999'  # السيرفر يرجع خطأ لهذا الرقم
+CONCURRENT_SENDS = 200
+SERVER_DELAY_SECONDS = 0.05
+
+
+class FakeWhatsAppServer(BaseHTTPRequestHandler):
+    """
+    سيرفر وهمي يحاكي ردود المزودين الثلاثة ويسجل الطلبات
+    """
+    protocol_version = 'HTTP/1.1'
+    requests_log = []
+    in_flight = 0
+    max_in_flight = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        cls = FakeWhatsAppServer
+        with cls.lock:
+            cls.in_flight += 1
+            cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            with cls.lock:
+                cls.requests_log.append((self.path, dict(self.headers), payload))
+
+            time.sleep(SERVER_DELAY_SECONDS)
+
+            phone = payload.get('phone') or payload.get('to') or payload.get('phone_number') or ''
+            if FAILING_PHONE in phone:
+                if '/graph/' in self.path:
+                    self.reply(400, {'error': {'message': 'Invalid parameter', 'code': 100}})
+                else:
+                    self.reply(500, {'success': False, 'error': 'provider down'})
+                return
+
+            if self.path.startswith('/wpp/'):
+                self.reply(200, {'success': True, 'message_id': f'wpp-{len(cls.requests_log)}'})
+            elif self.path.startswith('/graph/'):
+                self.reply(200, {
+                    'messaging_product': 'whatsapp',
+                    'contacts': [{'input': phone, 'wa_id': phone}],
+                    'messages': [{'id': f'wamid.{len(cls.requests_log)}'}]
+                })
+            else:
+                self.reply(200, {'message': 'Message processed', 'id': f'elm-{len(cls.requests_log)}'})
+        finally:
+            with cls.lock:
+                cls.in_flight -= 1
+
+    def reply(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+failures = []
+
+
+def check(name, condition, detail=''):
+    print(f"{'✅' if condition else '❌'} {name}{f' - {detail}' if detail else ''}")
+    if not condition:
+        failures.append(name)
+
+
+def last_request(path_part):
+    return [entry for entry in FakeWhatsAppServer.requests_log if path_part in entry[0]][-1]
+
+
+async def run_tests(base_url):
+    drivers = {
+        'wppconnect': AsyncWPPConnectDriver({'base_url': f'{base_url}/wpp', 'api_key': 'test-key'}),
+        'cloud_api': AsyncCloudAPIDriver({
+            'base_url': f'{base_url}/graph',
+            'access_token': 'test-token',
+            'phone_number_id': '12345'
+        }),
+        'elmujib_cloud': AsyncElmujibCloudAPIDriver({
+            'base_url': f'{base_url}/elmujib',
+            'vendor_uid': 'vendor-1',
+            'bearer_token': 'test-bearer',
+            'from_phone_number_id': '777'
+        }),
+    }
+
+    # 1) رسالة نصية لكل مزود
+    print("\n1. Text messages")
+    for name, driver in drivers.items():
+        result = await driver.send_text_message('01012345678', 'مرحباً')
+        check(f'{name} text', result.get('success') and result.get('message_id') and result['provider'] == name, str(result))
+
+    path, headers, payload = last_request('/wpp/api/send-message')
+    check('wppconnect payload', payload == {'phone': '201012345678', 'message': 'مرحباً'} and headers.get('X-API-Key') == 'test-key')
+    path, headers, payload = last_request('/graph/12345/messages')
+    check('cloud_api payload', payload['to'] == '201012345678' and payload['text']['body'] == 'مرحباً'
+          and headers.get('Authorization') == 'Bearer test-token')
+    path, headers, payload = last_request('/elmujib/vendor-1/contact/send-message')
+    check('elmujib payload', payload == {
+        'phone_number': '201012345678', 'message_body': 'مرحباً', 'from_phone_number_id': '777'
+    } and headers.get('Authorization') == 'Bearer test-bearer')
+
+    # 2) ميديا
+    print("\n2. Media messages")
+    for name, driver in drivers.items():
+        result = await driver.send_media_message('201012345678', 'https://example.com/a.jpg', 'image', caption='روشتة')
+        check(f'{name} media', result.get('success'), str(result))
+    check('cloud_api media payload', last_request('/graph/')[2]['image'] == {'link': 'https://example.com/a.jpg', 'caption': 'روشتة'})
+    check('elmujib media endpoint', last_request('/elmujib/')[0].endswith('/send-media-message'))
+
+    # 3) Template و Interactive
+    print("\n3. Template & interactive messages")
+    interactive = {
+        'type': 'button',
+        'body': {'text': 'اختر الخدمة'},
+        'action': {'buttons': [
+            {'type': 'reply', 'reply': {'id': '1', 'title': 'شكوى'}},
+            {'type': 'reply', 'reply': {'id': '2', 'title': 'طلب أدوية'}},
+        ]}
+    }
+    for name in ('cloud_api', 'elmujib_cloud'):
+        result = await drivers[name].send_template_message('201012345678', 'welcome', 'ar')
+        check(f'{name} template', result.get('success'), str(result))
+        result = await drivers[name].send_interactive_message('201012345678', interactive)
+        check(f'{name} interactive', result.get('success'), str(result))
+    check('cloud_api template payload', last_request('/graph/')[2]['type'] == 'interactive'
+          and any(entry[2].get('template') == {'name': 'welcome', 'language': {'code': 'ar'}}
+                  for entry in FakeWhatsAppServer.requests_log))
+
+    result = await drivers['wppconnect'].send_template_message('201012345678', 'welcome')
+    check('wppconnect template unsupported', result['success'] is False)
+    result = await drivers['wppconnect'].send_interactive_message('201012345678', interactive)
+    check('wppconnect interactive as text', result.get('success')
+          and last_request('/wpp/')[2]['message'] == 'اختر الخدمة\n1 شكوى\n2 طلب أدوية')
+
+    # 4) أخطاء المزود
+    print("\n4. Provider errors")
+    for name, driver in drivers.items():
+        result = await driver.send_text_message(FAILING_PHONE, 'x')
+        check(f'{name} error result', result['success'] is False and result.get('error'), str(result))
+
+    # 5) توازي عالٍ من event loop واحد
+    print(f"\n5. {CONCURRENT_SENDS} concurrent sends per provider")
+    for name, driver in drivers.items():
+        FakeWhatsAppServer.max_in_flight = 0
+        started = time.monotonic()
+        results = await asyncio.gather(*[
+            driver.send_text_message(f'2010{index:08d}', f'رسالة {index}')
+            for index in range(CONCURRENT_SENDS)
+        ])
+        elapsed = time.monotonic() - started
+        sequential = CONCURRENT_SENDS * SERVER_DELAY_SECONDS
+        check(
+            f'{name} concurrent',
+            all(result['success'] for result in results) and elapsed < sequential / 4,
+            f'{elapsed:.2f}s (sequential ≈ {sequential:.0f}s), max in flight {FakeWhatsAppServer.max_in_flight}'
+        )
+
+    for driver in drivers.values():
+        await driver.aclose()
+
+
+print("=" * 70)
+print("Testing AsyncMessageDriver against a local fake server")
+print("=" * 70)
+
+class FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # listen backlog كافٍ لكل الطلبات المتزامنة
+
+
+server = FakeServer(('127.0.0.1', 0), FakeWhatsAppServer)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+
+try:
+    asyncio.run(run_tests(f'http://127.0.0.1:{server.server_address[1]}'))
+finally:
+    server.shutdown()
+
+print("\n" + "=" * 70)
+if failures:
+    print(f"❌ FAILED: {', '.join(failures)}")
+    raise SystemExit(1)
+print("✅ All async driver tests passed")
+print("=" * 70)
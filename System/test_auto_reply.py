@@ -0,0 +1,118 @@
+"""
+Test: محرك الرد التلقائي (conversations/auto_reply.py)
+
+يتحقق من:
+- توحيد النص العربي (تشكيل، أشكال الألف، ى/ي، ة/ه، الأرقام العربية-الهندية)
+- اختيار القائمة: الرسالة كلها = كلمة القائمة
+- المحفزات: كلمة كاملة داخل الرسالة، والأطول هو المعتمد
+- الـ Automaton يُبنى مرة واحدة ويُعاد بناؤه فقط عند تعديل المحفزات
+
+كل الاختبار داخل transaction يتم التراجع عنها في النهاية.
+
+Usage:
+    python test_auto_reply.py
+"""
+
+import os
+import sys
+import django
+
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8')
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'khalifa_pharmacy.settings')
+django.setup()
+
+from django.db import transaction
+
+from conversations.models import User, Admin, AutoReplyTrigger
+from conversations.auto_reply import AhoCorasickAutomaton, normalize_arabic, get_auto_reply_engine
+
+
+class Rollback(Exception):
+    pass
+
+
+failures = []
+
+
+def check(name, condition, detail=''):
+    print(f"{'✅' if condition else '❌'} {name}{f' - {detail}' if detail else ''}")
+    if not condition:
+        failures.append(name)
+
+
+print("=" * 70)
+print("Testing auto reply engine")
+print("=" * 70)
+
+# 1) توحيد النص
+print("\n1. Arabic normalization")
+check('alef/ta marbuta/alef maqsura', normalize_arabic('أدويـــة') == normalize_arabic('ادويه'))
+check('diacritics removed', normalize_arabic('شَكْوَى') == normalize_arabic('شكوي'))
+check('indic digits', normalize_arabic(' ١ ') == '1' and normalize_arabic('۳') == '3')
+
+# 2) Aho-Corasick: كلمات متداخلة في مرور واحد
+print("\n2. Aho-Corasick automaton")
+automaton = AhoCorasickAutomaton([('he', 1), ('she', 2), ('his', 3), ('hers', 4)])
+found = sorted((start, end, payload) for start, end, payload in automaton.iter_matches('ushers'))
+check('overlapping matches', found == [(1, 4, 2), (2, 4, 1), (2, 6, 4)], str(found))
+
+engine = get_auto_reply_engine()
+
+try:
+    with transaction.atomic():
+        user = User.objects.create(
+            username='auto_reply_test_admin',
+            password_hash='-',
+            role='admin',
+            full_name='Auto Reply Test'
+        )
+        admin, _ = Admin.objects.get_or_create(user=user)
+
+        # 3) القائمة
+        print("\n3. Menu selections")
+        check('digit', engine.match_menu('1') == 'complaint')
+        check('indic digit', engine.match_menu('٢') == 'medicine_order')
+        check('spelling variant', engine.match_menu('شكوي') == 'complaint')
+        check('phrase', engine.match_menu('طلب  سابق') == 'follow_up')
+        check('whole message only', engine.match_menu('عندي شكوى') is None)
+        check('10 is not 1', engine.match_menu('10') is None)
+
+        # 4) المحفزات
+        print("\n4. Triggers")
+        builds = engine.builds
+        AutoReplyTrigger.objects.create(trigger_keyword='مواعيد', reply_text='نعمل من 9 ص حتى 12 م', created_by=admin)
+        AutoReplyTrigger.objects.create(trigger_keyword='مواعيد العمل', reply_text='مواعيد العمل: 9 ص - 12 م', created_by=admin)
+        AutoReplyTrigger.objects.create(trigger_keyword='توصيل', reply_text='التوصيل خلال ساعة', created_by=admin, is_active=False)
+
+        match = engine.match('ما هي مواعيد العمل؟')
+        check('longest trigger wins', match.trigger and match.trigger.keyword == 'مواعيد العمل', str(match.trigger))
+        check('partial word ignored', engine.match('المواعيد').trigger is None)
+        check('inactive trigger ignored', engine.match('هل يوجد توصيل').trigger is None)
+        check('rebuilt after trigger change', engine.builds == builds + 1, f'{engine.builds - builds} build(s)')
+
+        # 5) بدون تعديل → بدون إعادة بناء
+        print("\n5. Cached automaton")
+        builds = engine.builds
+        for _ in range(100):
+            engine.match('مواعيد')
+        check('no rebuild without changes', engine.builds == builds)
+
+        AutoReplyTrigger.objects.filter(trigger_keyword='توصيل').first().delete()
+        engine.match('توصيل')
+        check('rebuilt after delete', engine.builds == builds + 1)
+
+        raise Rollback()
+except Rollback:
+    pass
+
+engine.invalidate()
+
+print("\n" + "=" * 70)
+if failures:
+    print(f"❌ FAILED: {', '.join(failures)}")
+    raise SystemExit(1)
+print("✅ All auto reply tests passed")
+print("=" * 70)
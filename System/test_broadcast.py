@@ -0,0 +1,286 @@
+"""
+Test: حملات الإرسال الجماعي (conversations/broadcast.py و views_broadcast.py)
+
+يتحقق من:
+- اختيار الجمهور: التاجات والاستثناءات والمحظورين وحسابات LID (بدون تكرار العميل)
+- إنشاء المستلمين على دفعات (BROADCAST_CHUNK_SIZE)
+- حد الحملات في الـ Rate Limiter: الدفعة تتوقف والمستلمون يعودون pending مع retry_at
+- الحملة تفسح الطريق لردود الموظفين/النظام المستحقة (حصة مسار BULK فقط)
+- إعادة المحاولة مع Backoff حتى MAX_RETRY_COUNT ثم failed
+- عدادات delivered/read تتقدم للأمام فقط
+- الـ API: إنشاء حملة والتحقق من المدخلات وبدءها
+
+لا اتصال بأي مزود حقيقي (driver وهمي). كل الاختبار داخل transaction يتم التراجع عنها في النهاية.
+
+Usage:
+    python test_broadcast.py
+"""
+
+import os
+import sys
+import threading
+import django
+
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8')
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'khalifa_pharmacy.settings')
+django.setup()
+
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from conversations.models import (
+    User, Customer, CustomerTag, Ticket, Message, BroadcastCampaign, BroadcastRecipient, RateLimitBucket
+)
+from conversations.broadcast import BroadcastEngine
+
+PROVIDER = 'broadcast_test'
+
+
+class FakeDriver:
+    """
+    مزود وهمي: يسجل الرسائل، ويفشل للأرقام الموجودة في failing
+    """
+
+    def __init__(self):
+        self.provider_name = PROVIDER
+        self.sent = []
+        self.failing = set()
+
+    def circuit_retry_at(self):
+        return None
+
+    def send_text_message(self, phone, message):
+        if phone in self.failing:
+            return {'success': False, 'error': 'provider error'}
+        self.sent.append(phone)
+        return {'success': True, 'message_id': f'bc-test-{len(self.sent)}'}
+
+
+class Rollback(Exception):
+    pass
+
+
+failures = []
+
+
+def check(name, condition, detail=''):
+    print(f"{'✅' if condition else '❌'} {name}{f' - {detail}' if detail else ''}")
+    if not condition:
+        failures.append(name)
+
+
+def run_batch(engine, batch_size=50):
+    """
+    نفس خطوات process_batch بدون threads (الـ threads لا ترى بيانات الـ transaction)
+    """
+    paused = threading.Event()
+    results = [
+        dict(engine._process_recipient(recipient, paused), campaign_id=recipient.campaign_id)
+        for recipient in engine.claim_batch(batch_size)
+    ]
+    engine._update_counters(results)
+    return [result['outcome'] for result in results]
+
+
+def make_due(campaign_id):
+    BroadcastRecipient.objects.filter(campaign_id=campaign_id, status='pending').update(next_attempt_at=timezone.now())
+
+
+print("=" * 70)
+print("Testing broadcast campaigns")
+print("=" * 70)
+
+engine = BroadcastEngine()
+driver = FakeDriver()
+engine.driver = driver
+
+try:
+    with transaction.atomic():
+        # بيئة معزولة: لا حملات جارية ولا رسائل مستحقة غير بيانات الاختبار
+        BroadcastCampaign.objects.filter(status='running').update(status='paused')
+        Message.objects.filter(delivery_status='pending').update(delivery_status='sent')
+
+        user = User.objects.create(
+            username='broadcast_test_admin',
+            password_hash='-',
+            role='admin',
+            full_name='Broadcast Test'
+        )
+
+        customers = [
+            Customer.objects.create(phone_number=f'20199900{index:04d}', wa_id=f'20199900{index:04d}')
+            for index in range(5)
+        ]
+        lid_customer = Customer.objects.create(phone_number='201999009999', wa_id='1999009999@lid')
+        customers[3].is_blocked = True
+        customers[3].save(update_fields=['is_blocked'])
+
+        for customer in customers + [lid_customer]:
+            CustomerTag.objects.create(customer=customer, tag='bc_test_vip')
+        CustomerTag.objects.create(customer=customers[0], tag='bc_test_diabetes')  # تاجان مطابقان
+        CustomerTag.objects.create(customer=customers[4], tag='bc_test_no_promotions')
+
+        audience_filter = {
+            'tags': ['bc_test_vip', 'bc_test_diabetes'],
+            'exclude_tags': ['bc_test_no_promotions']
+        }
+        expected = [customers[0].id, customers[1].id, customers[2].id]
+
+        # 1) الجمهور
+        print("\n1. Audience selection")
+        audience = list(engine.select_audience(audience_filter).values_list('id', flat=True))
+        check('tags, exclusions, blocked and LID', audience == expected, str(audience))
+
+        result = engine.create_campaign('bc test', message_text='عرض', audience_filter={'tagz': ['x']})
+        check('unknown filter key rejected', not result['success'])
+
+        result = engine.create_campaign('bc test', message_text='عرض', audience_filter=audience_filter, user=user)
+        check('campaign created as draft', result['success'] and result['status'] == 'draft'
+              and result['audience_size'] == 3, str(result))
+        campaign_id = result['campaign_id']
+
+        # 2) إنشاء المستلمين على دفعات
+        print("\n2. Chunked recipient creation")
+        with override_settings(BROADCAST_CHUNK_SIZE=2), CaptureQueriesContext(connection) as ctx:
+            result = engine.launch(campaign_id)
+        inserts = [q for q in ctx.captured_queries if q['sql'].startswith('INSERT') and 'broadcast_recipients' in q['sql']]
+        check('launched', result['success'] and result['total_recipients'] == 3, str(result))
+        check('one bulk insert per chunk', len(inserts) == 2, f'{len(inserts)} insert(s)')
+        check('launch only once', not engine.launch(campaign_id)['success'])
+
+        # 3) حد الحملات
+        print("\n3. Rate-limited release")
+        with override_settings(
+            WHATSAPP_PROVIDER_RATE_LIMITS={PROVIDER: 100},
+            WHATSAPP_BROADCAST_RATE_LIMIT_PER_MINUTE=2
+        ):
+            outcomes = run_batch(engine)
+        check('2 sent then rate limited', outcomes == ['sent', 'sent', 'rate_limited'], str(outcomes))
+
+        held = BroadcastRecipient.objects.get(campaign_id=campaign_id, status='pending')
+        check('rate-limited recipient released with retry_at', held.claimed_by is None
+              and held.next_attempt_at > timezone.now())
+        check('not claimed before retry_at', run_batch(engine) == [])
+
+        campaign = BroadcastCampaign.objects.get(id=campaign_id)
+        check('sent counter', campaign.sent_count == 2 and campaign.status == 'running', str(campaign.sent_count))
+
+        # 4) الحملة تفسح الطريق لردود الموظفين/النظام
+        print("\n4. Yield to interactive/system lanes")
+        check('full batch when queue idle', engine._yield_batch_size(50) == 50)
+        ticket = Ticket.objects.create(ticket_number='TKT-BCAST-0001', customer=customers[1])
+        message = Message.objects.create(
+            ticket=ticket,
+            sender=user,
+            sender_type='admin',
+            direction='outgoing',
+            message_text='رد الموظف',
+            delivery_status='pending',
+            priority=Message.PRIORITY_INTERACTIVE,
+            next_attempt_at=timezone.now()
+        )
+        check('bulk share when replies are due', engine._yield_batch_size(50) == 5, str(engine._yield_batch_size(50)))
+        Message.objects.filter(id=message.id).update(priority=Message.PRIORITY_BULK)
+        check('bulk messages do not shrink the batch', engine._yield_batch_size(50) == 50)
+        Message.objects.filter(id=message.id).update(delivery_status='sent')
+
+        RateLimitBucket.objects.filter(key__startswith='broadcast:').delete()
+        make_due(campaign_id)
+        outcomes = run_batch(engine)
+        campaign.refresh_from_db()
+        check('campaign completed', outcomes == ['sent'] and campaign.status == 'completed'
+              and campaign.completed_at is not None, campaign.status)
+
+        # 5) عدادات التوصيل (للأمام فقط)
+        print("\n5. Forward-only delivery counters")
+        first, second, third = BroadcastRecipient.objects.filter(campaign_id=campaign_id).order_by('id')
+        updated = engine.record_delivery_statuses({
+            first.whatsapp_message_id: 'read',
+            second.whatsapp_message_id: 'delivered',
+            'unknown-id': 'read'
+        })
+        campaign.refresh_from_db()
+        check('sent → read counts delivered too', updated == 2 and campaign.delivered_count == 2
+              and campaign.read_count == 1, f'{campaign.delivered_count}/{campaign.read_count}')
+
+        check('read does not go back to delivered', not engine.record_delivery_status(first.whatsapp_message_id, 'delivered'))
+        check('delivered → read', engine.record_delivery_status(second.whatsapp_message_id, 'read'))
+        check('duplicate read ignored', not engine.record_delivery_status(second.whatsapp_message_id, 'read'))
+        campaign.refresh_from_db()
+        check('counters after repeats', campaign.delivered_count == 2 and campaign.read_count == 2,
+              f'{campaign.delivered_count}/{campaign.read_count}')
+
+        progress = engine.get_progress(campaign)
+        check('progress', progress['progress_percent'] == 100.0 and progress['remaining'] == 0, str(progress))
+
+        # 6) إعادة المحاولة حتى failed
+        print("\n6. Retry until failed")
+        result = engine.create_campaign(
+            'bc retry test', message_text='تنبيه', audience_filter={'customer_ids': [customers[1].id]}
+        )
+        retry_campaign_id = result['campaign_id']
+        engine.launch(retry_campaign_id)
+        driver.failing.add(customers[1].wa_id)
+
+        outcomes = []
+        for _ in range(engine.MAX_RETRY_COUNT):
+            outcomes += run_batch(engine)
+            if outcomes[-1] == 'retry':
+                recipient = BroadcastRecipient.objects.get(campaign_id=retry_campaign_id)
+                check(f'backoff after attempt {recipient.retry_count}', recipient.next_attempt_at > timezone.now())
+                make_due(retry_campaign_id)
+
+        recipient = BroadcastRecipient.objects.get(campaign_id=retry_campaign_id)
+        campaign = BroadcastCampaign.objects.get(id=retry_campaign_id)
+        check('retry, retry, failed', outcomes == ['retry', 'retry', 'failed'], str(outcomes))
+        check('recipient failed', recipient.status == 'failed'
+              and recipient.retry_count == engine.MAX_RETRY_COUNT and recipient.error_message == 'provider error')
+        check('failed counter and completion', campaign.failed_count == 1 and campaign.status == 'completed')
+
+        # 7) الـ API
+        print("\n7. API")
+        client = APIClient()
+        client.force_authenticate(user=user)
+
+        response = client.post('/api/broadcasts/', {'name': 'bc api', 'message_type': 'image'}, format='json')
+        check('media without media_url rejected', response.status_code == 400, str(response.data))
+
+        response = client.post('/api/broadcasts/', {
+            'name': 'bc api',
+            'message_text': 'عرض',
+            'audience_filter': {'customer_ids': [customers[2].id]}
+        }, format='json')
+        check('campaign created via API', response.status_code == 201 and response.data['audience_size'] == 1,
+              str(response.data))
+
+        api_campaign_id = response.data['campaign_id']
+        response = client.post(f'/api/broadcasts/{api_campaign_id}/launch/')
+        check('launched via API', response.status_code == 200 and response.data['total_recipients'] == 1)
+        response = client.post(f'/api/broadcasts/{api_campaign_id}/pause/')
+        check('paused via API', response.status_code == 200 and response.data['status'] == 'paused')
+        check('paused campaign not claimed', run_batch(engine) == [])
+        response = client.post(f'/api/broadcasts/{api_campaign_id}/restart/')
+        check('unknown action', response.status_code == 404)
+        response = client.get(f'/api/broadcasts/{api_campaign_id}/')
+        check('progress via API', response.status_code == 200 and response.data['campaign']['status'] == 'paused')
+
+        agent = User.objects.filter(role='agent').first()
+        if agent:
+            client.force_authenticate(user=agent)
+            check('agents cannot manage campaigns', client.get('/api/broadcasts/').status_code == 403)
+
+        raise Rollback()
+except Rollback:
+    pass
+
+print("\n" + "=" * 70)
+if failures:
+    print(f"❌ FAILED: {', '.join(failures)}")
+    raise SystemExit(1)
+print("✅ All broadcast tests passed")
+print("=" * 70)
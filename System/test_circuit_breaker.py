@@ -0,0 +1,185 @@
+"""
+Test: Circuit Breaker و Failover بين مزودي WhatsApp (conversations/circuit_breaker.py)
+
+يتحقق من:
+- فتح الدائرة بعد أخطاء متتالية (مزود متوقف) ثم الرفض الفوري بدون اتصال
+- half_open بعد مهلة الاستعادة: طلب تجريبي واحد، ونجاحه يغلق الدائرة
+- أخطاء 4xx لا تفتح الدائرة (المزود يعمل)
+- طلبات غير الإرسال (حالة الاتصال) لا تُحتسب ولا تغلق دائرة مفتوحة
+- FailoverDriver يرسل عبر المزود الاحتياطي عند فتح دائرة الأساسي، ما عدا مستلمي LID
+
+لا اتصال بأي مزود حقيقي (سيرفر HTTP محلي وهمي).
+
+Usage:
+    python test_circuit_breaker.py
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import django
+
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8')
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'khalifa_pharmacy.settings')
+django.setup()
+
+from conversations.circuit_breaker import CircuitBreaker
+from conversations.whatsapp_driver import WPPConnectDriver, ElmujibCloudAPIDriver, FailoverDriver
+
+RESET_SECONDS = 0.5
+
+
+class FakeElmujibServer(BaseHTTPRequestHandler):
+    """
+    سيرفر وهمي: /down/ يرجع 503، /bad/ يرجع 400، غير ذلك نجاح
+    """
+    protocol_version = 'HTTP/1.1'
+    requests_log = []
+
+    def do_GET(self):
+        self.reply(200, {'status': 'CONNECTED'})
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        FakeElmujibServer.requests_log.append((self.path, payload))
+
+        if self.path.startswith('/down/'):
+            self.reply(503, {'error': 'maintenance'})
+        elif self.path.startswith('/bad/'):
+            self.reply(400, {'error': 'invalid phone'})
+        else:
+            self.reply(200, {'message': 'Message processed', 'id': f'elm-{len(FakeElmujibServer.requests_log)}'})
+
+    def reply(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+failures = []
+
+
+def check(name, condition, detail=''):
+    print(f"{'✅' if condition else '❌'} {name}{f' - {detail}' if detail else ''}")
+    if not condition:
+        failures.append(name)
+
+
+def closed_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def elmujib(base_url, path):
+    return ElmujibCloudAPIDriver({
+        'base_url': f'{base_url}/{path}',
+        'vendor_uid': 'vendor-1',
+        'bearer_token': 'test-bearer',
+        'circuit_failure_threshold': 3,
+        'circuit_reset_timeout': RESET_SECONDS,
+        'transport_retries': 0,
+    })
+
+
+print("=" * 70)
+print("Testing provider circuit breaker & failover")
+print("=" * 70)
+
+server = ThreadingHTTPServer(('127.0.0.1', 0), FakeElmujibServer)
+server.daemon_threads = True
+threading.Thread(target=server.serve_forever, daemon=True).start()
+base_url = f'http://127.0.0.1:{server.server_address[1]}'
+
+try:
+    # 1) مزود متوقف (لا يوجد سيرفر على المنفذ)
+    print("\n1. Provider down → circuit opens")
+    wpp = WPPConnectDriver({
+        'base_url': f'http://127.0.0.1:{closed_port()}',
+        'circuit_failure_threshold': 3,
+        'circuit_reset_timeout': 30,  # يبقى مفتوحاً حتى اختبار الـ Failover
+        'transport_retries': 0,
+    })
+    for _ in range(3):
+        wpp.send_text_message('201012345678', 'x')
+    check('circuit open after 3 failures', wpp.get_circuit_state()['state'] == CircuitBreaker.OPEN, str(wpp.get_circuit_state()))
+    check('circuit_retry_at set', wpp.circuit_retry_at() is not None)
+
+    started = time.monotonic()
+    result = wpp.send_text_message('201012345678', 'x')
+    check('open circuit rejects immediately', result['success'] is False and 'Circuit open' in result['error']
+          and time.monotonic() - started < 0.1, result['error'])
+
+    # 2) 5xx تفتح الدائرة، 4xx لا تفتحها
+    print("\n2. HTTP 5xx vs 4xx")
+    down = elmujib(base_url, 'down')
+    for _ in range(3):
+        down.send_text_message('201012345678', 'x')
+    check('503 opens circuit', down.get_circuit_state()['state'] == CircuitBreaker.OPEN)
+
+    bad = elmujib(base_url, 'bad')
+    for _ in range(5):
+        bad.send_text_message('201012345678', 'x')
+    check('400 keeps circuit closed', bad.get_circuit_state()['state'] == CircuitBreaker.CLOSED)
+
+    # طلبات الحالة لا تمر على الدائرة
+    response = down.session.get(f'{base_url}/up/status', timeout=5)
+    check('status request passes an open circuit', response.status_code == 200)
+    check('status request not counted as success', down.get_circuit_state()['state'] == CircuitBreaker.OPEN
+          and down.get_circuit_state()['consecutive_failures'] == 3, str(down.get_circuit_state()))
+
+    # 3) Half-open: طلب تجريبي ناجح يغلق الدائرة
+    print("\n3. Half-open probe")
+    recovering = elmujib(base_url, 'down')
+    for _ in range(3):
+        recovering.send_text_message('201012345678', 'x')
+    time.sleep(RESET_SECONDS + 0.1)
+    check('half_open after reset timeout', recovering.get_circuit_state()['state'] == CircuitBreaker.HALF_OPEN)
+    check('only one probe allowed', recovering.breaker.allow_request() and not recovering.breaker.allow_request())
+    recovering.breaker.release_probe()
+
+    recovering.base_url = f'{base_url}/up'  # المزود عاد للعمل
+    result = recovering.send_text_message('201012345678', 'x')
+    check('successful probe closes circuit', result['success']
+          and recovering.get_circuit_state()['state'] == CircuitBreaker.CLOSED)
+
+    # 4) Failover: الأساسي متوقف → الاحتياطي
+    print("\n4. Failover to secondary driver")
+    secondary = elmujib(base_url, 'up')
+    failover = FailoverDriver(wpp, secondary)
+    result = failover.send_text_message('201012345678@c.us', 'مرحباً')
+    sent_payload = FakeElmujibServer.requests_log[-1][1]
+    check('sent via secondary', result['success'] and result['provider'] == 'elmujib_cloud', str(result))
+    check('chatId converted to number', sent_payload['phone_number'] == '201012345678', sent_payload['phone_number'])
+    check('active provider reported', failover.get_circuit_state()['active_provider'] == 'elmujib_cloud')
+    check('template available via secondary', callable(getattr(failover, 'send_template_message', None)))
+    check('failover driver available', failover.circuit_retry_at() is None)
+
+    sent_count = len(FakeElmujibServer.requests_log)
+    result = failover.send_text_message('123456789012345@lid', 'مرحباً')
+    check('LID recipient not failed over', result['success'] is False and 'Circuit open' in result['error']
+          and len(FakeElmujibServer.requests_log) == sent_count, str(result))
+
+finally:
+    server.shutdown()
+
+print("\n" + "=" * 70)
+if failures:
+    print(f"❌ FAILED: {', '.join(failures)}")
+    raise SystemExit(1)
+print("✅ All circuit breaker tests passed")
+print("=" * 70)
@@ -0,0 +1,196 @@
+"""
+Test: Dead Letter Queue (MessageQueue + views_dead_letters.py)
+
+يتحقق من:
+- الرسالة تنتقل إلى Dead Letter Queue بعد MAX_RETRY_COUNT مع سجل المحاولات ورد المزود
+- حساب LID يفشل نهائياً من أول محاولة (غير قابل لإعادة المحاولة)
+- الـ API: العرض مع الفلاتر والترقيم، إعادة الإرسال الانتقائية (force)، الحذف، التحقق من المدخلات
+- عدادات queue_stats تطابق جدول الرسائل بعد إعادة الإرسال
+
+لا اتصال بأي مزود حقيقي (driver وهمي). كل الاختبار داخل transaction يتم التراجع عنها في النهاية.
+
+Usage:
+    python test_dead_letters.py
+"""
+
+import os
+import sys
+import django
+
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8')
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'khalifa_pharmacy.settings')
+django.setup()
+
+from django.db import transaction
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from conversations.models import User, Customer, Ticket, Message, MessageDeliveryLog, DeadLetterMessage
+from conversations.message_queue import MessageQueue
+from conversations.queue_stats import reconcile
+
+
+class FailingDriver:
+    """
+    مزود وهمي يرفض كل الرسائل برد مفصل
+    """
+    provider_name = 'dead_letter_test'
+
+    def circuit_retry_at(self):
+        return None
+
+    def send_text_message(self, phone, message):
+        return {'success': False, 'error': 'recipient not on WhatsApp', 'status_code': 400}
+
+
+class Rollback(Exception):
+    pass
+
+
+failures = []
+
+
+def check(name, condition, detail=''):
+    print(f"{'✅' if condition else '❌'} {name}{f' - {detail}' if detail else ''}")
+    if not condition:
+        failures.append(name)
+
+
+def create_ticket(phone, wa_id, number):
+    customer = Customer.objects.create(phone_number=phone, wa_id=wa_id)
+    return Ticket.objects.create(ticket_number=f'TKT-DLQ-{number}', customer=customer)
+
+
+def send_until_settled(queue, message_id):
+    """
+    محاولات متتالية (بتجاوز الـ Backoff) حتى تصبح الرسالة failed
+    """
+    for _ in range(MessageQueue.MAX_RETRY_COUNT):
+        Message.objects.filter(id=message_id, delivery_status='pending').update(next_attempt_at=timezone.now())
+        for message in queue.claim_batch(batch_size=10):
+            if message.id == message_id:
+                queue.process_message(message)
+            else:
+                queue.release_claim(message)
+        if Message.objects.get(id=message_id).delivery_status == 'failed':
+            break
+
+
+print("=" * 70)
+print("Testing dead letter queue")
+print("=" * 70)
+
+queue = MessageQueue()
+queue.driver = FailingDriver()
+
+try:
+    with transaction.atomic():
+        # بيئة معزولة: لا رسائل معلقة ولا Dead Letters غير بيانات الاختبار
+        Message.objects.filter(delivery_status__in=['pending', 'sending']).update(delivery_status='sent')
+        DeadLetterMessage.objects.all().delete()
+        reconcile()
+
+        user = User.objects.create(
+            username='dead_letter_test_admin',
+            password_hash='-',
+            role='admin',
+            full_name='Dead Letter Test'
+        )
+        ticket = create_ticket('201055500001', '201055500001@c.us', '0001')
+        lid_ticket = create_ticket('201055500002', '123456789012345@lid', '0002')
+
+        # تغييرات العدادات تُطبق عند الـ commit (on_commit): تنفذ هنا عند نهاية الكتلة
+        with TestCase.captureOnCommitCallbacks(execute=True):
+            retryable_id = queue.enqueue(ticket_id=ticket.id, user=user, message_text='طلبك جاهز')['message_id']
+            lid_id = queue.enqueue(ticket_id=lid_ticket.id, user=user, message_text='طلبك جاهز')['message_id']
+
+            # 1) الانتقال إلى Dead Letter Queue
+            print("\n1. Dead-lettering")
+            send_until_settled(queue, retryable_id)
+            dead_letter = DeadLetterMessage.objects.filter(message_id=retryable_id).first()
+            check('dead letter after MAX_RETRY_COUNT', dead_letter is not None
+                  and dead_letter.retry_count == MessageQueue.MAX_RETRY_COUNT and dead_letter.is_retryable)
+            check('attempt history kept', dead_letter and len(dead_letter.attempts) == MessageQueue.MAX_RETRY_COUNT,
+                  str(dead_letter and dead_letter.attempts))
+            check('provider response stored', dead_letter and dead_letter.provider == 'dead_letter_test'
+                  and dead_letter.provider_response.get('status_code') == 400)
+
+            send_until_settled(queue, lid_id)
+            lid_dead_letter = DeadLetterMessage.objects.filter(message_id=lid_id).first()
+            check('LID fails on first attempt as non-retryable', lid_dead_letter is not None
+                  and not lid_dead_letter.is_retryable and len(lid_dead_letter.attempts) == 1)
+
+            # 2) العرض
+            print("\n2. List API")
+            client = APIClient()
+            client.force_authenticate(user=user)
+
+            response = client.get('/api/whatsapp/dead-letters/', {'limit': 1})
+            check('paginated list', response.status_code == 200 and len(response.data['dead_letters']) == 1
+                  and response.data['pagination']['total'] == 2 and response.data['pagination']['has_more'])
+
+            response = client.get('/api/whatsapp/dead-letters/', {'retryable': 'false'})
+            check('filter by retryable', [item['message_id'] for item in response.data['dead_letters']] == [lid_id])
+
+            response = client.get('/api/whatsapp/dead-letters/', {'limit': 'x'})
+            check('invalid limit rejected', response.status_code == 400)
+
+            # 3) إعادة الإرسال
+            print("\n3. Requeue API")
+            response = client.post('/api/whatsapp/dead-letters/requeue/', {}, format='json')
+            check('ids or hours required', response.status_code == 400)
+            response = client.post('/api/whatsapp/dead-letters/requeue/', {'ids': '1'}, format='json')
+            check('ids must be a list', response.status_code == 400)
+
+            response = client.post('/api/whatsapp/dead-letters/requeue/', {
+                'ids': [dead_letter.id, lid_dead_letter.id]
+            }, format='json')
+            check('non-retryable skipped without force', response.data.get('requeued') == 1, str(response.data))
+
+            message = Message.objects.get(id=retryable_id)
+            check('requeued message reset', message.delivery_status == 'pending' and message.retry_count == 0
+                  and message.error_message is None)
+            check('dead letter removed, history kept', not DeadLetterMessage.objects.filter(message_id=retryable_id).exists()
+                  and MessageDeliveryLog.objects.filter(message_id=retryable_id, delivery_status='failed').count()
+                  == MessageQueue.MAX_RETRY_COUNT)
+
+            response = client.post('/api/whatsapp/dead-letters/requeue/', {
+                'ids': [lid_dead_letter.id],
+                'force': True
+            }, format='json')
+            check('force requeues non-retryable', response.data.get('requeued') == 1)
+
+        corrections = reconcile()['corrections']
+        check('counters match messages table', not corrections, str(corrections))
+
+        # 4) الحذف
+        print("\n4. Purge API")
+        send_until_settled(queue, retryable_id)
+        dead_letter = DeadLetterMessage.objects.get(message_id=retryable_id)
+        response = client.post('/api/whatsapp/dead-letters/purge/', {}, format='json')
+        check('ids or older_than_days required', response.status_code == 400)
+        response = client.post('/api/whatsapp/dead-letters/purge/', {'older_than_days': 1}, format='json')
+        check('recent entries kept', response.data.get('purged') == 0)
+        response = client.post('/api/whatsapp/dead-letters/purge/', {'ids': [dead_letter.id]}, format='json')
+        check('purged by id', response.data.get('purged') == 1)
+        check('message stays failed', Message.objects.get(id=retryable_id).delivery_status == 'failed')
+
+        agent = User.objects.filter(role='agent').first()
+        if agent:
+            client.force_authenticate(user=agent)
+            check('agents cannot inspect dead letters', client.get('/api/whatsapp/dead-letters/').status_code == 403)
+
+        raise Rollback()
+except Rollback:
+    pass
+
+print("\n" + "=" * 70)
+if failures:
+    print(f"❌ FAILED: {', '.join(failures)}")
+    raise SystemExit(1)
+print("✅ All dead letter tests passed")
+print("=" * 70)
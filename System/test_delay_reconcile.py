@@ -0,0 +1,162 @@
+"""
+Test: مزامنة التأخير الجماعية (conversations/utils.py → reconcile_ticket_delays)
+
+يتحقق من:
+- التذكرة تصبح متأخرة بعد حد التأخير فقط، مع TicketStateLog و AgentDelayEvent مفتوح للموظف المعين
+- رد الموظف ينهي التأخير: total_delay_minutes، إغلاق AgentDelayEvent، و TicketStateLog
+- التذاكر المغلقة والتذاكر خارج ticket_ids لا تتأثر
+- عدد الاستعلامات ثابت لا يزيد مع عدد التذاكر (QUERIES_PER_DELAY_RECONCILE)
+
+كل الاختبار داخل transaction يتم التراجع عنها في النهاية.
+
+Usage:
+    python test_delay_reconcile.py
+"""
+
+import os
+import sys
+import django
+
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8')
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'khalifa_pharmacy.settings')
+django.setup()
+
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from conversations.models import User, Agent, Customer, Ticket, TicketStateLog, AgentDelayEvent
+from conversations.utils import QUERIES_PER_DELAY_RECONCILE, reconcile_ticket_delays
+
+THRESHOLD_MINUTES = 10
+
+
+class Rollback(Exception):
+    pass
+
+
+failures = []
+
+
+def check(name, condition, detail=''):
+    print(f"{'✅' if condition else '❌'} {name}{f' - {detail}' if detail else ''}")
+    if not condition:
+        failures.append(name)
+
+
+def statements(queries):
+    # SAVEPOINT / RELEASE ليست استعلامات بيانات (الاختبار كله داخل transaction خارجية)
+    return [query['sql'] for query in queries.captured_queries if 'SAVEPOINT' not in query['sql']]
+
+
+def create_tickets(prefix, count, agent, customer_message_at):
+    tickets = []
+    for index in range(count):
+        phone = f'2010{prefix}{index:04d}'
+        customer = Customer.objects.create(phone_number=phone, wa_id=f'{phone}@c.us')
+        tickets.append(Ticket.objects.create(
+            ticket_number=f'TKT-RECON-{prefix}-{index:04d}',
+            customer=customer,
+            assigned_agent=agent,
+            last_customer_message_at=customer_message_at
+        ))
+    return [ticket.id for ticket in tickets]
+
+
+def reconcile(ticket_ids):
+    with CaptureQueriesContext(connection) as queries:
+        result = reconcile_ticket_delays(ticket_ids=ticket_ids, delay_threshold=THRESHOLD_MINUTES)
+    return result, len(statements(queries))
+
+
+print("=" * 70)
+print("Testing set-based delay reconciliation")
+print("=" * 70)
+
+try:
+    with transaction.atomic():
+        user = User.objects.create(
+            username='delay_reconcile_test_agent',
+            password_hash='-',
+            role='agent',
+            full_name='Delay Reconcile Test'
+        )
+        agent = Agent.objects.create(user=user)
+
+        now = timezone.now()
+        overdue = now - timedelta(minutes=THRESHOLD_MINUTES + 5)
+        single_ids = create_tickets('111', 1, agent, overdue)
+        many_ids = create_tickets('222', 8, agent, overdue)
+        recent_ids = create_tickets('333', 2, agent, now - timedelta(minutes=1))
+        closed_ids = create_tickets('444', 1, agent, overdue)
+        Ticket.objects.filter(id__in=closed_ids).update(status='closed')
+
+        # 1) أصبحت متأخرة
+        print("\n1. Newly delayed")
+        single_result, single_queries = reconcile(single_ids)
+        many_result, many_queries = reconcile(many_ids + recent_ids + closed_ids)
+        check('overdue tickets delayed', single_result['newly_delayed'] == 1 and many_result['newly_delayed'] == 8,
+              f"{single_result} {many_result}")
+        check('recent and closed tickets untouched',
+              not Ticket.objects.filter(id__in=recent_ids + closed_ids, is_delayed=True).exists())
+
+        delayed = Ticket.objects.filter(id__in=single_ids + many_ids)
+        check('is_delayed + delay_started_at + delay_count',
+              all(ticket.is_delayed and ticket.delay_started_at and ticket.delay_count == 1 for ticket in delayed))
+        check('TicketStateLog per ticket',
+              TicketStateLog.objects.filter(ticket_id__in=many_ids, new_state='delayed').count() == 8)
+        check('AgentDelayEvent opened per ticket', AgentDelayEvent.objects.filter(
+            ticket_id__in=many_ids, agent=agent, delay_end_time__isnull=True
+        ).count() == 8)
+        check(f'fixed query count (1 ticket: {single_queries}, 8 tickets: {many_queries})',
+              single_queries == many_queries <= QUERIES_PER_DELAY_RECONCILE)
+
+        result, _ = reconcile(many_ids)
+        check('idempotent', result == {'newly_delayed': 0, 'no_longer_delayed': 0}, str(result))
+
+        # 2) الموظف رد
+        print("\n2. Agent replied")
+        Ticket.objects.filter(id__in=single_ids + many_ids).update(
+            delay_started_at=now - timedelta(minutes=5),
+            last_agent_message_at=now
+        )
+        AgentDelayEvent.objects.filter(ticket_id__in=single_ids + many_ids).update(
+            delay_start_time=now - timedelta(minutes=5)
+        )
+
+        single_result, single_queries = reconcile(single_ids)
+        many_result, many_queries = reconcile(many_ids)
+        check('replied tickets no longer delayed',
+              single_result['no_longer_delayed'] == 1 and many_result['no_longer_delayed'] == 8,
+              f"{single_result} {many_result}")
+
+        undelayed = Ticket.objects.filter(id__in=many_ids)
+        check('delay cleared, total_delay_minutes added', all(
+            not ticket.is_delayed and ticket.delay_started_at is None and ticket.total_delay_minutes == 5
+            for ticket in undelayed
+        ))
+        events = AgentDelayEvent.objects.filter(ticket_id__in=many_ids)
+        check('AgentDelayEvent closed', all(
+            event.delay_end_time and 299 <= event.delay_duration_seconds <= 301 for event in events
+        ) and events.count() == 8)
+        check('TicketStateLog back to open', TicketStateLog.objects.filter(
+            ticket_id__in=many_ids, old_state='delayed', new_state='open'
+        ).count() == 8)
+        check(f'fixed query count (1 ticket: {single_queries}, 8 tickets: {many_queries})',
+              single_queries == many_queries <= QUERIES_PER_DELAY_RECONCILE)
+
+        raise Rollback()
+except Rollback:
+    pass
+
+print("\n" + "=" * 70)
+if failures:
+    print(f"❌ FAILED: {', '.join(failures)}")
+    raise SystemExit(1)
+print("✅ All delay reconcile tests passed")
+print("=" * 70)
@@ -0,0 +1,142 @@
+"""
+Test: جدولة التأخير المعتمدة على الأحداث (conversations/delay_scheduler.py)
+
+يتحقق من:
+- الـ heap: المواعيد = last_customer_message_at + حد التأخير، وأقربها أولاً (next_due_at)
+- الإلغاء الكسول: cancel وإعادة الجدولة تستبدل الموعد القديم بدون حذفه من الـ heap
+- watermark رسائل العملاء: المزامنة التدريجية تضيف التذاكر الجديدة فقط
+- watermark ردود الموظفين: رد من أي مسار (حتى update() مباشر) يُلغي الموعد ويُنهي التأخير
+  في المزامنة التدريجية التالية بدون انتظار إعادة البناء الكاملة
+- fire_due ينفذ المواعيد المستحقة فقط
+
+كل الاختبار داخل transaction يتم التراجع عنها في النهاية.
+
+Usage:
+    python test_delay_scheduler.py
+"""
+
+import os
+import sys
+import django
+
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8')
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'khalifa_pharmacy.settings')
+django.setup()
+
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from conversations.models import Customer, Ticket, SystemSettings
+from conversations.delay_scheduler import DelayScheduler
+
+THRESHOLD_MINUTES = 10
+
+
+class Rollback(Exception):
+    pass
+
+
+failures = []
+
+
+def check(name, condition, detail=''):
+    print(f"{'✅' if condition else '❌'} {name}{f' - {detail}' if detail else ''}")
+    if not condition:
+        failures.append(name)
+
+
+def create_ticket(phone, number, customer_message_at, agent_message_at=None):
+    customer = Customer.objects.create(phone_number=phone, wa_id=f'{phone}@c.us')
+    return Ticket.objects.create(
+        ticket_number=f'TKT-SCHED-{number}',
+        customer=customer,
+        last_customer_message_at=customer_message_at,
+        last_agent_message_at=agent_message_at
+    )
+
+
+print("=" * 70)
+print("Testing delay scheduler")
+print("=" * 70)
+
+try:
+    with transaction.atomic():
+        # بيئة معزولة: لا تذاكر مفتوحة غير بيانات الاختبار
+        Ticket.objects.filter(status='open').update(status='closed')
+        SystemSettings.get_settings()
+        SystemSettings.objects.filter(id=1).update(delay_threshold_minutes=THRESHOLD_MINUTES)
+
+        now = timezone.now()
+        soon = create_ticket('201099900001', '0001', now - timedelta(minutes=8))
+        later = create_ticket('201099900002', '0002', now - timedelta(minutes=5))
+        overdue = create_ticket('201099900003', '0003', now - timedelta(minutes=11))
+        replied = create_ticket('201099900004', '0004', now - timedelta(minutes=20), now - timedelta(minutes=19))
+
+        scheduler = DelayScheduler()
+
+        # 1) الـ heap
+        print("\n1. Heap")
+        added = scheduler.sync(force_full=True)
+        check('awaiting-reply tickets scheduled', added == 3 and replied.id not in scheduler._scheduled, str(added))
+        check('earliest deadline first', scheduler.next_due_at() == overdue.last_customer_message_at
+              + timedelta(minutes=THRESHOLD_MINUTES))
+
+        # 2) الإلغاء الكسول
+        print("\n2. Lazy cancel")
+        scheduler.cancel(overdue.id)
+        check('cancelled entry skipped', scheduler.next_due_at() == soon.last_customer_message_at
+              + timedelta(minutes=THRESHOLD_MINUTES))
+
+        scheduler.schedule(soon.id, now)
+        check('reschedule replaces old deadline', scheduler.next_due_at() == later.last_customer_message_at
+              + timedelta(minutes=THRESHOLD_MINUTES))
+        due = scheduler._pop_due(now + timedelta(days=1))
+        check('one live entry per ticket', sorted(due) == sorted([soon.id, later.id]) and due[soon.id] == now,
+              str(due))
+
+        # 3) watermark رسائل العملاء
+        print("\n3. Customer message watermark")
+        scheduler.sync(force_full=True)
+        last_full_sync = scheduler._last_full_sync
+        fresh = create_ticket('201099900005', '0005', timezone.now())
+        added = scheduler.sync()
+        # التذكرة الجديدة + آخر تذكرة قبل الـ watermark (داخل WATERMARK_OVERLAP_SECONDS) فقط
+        check('incremental sync reads only new tickets', added == 2 and fresh.id in scheduler._scheduled, str(added))
+        check('no full rebuild', scheduler._last_full_sync == last_full_sync)
+
+        # 4) fire_due
+        print("\n4. fire_due")
+        check('only due deadlines fired', scheduler.fire_due() == 1)
+        overdue.refresh_from_db()
+        soon.refresh_from_db()
+        check('overdue ticket delayed', overdue.is_delayed and overdue.delay_started_at is not None)
+        check('not-yet-due ticket untouched', not soon.is_delayed and soon.id in scheduler._scheduled)
+        check('nothing left due', scheduler.fire_due() == 0)
+
+        # 5) watermark ردود الموظفين (تحديث مباشر بدون views_messages / enqueue)
+        print("\n5. Agent reply watermark")
+        replied_at = timezone.now()
+        Ticket.objects.filter(id__in=[overdue.id, soon.id]).update(last_agent_message_at=replied_at)
+        scheduler.sync()
+        overdue.refresh_from_db()
+        check('delayed ticket un-delayed on next incremental sync', not overdue.is_delayed
+              and overdue.delay_started_at is None)
+        check('pending deadline cancelled', soon.id not in scheduler._scheduled)
+        check('still no full rebuild', scheduler._last_full_sync == last_full_sync)
+        check('watermark advanced to latest reply', scheduler._agent_watermark == replied_at)
+
+        raise Rollback()
+except Rollback:
+    pass
+
+print("\n" + "=" * 70)
+if failures:
+    print(f"❌ FAILED: {', '.join(failures)}")
+    raise SystemExit(1)
+print("✅ All delay scheduler tests passed")
+print("=" * 70)
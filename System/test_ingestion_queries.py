@@ -0,0 +1,317 @@
+"""
+Test: عدد الاستعلامات في خدمة استقبال الرسائل الموحدة (conversations/ingestion.py)
+
+يتحقق من أن كل رسالة واردة تلتزم بميزانية الاستعلامات الثابتة لكل المزودين.
+كل الاختبار داخل transaction يتم التراجع عنها في النهاية (لا بيانات متبقية،
+ولا تُرسل رسائل الترحيب/القائمة لأنها تعمل بعد الـ commit فقط).
+
+Usage:
+    python test_ingestion_queries.py
+"""
+
+import os
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'khalifa_pharmacy.settings')
+django.setup()
+
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from conversations.models import User, Agent, Ticket, Message, TicketNumberSequence
+from conversations.utils import reserve_ticket_numbers
+from conversations.identity_cache import get_identity_cache
+from conversations.ingestion import (
+    QUERIES_PER_MESSAGE,
+    QUERIES_PER_NEW_CUSTOMER,
+    QUERIES_PER_BULK_BATCH,
+    QUERIES_PER_NEW_TICKET,
+    process_wppconnect_payload,
+    process_cloud_api_payload,
+    process_elmujib_payload,
+)
+from conversations.delivery_receipts import QUERIES_PER_RECEIPT_BATCH
+from conversations.webhook_inbox import store_webhook
+
+QUERIES_PER_CACHED_MESSAGE = 4  # identity cache + تذكرة مصنفة: بدون أي بحث عن العميل/التذكرة
+
+
+class Rollback(Exception):
+    pass
+
+
+failures = []
+
+
+def check(name, queries, budget, result=None):
+    # SAVEPOINT / RELEASE ليست استعلامات بيانات (الاختبار كله داخل transaction خارجية)
+    statements = [
+        query['sql'] for query in queries.captured_queries
+        if 'SAVEPOINT' not in query['sql']
+    ]
+    ok = len(statements) <= budget and (result is None or result.get('success'))
+    status = '✅' if ok else '❌'
+    print(f"{status} {name}: {len(statements)} queries (budget {budget})")
+    if not ok:
+        failures.append(name)
+        for sql in statements:
+            print(f"     {sql[:150]}")
+
+
+def lookup_queries(queries):
+    return [
+        query['sql'] for query in queries.captured_queries
+        if query['sql'].startswith('SELECT') and ('FROM "customers"' in query['sql'] or 'FROM "tickets"' in query['sql'])
+    ]
+
+
+def wpp_payload(phone, message_id, text):
+    return {
+        'id_ext': message_id,
+        'phone': phone,
+        'chat_id': f'{phone}@c.us',
+        'message_text': text,
+        'message_type': 'text',
+        'sender_name': 'Query Test',
+        'timestamp': 1700000000,
+        'is_from_me': False,
+    }
+
+
+def cloud_message(phone, message_id, text):
+    return {
+        'from': phone,
+        'id': message_id,
+        'timestamp': '1700000000',
+        'type': 'text',
+        'text': {'body': text},
+    }
+
+
+print("=" * 70)
+print("Testing Ingestion Query Budget")
+print("=" * 70)
+
+identity_cache = get_identity_cache()
+identity_cache.clear()
+
+try:
+    with transaction.atomic():
+        user = User.objects.create(
+            username='ingestion_query_test_agent',
+            password_hash='-',
+            role='agent',
+            full_name='Ingestion Query Test'
+        )
+        Agent.objects.get_or_create(user=user, defaults={
+            'is_online': True,
+            'status': 'available',
+            'max_capacity': 1000,
+        })
+
+        # 1) عميل جديد + تذكرة جديدة (WPPConnect)
+        with CaptureQueriesContext(connection) as queries:
+            result = process_wppconnect_payload(wpp_payload('201099900001', 'QT-WPP-1', 'مرحبا'))
+        check('WPPConnect new customer + new ticket', queries, QUERIES_PER_NEW_CUSTOMER, result)
+
+        # 2) رسالة ثانية لنفس التذكرة (قبل اختيار القائمة)
+        with CaptureQueriesContext(connection) as queries:
+            result = process_wppconnect_payload(wpp_payload('201099900001', 'QT-WPP-2', '2'))
+        check('WPPConnect existing ticket (menu pending)', queries, QUERIES_PER_MESSAGE, result)
+        if any(' LIKE ' in query['sql'] for query in queries.captured_queries):
+            failures.append('welcome detection still scans message text')
+        if Ticket.objects.get(id=result['ticket_id']).customer_messages_count != 2:
+            failures.append('customer_messages_count not incremented')
+
+        # 3) تذكرة مصنفة بالفعل
+        Ticket.objects.filter(id=result['ticket_id']).update(
+            category_selected_at=timezone.now(),
+            conversation_state=Ticket.CONVERSATION_CLASSIFIED
+        )
+        with CaptureQueriesContext(connection) as queries:
+            result = process_wppconnect_payload(wpp_payload('201099900001', 'QT-WPP-3', 'شكراً'))
+        check('WPPConnect classified ticket', queries, QUERIES_PER_MESSAGE, result)
+
+        # 3b) محادثة مستمرة من الـ identity cache → صفر استعلامات بحث
+        with CaptureQueriesContext(connection) as queries:
+            result = process_wppconnect_payload(wpp_payload('201099900001', 'QT-WPP-3b', 'تمام'))
+        check('WPPConnect cached identity (steady conversation)', queries, QUERIES_PER_CACHED_MESSAGE, result)
+        if lookup_queries(queries):
+            failures.append('cached identity still queried customers/tickets')
+
+        # 4) رسالة مكررة → استعلام واحد فقط
+        with CaptureQueriesContext(connection) as queries:
+            result = process_wppconnect_payload(wpp_payload('201099900001', 'QT-WPP-3', 'شكراً'))
+        check('WPPConnect duplicate message', queries, 1, result)
+        if not result.get('duplicate'):
+            failures.append('duplicate not detected')
+
+        # 5) Elmujib لنفس العميل
+        with CaptureQueriesContext(connection) as queries:
+            result = process_elmujib_payload({
+                'from': '201099900001',
+                'id': 'QT-ELM-1',
+                'type': 'text',
+                'text': {'body': 'استفسار'},
+            })
+        check('Elmujib existing customer', queries, QUERIES_PER_MESSAGE, result)
+
+        # 6) Cloud API: دفعة من 4 رسائل لعميلين جديدين
+        payload = {
+            'object': 'whatsapp_business_account',
+            'entry': [{
+                'changes': [{
+                    'value': {
+                        'contacts': [
+                            {'wa_id': '201099900002', 'profile': {'name': 'Cloud A'}},
+                            {'wa_id': '201099900003', 'profile': {'name': 'Cloud B'}},
+                        ],
+                        'messages': [
+                            cloud_message('201099900002', 'QT-CLD-1', 'مرحبا'),
+                            cloud_message('201099900002', 'QT-CLD-2', '1'),
+                            cloud_message('201099900003', 'QT-CLD-3', 'مرحبا'),
+                        ]
+                    }
+                }, {
+                    'value': {
+                        'messages': [cloud_message('201099900003', 'QT-CLD-4', '2')]
+                    }
+                }]
+            }]
+        }
+        with CaptureQueriesContext(connection) as queries:
+            result = process_cloud_api_payload(payload)
+        check(
+            'Cloud API batch (4 messages, 2 new customers)',
+            queries,
+            QUERIES_PER_BULK_BATCH + 2 * QUERIES_PER_NEW_TICKET,
+            result
+        )
+        if result['processed'] != 4 or not all(r['success'] for r in result['results']):
+            failures.append('cloud batch results')
+
+        # 7) Cloud API: دفعة أكبر لعملاء موجودين (+ رسالة مكررة) → عدد ثابت
+        messages = [
+            cloud_message(phone, f'QT-CLD-{phone[-1]}-{n}', f'رسالة {n}')
+            for n in range(10)
+            for phone in ('201099900001', '201099900002', '201099900003')
+        ]
+        messages.append(cloud_message('201099900002', 'QT-CLD-1', 'مرحبا'))
+        payload = {'entry': [{'changes': [{'value': {'messages': messages}}]}]}
+        with CaptureQueriesContext(connection) as queries:
+            result = process_cloud_api_payload(payload)
+        check('Cloud API batch (31 messages, existing customers)', queries, QUERIES_PER_BULK_BATCH, result)
+        if sum(1 for r in result['results'] if r.get('duplicate')) != 1:
+            failures.append('cloud batch duplicate')
+
+        counts = dict(
+            Ticket.objects.filter(customer__phone_number__startswith='2010999000')
+            .values_list('customer__phone_number', 'messages_count')
+        )
+        print(f"\n🎫 Ticket messages_count: {counts}")
+        if counts != {'201099900001': 15, '201099900002': 12, '201099900003': 12}:
+            failures.append('ticket counters')
+
+        saved = Message.objects.filter(whatsapp_message_id__startswith='QT-').count()
+        print(f"📨 Messages saved: {saved} (expected 39)")
+        if saved != 39:
+            failures.append('saved message count')
+
+        # 8) تذكرة أُغلقت في عملية أخرى (بدون signal) → الـ cache يُكتشف ويفتح تذكرة جديدة
+        first_ticket_id = Ticket.objects.get(customer__phone_number='201099900001').id
+        Ticket.objects.filter(id=first_ticket_id).update(status='closed')
+        result = process_wppconnect_payload(wpp_payload('201099900001', 'QT-WPP-4', 'مرحبا'))
+        print(f"🔁 Closed ticket {first_ticket_id} → new ticket {result['ticket_id']}")
+        if result['ticket_id'] == first_ticket_id:
+            failures.append('stale identity cache after ticket close')
+
+        # 9) حالات التوصيل: دفعة كاملة بعدد استعلامات ثابت + للأمام فقط
+        receipt_ids = [f'QT-CLD-1-{n}' for n in range(10)]
+        Message.objects.filter(whatsapp_message_id__in=receipt_ids).update(delivery_status='sent')
+        Message.objects.filter(whatsapp_message_id='QT-CLD-1-0').update(delivery_status='read')
+        statuses = (
+            [{'id': message_id, 'status': 'delivered', 'timestamp': '1700000100'} for message_id in receipt_ids[:5]]
+            + [{'id': message_id, 'status': 'read', 'timestamp': '1700000200'} for message_id in receipt_ids[5:]]
+            + [{'id': 'QT-CLD-1-1', 'status': 'sent'}]  # متأخرة → لا ترجع للخلف
+            + [{'id': 'QT-UNKNOWN', 'status': 'failed', 'errors': [{'code': 131026, 'title': 'Undeliverable'}]}]
+        )
+        payload = {'entry': [{'changes': [{'value': {'statuses': statuses}}]}]}
+        with CaptureQueriesContext(connection) as queries:
+            result = process_cloud_api_payload(payload)
+        check('Cloud API delivery receipts (12 statuses)', queries, QUERIES_PER_RECEIPT_BATCH, result)
+
+        delivery = dict(
+            Message.objects.filter(whatsapp_message_id__in=receipt_ids)
+            .values_list('whatsapp_message_id', 'delivery_status')
+        )
+        print(f"📬 Receipts: {result['receipts']}")
+        if result['receipts']['updated'] != 9 or delivery['QT-CLD-1-0'] != 'read' \
+                or delivery['QT-CLD-1-1'] != 'delivered' or delivery['QT-CLD-1-9'] != 'read':
+            failures.append('delivery receipts transitions')
+
+        # 10) أول تذكرة في اليوم: عداد الأرقام بدون بحث عن آخر تذكرة (آخر خطوة: الأرقام تبدأ من جديد)
+        TicketNumberSequence.objects.filter(date=timezone.now().date()).delete()
+        with CaptureQueriesContext(connection) as queries:
+            numbers = reserve_ticket_numbers(2)
+        check('First ticket number of the day', queries, 1)
+        if not numbers[0].endswith('-0001'):
+            failures.append('first ticket number of the day')
+
+        # 11) صندوق الوارد: webhook Cloud API متعدد المرسلين → سجل لكل مرسل (INSERT واحد)
+        payload = {
+            'object': 'whatsapp_business_account',
+            'entry': [{
+                'id': 'WABA-1',
+                'changes': [{
+                    'value': {
+                        'contacts': [
+                            {'wa_id': '201099900004', 'profile': {'name': 'Inbox A'}},
+                            {'wa_id': '201099900005', 'profile': {'name': 'Inbox B'}},
+                        ],
+                        'messages': [
+                            cloud_message('201099900004', 'QT-INBOX-1', 'مرحبا'),
+                            cloud_message('201099900005', 'QT-INBOX-2', 'مرحبا'),
+                            cloud_message('201099900004', 'QT-INBOX-3', '1'),
+                        ]
+                    }
+                }, {
+                    'value': {'statuses': [{'id': 'QT-CLD-1-2', 'status': 'read'}]}
+                }]
+            }]
+        }
+        with CaptureQueriesContext(connection) as queries:
+            entries = store_webhook('cloud_api', payload)
+        check('Cloud API multi-sender webhook → inbox', queries, 1)
+
+        split = {
+            entry.customer_key: [
+                (item['id'], [contact['wa_id'] for contact in change['value'].get('contacts', [])])
+                for change in entry.payload['entry'][0]['changes']
+                for item in change['value'].get('messages', change['value'].get('statuses', []))
+            ]
+            for entry in entries
+        }
+        print(f"📥 Inbox split: {split}")
+        if split != {
+            '201099900004': [('QT-INBOX-1', ['201099900004']), ('QT-INBOX-3', ['201099900004'])],
+            '201099900005': [('QT-INBOX-2', ['201099900005'])],
+            None: [('QT-CLD-1-2', [])],
+        }:
+            failures.append('inbox split per sender')
+
+        print(f"🗂️  Identity cache: {identity_cache.get_stats()}")
+
+        raise Rollback()
+
+except Rollback:
+    pass
+finally:
+    identity_cache.clear()
+
+print("\n" + "=" * 70)
+if failures:
+    print(f"❌ FAILED: {', '.join(failures)}")
+    raise SystemExit(1)
+print("✅ All ingestion query budgets respected")
+print("=" * 70)
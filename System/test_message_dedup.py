@@ -0,0 +1,144 @@
+"""
+Test: منع تكرار الرسائل الصادرة (message_hash + dedup_bucket)
+
+يتحقق من:
+- نفس الرسالة لنفس التذكرة في نفس النافذة تُرفض (duplicate) بدون إفساد الـ transaction الخارجية
+- التكرار التالي من نفس العملية يُرفض من الـ cache بدون أي استعلام
+- القيد الفريد في قاعدة البيانات يرفض التكرار حتى بدون المرور على enqueue
+- نافذة جديدة، أو نص/تذكرة/مرسل مختلف → ليست تكراراً
+- الرسائل الواردة (بدون hash) لا يشملها القيد
+
+كل الاختبار داخل transaction يتم التراجع عنها في النهاية.
+
+Usage:
+    python test_message_dedup.py
+"""
+
+import os
+import sys
+import django
+
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8')
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'khalifa_pharmacy.settings')
+django.setup()
+
+from django.db import IntegrityError, connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from conversations.models import User, Customer, Ticket, Message
+from conversations.message_queue import MessageQueue, _recent_hashes
+
+
+class Rollback(Exception):
+    pass
+
+
+failures = []
+
+
+def check(name, condition, detail=''):
+    print(f"{'✅' if condition else '❌'} {name}{f' - {detail}' if detail else ''}")
+    if not condition:
+        failures.append(name)
+
+
+print("=" * 70)
+print("Testing outgoing message deduplication")
+print("=" * 70)
+
+queue = MessageQueue()
+_recent_hashes.clear()
+
+try:
+    with transaction.atomic():
+        user = User.objects.create(
+            username='dedup_test_admin',
+            password_hash='-',
+            role='admin',
+            full_name='Dedup Test'
+        )
+        other_user = User.objects.create(
+            username='dedup_test_admin_2',
+            password_hash='-',
+            role='admin',
+            full_name='Dedup Test 2'
+        )
+        customer = Customer.objects.create(phone_number='201044400001', wa_id='201044400001@c.us')
+        ticket = Ticket.objects.create(ticket_number='TKT-DEDUP-0001', customer=customer)
+        other_ticket = Ticket.objects.create(ticket_number='TKT-DEDUP-0002', customer=customer)
+
+        # 1) نفس النافذة
+        print("\n1. Same window")
+        first = queue.enqueue(ticket_id=ticket.id, user=user, message_text='تم تجهيز طلبك')
+        check('first message queued', first['success'])
+
+        second = queue.enqueue(ticket_id=ticket.id, user=user, message_text='تم تجهيز طلبك')
+        check('duplicate rejected by unique constraint', not second['success'] and second.get('duplicate'), str(second))
+        check('outer transaction still usable', Message.objects.filter(ticket=ticket).count() == 1)
+
+        with CaptureQueriesContext(connection) as queries:
+            third = queue.enqueue(ticket_id=ticket.id, user=user, message_text='تم تجهيز طلبك')
+        lookups = [query for query in queries.captured_queries if 'SAVEPOINT' not in query['sql']]
+        check('repeat rejected from cache without queries', third.get('duplicate') and not lookups,
+              f'{len(lookups)} queries')
+
+        message = Message.objects.get(id=first['message_id'])
+        check('check_duplicate', queue.check_duplicate(message.message_hash, message.dedup_bucket)
+              and not queue.check_duplicate(message.message_hash, message.dedup_bucket + 1))
+
+        # 2) القيد في قاعدة البيانات
+        print("\n2. Database constraint")
+        try:
+            with transaction.atomic():
+                Message.objects.create(
+                    ticket=ticket,
+                    sender=user,
+                    sender_type='admin',
+                    direction='outgoing',
+                    message_text='تم تجهيز طلبك',
+                    message_hash=message.message_hash,
+                    dedup_bucket=message.dedup_bucket
+                )
+            constraint_enforced = False
+        except IntegrityError:
+            constraint_enforced = True
+        check('unique (message_hash, dedup_bucket)', constraint_enforced)
+
+        for index in range(2):
+            Message.objects.create(
+                ticket=ticket,
+                sender_type='customer',
+                direction='incoming',
+                message_text='شكراً',
+                whatsapp_message_id=f'DEDUP-IN-{index}'
+            )
+        check('incoming messages without hash not constrained',
+              Message.objects.filter(ticket=ticket, direction='incoming', message_hash__isnull=True).count() == 2)
+
+        # 3) ليست تكراراً
+        print("\n3. Not duplicates")
+        check('different text', queue.enqueue(ticket_id=ticket.id, user=user, message_text='في الطريق')['success'])
+        check('different ticket', queue.enqueue(ticket_id=other_ticket.id, user=user, message_text='تم تجهيز طلبك')['success'])
+        check('different sender', queue.enqueue(ticket_id=ticket.id, user=other_user, message_text='تم تجهيز طلبك')['success'])
+
+        next_window = MessageQueue()
+        current_bucket = next_window.get_dedup_bucket()
+        next_window.get_dedup_bucket = lambda now=None: current_bucket + 1
+        result = next_window.enqueue(ticket_id=ticket.id, user=user, message_text='تم تجهيز طلبك')
+        check('next window', result['success'], str(result))
+
+        raise Rollback()
+except Rollback:
+    pass
+
+_recent_hashes.clear()
+
+print("\n" + "=" * 70)
+if failures:
+    print(f"❌ FAILED: {', '.join(failures)}")
+    raise SystemExit(1)
+print("✅ All dedup tests passed")
+print("=" * 70)
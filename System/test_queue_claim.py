@@ -0,0 +1,154 @@
+"""
+Test: حجز دفعات قائمة الانتظار بين عدة عمال (MessageQueue.claim_batch)
+
+يتحقق من:
+- كل دفعة لها lease token خاص (claimed_by) والرسائل تنتقل pending → sending مرة واحدة فقط
+- عامل آخر لا يحجز رسائل عميل لديه رسالة قيد الإرسال (الحفاظ على الترتيب)
+- Visibility Timeout: رسائل العامل المتوقف تعود إلى pending ويحجزها عامل آخر
+- العامل القديم لا يستطيع حفظ نتيجة رسالة انتهى حجزها
+- release_claim يعيد الرسالة بدون احتساب محاولة
+- عدادات queue_stats تُطبق بعد الـ commit فقط وتطابق جدول الرسائل بعد كل الانتقالات
+
+SQLite لا يدعم SKIP LOCKED: الحجز هنا compare-and-set (نفس الضمانات بين العمال).
+كل الاختبار داخل transaction يتم التراجع عنها في النهاية.
+
+Usage:
+    python test_queue_claim.py
+"""
+
+import os
+import sys
+import django
+
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8')
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'khalifa_pharmacy.settings')
+django.setup()
+
+from datetime import timedelta
+
+from django.db import transaction
+from django.test import TestCase
+from django.utils import timezone
+
+from conversations.models import User, Customer, Ticket, Message
+from conversations.message_queue import MessageQueue
+from conversations.queue_stats import get_state_counts, reconcile
+
+
+class Rollback(Exception):
+    pass
+
+
+failures = []
+
+
+def check(name, condition, detail=''):
+    print(f"{'✅' if condition else '❌'} {name}{f' - {detail}' if detail else ''}")
+    if not condition:
+        failures.append(name)
+
+
+def create_ticket(phone, number):
+    customer = Customer.objects.create(phone_number=phone, wa_id=f'{phone}@c.us')
+    return Ticket.objects.create(ticket_number=f'TKT-CLAIM-{number}', customer=customer)
+
+
+print("=" * 70)
+print("Testing multi-worker queue claiming")
+print("=" * 70)
+
+worker_a = MessageQueue()
+worker_b = MessageQueue()
+
+try:
+    with transaction.atomic():
+        # بيئة معزولة: لا رسائل معلقة غير بيانات الاختبار
+        Message.objects.filter(delivery_status__in=['pending', 'sending']).update(delivery_status='sent')
+        reconcile()
+
+        user = User.objects.create(
+            username='queue_claim_test_admin',
+            password_hash='-',
+            role='admin',
+            full_name='Queue Claim Test'
+        )
+        first_ticket = create_ticket('201088800001', '0001')
+        second_ticket = create_ticket('201088800002', '0002')
+
+        counts_before = get_state_counts()
+
+        # تغييرات العدادات تُطبق عند الـ commit (on_commit): تنفذ هنا عند نهاية الكتلة
+        with TestCase.captureOnCommitCallbacks(execute=True):
+            first_ids = [
+                worker_a.enqueue(ticket_id=first_ticket.id, user=user, message_text=f'رسالة {index}')['message_id']
+                for index in range(3)
+            ]
+            second_ids = [
+                worker_a.enqueue(ticket_id=second_ticket.id, user=user, message_text=f'رسالة {index}')['message_id']
+                for index in range(2)
+            ]
+
+            # 1) حجز دفعة
+            print("\n1. Claim a batch")
+            claimed = worker_a.claim_batch(batch_size=2)
+            claimed_ids = [message.id for message in claimed]
+            check('oldest messages first', claimed_ids == first_ids[:2], str(claimed_ids))
+            check('one lease per batch', len({message.claimed_by for message in claimed}) == 1
+                  and all(message.delivery_status == 'sending' and message.claimed_at for message in claimed))
+
+            # 2) عامل آخر
+            print("\n2. Second worker")
+            other = worker_b.claim_batch(batch_size=10)
+            other_ids = [message.id for message in other]
+            check('busy customer skipped', other_ids == second_ids, str(other_ids))
+            check('different lease', {message.claimed_by for message in other}.isdisjoint(
+                {message.claimed_by for message in claimed}))
+            check('nothing left to claim', worker_a.claim_batch(batch_size=10) == [])
+
+            for message in other:
+                worker_b.release_claim(message)
+            released = Message.objects.filter(id__in=second_ids)
+            check('release_claim returns to pending without an attempt',
+                  all(message.delivery_status == 'pending' and message.retry_count == 0
+                      and message.claimed_by is None for message in released))
+
+            # 3) Visibility Timeout
+            print("\n3. Visibility timeout")
+            Message.objects.filter(id__in=claimed_ids).update(
+                claimed_at=timezone.now() - timedelta(seconds=MessageQueue.CLAIM_TIMEOUT_SECONDS + 1)
+            )
+            check('stale claims released', worker_b.release_stale_claims() == 2)
+            check('released once', worker_a.release_stale_claims() == 0)
+
+            reclaimed = worker_b.claim_batch(batch_size=10)
+            reclaimed_ids = [message.id for message in reclaimed]
+            check('reclaimed by another worker in order', reclaimed_ids[:3] == first_ids, str(reclaimed_ids))
+
+            stale_message = claimed[0]
+            check('stale lease cannot save its result',
+                  not worker_a._save_claimed(stale_message, delivery_status='sent'))
+            check('new lease still owns the message',
+                  Message.objects.get(id=stale_message.id).claimed_by == reclaimed[0].claimed_by)
+
+            check('new lease saves its result', worker_b._save_claimed(reclaimed[0], delivery_status='sent'))
+
+            check('counters untouched before commit', get_state_counts() == counts_before)
+
+        # 4) العدادات
+        print("\n4. Queue counters")
+        corrections = reconcile()['corrections']
+        check('counters match messages table', not corrections, str(corrections))
+
+        raise Rollback()
+except Rollback:
+    pass
+
+print("\n" + "=" * 70)
+if failures:
+    print(f"❌ FAILED: {', '.join(failures)}")
+    raise SystemExit(1)
+print("✅ All queue claim tests passed")
+print("=" * 70)
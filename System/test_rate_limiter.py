@@ -0,0 +1,141 @@
+"""
+Test: الـ Rate Limiter المشترك (conversations/rate_limiter.py)
+
+يتحقق من:
+- حد المزود: الطلب بعد نفاد الرصيد يُرفض فوراً مع retry_at (بدون انتظار)
+- الرصيد في قاعدة البيانات: instance آخر (عملية أخرى) يرى نفس الرصيد
+- حد لكل مستلم (نفس الـ bucket لـ 2010... و 2010...@c.us) وحد الحملات
+- الطلب المرفوض لا يستهلك رصيداً، والرصيد يُعاد ملؤه مع الوقت
+- compare-and-set: تعديل الـ bucket من عملية أخرى بين القراءة والكتابة يعيد المحاولة
+
+كل الاختبار داخل transaction يتم التراجع عنها في النهاية.
+
+Usage:
+    python test_rate_limiter.py
+"""
+
+import os
+import sys
+import django
+
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8')
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'khalifa_pharmacy.settings')
+django.setup()
+
+from datetime import timedelta
+
+from django.db import transaction
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from conversations.models import RateLimitBucket
+from conversations.rate_limiter import TokenBucketLimiter
+
+
+class Rollback(Exception):
+    pass
+
+
+class ConcurrentWriterLimiter(TokenBucketLimiter):
+    """
+    يحاكي عملية أخرى تخصم من نفس الـ bucket بعد القراءة مباشرة
+    """
+
+    def __init__(self, conflicts):
+        self.conflicts = conflicts
+        self.loads = 0
+
+    def _load_buckets(self, limits, now):
+        buckets = super()._load_buckets(limits, now)
+        self.loads += 1
+        if self.loads <= self.conflicts:
+            RateLimitBucket.objects.filter(key__in=list(buckets)).update(
+                updated_at=now - timedelta(microseconds=self.loads)
+            )
+        return buckets
+
+
+failures = []
+
+
+def check(name, condition, detail=''):
+    print(f"{'✅' if condition else '❌'} {name}{f' - {detail}' if detail else ''}")
+    if not condition:
+        failures.append(name)
+
+
+print("=" * 70)
+print("Testing shared rate limiter")
+print("=" * 70)
+
+limiter = TokenBucketLimiter()
+
+try:
+    with transaction.atomic(), override_settings(
+        WHATSAPP_PROVIDER_RATE_LIMITS={'rl_test': 3, 'rl_test_recipients': 100},
+        WHATSAPP_RECIPIENT_RATE_LIMIT_PER_MINUTE=2,
+        WHATSAPP_BROADCAST_RATE_LIMIT_PER_MINUTE=1
+    ):
+        # 1) حد المزود
+        print("\n1. Provider bucket")
+        decisions = [limiter.acquire('rl_test') for _ in range(3)]
+        check('capacity = per-minute limit', all(decision['allowed'] for decision in decisions))
+
+        started = timezone.now()
+        decision = limiter.acquire('rl_test')
+        wait_seconds = (decision['retry_at'] - started).total_seconds() if decision['retry_at'] else None
+        check('denied with retry_at', not decision['allowed'] and decision['bucket'] == 'provider:rl_test')
+        check('retry_at = time for one token (60/3 s)', wait_seconds and 19 < wait_seconds <= 20.5, str(wait_seconds))
+
+        tokens = RateLimitBucket.objects.get(key='provider:rl_test').tokens
+        check('shared across instances', not TokenBucketLimiter().acquire('rl_test')['allowed'])
+        check('denied request consumes nothing', RateLimitBucket.objects.get(key='provider:rl_test').tokens == tokens)
+
+        RateLimitBucket.objects.filter(key='provider:rl_test').update(
+            updated_at=timezone.now() - timedelta(seconds=21)
+        )
+        check('refilled over time', limiter.acquire('rl_test')['allowed'])
+
+        # 2) حد المستلم
+        print("\n2. Recipient bucket")
+        check('2 allowed', limiter.acquire('rl_test_recipients', recipient='201077700001')['allowed']
+              and limiter.acquire('rl_test_recipients', recipient='201077700001@c.us')['allowed'])
+        decision = limiter.acquire('rl_test_recipients', recipient='201077700001')
+        check('3rd denied on recipient bucket', not decision['allowed']
+              and decision['bucket'] == 'recipient:201077700001', decision['bucket'])
+        check('other recipient allowed', limiter.acquire('rl_test_recipients', recipient='201077700002')['allowed'])
+
+        # 3) حد الحملات
+        print("\n3. Broadcast bucket")
+        check('1st broadcast allowed', limiter.acquire('rl_test_recipients', broadcast=True)['allowed'])
+        decision = limiter.acquire('rl_test_recipients', broadcast=True)
+        check('2nd broadcast denied', not decision['allowed']
+              and decision['bucket'] == 'broadcast:rl_test_recipients', decision['bucket'])
+        check('replies not blocked by broadcast limit', limiter.acquire('rl_test_recipients')['allowed'])
+
+        # 4) compare-and-set
+        print("\n4. Compare-and-set")
+        RateLimitBucket.objects.filter(key='provider:rl_test').update(
+            tokens=3, updated_at=timezone.now()
+        )
+        racing = ConcurrentWriterLimiter(conflicts=2)
+        check('retried after concurrent update', racing.acquire('rl_test')['allowed'] and racing.loads == 3,
+              f'{racing.loads} load(s)')
+
+        racing = ConcurrentWriterLimiter(conflicts=TokenBucketLimiter.MAX_CAS_ATTEMPTS)
+        decision = racing.acquire('rl_test')
+        check('persistent contention denied briefly', not decision['allowed'] and decision['retry_at'] is not None)
+
+        raise Rollback()
+except Rollback:
+    pass
+
+print("\n" + "=" * 70)
+if failures:
+    print(f"❌ FAILED: {', '.join(failures)}")
+    raise SystemExit(1)
+print("✅ All rate limiter tests passed")
+print("=" * 70)
@@ -0,0 +1,163 @@
+"""
+Test: جدولة إعادة المحاولة بـ next_attempt_at (MessageQueue)
+
+يتحقق من:
+- التأخير بين المحاولات حسب RETRY_DELAY_SECONDS مع Jitter (±RETRY_JITTER)
+- الرسالة الفاشلة لا تُحجز قبل next_attempt_at، وتُحجز بعده
+- رسائل نفس العميل التالية تنتظرها (الترتيب)، ورسائل العملاء الآخرين لا تنتظر
+- رسالة جماعية (BULK) تنتظر إعادة المحاولة لا تؤخر رد الموظف لنفس العميل
+- بعد MAX_RETRY_COUNT تصبح الرسالة failed
+
+لا اتصال بأي مزود حقيقي (driver وهمي). كل الاختبار داخل transaction يتم التراجع عنها في النهاية.
+
+Usage:
+    python test_retry_backoff.py
+"""
+
+import os
+import sys
+import django
+
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8')
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'khalifa_pharmacy.settings')
+django.setup()
+
+from django.db import transaction
+from django.utils import timezone
+
+from conversations.models import User, Customer, Ticket, Message
+from conversations.message_queue import MessageQueue
+
+
+class FailingDriver:
+    """
+    مزود وهمي يرفض كل الرسائل
+    """
+    provider_name = 'backoff_test'
+
+    def circuit_retry_at(self):
+        return None
+
+    def send_text_message(self, phone, message):
+        return {'success': False, 'error': 'provider error'}
+
+
+class Rollback(Exception):
+    pass
+
+
+failures = []
+
+
+def check(name, condition, detail=''):
+    print(f"{'✅' if condition else '❌'} {name}{f' - {detail}' if detail else ''}")
+    if not condition:
+        failures.append(name)
+
+
+def create_ticket(phone, number):
+    customer = Customer.objects.create(phone_number=phone, wa_id=f'{phone}@c.us')
+    return Ticket.objects.create(ticket_number=f'TKT-RETRY-{number}', customer=customer)
+
+
+def claimed_ids(queue):
+    claimed = queue.claim_batch(batch_size=10)
+    for message in claimed:
+        queue.release_claim(message)
+    return [message.id for message in claimed]
+
+
+def make_due(message_id):
+    Message.objects.filter(id=message_id).update(next_attempt_at=timezone.now())
+
+
+print("=" * 70)
+print("Testing retry scheduling (next_attempt_at)")
+print("=" * 70)
+
+queue = MessageQueue()
+queue.driver = FailingDriver()
+
+# 1) التأخير
+print("\n1. Backoff delays")
+for retry_count, base_delay in enumerate(MessageQueue.RETRY_DELAY_SECONDS, start=1):
+    delays = [(queue._next_attempt_at(retry_count) - timezone.now()).total_seconds() for _ in range(50)]
+    low, high = base_delay * (1 - MessageQueue.RETRY_JITTER), base_delay * (1 + MessageQueue.RETRY_JITTER)
+    check(f'attempt {retry_count}: {base_delay}s ±{int(MessageQueue.RETRY_JITTER * 100)}%',
+          all(low - 0.1 <= delay <= high for delay in delays) and max(delays) - min(delays) > 0,
+          f'{min(delays):.1f}-{max(delays):.1f}s')
+
+last_delay = MessageQueue.RETRY_DELAY_SECONDS[-1]
+delay = (queue._next_attempt_at(10) - timezone.now()).total_seconds()
+check('delay capped at last step', delay <= last_delay * (1 + MessageQueue.RETRY_JITTER), f'{delay:.1f}s')
+
+try:
+    with transaction.atomic():
+        # بيئة معزولة: لا رسائل معلقة غير بيانات الاختبار
+        Message.objects.filter(delivery_status__in=['pending', 'sending']).update(delivery_status='sent')
+
+        user = User.objects.create(
+            username='retry_backoff_test_admin',
+            password_hash='-',
+            role='admin',
+            full_name='Retry Backoff Test'
+        )
+        ticket = create_ticket('201066600001', '0001')
+        other_ticket = create_ticket('201066600002', '0002')
+
+        failing_id = queue.enqueue(ticket_id=ticket.id, user=user, message_text='أولى')['message_id']
+        next_id = queue.enqueue(ticket_id=ticket.id, user=user, message_text='ثانية')['message_id']
+        other_id = queue.enqueue(ticket_id=other_ticket.id, user=user, message_text='عميل آخر')['message_id']
+
+        # 2) محاولة فاشلة
+        print("\n2. Failed attempt")
+        message = queue.claim_batch(batch_size=1)[0]
+        check('oldest claimed first', message.id == failing_id)
+        queue.process_message(message)
+
+        message = Message.objects.get(id=failing_id)
+        delay = (message.next_attempt_at - timezone.now()).total_seconds()
+        check('back to pending with retry_count 1', message.delivery_status == 'pending' and message.retry_count == 1)
+        check('next_attempt_at ≈ first delay', 0 < delay <= MessageQueue.RETRY_DELAY_SECONDS[0] * 1.2, f'{delay:.1f}s')
+
+        ids = claimed_ids(queue)
+        check('not claimed before next_attempt_at', failing_id not in ids)
+        check('same customer waits (order kept)', next_id not in ids)
+        check('other customers not blocked', other_id in ids, str(ids))
+
+        # 3) مسار أعلى لا ينتظر رسالة جماعية
+        print("\n3. Lanes")
+        Message.objects.filter(id=failing_id).update(priority=Message.PRIORITY_BULK)
+        ids = claimed_ids(queue)
+        check('interactive reply skips a waiting bulk message', next_id in ids and failing_id not in ids, str(ids))
+        Message.objects.filter(id=failing_id).update(priority=Message.PRIORITY_INTERACTIVE)
+
+        # 4) بعد الموعد
+        print("\n4. Due again")
+        make_due(failing_id)
+        check('claimed once due', failing_id in claimed_ids(queue))
+
+        for _ in range(MessageQueue.MAX_RETRY_COUNT - 1):
+            make_due(failing_id)
+            message = next(claimed for claimed in queue.claim_batch(batch_size=1) if claimed.id == failing_id)
+            queue.process_message(message)
+
+        message = Message.objects.get(id=failing_id)
+        check('failed after MAX_RETRY_COUNT', message.delivery_status == 'failed'
+              and message.retry_count == MessageQueue.MAX_RETRY_COUNT, message.delivery_status)
+        check('failed message never claimed again', failing_id not in claimed_ids(queue))
+        check('next message released after final failure', next_id in claimed_ids(queue))
+
+        raise Rollback()
+except Rollback:
+    pass
+
+print("\n" + "=" * 70)
+if failures:
+    print(f"❌ FAILED: {', '.join(failures)}")
+    raise SystemExit(1)
+print("✅ All retry scheduling tests passed")
+print("=" * 70)
@@ -54,6 +54,14 @@ timeout /t 2 /nobreak >nul
 echo %GREEN%[OK]%RESET% Delay Tracker window opened
 echo.
 
+REM Webhook Inbox Worker
+echo %YELLOW%[STARTING]%RESET% Starting Webhook Inbox Worker...
+echo.
+start "Khalifa Pharmacy - Webhook Inbox" cmd /k "cd /d "%SYSTEM_DIR%" && echo %GREEN%[SUCCESS]%RESET% Webhook Inbox worker running && python manage.py process_webhook_inbox --continuous"
+timeout /t 2 /nobreak >nul
+echo %GREEN%[OK]%RESET% Webhook Inbox window opened
+echo.
+
 echo ============================================
 echo %GREEN%[SUCCESS]%RESET% Development mode started!
 echo.